@@ -31,9 +31,11 @@ echo "🔄 Conectando a PostgreSQL ($HOST:$PORT/$DBNAME)..."
 # 3. Definir el comando SQL
 # Usamos 'DOUBLE PRECISION' para el costo, que es mejor que FLOAT para decimales en Postgres
 SQL_COMMANDS="
+-- Tabla particionada por mes (RANGE sobre timestamp). La PK debe incluir la clave de partición.
+-- Para migrar una instalación existente con la tabla monolítica: DB/migrate_analytics_partitions.sh
 CREATE TABLE IF NOT EXISTS analytics_events (
-    id SERIAL PRIMARY KEY,
-    timestamp TIMESTAMPTZ DEFAULT NOW(),
+    id BIGSERIAL,
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     business_id VARCHAR(50) NOT NULL,
     thread_id VARCHAR(100) NOT NULL,
     event_type VARCHAR(50),
@@ -43,11 +45,39 @@ CREATE TABLE IF NOT EXISTS analytics_events (
     estimated_cost DOUBLE PRECISION DEFAULT 0.0,
     latency_ms INT DEFAULT 0,
     tool_name VARCHAR(50),
-    sentiment_label VARCHAR(20)
-);
+    sentiment_label VARCHAR(20),
+    cost_avoided DOUBLE PRECISION DEFAULT 0.0,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
 
+-- BRIN: los eventos llegan en orden de timestamp, el índice ocupa unos pocos KB por partición
+CREATE INDEX IF NOT EXISTS idx_analytics_timestamp_brin ON analytics_events USING BRIN (timestamp) WITH (pages_per_range = 32);
 CREATE INDEX IF NOT EXISTS idx_analytics_business_date ON analytics_events (business_id, timestamp);
 CREATE INDEX IF NOT EXISTS idx_analytics_event_type ON analytics_events (event_type);
+
+-- Particiones del mes actual y los 2 siguientes (después las crea la app: analytics_partitions.py)
+DO \$\$
+DECLARE
+    mes DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('analytics_events')) = 'p' THEN
+        FOR mes IN
+            SELECT generate_series(
+                date_trunc('month', NOW() AT TIME ZONE 'UTC'),
+                date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '2 months',
+                INTERVAL '1 month'
+            )::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF analytics_events FOR VALUES FROM (%L) TO (%L)',
+                'analytics_events_' || to_char(mes, 'YYYYMM'),
+                mes::text || ' 00:00:00+00',
+                (mes + INTERVAL '1 month')::date::text || ' 00:00:00+00'
+            );
+        END LOOP;
+    END IF;
+END
+\$\$;
 "
 
 # 4. Ejecutar comando en Docker o Localmente
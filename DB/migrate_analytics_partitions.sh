@@ -0,0 +1,133 @@
+#!/bin/bash
+# chmod +x DB/migrate_analytics_partitions.sh
+# ./DB/migrate_analytics_partitions.sh
+
+# ==========================================
+# Migración de analytics_events a particiones mensuales
+# ==========================================
+# - Renombra la tabla monolítica a analytics_events_legacy (con sus índices).
+# - Crea analytics_events particionada por RANGE(timestamp), con índice BRIN en timestamp.
+# - Crea una partición por mes desde el evento más viejo hasta 2 meses adelante.
+# - Copia los eventos y ajusta la secuencia del id.
+# Todo corre en una única transacción: si algo falla no queda nada a medias.
+# La tabla legacy NO se borra; verificar los conteos y luego: DROP TABLE analytics_events_legacy;
+# Recomendado: detener la app durante la migración (el AnalyticsWriter reintenta al volver).
+
+# 1. Cargar variables de entorno desde .env
+if [ -f .env ]; then
+    export $(grep -v '^#' .env | xargs)
+    echo "✅ Variables de entorno cargadas."
+else
+    echo "❌ Error: No se encontró el archivo .env"
+    exit 1
+fi
+
+# 2. Configurar variables de conexión
+HOST="${DB_HOST:-localhost}"
+PORT="${DB_PORT:-5432}"
+USER="${DB_USER:-postgres}"
+DBNAME="${DB_NAME_AGENT:-checkpointer_db}"
+
+export PGPASSWORD="${DB_PASSWORD}"
+
+if ! command -v psql &> /dev/null; then
+    echo "⚠️  No se encontró el comando 'psql' en este sistema."
+    echo "   Si estás usando Docker, copia este script al contenedor de postgres y ejecútalo ahí."
+    exit 1
+fi
+
+echo "🔄 Conectando a PostgreSQL ($HOST:$PORT/$DBNAME)..."
+
+# 3. Verificar el estado actual
+RELKIND=$(psql -h "$HOST" -p "$PORT" -U "$USER" -d "$DBNAME" -tA \
+    -c "SELECT relkind FROM pg_class WHERE oid = to_regclass('analytics_events')")
+
+if [ "$RELKIND" = "p" ]; then
+    echo "✅ analytics_events ya está particionada. Nada que migrar."
+    exit 0
+elif [ -z "$RELKIND" ]; then
+    echo "⚠️  analytics_events no existe. Usar DB/init_metrics_db.sh para una instalación nueva."
+    exit 1
+fi
+
+# 4. Migrar (una sola transacción)
+psql -h "$HOST" -p "$PORT" -U "$USER" -d "$DBNAME" -v ON_ERROR_STOP=1 --single-transaction <<'SQL'
+ALTER TABLE analytics_events RENAME TO analytics_events_legacy;
+ALTER INDEX IF EXISTS analytics_events_pkey RENAME TO analytics_events_legacy_pkey;
+ALTER INDEX IF EXISTS idx_analytics_business_date RENAME TO idx_analytics_legacy_business_date;
+ALTER INDEX IF EXISTS idx_analytics_event_type RENAME TO idx_analytics_legacy_event_type;
+
+CREATE TABLE analytics_events (
+    id BIGSERIAL,
+    timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    business_id VARCHAR(50) NOT NULL,
+    thread_id VARCHAR(100) NOT NULL,
+    event_type VARCHAR(50),
+    input_tokens INT DEFAULT 0,
+    output_tokens INT DEFAULT 0,
+    model_name VARCHAR(50),
+    estimated_cost DOUBLE PRECISION DEFAULT 0.0,
+    latency_ms INT DEFAULT 0,
+    tool_name VARCHAR(50),
+    sentiment_label VARCHAR(20),
+    cost_avoided DOUBLE PRECISION DEFAULT 0.0,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE INDEX idx_analytics_timestamp_brin ON analytics_events USING BRIN (timestamp) WITH (pages_per_range = 32);
+CREATE INDEX idx_analytics_business_date ON analytics_events (business_id, timestamp);
+CREATE INDEX idx_analytics_event_type ON analytics_events (event_type);
+
+-- Una partición por mes: desde el evento más viejo hasta 2 meses adelante
+DO $$
+DECLARE
+    mes DATE;
+    desde DATE;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(timestamp), NOW()) AT TIME ZONE 'UTC')::date
+      INTO desde
+      FROM analytics_events_legacy;
+
+    FOR mes IN
+        SELECT generate_series(
+            desde,
+            date_trunc('month', NOW() AT TIME ZONE 'UTC') + INTERVAL '2 months',
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF analytics_events FOR VALUES FROM (%L) TO (%L)',
+            'analytics_events_' || to_char(mes, 'YYYYMM'),
+            mes::text || ' 00:00:00+00',
+            (mes + INTERVAL '1 month')::date::text || ' 00:00:00+00'
+        );
+    END LOOP;
+END
+$$;
+
+INSERT INTO analytics_events
+    (id, timestamp, business_id, thread_id, event_type, input_tokens, output_tokens,
+     model_name, estimated_cost, latency_ms, tool_name, sentiment_label)
+SELECT id, COALESCE(timestamp, NOW()), business_id, thread_id, event_type, input_tokens, output_tokens,
+       model_name, estimated_cost, latency_ms, tool_name, sentiment_label
+FROM analytics_events_legacy
+ORDER BY timestamp;
+
+SELECT setval(
+    pg_get_serial_sequence('analytics_events', 'id'),
+    COALESCE((SELECT MAX(id) FROM analytics_events), 0) + 1,
+    false
+);
+
+ANALYZE analytics_events;
+SQL
+
+if [ $? -eq 0 ]; then
+    echo "✅ analytics_events migrada a particiones mensuales."
+    psql -h "$HOST" -p "$PORT" -U "$USER" -d "$DBNAME" -c \
+        "SELECT (SELECT COUNT(*) FROM analytics_events_legacy) AS legacy, (SELECT COUNT(*) FROM analytics_events) AS particionada;"
+    echo "   Si los conteos coinciden: DROP TABLE analytics_events_legacy;"
+else
+    echo "🔴 Error en la migración. No se aplicó ningún cambio."
+    exit 1
+fi
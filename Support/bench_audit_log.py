@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark del log de auditoría: un handler de Loguru por cliente vs un sink único.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/bench_audit_log.py [--tenants 10 100 1000] [--registros 20000] [--max-abiertos 128]
+
+Para cada cantidad de clientes mide, por registro:
+- el costo de un log común (DEBUG, no auditoría), que con un handler por cliente pasa por N filtros;
+- el costo en el hilo que loguea de un registro de auditoría (filtros + encolado);
+- el tiempo total hasta que el registro queda escrito (logger.complete()).
+
+Escribe en un directorio temporal que se borra al terminar.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from loguru import logger
+from app.logger_config import SinkAuditoria, filtro_auditoria, filtro_log_principal, AUDIT_FORMATO
+
+
+def handlers_por_cliente(directorio: str, tenants: list) -> list:
+    """Comportamiento anterior: un logger.add con su filtro (y su hilo de enqueue) por cliente."""
+    ids = []
+    for business_id in tenants:
+        def filtro_cliente_especifico(record, business_id=business_id):
+            extra = record["extra"]
+            return extra.get("is_audit") is True and extra.get("business_id") == business_id
+
+        ids.append(logger.add(
+            os.path.join(directorio, f"audit_{business_id}.log"),
+            filter=filtro_cliente_especifico,
+            format=AUDIT_FORMATO,
+            rotation="10 MB",
+            retention="30 days",
+            enqueue=True,
+            encoding="utf-8",
+        ))
+    return ids
+
+
+def sink_unico(directorio: str, tenants: list, max_abiertos: int) -> list:
+    return [logger.add(
+        SinkAuditoria(directorio=directorio, max_abiertos=max_abiertos),
+        filter=filtro_auditoria,
+        format=AUDIT_FORMATO,
+        enqueue=True,
+    )]
+
+
+def medir(registros: int, tenants: list) -> dict:
+    mensaje = "[RCV <- EVO] 📨 ID: 5491100000000 - MSG: hola, quería consultar por el pedido..."
+    destinos = [random.choice(tenants) for _ in range(registros)]
+
+    inicio = time.perf_counter()
+    for i in range(registros):
+        logger.debug("mensaje común {}", i)
+    comun = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for business_id in destinos:
+        logger.bind(business_id=business_id, is_audit=True).info(mensaje)
+    encolado = time.perf_counter() - inicio
+    logger.complete()
+    total = time.perf_counter() - inicio
+
+    return {
+        "comun_us": comun / registros * 1e6,
+        "audit_us": encolado / registros * 1e6,
+        "total_us": total / registros * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del log de auditoría por cliente")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000], help="Cantidades de clientes a medir")
+    parser.add_argument("--registros", type=int, default=20000, help="Registros por medición")
+    parser.add_argument("--max-abiertos", type=int, default=128, help="Archivos abiertos del sink único")
+    args = parser.parse_args()
+
+    logger.remove()
+    # Handler "principal" que descarta la salida, para medir solo el costo de filtrado y despacho
+    logger.add(lambda _: None, filter=filtro_log_principal, level="DEBUG")
+
+    print(f"🧪 {args.registros} registros por medición, sink único con {args.max_abiertos} archivos abiertos")
+    print(f"{'clientes':>8} {'modo':<12} {'común µs':>9} {'audit µs':>9} {'total µs':>9} {'setup s':>8}")
+    for cantidad in args.tenants:
+        tenants = [f"cliente{i}" for i in range(cantidad)]
+        for nombre, registrar in (
+            ("por_cliente", lambda d: handlers_por_cliente(d, tenants)),
+            ("sink_unico", lambda d: sink_unico(d, tenants, args.max_abiertos)),
+        ):
+            directorio = tempfile.mkdtemp(prefix="bench_audit_")
+            try:
+                inicio = time.perf_counter()
+                ids = registrar(directorio)
+                setup = time.perf_counter() - inicio
+                r = medir(args.registros, tenants)
+                for handler_id in ids:
+                    logger.remove(handler_id)
+            finally:
+                shutil.rmtree(directorio, ignore_errors=True)
+            print(f"{cantidad:>8} {nombre:<12} {r['comun_us']:>9.2f} {r['audit_us']:>9.2f} {r['total_us']:>9.2f} {setup:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark de durabilidad de checkpoints (sync / async / exit).
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/bench_checkpoint_durability.py --business cliente1 [--mensajes 10] [--fake-llm [--fake-tool consultar_stock]]
+
+Compila el workflow_builder del agente con un checkpointer que cuenta las escrituras y, por
+cada modo, envía N mensajes a un thread propio. Reporta por mensaje: llamadas a put
+(checkpoints), filas de checkpoint_writes, blobs, tiempo en el checkpointer y latencia total.
+
+Con --fake-llm el LLM se reemplaza por uno local (sin costo ni variabilidad de red); con
+--fake-tool además pide esa tool en el primer paso (args vacíos) para recorrer chatbot →
+tools → chatbot. Sin --fake-llm se usa el LLM real del negocio y se registran sus costos.
+Los threads del benchmark se borran al terminar.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+load_dotenv()
+
+from app.db import init_db, get_pool
+
+init_db(None)
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app.services import agent
+from app.services.durabilidad import MODOS_DURABILIDAD, kwargs_durabilidad
+from app.services.instrumentacion import PostgresSaverMedido
+from app.services.sesiones import borrar_memoria_threads
+
+
+class SaverContador(PostgresSaverMedido):
+    """PostgresSaver que cuenta escrituras y el tiempo pasado en ellas."""
+
+    def __init__(self, conn):
+        super().__init__(conn)
+        self.puts = 0
+        self.writes = 0
+        self.blobs = 0
+        self.segundos = 0.0
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        inicio = time.perf_counter()
+        try:
+            return super().put(config, checkpoint, metadata, new_versions)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.puts += 1
+            self.blobs += len(new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        inicio = time.perf_counter()
+        try:
+            return super().put_writes(config, writes, task_id, task_path)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.writes += len(writes)
+
+
+class LLMFalso(BaseChatModel):
+    """Responde texto fijo; con `herramienta` pide esa tool ante cada mensaje del usuario."""
+
+    herramienta: str = ""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.herramienta and isinstance(messages[-1], HumanMessage):
+            mensaje = AIMessage(content="", tool_calls=[
+                {"name": self.herramienta, "args": {}, "id": f"bench-{uuid.uuid4().hex[:8]}"}
+            ])
+        else:
+            mensaje = AIMessage(content="Respuesta de benchmark.")
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-falso"
+
+
+def medir_modo(modo: str, business_id: str, mensajes: int, texto: str) -> dict:
+    thread_id = f"{business_id}:bench-{modo}-{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": thread_id, "business_id": business_id, "client_name": "Benchmark"}}
+    latencias = []
+    with get_pool().connection() as conn:
+        saver = SaverContador(conn)
+        grafo = agent.workflow_builder.compile(checkpointer=saver)
+        try:
+            for i in range(mensajes):
+                inicio = time.perf_counter()
+                grafo.invoke({"messages": [HumanMessage(content=f"{texto} ({i + 1})")]}, config=config,
+                             **kwargs_durabilidad(modo))
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        finally:
+            with conn.transaction():
+                borrar_memoria_threads(conn, [thread_id])
+
+    return {
+        "modo": modo,
+        "puts": saver.puts / mensajes,
+        "writes": saver.writes / mensajes,
+        "blobs": saver.blobs / mensajes,
+        "checkpoint_ms": saver.segundos * 1000 / mensajes,
+        "p50_ms": statistics.median(latencias),
+        "media_ms": statistics.mean(latencias),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de durabilidad de checkpoints")
+    parser.add_argument("--business", required=True, help="business_id de config_negocios.json")
+    parser.add_argument("--mensajes", type=int, default=5, help="Mensajes por modo")
+    parser.add_argument("--modos", default=",".join(MODOS_DURABILIDAD), help="Modos a medir (sync,async,exit)")
+    parser.add_argument("--texto", default="Hola, ¿qué productos tienen?", help="Mensaje del usuario")
+    parser.add_argument("--fake-llm", action="store_true", help="Usar un LLM local en lugar del real")
+    parser.add_argument("--fake-tool", default="", help="Tool que pide el LLM local en el primer paso")
+    args = parser.parse_args()
+
+    if not kwargs_durabilidad("sync"):
+        print("❌ La versión instalada de LangGraph no permite elegir la durabilidad")
+        return 1
+
+    modos = [m.strip() for m in args.modos.split(",") if m.strip() in MODOS_DURABILIDAD]
+    if args.fake_llm:
+        agent.llm_primary = agent.llm_backup = LLMFalso(herramienta=args.fake_tool)
+        agent.llm_economico = None
+
+    print(f"🧪 {args.mensajes} mensajes por modo para {args.business} ({'LLM local' if args.fake_llm else 'LLM real'})")
+    print(f"{'modo':<6} {'puts/msg':>9} {'writes/msg':>11} {'blobs/msg':>10} {'ckpt ms/msg':>12} {'p50 ms':>9} {'media ms':>9}")
+    for modo in modos:
+        r = medir_modo(modo, args.business, args.mensajes, args.texto)
+        print(f"{r['modo']:<6} {r['puts']:>9.1f} {r['writes']:>11.1f} {r['blobs']:>10.1f} "
+              f"{r['checkpoint_ms']:>12.1f} {r['p50_ms']:>9.0f} {r['media_ms']:>9.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark del serializador de checkpoints (base / zstd / zstd + diccionario).
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/bench_checkpoint_serde.py [--threads 200] [--business cliente1] [--dict DB/zstd/checkpoints-<id>.dict]
+
+Toma el último checkpoint de N threads reales (sus blobs de checkpoint_blobs), los
+deserializa y, para cada serializador, mide bytes por checkpoint y tiempo de
+encode/decode por checkpoint.
+
+Sin --dict se entrena un diccionario con la primera mitad de los threads y se mide sobre la
+otra mitad (para no medir sobre los mismos datos con los que se entrenó).
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+load_dotenv()
+
+import zstandard
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from app.db import init_db, get_pool
+from app.services.serializacion import SerializadorComprimido, cargar_diccionario, serializador_checkpoints
+
+init_db(None)
+
+SQL_ULTIMOS_CHECKPOINTS = """
+WITH ultimos AS (
+    SELECT DISTINCT ON (thread_id, checkpoint_ns) thread_id, checkpoint_ns, checkpoint
+    FROM checkpoints
+    WHERE %(prefijo)s::text IS NULL OR split_part(thread_id, ':', 1) = %(prefijo)s
+    ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC
+    LIMIT %(limite)s
+)
+SELECT u.thread_id, b.type, b.blob
+FROM ultimos u
+CROSS JOIN LATERAL jsonb_each_text(u.checkpoint -> 'channel_versions') v
+JOIN checkpoint_blobs b ON b.thread_id = u.thread_id AND b.checkpoint_ns = u.checkpoint_ns
+    AND b.channel = v.key AND b.version = v.value
+WHERE b.blob IS NOT NULL AND b.type NOT IN ('empty', 'null')
+"""
+
+
+def cargar_historias(threads: int, business: str) -> list:
+    """Lista de checkpoints; cada uno es la lista de valores (ya deserializados) de sus canales."""
+    por_thread = {}
+    with get_pool("admin").connection() as conn:
+        for thread_id, tipo, blob in conn.execute(
+            SQL_ULTIMOS_CHECKPOINTS, {"prefijo": business, "limite": threads}
+        ).fetchall():
+            por_thread.setdefault(thread_id, []).append(serializador_checkpoints.loads_typed((tipo, bytes(blob))))
+    return list(por_thread.values())
+
+
+def medir(serializador, checkpoints: list) -> dict:
+    tamanos, encode, decode = [], [], []
+    for valores in checkpoints:
+        inicio = time.perf_counter()
+        serializados = [serializador.dumps_typed(v) for v in valores]
+        encode.append((time.perf_counter() - inicio) * 1e6)
+        tamanos.append(sum(len(d) for _, d in serializados))
+
+        inicio = time.perf_counter()
+        for s in serializados:
+            serializador.loads_typed(s)
+        decode.append((time.perf_counter() - inicio) * 1e6)
+    return {
+        "bytes": statistics.mean(tamanos),
+        "bytes_p95": sorted(tamanos)[int(len(tamanos) * 0.95)],
+        "encode_us": statistics.mean(encode),
+        "decode_us": statistics.mean(decode),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del serializador de checkpoints")
+    parser.add_argument("--threads", type=int, default=200, help="Threads a muestrear (último checkpoint de cada uno)")
+    parser.add_argument("--business", default=None, help="Solo threads de este business_id")
+    parser.add_argument("--dict", default=None, help="Diccionario ya entrenado (si no, se entrena con la mitad)")
+    parser.add_argument("--nivel", type=int, default=3, help="Nivel de zstd")
+    parser.add_argument("--tamano-kb", type=int, default=112, help="Tamaño del diccionario entrenado en KB")
+    args = parser.parse_args()
+
+    checkpoints = cargar_historias(args.threads, args.business)
+    if len(checkpoints) < 10:
+        print(f"❌ Solo {len(checkpoints)} checkpoints con blobs: se necesitan al menos 10")
+        return 1
+
+    base = JsonPlusSerializer()
+    if args.dict:
+        diccionario = cargar_diccionario(args.dict)
+        medidos = checkpoints
+    else:
+        mitad = len(checkpoints) // 2
+        muestras = [base.dumps_typed(v)[1] for valores in checkpoints[:mitad] for v in valores]
+        diccionario = zstandard.train_dictionary(args.tamano_kb * 1024, muestras, level=args.nivel)
+        medidos = checkpoints[mitad:]
+
+    candidatos = {
+        "base": SerializadorComprimido(base=base, comprimir=False),
+        "zstd": SerializadorComprimido(base=base, nivel=args.nivel),
+        "zstd+dict": SerializadorComprimido(base=base, nivel=args.nivel, diccionario=diccionario),
+    }
+
+    canales = sum(len(v) for v in medidos)
+    print(f"🧪 {len(medidos)} checkpoints ({canales} blobs) de {args.business or 'todos los negocios'}, zstd nivel {args.nivel}")
+    print(f"{'serializador':<12} {'bytes/ckpt':>11} {'p95 bytes':>10} {'ratio':>6} {'encode µs':>10} {'decode µs':>10}")
+    referencia = None
+    for nombre, serializador in candidatos.items():
+        r = medir(serializador, medidos)
+        referencia = referencia or r["bytes"]
+        print(f"{nombre:<12} {r['bytes']:>11.0f} {r['bytes_p95']:>10} {referencia / r['bytes']:>5.1f}x "
+              f"{r['encode_us']:>10.0f} {r['decode_us']:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
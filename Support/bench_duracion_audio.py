@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark de lo que se ahorra por nota de voz antes de transcribir.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/bench_duracion_audio.py nota1.ogg nota2.m4a [--repeticiones 20] [--transcribir 5]
+
+1. Duración: encabezados Ogg/MP4 (app/services/audio.py) vs decodificar con pydub/ffmpeg.
+   Mide tiempo de pared y CPU (proceso + hijos, ffmpeg incluido) por nota, y verifica que
+   ambas duraciones coincidan.
+2. Cliente de OpenAI (con --transcribir N y OPENAI_API_KEY): N transcripciones creando un
+   cliente por nota (comportamiento anterior) vs reutilizando cliente_openai(). La diferencia
+   es la construcción del cliente más el handshake TCP/TLS que ahorra el keep-alive.
+"""
+import io
+import os
+import sys
+import time
+import resource
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+load_dotenv()
+
+from pydub import AudioSegment
+from app.services.audio import duracion_por_encabezado
+
+
+def cpu_total() -> float:
+    """CPU de usuario + sistema de este proceso y de los hijos ya terminados (ffmpeg)."""
+    propio = resource.getrusage(resource.RUSAGE_SELF)
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return propio.ru_utime + propio.ru_stime + hijos.ru_utime + hijos.ru_stime
+
+
+def medir(funcion, repeticiones: int) -> tuple:
+    """(ms de pared por llamada, ms de CPU por llamada, último resultado)."""
+    resultado = None
+    cpu = cpu_total()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    pared = (time.perf_counter() - inicio) * 1000 / repeticiones
+    return pared, (cpu_total() - cpu) * 1000 / repeticiones, resultado
+
+
+def formato_de(buf: bytes) -> str:
+    return "ogg" if buf[:4] == b"OggS" else "mp4"
+
+
+def bench_duracion(rutas: list, repeticiones: int):
+    print(f"{'archivo':<28} {'KB':>6} {'seg enc.':>9} {'seg pydub':>9} {'enc. ms':>8} {'enc. CPU':>8} {'pydub ms':>9} {'pydub CPU':>9}")
+    ahorro_pared, ahorro_cpu = [], []
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            buf = f.read()
+        formato = formato_de(buf)
+        enc_ms, enc_cpu, seg_enc = medir(lambda: duracion_por_encabezado(buf), repeticiones)
+        dec_ms, dec_cpu, seg_dec = medir(
+            lambda: len(AudioSegment.from_file(io.BytesIO(buf), format=formato)) / 1000.0, repeticiones
+        )
+        ahorro_pared.append(dec_ms - enc_ms)
+        ahorro_cpu.append(dec_cpu - enc_cpu)
+        seg_enc_txt = f"{seg_enc:.2f}" if seg_enc is not None else "-"
+        print(f"{os.path.basename(ruta)[:28]:<28} {len(buf) / 1024:>6.0f} {seg_enc_txt:>9} {seg_dec:>9.2f} "
+              f"{enc_ms:>8.3f} {enc_cpu:>8.3f} {dec_ms:>9.1f} {dec_cpu:>9.1f}")
+    print(f"⏱️ Ahorro medio por nota: {statistics.mean(ahorro_pared):.1f} ms de pared, {statistics.mean(ahorro_cpu):.1f} ms de CPU")
+
+
+def bench_cliente(ruta: str, veces: int):
+    from openai import OpenAI
+    from app.services.agent import cliente_openai
+
+    with open(ruta, "rb") as f:
+        buf = f.read()
+    modelo = os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
+
+    def transcribir(cliente):
+        archivo = io.BytesIO(buf)
+        archivo.name = f"audio.{formato_de(buf)}"
+        cliente.audio.transcriptions.create(model=modelo, file=archivo, language="es", response_format="text")
+
+    nuevo = [medir(lambda: transcribir(OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))), 1)[0] for _ in range(veces)]
+    transcribir(cliente_openai())  # Calentar la conexión del cliente compartido
+    reutilizado = [medir(lambda: transcribir(cliente_openai()), 1)[0] for _ in range(veces)]
+    print(f"🔌 {veces} transcripciones de {os.path.basename(ruta)} con {modelo}: "
+          f"cliente nuevo p50 {statistics.median(nuevo):.0f} ms, reutilizado p50 {statistics.median(reutilizado):.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de duración de audio y cliente de transcripción")
+    parser.add_argument("archivos", nargs="+", help="Notas de voz (.ogg, .opus, .m4a, .mp4)")
+    parser.add_argument("--repeticiones", type=int, default=20, help="Repeticiones por archivo")
+    parser.add_argument("--transcribir", type=int, default=0, help="Transcripciones reales por variante de cliente (0 = no)")
+    args = parser.parse_args()
+
+    bench_duracion(args.archivos, args.repeticiones)
+    if args.transcribir:
+        if not os.getenv("OPENAI_API_KEY"):
+            print("❌ --transcribir requiere OPENAI_API_KEY")
+            return 1
+        bench_cliente(args.archivos[0], args.transcribir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
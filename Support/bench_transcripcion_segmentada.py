@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark de transcripción de notas largas: un request vs segmentos en paralelo.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/bench_transcripcion_segmentada.py nota_larga.ogg [--repeticiones 3]
+
+Con el proveedor configurado (TRANSCRIPTION_PROVIDER, OPENAI_API_KEY) transcribe cada nota
+con un solo request (baseline) y en segmentos paralelos (TRANSCRIPCION_SEGMENTO_SEG,
+TRANSCRIPCION_PARALELO, TRANSCRIPCION_SOLAPE_MS). Reporta tiempo de pared de ambos, latencia
+de cada segmento, minutos facturados y la similitud entre los dos textos.
+"""
+import os
+import sys
+import time
+import argparse
+import difflib
+import statistics
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+load_dotenv()
+
+from app.services.audio import duracion_audio
+from app.services.agent import _transcribir_openai, _transcribir_whisper_local
+from app.services import transcripcion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de transcripción segmentada")
+    parser.add_argument("archivos", nargs="+", help="Notas de voz largas (.ogg, .m4a, .mp3)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por modo")
+    args = parser.parse_args()
+
+    proveedor = os.getenv("TRANSCRIPTION_PROVIDER", "openai")
+    transcribir = _transcribir_whisper_local if proveedor == "whisper-local" else _transcribir_openai
+    print(f"🧪 {proveedor}: segmentos de {transcripcion.SEGMENTO_SEG:.0f}s, {transcripcion.PARALELO} en paralelo, "
+          f"solape {transcripcion.SOLAPE_MS}ms")
+
+    for ruta in args.archivos:
+        with open(ruta, "rb") as f:
+            buf = f.read()
+        formato = os.path.splitext(ruta)[1].lstrip(".").replace("opus", "ogg").replace("m4a", "mp4") or "ogg"
+        duracion = duracion_audio(buf, formato)
+
+        simple, segmentado, latencias = [], [], []
+        texto_simple = texto_segmentado = ""
+        segundos_enviados = duracion
+        for _ in range(args.repeticiones):
+            inicio = time.perf_counter()
+            texto_simple = transcribir(buf, formato) or ""
+            simple.append(time.perf_counter() - inicio)
+
+            # Latencia de cada segmento: se envuelve la función de transcripción
+            def medida(datos, fmt):
+                t0 = time.perf_counter()
+                try:
+                    return transcribir(datos, fmt)
+                finally:
+                    latencias.append(time.perf_counter() - t0)
+
+            inicio = time.perf_counter()
+            texto_segmentado, segundos_enviados = transcripcion.transcribir_en_segmentos(buf, formato, medida, proveedor)
+            texto_segmentado = texto_segmentado or ""
+            segmentado.append(time.perf_counter() - inicio)
+
+        similitud = difflib.SequenceMatcher(None, texto_simple.lower().split(), texto_segmentado.lower().split()).ratio()
+        print(f"\n🔊 {os.path.basename(ruta)}: {duracion:.0f}s de audio")
+        print(f"   un request:  p50 {statistics.median(simple):.1f}s de pared, {duracion / 60:.2f} min facturados")
+        print(f"   segmentado:  p50 {statistics.median(segmentado):.1f}s de pared, {segundos_enviados / 60:.2f} min facturados "
+              f"({statistics.median(simple) / statistics.median(segmentado):.1f}x)")
+        print(f"   segmentos:   {len(latencias) // args.repeticiones} por nota, latencia p50 {statistics.median(latencias):.1f}s, "
+              f"máx {max(latencias):.1f}s")
+        print(f"   similitud de palabras entre ambos textos: {similitud:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Chequeo del preprocesado de imágenes contra comprobantes de referencia.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/check_vision_recibos.py fixtures_recibos/ [--extraer]
+
+El directorio tiene un comprobante por archivo (.jpg, .jpeg, .png, .webp, .pdf) y, al lado,
+un JSON con el mismo nombre con los campos esperados de ReciboTransferencia, por ejemplo:
+
+    recibo_mp_01.jpg
+    recibo_mp_01.json   {"monto": "159360", "operacion": "123456789", "fecha": "02/10/2026",
+                         "cuenta_destino": "0000003100012345678901"}
+
+Sin --extraer solo compara tamaño y tokens de imagen estimados (fórmulas de OpenAI y Gemini)
+de la imagen original contra la preprocesada para IMAGE_ANALYSIS_PROVIDER; no llama a ninguna API.
+
+Con --extraer corre extract_transfer_receipt_data sobre cada comprobante sin preprocesar y
+preprocesado (cache de medios deshabilitado) y reporta campos acertados, tokens de entrada
+reales y latencia de cada modo. Solo se comparan los campos presentes en el JSON esperado.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ["MEDIA_CACHE_MAX"] = "0"  # Cada corrida tiene que llegar al proveedor
+
+from PIL import Image
+from app.services import imagenes
+
+EXTENSIONES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+               ".webp": "image/webp", ".pdf": "application/pdf"}
+
+
+def tokens_openai(ancho: int, alto: int, detail: str) -> int:
+    """Tokens de imagen de OpenAI (gpt-4o/4o-mini base): 85 + 170 por tile de 512 con detail=high."""
+    if detail == "low":
+        return 85
+    escala = min(1.0, 2048 / max(ancho, alto))
+    ancho, alto = ancho * escala, alto * escala
+    escala = min(1.0, 768 / min(ancho, alto))
+    ancho, alto = ancho * escala, alto * escala
+    return 85 + 170 * math.ceil(ancho / 512) * math.ceil(alto / 512)
+
+
+def tokens_gemini(ancho: int, alto: int) -> int:
+    """Tokens de imagen de Gemini 2.x: 258 si entra en 384x384, si no 258 por tile de 768."""
+    if ancho <= 384 and alto <= 384:
+        return 258
+    return 258 * math.ceil(ancho / 768) * math.ceil(alto / 768)
+
+
+def tokens_estimados(proveedor: str, ancho: int, alto: int, detail: str) -> int:
+    return tokens_gemini(ancho, alto) if proveedor == "gemini" else tokens_openai(ancho, alto, detail or "high")
+
+
+def cargar_fixtures(directorio: str) -> list:
+    """[(nombre, bytes, mime_type, campos esperados)] de los comprobantes con su JSON."""
+    fixtures = []
+    for archivo in sorted(os.listdir(directorio)):
+        nombre, ext = os.path.splitext(archivo)
+        esperado = os.path.join(directorio, f"{nombre}.json")
+        if ext.lower() not in EXTENSIONES or not os.path.exists(esperado):
+            continue
+        with open(os.path.join(directorio, archivo), "rb") as f:
+            datos = f.read()
+        with open(esperado, encoding="utf-8") as f:
+            fixtures.append((archivo, datos, EXTENSIONES[ext.lower()], json.load(f)))
+    return fixtures
+
+
+def normalizar(valor) -> str:
+    return "".join(str(valor or "").lower().split())
+
+
+def chequear_tamanos(fixtures: list, proveedor: str):
+    print(f"{'comprobante':<28} {'original':>14} {'KB':>6} {'tokens':>7} {'enviada':>14} {'KB':>6} {'tokens':>7} {'detail':>6}")
+    total_original = total_enviada = 0
+    for nombre, datos, mime_type, _ in fixtures:
+        if not mime_type.startswith("image/"):
+            continue
+        original = Image.open(io.BytesIO(datos)).size
+        enviada_bytes, _, detail = imagenes.preparar_imagen(datos, proveedor, mime_type)
+        enviada = Image.open(io.BytesIO(enviada_bytes)).size
+        tok_original = tokens_estimados(proveedor, *original, "high")
+        tok_enviada = tokens_estimados(proveedor, *enviada, detail)
+        total_original += tok_original
+        total_enviada += tok_enviada
+        print(f"{nombre[:28]:<28} {f'{original[0]}x{original[1]}':>14} {len(datos) // 1024:>6} {tok_original:>7} "
+              f"{f'{enviada[0]}x{enviada[1]}':>14} {len(enviada_bytes) // 1024:>6} {tok_enviada:>7} {detail or '-':>6}")
+    if total_original:
+        print(f"🧮 Tokens de imagen estimados: {total_original} -> {total_enviada} "
+              f"({(1 - total_enviada / total_original) * 100:.0f}% menos)")
+
+
+def chequear_extraccion(fixtures: list):
+    from app.services import agent
+
+    usos = []
+    original_metricas = agent._lanzar_metricas_background
+
+    def capturar(respuesta, thread_id, latency_ms, isLlmPrimary=True):
+        uso = getattr(respuesta, "usage_metadata", None) or {}
+        usos.append(uso.get("input_tokens", 0))
+        return original_metricas(respuesta, thread_id, latency_ms, isLlmPrimary)
+
+    agent._lanzar_metricas_background = capturar
+
+    resumen = {}
+    for modo, preprocesado in (("original", False), ("preprocesada", True)):
+        imagenes.PREPROCESADO = preprocesado
+        aciertos = campos = tokens = 0
+        latencias = []
+        for nombre, datos, mime_type, esperado in fixtures:
+            usos.clear()
+            inicio = time.perf_counter()
+            ok, resultado = agent.extract_transfer_receipt_data(datos, "check_vision:fixtures", None, mime_type)
+            latencias.append(time.perf_counter() - inicio)
+            obtenido = resultado if ok and isinstance(resultado, dict) else {}
+            errores = [c for c, v in esperado.items() if normalizar(obtenido.get(c)) != normalizar(v)]
+            aciertos += len(esperado) - len(errores)
+            campos += len(esperado)
+            tokens += sum(usos)
+            estado = "✅" if not errores else f"❌ {', '.join(errores)}"
+            print(f"[{modo}] {nombre[:28]:<28} {sum(usos):>6} tokens {latencias[-1]:>6.1f}s {estado}")
+        resumen[modo] = (aciertos, campos, tokens, sum(latencias) / len(latencias))
+
+    for modo, (aciertos, campos, tokens, latencia) in resumen.items():
+        print(f"📋 {modo:<12}: {aciertos}/{campos} campos correctos, {tokens} tokens de entrada, "
+              f"latencia media {latencia:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chequeo del preprocesado de imágenes de comprobantes")
+    parser.add_argument("directorio", help="Directorio con los comprobantes y sus JSON esperados")
+    parser.add_argument("--extraer", action="store_true", help="Llamar al proveedor con y sin preprocesado")
+    args = parser.parse_args()
+
+    fixtures = cargar_fixtures(args.directorio)
+    if not fixtures:
+        print(f"❌ No hay comprobantes con su .json en {args.directorio}")
+        return 1
+
+    proveedor = os.getenv("IMAGE_ANALYSIS_PROVIDER", "openai")
+    print(f"🧪 {len(fixtures)} comprobantes, proveedor {proveedor}, lado máx {imagenes.LADO_MAX.get(proveedor)}, "
+          f"{imagenes.FORMATO} q{imagenes.CALIDAD}, recorte {'sí' if imagenes.RECORTE else 'no'}")
+    chequear_tamanos(fixtures, proveedor)
+    if args.extraer:
+        chequear_extraccion(fixtures)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,58 @@
-import psycopg2
-from datetime import datetime, timedelta
-
-def limpiar_datos_antiguos():
-    try:
-        # 1. Conexión a tu base de datos Postgres
-        conn = psycopg2.connect(
-            dbname="tu_db",
-            user="tu_usuario",
-            password="tu_password",
-            host="localhost"
-        )
-        cur = conn.cursor()
-
-        # 2. Definimos el límite (ejemplo: borrar lo anterior a 30 días)
-        limite = datetime.now() - timedelta(days=30)
-        
-        # 3. Ejecutamos el borrado
-        # Cambia 'logs' y 'fecha_registro' por tus nombres reales
-        query = "DELETE FROM logs WHERE fecha_registro < %s"
-        cur.execute(query, (limite,))
-        
-        filas_borradas = cur.rowcount
-        conn.commit()
-
-        # 4. OPCIONAL: Correr un VACUUM sencillo (no bloquea la tabla)
-        # Esto ayuda a que Postgres marque el espacio como reusable internamente
-        conn.set_isolation_level(0) # VACUUM no puede correr dentro de una transacción
-        cur.execute("VACUUM ANALYZE logs")
-        
-        print(f"[{datetime.now()}] Limpieza exitosa: {filas_borradas} filas eliminadas.")
-
-    except Exception as e:
-        print(f"Error en la limpieza: {e}")
-    finally:
-        if conn:
-            cur.close()
-            conn.close()
+#!/usr/bin/env python3
+"""
+Retención de analytics_events por particiones mensuales.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/clear_db.py --meses 6 [--dry-run]
+
+Elimina (DETACH + DROP) las particiones completas anteriores a la ventana de retención
+(mes actual + N meses previos). Requiere la tabla particionada (DB/migrate_analytics_partitions.sh).
+La app ya aplica esta retención sola si ANALYTICS_RETENTION_MESES > 0; este script es para
+correrlo a mano o desde cron.
+"""
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.db import init_db, get_pool
+from app.services.analytics_partitions import (
+    esta_particionada,
+    listar_particiones,
+    eliminar_particiones_vencidas,
+)
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retención de analytics_events por particiones")
+    parser.add_argument("--meses", type=int, default=int(os.getenv("ANALYTICS_RETENTION_MESES", "6") or 6),
+                        help="Meses completos a conservar además del actual")
+    parser.add_argument("--dry-run", action="store_true", help="Solo listar lo que se eliminaría")
+    args = parser.parse_args()
+
+    if args.meses <= 0:
+        print("❌ --meses debe ser mayor a 0")
+        return 1
+
+    init_db(None)
+    with get_pool().connection() as conn:
+        if not esta_particionada(conn):
+            print("❌ analytics_events no está particionada. Ejecutar primero DB/migrate_analytics_partitions.sh")
+            return 1
+
+        print(f"🗂️ Particiones actuales: {', '.join(sorted(listar_particiones(conn).values())) or '(ninguna)'}")
+        eliminadas = eliminar_particiones_vencidas(conn, args.meses, dry_run=args.dry_run)
+
+    if not eliminadas:
+        print("✅ No hay particiones fuera de la ventana de retención.")
+    elif args.dry_run:
+        print(f"🔎 Se eliminarían: {', '.join(eliminadas)}")
+    else:
+        print(f"✅ Particiones eliminadas: {', '.join(eliminadas)}")
+    return 0
+
 
 if __name__ == "__main__":
-    limpiar_datos_antiguos()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Entrena el diccionario zstd de checkpoints con nuestros propios blobs.
+Ejecutar: cd /home/leanusr/sisagent && python3 Support/entrenar_diccionario_zstd.py [--muestras 5000] [--tamano-kb 112] [--salida DB/zstd]
+
+Toma una muestra de checkpoint_blobs y checkpoint_writes (descomprimiendo las filas que ya
+estén en zstd), entrena un diccionario y lo guarda como <salida>/checkpoints-<dict_id>.dict.
+Después: CHECKPOINT_ZSTD_DICT=<ruta> y reiniciar. Los diccionarios anteriores deben quedar en
+la misma carpeta para poder leer las filas comprimidas con ellos.
+"""
+import os
+import sys
+import random
+import argparse
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+load_dotenv()
+
+import zstandard
+from app.db import init_db, get_pool
+from app.services.serializacion import serializador_checkpoints
+
+init_db(None)
+
+SQL_MUESTRA = """
+SELECT type, blob FROM {tabla} TABLESAMPLE SYSTEM (%s)
+WHERE blob IS NOT NULL AND type NOT IN ('empty', 'null')
+LIMIT %s
+"""
+
+
+def tomar_muestras(cantidad: int, porcentaje: float) -> list:
+    muestras = []
+    with get_pool("admin").connection() as conn:
+        for tabla in ("checkpoint_blobs", "checkpoint_writes"):
+            for tipo, blob in conn.execute(SQL_MUESTRA.format(tabla=tabla), (porcentaje, cantidad // 2)).fetchall():
+                muestras.append(serializador_checkpoints.descomprimir(tipo, bytes(blob))[1])
+    random.shuffle(muestras)
+    return muestras
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrenamiento del diccionario zstd de checkpoints")
+    parser.add_argument("--muestras", type=int, default=5000, help="Blobs a muestrear (mitad blobs, mitad writes)")
+    parser.add_argument("--porcentaje", type=float, default=10.0, help="Porcentaje de páginas para TABLESAMPLE")
+    parser.add_argument("--tamano-kb", type=int, default=112, help="Tamaño del diccionario en KB")
+    parser.add_argument("--nivel", type=int, default=3, help="Nivel de zstd para la validación")
+    parser.add_argument("--salida", default="DB/zstd", help="Carpeta de destino")
+    args = parser.parse_args()
+
+    muestras = tomar_muestras(args.muestras, args.porcentaje)
+    if len(muestras) < 100:
+        print(f"❌ Solo {len(muestras)} muestras: se necesitan al menos 100 (subir --porcentaje)")
+        return 1
+
+    # 90% para entrenar, 10% para validar la ganancia contra zstd sin diccionario
+    corte = int(len(muestras) * 0.9)
+    entrenamiento, validacion = muestras[:corte], muestras[corte:]
+    diccionario = zstandard.train_dictionary(args.tamano_kb * 1024, entrenamiento, level=args.nivel)
+
+    original = sum(len(m) for m in validacion)
+    sin_dict = zstandard.ZstdCompressor(level=args.nivel)
+    con_dict = zstandard.ZstdCompressor(level=args.nivel, dict_data=diccionario)
+    bytes_sin = sum(len(sin_dict.compress(m)) for m in validacion)
+    bytes_con = sum(len(con_dict.compress(m)) for m in validacion)
+
+    os.makedirs(args.salida, exist_ok=True)
+    ruta = os.path.join(args.salida, f"checkpoints-{diccionario.dict_id()}.dict")
+    with open(ruta, "wb") as f:
+        f.write(diccionario.as_bytes())
+
+    print(f"🗜️ Diccionario {diccionario.dict_id()} entrenado con {len(entrenamiento)} muestras → {ruta}")
+    print(f"   Validación ({len(validacion)} muestras, {original / 1024:.0f} KB): "
+          f"zstd {original / bytes_sin:.1f}x, zstd+dict {original / bytes_con:.1f}x")
+    print(f"   Activar con CHECKPOINT_ZSTD_DICT={ruta}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
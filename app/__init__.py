@@ -4,6 +4,7 @@ from loguru import logger
 from .logger_config import inicializar_logger
 from .db import init_db
 import threading
+import time
 import os
 from .workers.instagram import worker_secuencial_instagram  
 from .utils.utilities import get_app_configs
@@ -42,9 +43,63 @@ def create_app(config_object=None):
     # inicializar DB/pools/servicios globales aquí
     init_db(app)
 
-    #Obtengo las configuraciones de la app
+    #Obtengo las configuraciones de la app (tabla tenant_config con avisos por LISTEN/NOTIFY)
+    from .services.config_store import config_store
+    config_store.iniciar()
     get_app_configs()
 
+    # Restaurar blacklist/whitelist y cooldowns de DMs persistidos (carga en bloque por worker)
+    from .utils.ddos_protection import ddos_protection, tracker_dms
+    from .utils.ddos_persistence import inicializar_persistencia_ddos
+    inicializar_persistencia_ddos(ddos_protection, tracker_dms)
+
+    # Particiones mensuales de analytics_events: crear las futuras y aplicar retención
+    from .services.analytics_partitions import iniciar_mantenimiento_particiones
+    iniciar_mantenimiento_particiones()
+
+    # Vencimiento de sesiones: tabla de última actividad y barrido en lote de threads vencidos
+    from .services.sesiones import iniciar_barrido_sesiones
+    iniciar_barrido_sesiones()
+
+    # Compactación periódica de checkpoints (conserva los últimos N por thread)
+    from .services.compactacion import compactador_checkpoints, intervalo_compactacion_horas
+    compactador_checkpoints.iniciar(intervalo_compactacion_horas())
+
+    # Gasto del día/mes por negocio (presupuestos): carga desde la DB y reconciliación periódica
+    from .services.costos import cost_accumulator
+    cost_accumulator.iniciar()
+
+    # Registros de auditoría también en audit_log (particionada e indexada) para buscarlos por API
+    from .services.auditoria import audit_store
+    audit_store.iniciar()
+
+    # Whisper local: procesos con el modelo residente (la carga arranca en segundo plano)
+    if os.getenv("TRANSCRIPTION_PROVIDER", "openai") == "whisper-local":
+        from .services.whisper_local import pool_whisper
+        pool_whisper.iniciar()
+
+    # Métricas para /metrics: duración de cada request (webhooks incluidos) y volcado multi-worker
+    from .utils.metrics import metricas, http_duracion
+
+    @app.before_request
+    def _inicio_request_metricas():
+        request._inicio_metricas = time.perf_counter()
+
+    @app.after_request
+    def _fin_request_metricas(response):
+        inicio = getattr(request, "_inicio_metricas", None)
+        if inicio is not None:
+            http_duracion.observe(
+                time.perf_counter() - inicio,
+                # url_rule y no path: los ids en la URL harían explotar la cardinalidad
+                endpoint=request.url_rule.rule if request.url_rule else "unmatched",
+                method=request.method,
+                status=response.status_code,
+            )
+        return response
+
+    metricas.iniciar()
+
     if _HAS_FLASGGER:
         # Initialize Flasgger Swagger UI
         try:
@@ -84,6 +139,7 @@ def create_app(config_object=None):
     from .routes.hitl_tool_enable import hitl_tool_enable_bp
     from .routes.meta_onboarding import meta_onboarding_bp
     from .routes.calendar import calendar_bp
+    from .routes.metrics import metrics_bp
 
     app.register_blueprint(frontend_bp, url_prefix='')
     app.register_blueprint(admin_bp, url_prefix='/api')
@@ -93,6 +149,7 @@ def create_app(config_object=None):
     app.register_blueprint(hitl_tool_enable_bp, url_prefix='')
     app.register_blueprint(meta_onboarding_bp, url_prefix='')
     app.register_blueprint(calendar_bp, url_prefix='')
+    app.register_blueprint(metrics_bp, url_prefix='')
 
     # 3. Arrancar el Hilo Demonio junto con Flask para procesar tareas de contestación de comentarios de Instagram (si está habilitado)
     # 'daemon=True' asegura que el hilo muera automáticamente si apagas Flask
@@ -1,30 +1,220 @@
-from psycopg_pool import ConnectionPool
+from psycopg_pool import ConnectionPool, PoolTimeout
 import os
+import time
+import threading
+import psycopg
+from contextlib import contextmanager
 from loguru import logger
+from app.utils.metrics import pool_espera, pool_timeouts
 
-_pool = None
+# Pools por tipo de carga, para que un dashboard pesado o un lote de analytics no dejen sin
+# conexiones al checkpointer:
+#
+# - checkpoint: checkpointer de LangGraph, expiración de sesión, HITL (camino del mensaje).
+# - analytics:  AnalyticsWriter, rollups, presupuestos, estado DDoS.
+# - admin:      escrituras del panel, recargas de configuración y lotes de purga. Usa
+#               DB_DIRECT_URI si está definido. Los jobs que sostienen un advisory lock de
+#               sesión toda la corrida (compactación, barrido de sesiones, particiones) no
+#               lo usan: abren su propia conexión con conexion_dedicada().
+# - reporting:  lecturas del dashboard y percentiles. Usa DB_REPLICA_URI si está definido.
+# - export:     exports largos (una conexión por export). También lee de la réplica.
+#
+# Cada pool se configura con DB_POOL_<NOMBRE>_MIN / _MAX / _TIMEOUT / _MAX_WAITING.
+# Defaults: (min_size, max_size, timeout de espera en segundos, max_waiting)
+#
+# Presupuesto de conexiones: con los defaults cada worker abre como máximo 8+3+2+3+2 = 18
+# conexiones de pool, más 1 fuera de pool para el LISTEN de tenant_config. Con los 10
+# workers del Dockerfile son 190, más una conexión dedicada por job de mantenimiento en
+# curso (solo en el worker que tiene el advisory lock): por debajo de las 200 que podía
+# abrir el pool único anterior (20 x 10). Si se suben los máximos o los workers, revisar
+# max_connections de Postgres: suma(DB_POOL_*_MAX) x workers + workers + jobs.
+POOLS = {
+    "checkpoint": (1, 8, 30.0, 20),
+    "analytics": (0, 3, 10.0, 50),
+    "admin": (0, 2, 30.0, 10),
+    "reporting": (0, 3, 30.0, 10),
+    "export": (0, 2, 5.0, 2),
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+_inicializado = False
+
+
+class PoolMedido(ConnectionPool):
+    """ConnectionPool que observa cuánto espera cada pedido de conexión y cuenta los timeouts."""
+
+    def getconn(self, timeout=None):
+        inicio = time.perf_counter()
+        try:
+            return super().getconn(timeout)
+        except PoolTimeout:
+            pool_timeouts.inc(pool=self.name)
+            raise
+        finally:
+            pool_espera.observe(time.perf_counter() - inicio, pool=self.name)
 
-def init_db(app):
-    global _pool
 
+def _db_uri():
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_NAME = os.getenv('DB_NAME_AGENT', 'checkpointer_db')
     DB_USER = os.getenv('DB_USER', 'sisbot_user')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres_password')
     DB_PORT = os.getenv('DB_PORT', '5432')
 
-    DB_URI = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    return f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+
+def modo_pgbouncer() -> bool:
+    """DB_PGBOUNCER=true: PgBouncer en modo transaction pooling delante de Postgres."""
+    return os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+
+def _destino(nombre: str) -> tuple:
+    """(conninfo, destino) del pool. destino es primary, replica o direct (sin credenciales)."""
+    if nombre in ("reporting", "export") and os.getenv('DB_REPLICA_URI'):
+        return os.getenv('DB_REPLICA_URI'), "replica"
+    if nombre == "admin" and os.getenv('DB_DIRECT_URI'):
+        return os.getenv('DB_DIRECT_URI'), "direct"
+    return _db_uri(), "primary"
+
+
+def _config_pool(nombre: str) -> tuple:
+    min_size, max_size, timeout, max_waiting = POOLS[nombre]
+    prefijo = f"DB_POOL_{nombre.upper()}_"
+
+    try:
+        min_size = int(os.getenv(prefijo + "MIN", min_size))
+    except Exception:
+        pass
+
+    try:
+        # DB_EXPORT_POOL_MAX: nombre anterior del máximo del pool de exports
+        max_size = int(os.getenv(prefijo + "MAX", os.getenv('DB_EXPORT_POOL_MAX', max_size) if nombre == "export" else max_size))
+    except Exception:
+        pass
+
+    try:
+        timeout = float(os.getenv(prefijo + "TIMEOUT", timeout))
+    except Exception:
+        pass
+
+    try:
+        max_waiting = int(os.getenv(prefijo + "MAX_WAITING", max_waiting))
+    except Exception:
+        pass
+
+    max_size = max(1, max_size)
+    return min(min_size, max_size), max_size, timeout, max_waiting
+
 
-    _pool = ConnectionPool(
-        conninfo=DB_URI,
-        min_size=1,
-        max_size=20,
-        kwargs={"autocommit": True},
+def _crear_pool(nombre: str) -> PoolMedido:
+    min_size, max_size, timeout, max_waiting = _config_pool(nombre)
+    conninfo, destino = _destino(nombre)
+
+    kwargs = {"autocommit": True}
+    if modo_pgbouncer() and destino != "direct":
+        # En transaction pooling cada transacción puede caer en otra conexión del servidor:
+        # sin prepared statements del lado del servidor
+        kwargs["prepare_threshold"] = None
+
+    pool = PoolMedido(
+        conninfo=conninfo,
+        min_size=min_size,
+        max_size=max_size,
+        kwargs=kwargs,
+        name=nombre,
+        timeout=timeout,
         reconnect_timeout=30,
-        max_waiting=20,
+        max_waiting=max_waiting,
+        open=True,
     )
+    pool.destino = destino
+    logger.info(f"✅ Pool '{nombre}' inicializado ({destino}, max_size={max_size}, timeout={timeout}s).")
+    return pool
+
+
+@contextmanager
+def conexion_dedicada(nombre: str = "admin"):
+    """
+    Conexión propia (fuera del pool) al destino del pool `nombre`, para el LISTEN de
+    configuración y los jobs que sostienen un advisory lock de sesión durante toda la corrida:
+    así no ocupan una conexión del pool que necesitan el panel y las recargas de configuración.
+    """
+    conninfo, destino = _destino(nombre)
+    kwargs = {"autocommit": True, "connect_timeout": 10}
+    if modo_pgbouncer() and destino != "direct":
+        kwargs["prepare_threshold"] = None
+    with psycopg.connect(conninfo, **kwargs) as conn:
+        yield conn
+
+
+def presupuesto_conexiones() -> int:
+    """Máximo de conexiones de pool que puede abrir este worker con la configuración actual."""
+    return sum(_config_pool(nombre)[1] for nombre in POOLS)
+
+
+def init_db(app):
+    global _inicializado
+
+    _inicializado = True
+    _pools["checkpoint"] = _crear_pool("checkpoint")
+
+    if modo_pgbouncer() and not os.getenv('DB_DIRECT_URI'):
+        logger.warning(
+            "⚠️ DB_PGBOUNCER=true sin DB_DIRECT_URI: los jobs de mantenimiento usan advisory locks "
+            "de sesión y la configuración escucha con LISTEN, que PgBouncer en transaction pooling no garantiza"
+        )
+
+    logger.info(
+        f"✅ Pool de conexiones a la base de datos inicializado correctamente "
+        f"(hasta {presupuesto_conexiones()} conexiones de pool por worker, más LISTEN y jobs)."
+    )
+
+
+def get_pool(nombre: str = "checkpoint"):
+    """
+    Pool de la carga `nombre` (ver POOLS). Los pools distintos de checkpoint se crean en el
+    primer uso. Devuelve None si init_db no se llamó.
+    """
+    if not _inicializado:
+        return None
+    pool = _pools.get(nombre)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(nombre)
+            if pool is None:
+                pool = _pools[nombre] = _crear_pool(nombre)
+    return pool
+
+
+def get_export_pool():
+    """
+    Pool separado (y chico) para exports largos: un export que tarda minutos ocupa una
+    conexión de este pool y nunca una del pool principal que usa el checkpointer.
+    Se crea recién en el primer export.
+    """
+    return get_pool("export")
 
-    logger.info("✅ Pool de conexiones a la base de datos inicializado correctamente.")
 
-def get_pool():
-    return _pool
\ No newline at end of file
+def estado_pools() -> dict:
+    """Estado de los pools ya creados en este worker (conexiones, espera, saturación)."""
+    estado = {}
+    for nombre, pool in list(_pools.items()):
+        stats = pool.get_stats()
+        en_uso = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+        pedidos = stats.get("requests_num", 0)
+        estado[nombre] = {
+            "target": getattr(pool, "destino", "primary"),
+            "max": pool.max_size,
+            "size": stats.get("pool_size", 0),
+            "available": stats.get("pool_available", 0),
+            "in_use": en_uso,
+            "waiting": stats.get("requests_waiting", 0),
+            "saturation": round(en_uso / pool.max_size, 3) if pool.max_size else 0.0,
+            "requests": pedidos,
+            "requests_queued": stats.get("requests_queued", 0),
+            "timeouts": stats.get("requests_errors", 0),
+            "avg_wait_ms": round(stats.get("requests_wait_ms", 0) / pedidos, 2) if pedidos else 0.0,
+        }
+    return estado
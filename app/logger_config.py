@@ -1,5 +1,9 @@
 import sys
 import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -38,8 +42,144 @@ def inicializar_logger():
         encoding="utf-8"
     )
 
-# Usamos un Set en memoria para registrar qué clientes ya tienen su handler activo
-_clientes_configurados = set()
+AUDIT_DIR = "logs_auditoria"
+AUDIT_FORMATO = "{time:YYYY-MM-DD HH:mm:ss} | {message}"
+
+try:
+    AUDIT_MAX_ARCHIVOS_ABIERTOS = max(1, int(os.getenv("AUDIT_MAX_ARCHIVOS_ABIERTOS", "128")))
+except Exception:
+    AUDIT_MAX_ARCHIVOS_ABIERTOS = 128
+
+try:
+    AUDIT_ROTACION_BYTES = int(float(os.getenv("AUDIT_ROTACION_MB", "10")) * 1024 * 1024)
+except Exception:
+    AUDIT_ROTACION_BYTES = 10 * 1024 * 1024
+
+try:
+    AUDIT_RETENCION_DIAS = float(os.getenv("AUDIT_RETENCION_DIAS", "30"))
+except Exception:
+    AUDIT_RETENCION_DIAS = 30.0
+
+
+def filtro_auditoria(record):
+    return record["extra"].get("is_audit") is True
+
+
+class SinkAuditoria:
+    """
+    Sink único de auditoría: escribe cada registro en logs_auditoria/audit_<business_id>.log.
+
+    Los archivos abiertos se guardan en un LRU acotado (al pasar el máximo se cierra el menos
+    usado y se reabre en append cuando vuelve a escribir). La rotación por tamaño y la
+    retención se aplican por cliente, con los mismos nombres que usaba el handler de Loguru
+    (audit_<id>.<fecha>.log).
+    """
+
+    def __init__(self, directorio=AUDIT_DIR, max_abiertos=AUDIT_MAX_ARCHIVOS_ABIERTOS,
+                 rotacion_bytes=AUDIT_ROTACION_BYTES, retencion_dias=AUDIT_RETENCION_DIAS):
+        self.directorio = directorio
+        self.max_abiertos = max(1, max_abiertos)
+        self.rotacion_bytes = rotacion_bytes
+        self.retencion_seg = retencion_dias * 86400
+        # business_id -> [archivo, bytes escritos]
+        self._abiertos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aperturas = 0
+        self.rotaciones = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, business_id):
+        return os.path.join(self.directorio, f"audit_{business_id}.log")
+
+    def _abrir(self, business_id):
+        while len(self._abiertos) >= self.max_abiertos:
+            _, (archivo, _) = self._abiertos.popitem(last=False)
+            archivo.close()
+        archivo = open(self._ruta(business_id), "a", buffering=1, encoding="utf-8")
+        entrada = self._abiertos[business_id] = [archivo, os.fstat(archivo.fileno()).st_size]
+        self.aperturas += 1
+        return entrada
+
+    def _rotar(self, business_id, entrada):
+        entrada[0].close()
+        del self._abiertos[business_id]
+        ruta = self._ruta(business_id)
+        sufijo = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        try:
+            os.replace(ruta, ruta[:-len(".log")] + f".{sufijo}.log")
+        except FileNotFoundError:
+            pass  # Otro worker ya lo rotó
+        self.rotaciones += 1
+        self._aplicar_retencion(business_id)
+
+    def _aplicar_retencion(self, business_id):
+        if self.retencion_seg <= 0:
+            return
+        prefijo = f"audit_{business_id}."
+        limite = time.time() - self.retencion_seg
+        for nombre in os.listdir(self.directorio):
+            # Solo los rotados de este cliente: audit_<id>.<fecha>.log
+            if not nombre.startswith(prefijo) or nombre == prefijo + "log":
+                continue
+            if not nombre[len(prefijo):len(prefijo) + 1].isdigit():
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+    def write(self, message):
+        business_id = message.record["extra"].get("business_id")
+        with self._lock:
+            entrada = self._abiertos.get(business_id)
+            if entrada is None:
+                entrada = self._abrir(business_id)
+            else:
+                self._abiertos.move_to_end(business_id)
+
+            tamano = len(message.encode("utf-8"))
+            if self.rotacion_bytes and entrada[1] and entrada[1] + tamano > self.rotacion_bytes:
+                self._rotar(business_id, entrada)
+                entrada = self._abrir(business_id)
+
+            entrada[0].write(message)
+            entrada[1] += tamano
+
+    def stop(self):
+        with self._lock:
+            for archivo, _ in self._abiertos.values():
+                archivo.close()
+            self._abiertos.clear()
+
+    def get_stats(self):
+        return {
+            "abiertos": len(self._abiertos),
+            "max_abiertos": self.max_abiertos,
+            "aperturas": self.aperturas,
+            "rotaciones": self.rotaciones,
+        }
+
+
+_sink_auditoria = None
+_sink_lock = threading.Lock()
+
+
+def _registrar_sink_auditoria():
+    """Registra el sink de auditoría una sola vez por proceso (un filtro y un hilo de escritura)."""
+    global _sink_auditoria
+    with _sink_lock:
+        if _sink_auditoria is None:
+            sink = SinkAuditoria()
+            logger.add(
+                sink,
+                filter=filtro_auditoria,
+                format=AUDIT_FORMATO,
+                enqueue=True,  # Thread-safe
+            )
+            _sink_auditoria = sink
+    return _sink_auditoria
 
 
 def generar_resumen_auditoria(business_id, message):
@@ -47,32 +187,8 @@ def generar_resumen_auditoria(business_id, message):
     Registra el resumen de la conversación en el archivo exclusivo del cliente.
     Crea el archivo automáticamente si es la primera vez que el cliente interactúa.
     """
-    
-    # Asegurar que existe la carpeta de logs
-    if not os.path.exists("logs_auditoria"):
-        os.makedirs("logs_auditoria")
-        
-    # 2. Creación explícita del Handler para el cliente (Solo corre 1 vez por cliente)
-    if business_id not in _clientes_configurados:
-        # Usamos f-strings de Python puro para el nombre, sin depender de Loguru
-        ruta_archivo = f"logs_auditoria/audit_{business_id}.log"
-        
-        # ⚠️ Filtro estricto: Solo atrapa a ESTE cliente y que SEA auditoría
-        def filtro_cliente_especifico(record):
-            extra = record["extra"]
-            return extra.get("is_audit") is True and extra.get("business_id") == business_id
-
-        # Agregamos el archivo a Loguru
-        logger.add(
-            ruta_archivo,
-            filter=filtro_cliente_especifico,
-            format="{time:YYYY-MM-DD HH:mm:ss} | {message}",
-            rotation="10 MB",
-            retention="30 days",
-            enqueue=True, # Thread-safe
-            encoding="utf-8"
-        )
-        _clientes_configurados.add(business_id)
-        
-    # Emitimos el log "etiquetado". 
-    logger.bind(business_id=business_id, is_audit=True).info(message)
\ No newline at end of file
+    if _sink_auditoria is None:
+        _registrar_sink_auditoria()
+
+    # Emitimos el log "etiquetado"; el sink lo enruta al archivo del cliente
+    logger.bind(business_id=business_id, is_audit=True).info(message)
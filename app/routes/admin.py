@@ -1,21 +1,45 @@
 from flask import Blueprint, request, jsonify
-from ..db import get_pool
+from ..db import get_pool, get_export_pool, estado_pools, modo_pgbouncer
 import os, logging
+import threading
 import json
 import psycopg
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from loguru import logger
 from ..utils.utilities import get_app_configs
 from ..services.agent import get_agent_tools
 from ..services.agent import workflow_builder # Importamos el builder para crear el grafico de grafo
 from flask import Response
-from ..utils.ddos_protection import ddos_protection
+from ..utils.ddos_protection import ddos_protection, tracker_dms
+from ..services.analytics import analytics_writer
+from ..services.analytics_rollups import asegurar_tablas_rollup, construir_dashboard_desde_rollups, reconstruir_rollups
+from ..services.dashboard import construir_dashboard_desde_eventos, dashboard_cache
+from ..services.analytics_export import FORMATOS as FORMATOS_EXPORT, formato_disponible as formato_export_disponible, StreamExport
+from psycopg_pool import PoolTimeout
+from ..services.costos import cost_accumulator, evaluar_presupuesto
+from ..services.latencias import latencias_vivas, percentiles_persistidos
+from ..services.sesiones import borrar_memoria_threads
+from ..services.compactacion import compactador_checkpoints
+from ..services.cache_checkpoints import cache_checkpoints
+from ..services.cache_media import cache_media
+from ..services.purga_memoria import purga_memoria, PurgaEnCurso
+from ..services.config_store import config_store, ConflictoVersion, ConfigNoDisponible
+from ..services.auditoria import audit_store
 
 admin_bp = Blueprint('admin', __name__)
 
 logger.info("🚀 Starting Admin Blueprint...")
 
 
+def _admin_no_autorizado(contexto: str = "ADMIN"):
+    """Valida el header X-Admin-Token (si ADMIN_TOKEN está configurado). Retorna la respuesta 401 o None."""
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if admin_token and request.headers.get("X-Admin-Token", "") != admin_token:
+        logger.warning(f"[{contexto}] Acceso no autorizado desde {request.remote_addr}")
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
 # curl -sS http://localhost:5001/api/health
 # curl -sS http://sisagent.sisnova.org/api/health
 @admin_bp.route('/health', methods=['GET'])
@@ -69,9 +93,12 @@ def wipe_analytics():
             return jsonify({"error": "Missing explicit confirmation. Send JSON {\"confirm\":\"I UNDERSTAND\"}"}), 400
 
         # Ejecutar TRUNCATE de forma atómica
-        pool = get_pool()
+        pool = get_pool("analytics")
         with pool.connection() as conn:
             conn.execute("TRUNCATE TABLE analytics_events RESTART IDENTITY CASCADE")
+            asegurar_tablas_rollup(conn)
+            conn.execute("TRUNCATE TABLE analytics_rollup_hourly, analytics_rollup_threads")
+        dashboard_cache.invalidar()
 
         logger.info(f"[ADMIN] analytics_events truncated by {request.remote_addr} (user-agent: {request.headers.get('User-Agent')})")
         return jsonify({"status": "ok", "message": "analytics_events truncated"}), 200
@@ -130,13 +157,19 @@ def get_dashboard():
             if start_date_str else end_date - timedelta(days=30)
         )
 
-        biz_filter = "AND business_id = %s" if business_id else ""
-        biz_params_pre = (business_id,) if business_id else ()
+        # La clave usa los parámetros tal como llegan: sin end_date el rango "hasta ahora"
+        # queda acotado por el TTL de la caché
+        cache_key = (business_id or "", start_date_str or "", end_date_str or "")
+        cacheado = dashboard_cache.obtener(cache_key)
+        if cacheado:
+            etag, dashboard = cacheado
+            logger.debug(f"[DASHBOARD] Cache hit: {cache_key}")
+            return _respuesta_dashboard(dashboard, etag)
 
         logger.info(f"[DASHBOARD] Consulta: {start_date.date()} → {end_date.date()} | negocio: {business_id or 'todos'}")
 
         # Check DB pool availability early and return a clear 503 if not configured
-        pool = get_pool()
+        pool = get_pool("reporting")
         if not pool:
             logger.warning("[DASHBOARD] Base de datos no configurada; get_pool() devolvió None")
             return jsonify({"error": "Database not configured"}), 503
@@ -153,235 +186,29 @@ def get_dashboard():
             "businesses": [],
         }
 
-        pool = get_pool()
+        # Rangos mayores a un día se sirven desde los rollups horarios (costo independiente del histórico);
+        # el resto sale de analytics_events en una sola consulta
+        usar_rollups = (
+            os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true").lower() == "true"
+            and end_date - start_date > timedelta(days=1)
+        )
+
         with pool.connection() as conn:
             with conn.cursor() as cur:
-                # KPIs
-                cur.execute(f"""
-                    SELECT
-                        COUNT(*)                                            AS total_events,
-                        COUNT(DISTINCT thread_id)                           AS unique_conversations,
-                        COUNT(DISTINCT business_id)                         AS active_businesses,
-                        COALESCE(SUM(input_tokens + output_tokens), 0)      AS total_tokens,
-                        COALESCE(SUM(estimated_cost), 0.0)                  AS total_cost_usd,
-                        COALESCE(AVG(latency_ms), 0)::INT                   AS avg_latency_ms,
-                        COUNT(*) FILTER (WHERE event_type = 'llm_fallback') AS fallback_count,
-                        COUNT(*) FILTER (WHERE event_type = 'transcription') AS transcription_count,
-                        COUNT(*) FILTER (WHERE event_type = 'image_analysis') AS image_count
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                """, (start_date, end_date) + biz_params_pre)
-                row = cur.fetchone()
-                total_events = (row[0] or 1)
-                fallback_count = row[6] or 0
-                dashboard["kpis"] = {
-                    "total_events": row[0],
-                    "unique_conversations": row[1],
-                    "active_businesses": row[2],
-                    "total_tokens": row[3],
-                    "total_cost_usd": round(row[4], 6),
-                    "avg_latency_ms": row[5],
-                    "fallback_rate_pct": round(fallback_count / total_events * 100, 2),
-                    "transcription_events": row[7],
-                    "image_analysis_events": row[8],
-                }
-
-                # Performance: latencies, by tool, events per hour, fallback daily
-                cur.execute(f"""
-                    SELECT
-                        PERCENTILE_CONT(0.50) WITHIN GROUP (ORDER BY latency_ms)::INT AS p50,
-                        PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY latency_ms)::INT AS p95,
-                        PERCENTILE_CONT(0.99) WITHIN GROUP (ORDER BY latency_ms)::INT AS p99,
-                        MAX(latency_ms)                                                 AS max_ms
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                """, (start_date, end_date) + biz_params_pre)
-                p = cur.fetchone()
-                dashboard["performance"]["latency_percentiles_ms"] = {"p50": p[0], "p95": p[1], "p99": p[2], "max": p[3]}
-
-                cur.execute(f"""
-                    SELECT tool_name, AVG(latency_ms)::INT AS avg_ms, COUNT(*) AS calls
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND tool_name IS NOT NULL
-                    {biz_filter}
-                    GROUP BY tool_name
-                    ORDER BY avg_ms DESC
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["performance"]["latency_by_tool"] = [
-                    {"tool": r[0], "avg_latency_ms": r[1], "calls": r[2]} for r in cur.fetchall()
-                ]
-
-                cur.execute(f"""
-                    SELECT DATE_TRUNC('hour', timestamp) AS hour, COUNT(*) AS events
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY hour
-                    ORDER BY hour
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["performance"]["events_per_hour"] = [{"hour": r[0].isoformat(), "events": r[1]} for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT
-                        DATE(timestamp) AS day,
-                        COUNT(*) FILTER (WHERE event_type = 'llm_fallback') AS fallbacks,
-                        COUNT(*) AS total
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY day ORDER BY day
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["performance"]["fallback_rate_daily"] = [
-                    {"date": str(r[0]), "fallbacks": r[1], "total": r[2], "rate_pct": round(r[1] / max(r[2], 1) * 100, 2)}
-                    for r in cur.fetchall()
-                ]
-
-                # Costs
-                cur.execute(f"""
-                    SELECT DATE(timestamp) AS day,
-                           SUM(estimated_cost)             AS cost,
-                           SUM(input_tokens + output_tokens) AS tokens
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY day ORDER BY day
-                """, (start_date, end_date) + biz_params_pre)
-                rows_daily = cur.fetchall()
-                dashboard["costs"]["daily"] = [{"date": str(r[0]), "cost_usd": round(r[1] or 0, 6), "tokens": r[2] or 0} for r in rows_daily]
-                if rows_daily:
-                    avg_daily_cost = sum(r[1] or 0 for r in rows_daily) / len(rows_daily)
-                    dashboard["costs"]["monthly_projection_usd"] = round(avg_daily_cost * 30, 4)
+                if usar_rollups:
+                    construir_dashboard_desde_rollups(cur, dashboard, start_date, end_date, business_id)
                 else:
-                    dashboard["costs"]["monthly_projection_usd"] = 0.0
-
-                cur.execute(f"""
-                    SELECT model_name,
-                           SUM(estimated_cost)               AS cost,
-                           SUM(input_tokens)                  AS input_t,
-                           SUM(output_tokens)                 AS output_t,
-                           COUNT(*)                           AS calls
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND model_name IS NOT NULL
-                    {biz_filter}
-                    GROUP BY model_name
-                    ORDER BY cost DESC
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["costs"]["by_model"] = [{"model": r[0], "cost_usd": round(r[1] or 0, 6), "input_tokens": r[2] or 0, "output_tokens": r[3] or 0, "calls": r[4]} for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT event_type, SUM(estimated_cost) AS cost, COUNT(*) AS calls
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY event_type ORDER BY cost DESC
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["costs"]["by_event_type"] = [{"type": r[0], "cost_usd": round(r[1] or 0, 6), "calls": r[2]} for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT COALESCE(AVG(output_tokens::float / NULLIF(input_tokens, 0)), 0)
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND event_type NOT IN ('transcription', 'image_analysis')
-                    {biz_filter}
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["costs"]["avg_output_input_ratio"] = round((cur.fetchone()[0] or 0), 3)
-
-                # Security
-                cur.execute(f"""
-                    SELECT COUNT(*) FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND tool_name = 'solicitar_atencion_humana'
-                    {biz_filter}
-                """, (start_date, end_date) + biz_params_pre)
-                hitl_count = cur.fetchone()[0] or 0
-                dashboard["security"]["hitl_escalations"] = hitl_count
-                dashboard["security"]["hitl_rate_pct"] = round(hitl_count / total_events * 100, 2)
-
-                try:
-                    config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'config_negocios.json')
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        config_data = json.load(f)
-                    enabled_count = sum(1 for v in config_data.values() if isinstance(v, dict) and v.get('enabled', True))
-                    disabled_count = len(config_data) - enabled_count
-                    dashboard["security"]["businesses_enabled"] = enabled_count
-                    dashboard["security"]["businesses_disabled"] = disabled_count
-                except Exception:
-                    dashboard["security"]["businesses_enabled"] = None
-                    dashboard["security"]["businesses_disabled"] = None
-
-                cur.execute(f"""
-                    SELECT tool_name, COUNT(*) AS errors
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND event_type = 'tool_error'
-                    {biz_filter}
-                    GROUP BY tool_name ORDER BY errors DESC
-                    LIMIT 10
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["security"]["tool_errors"] = [{"tool": r[0], "errors": r[1]} for r in cur.fetchall()]
-
-                # Usage
-                cur.execute(f"""
-                    SELECT DATE(timestamp) AS day, COUNT(DISTINCT thread_id) AS users
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY day ORDER BY day
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["usage"]["daily_unique_users"] = [{"date": str(r[0]), "users": r[1]} for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT tool_name, COUNT(*) AS calls
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                      AND tool_name IS NOT NULL
-                    {biz_filter}
-                    GROUP BY tool_name ORDER BY calls DESC
-                    LIMIT 15
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["usage"]["top_tools"] = [{"tool": r[0], "calls": r[1]} for r in cur.fetchall()]
-
-                cur.execute(f"""
-                    SELECT event_type, COUNT(*) AS count
-                    FROM analytics_events
-                    WHERE timestamp >= %s AND timestamp < %s
-                    {biz_filter}
-                    GROUP BY event_type ORDER BY count DESC
-                """, (start_date, end_date) + biz_params_pre)
-                dashboard["usage"]["event_type_distribution"] = [{"type": r[0], "count": r[1]} for r in cur.fetchall()]
-
-                if not business_id:
-                    cur.execute("""
-                        SELECT
-                            business_id,
-                            COUNT(*)                                            AS events,
-                            COUNT(DISTINCT thread_id)                           AS conversations,
-                            COALESCE(SUM(estimated_cost), 0)                    AS cost_usd,
-                            COALESCE(AVG(latency_ms), 0)::INT                   AS avg_latency_ms,
-                            COUNT(*) FILTER (WHERE event_type = 'llm_fallback') AS fallbacks
-                        FROM analytics_events
-                        WHERE timestamp >= %s AND timestamp < %s
-                        GROUP BY business_id
-                        ORDER BY cost_usd DESC
-                    """, (start_date, end_date))
-                    dashboard["businesses"] = [
-                        {
-                            "business_id": r[0],
-                            "events": r[1],
-                            "conversations": r[2],
-                            "cost_usd": round(r[3], 6),
-                            "avg_latency_ms": r[4],
-                            "fallback_rate_pct": round(r[5] / max(r[1], 1) * 100, 2),
-                        }
-                        for r in cur.fetchall()
-                    ]
+                    construir_dashboard_desde_eventos(cur, dashboard, start_date, end_date, business_id)
+
+        # Config en memoria (hot reload por mtime) en lugar de leer el JSON en cada request
+        config_data = get_app_configs() or {}
+        enabled_count = sum(1 for v in config_data.values() if isinstance(v, dict) and v.get('enabled', True))
+        dashboard["security"]["businesses_enabled"] = enabled_count
+        dashboard["security"]["businesses_disabled"] = len(config_data) - enabled_count
 
+        etag = dashboard_cache.guardar(cache_key, dashboard)
         logger.info(f"[DASHBOARD] Respuesta generada exitosamente para periodo {start_date.date()} → {end_date.date()}")
-        return jsonify(dashboard), 200
+        return _respuesta_dashboard(dashboard, etag)
 
     except ValueError:
         return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
@@ -394,6 +221,17 @@ def get_dashboard():
         return jsonify({"error": str(e)}), 500
 
 
+def _respuesta_dashboard(dashboard: dict, etag: str):
+    """Responde 304 si el cliente ya tiene esta versión (If-None-Match), si no el JSON con su ETag."""
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        response = Response(status=304)
+    else:
+        response = jsonify(dashboard)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
 @admin_bp.route('/borrar_memoria', methods=['DELETE'])
 def borrar_memoria():
     """Borra la memoria (checkpoints/blobs) de un usuario en un negocio."""
@@ -410,26 +248,12 @@ def borrar_memoria():
 
         thread_id = f"{business_id}:{user_id}"
 
-        pool = get_pool()
+        pool = get_pool("admin")
         with pool.connection() as conn:
-            # Usamos conn.cursor() para ejecutar SQL crudo
-            with conn.cursor() as cur:
-                # 1. Borrar checkpoints (el estado principal)
-                cur.execute(
-                    "DELETE FROM checkpoints WHERE thread_id = %s", 
-                    (thread_id,)
-                )
-                # 2. Borrar escrituras pendientes/auxiliares
-                cur.execute(
-                    "DELETE FROM checkpoint_writes WHERE thread_id = %s", 
-                    (thread_id,)
-                )
-                # 3. Borrar blobs (datos grandes serializados)
-                cur.execute(
-                    "DELETE FROM checkpoint_blobs WHERE thread_id = %s", 
-                    (thread_id,)
-                )
-                logger.info(f"Memoria borrada para thread_id={thread_id}")
+            # checkpoints, writes, blobs y la fila de session_activity en una transacción
+            with conn.transaction():
+                borrar_memoria_threads(conn, [thread_id])
+            logger.info(f"Memoria borrada para thread_id={thread_id}")
 
         return jsonify({
             "status": "MEMORIA_BORRADA", 
@@ -441,10 +265,244 @@ def borrar_memoria():
         return jsonify({"error": "Error al borrar memoria"}), 500
 
 
+@admin_bp.route('/memory/purge', methods=['POST'])
+def purgar_memoria():
+    """Purga en segundo plano la memoria de un negocio completo o de una lista de usuarios.
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: body
+        name: body
+        schema:
+          type: object
+          properties:
+            business_id:
+              type: string
+            user_ids:
+              type: array
+              items:
+                type: string
+            confirm:
+              type: string
+              example: "I UNDERSTAND"
+    responses:
+      202:
+        description: Job started (or resumed)
+      400:
+        description: Missing business_id, invalid user_ids or missing confirmation
+      401:
+        description: Unauthorized
+      409:
+        description: A purge for this business is already running
+    """
+    no_autorizado = _admin_no_autorizado("PURGA")
+    if no_autorizado:
+        return no_autorizado
+
+    data = request.get_json(silent=True) or {}
+    business_id = data.get("business_id")
+    user_ids = data.get("user_ids")
+    if not business_id:
+        return jsonify({"error": "Falta business_id"}), 400
+    if user_ids is not None and (not isinstance(user_ids, list) or not all(user_ids)):
+        return jsonify({"error": "user_ids debe ser una lista de ids no vacíos"}), 400
+    # Sin lista se borra el negocio completo: misma confirmación explícita que wipe_analytics
+    if not user_ids and data.get("confirm") != "I UNDERSTAND":
+        return jsonify({"error": "Missing explicit confirmation. Send JSON {\"confirm\":\"I UNDERSTAND\"}"}), 400
+
+    try:
+        job = purga_memoria.crear(business_id, user_ids or None, solicitante=request.remote_addr)
+    except PurgaEnCurso as e:
+        return jsonify({"error": "Ya hay una purga en curso para este negocio", "job_id": e.job_id}), 409
+    except Exception as e:
+        logger.error(f"🔴 [PURGA] Error creando el job para {business_id}: {e}")
+        return jsonify({"error": "Error al crear la purga"}), 500
+
+    return jsonify({**job, "status_url": f"/api/memory/purge/{job['job_id']}"}), 202
+
+
+@admin_bp.route('/memory/purge', methods=['GET'])
+@admin_bp.route('/memory/purge/<job_id>', methods=['GET'])
+def estado_purga_memoria(job_id=None):
+    """Progreso de un job de purga (o los últimos jobs, filtrables por business_id).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        required: false
+      - in: query
+        name: business_id
+        type: string
+        required: false
+    responses:
+      200:
+        description: Job status (threads_purged / estimated_threads, rows_deleted, status)
+      401:
+        description: Unauthorized
+      404:
+        description: Job not found
+    """
+    no_autorizado = _admin_no_autorizado("PURGA")
+    if no_autorizado:
+        return no_autorizado
+
+    try:
+        if job_id is None:
+            return jsonify({"jobs": purga_memoria.listar(request.args.get("business_id"))})
+        job = purga_memoria.estado(job_id)
+    except Exception as e:
+        logger.error(f"🔴 [PURGA] Error leyendo el estado: {e}")
+        return jsonify({"error": "Error leyendo el estado de la purga"}), 500
+
+    if not job:
+        return jsonify({"error": "Job no encontrado"}), 404
+    return jsonify(job)
+
+
+def _fecha_auditoria(valor: str, fin: bool = False):
+    """YYYY-MM-DD o ISO 8601; sin zona horaria se toma UTC. Una fecha sola como fin incluye ese día."""
+    fecha = datetime.fromisoformat(valor)
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    if fin and len(valor) == 10:
+        fecha += timedelta(days=1)
+    return fecha
+
+
+# curl -sS -H "X-Admin-Token: $ADMIN_TOKEN" "http://localhost:5001/api/audit/search?business_id=cliente1&client_id=54911XXXXXXXX&direction=snd&q=pedido"
+@admin_bp.route('/audit/search', methods=['GET'])
+def buscar_auditoria():
+    """Búsqueda paginada en los registros de auditoría (mensajes recibidos, enviados y acciones de herramientas).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: query
+        name: business_id
+        type: string
+        required: false
+      - in: query
+        name: client_id
+        type: string
+        required: false
+        description: Teléfono o usuario del contacto
+      - in: query
+        name: direction
+        type: string
+        enum: [rcv, snd, tool, otro]
+        required: false
+      - in: query
+        name: start
+        type: string
+        required: false
+        description: YYYY-MM-DD o ISO 8601 (default end - 7 días)
+      - in: query
+        name: end
+        type: string
+        required: false
+        description: YYYY-MM-DD (inclusive) o ISO 8601 (default ahora)
+      - in: query
+        name: q
+        type: string
+        required: false
+        description: Texto a buscar (sintaxis websearch, palabras completas)
+      - in: query
+        name: limit
+        type: integer
+        required: false
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: next_cursor de la página anterior (lleva el rango de la primera página; start/end se ignoran)
+    responses:
+      200:
+        description: Audit records (newest first) and next_cursor
+      400:
+        description: Invalid parameters
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("AUDITORIA")
+    if no_autorizado:
+        return no_autorizado
+
+    direccion = request.args.get("direction")
+    if direccion and direccion not in ("rcv", "snd", "tool", "otro"):
+        return jsonify({"error": "direction debe ser rcv, snd, tool u otro"}), 400
+    try:
+        limite = min(500, max(1, int(request.args.get("limit", 50))))
+        hasta = _fecha_auditoria(request.args["end"], fin=True) if request.args.get("end") else None
+        desde = _fecha_auditoria(request.args["start"]) if request.args.get("start") else None
+    except ValueError:
+        return jsonify({"error": "Parámetros inválidos: limit entero, start/end YYYY-MM-DD o ISO 8601"}), 400
+
+    try:
+        resultado = audit_store.buscar(
+            business_id=request.args.get("business_id"),
+            contacto=request.args.get("client_id"),
+            direccion=direccion,
+            desde=desde,
+            hasta=hasta,
+            texto=request.args.get("q"),
+            limite=limite,
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError:
+        return jsonify({"error": "cursor inválido"}), 400
+    except PoolTimeout:
+        return jsonify({"error": "Base de datos ocupada, reintentar"}), 503
+    except Exception as e:
+        logger.error(f"🔴 [AUDITORIA] Error en la búsqueda: {e}")
+        return jsonify({"error": "Error buscando en la auditoría"}), 500
+    return jsonify(resultado)
+
+
 # ==============================================================================
-# ENDPOINTS DE GESTIÓN DE CLIENTES (config_negocios.json)
+# ENDPOINTS DE GESTIÓN DE CLIENTES (tabla tenant_config)
 # ==============================================================================
 
+def _etag_config(version: int) -> str:
+    return f'"{version}"'
+
+
+def _version_if_match():
+    """Versión pedida en If-Match ('"12"', 'W/"12"' o '12'); None si no vino o es '*'. -1 si es inválida."""
+    valor = request.headers.get("If-Match", "").strip()
+    if not valor or valor == "*":
+        return None
+    try:
+        return int(valor.removeprefix("W/").strip('"'))
+    except ValueError:
+        return -1
+
+
+def _respuesta_conflicto(e: ConflictoVersion):
+    """412 con la versión actual en el ETag (para que el cliente relea y reintente)."""
+    response = jsonify({
+        "error": "La configuración cambió desde que se leyó (If-Match no coincide)",
+        "current_version": e.actual,
+    })
+    if e.actual > 0:
+        response.headers["ETag"] = _etag_config(e.actual)
+    return response, 412
+
+
+def _respuesta_config_no_disponible(e: ConfigNoDisponible):
+    """503: este worker arrancó sin DB y todavía no pasó a tenant_config."""
+    logger.warning(f"⚠️ Escritura de configuración rechazada: {e}")
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+
 @admin_bp.route('/get-tools', methods=['GET'])
 def listar_tools():
     """Lista las herramientas disponibles y los clientes que las usan.
@@ -545,7 +603,9 @@ def obtener_cliente(business_id):
             return jsonify({"error": f"Cliente {business_id} no existe"}), 404
         
         logger.info(f"📄 Obteniendo configuración de cliente {business_id}")
-        return jsonify(config[business_id]), 200
+        response = jsonify(config[business_id])
+        response.headers["ETag"] = _etag_config(config_store.version(business_id))
+        return response, 200
         
     except Exception as e:
         logger.exception(f"🔴 Error obteniendo cliente {business_id}: {e}")
@@ -564,6 +624,11 @@ def actualizar_cliente_completo(business_id):
         name: business_id
         type: string
         required: true
+      - in: header
+        name: If-Match
+        type: string
+        required: false
+        description: ETag de la última lectura; si la configuración cambió responde 412
       - in: body
         name: body
         schema:
@@ -581,20 +646,12 @@ def actualizar_cliente_completo(business_id):
         description: Missing data
       404:
         description: Client not found
+      412:
+        description: Version mismatch (If-Match)
     """
     try:
         config = get_app_configs()
         
-        if business_id not in config:
-            logger.warning(f"⚠️ Cliente {business_id} no encontrado")
-            return jsonify({"error": f"Cliente {business_id} no existe"}), 404
-        
-        # Obtener datos del request
-        nuevos_datos = request.json
-        if not nuevos_datos:
-            return jsonify({"error": "No se enviaron datos"}), 400
-        
-        # Validar campos requeridos
         if business_id not in config:
             logger.warning(f"⚠️ Cliente {business_id} no encontrado")
             return jsonify({"error": f"Cliente {business_id} no existe"}), 404
@@ -610,23 +667,25 @@ def actualizar_cliente_completo(business_id):
             if campo not in nuevos_datos:
                 return jsonify({"error": f"Campo requerido faltante: {campo}"}), 400
         
-        # Reemplazar completamente
-        config[business_id] = nuevos_datos
-        
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'services', 'config_negocios.json')
-
-        # Guardar archivo
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        # Reemplazar completamente (una fila de tenant_config; los demás workers se enteran por NOTIFY)
+        version = config_store.guardar(business_id, nuevos_datos, autor=request.remote_addr,
+                                       version_esperada=_version_if_match())
         
         logger.success(f"✅ Cliente {business_id} actualizado completamente")
         
-        return jsonify({
+        response = jsonify({
             "status": "success",
             "message": f"Cliente {business_id} actualizado",
-            "data": config[business_id]
-        }), 200
+            "version": version,
+            "data": nuevos_datos
+        })
+        response.headers["ETag"] = _etag_config(version)
+        return response, 200
         
+    except ConflictoVersion as e:
+        return _respuesta_conflicto(e)
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
     except Exception as e:
         logger.exception(f"🔴 Error actualizando cliente {business_id}: {e}")
         return jsonify({"error": str(e)}), 500
@@ -644,6 +703,11 @@ def actualizar_cliente_parcial(business_id):
         name: business_id
         type: string
         required: true
+      - in: header
+        name: If-Match
+        type: string
+        required: false
+        description: ETag de la última lectura; si la configuración cambió responde 412
       - in: body
         name: body
         schema:
@@ -658,6 +722,8 @@ def actualizar_cliente_parcial(business_id):
         description: Missing data
       404:
         description: Client not found
+      412:
+        description: Version mismatch (If-Match)
     """
     try:
         config = get_app_configs()
@@ -680,23 +746,32 @@ def actualizar_cliente_parcial(business_id):
                 else:
                     base[key] = value
         
-        merge_dicts(config[business_id], actualizaciones)
-        
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'services', 'config_negocios.json')
-
-        # Guardar archivo
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        def aplicar(actual):
+            if actual is None:
+                raise ConflictoVersion(business_id, 0)
+            merge_dicts(actual, actualizaciones)
+            return actual
+
+        # Merge sobre la fila actual de la DB (SELECT ... FOR UPDATE), no sobre el snapshot del worker
+        datos, version = config_store.actualizar(business_id, aplicar, autor=request.remote_addr,
+                                                 version_esperada=_version_if_match())
         
         logger.success(f"✅ Cliente {business_id} actualizado parcialmente: {list(actualizaciones.keys())}")
         
-        return jsonify({
+        response = jsonify({
             "status": "success",
             "message": f"Cliente {business_id} actualizado",
             "updated_fields": list(actualizaciones.keys()),
-            "data": config[business_id]
-        }), 200
+            "version": version,
+            "data": datos
+        })
+        response.headers["ETag"] = _etag_config(version)
+        return response, 200
         
+    except ConflictoVersion as e:
+        return _respuesta_conflicto(e)
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
     except Exception as e:
         logger.exception(f"🔴 Error actualizando cliente {business_id}: {e}")
         return jsonify({"error": str(e)}), 500
@@ -714,11 +789,18 @@ def eliminar_cliente(business_id):
         name: business_id
         type: string
         required: true
+      - in: header
+        name: If-Match
+        type: string
+        required: false
+        description: ETag de la última lectura; si la configuración cambió responde 412
     responses:
       200:
         description: Deleted
       404:
         description: Client not found
+      412:
+        description: Version mismatch (If-Match)
     """
     try:
         config = get_app_configs()
@@ -731,13 +813,7 @@ def eliminar_cliente(business_id):
         cliente_eliminado = config[business_id]
         
         # Eliminar
-        del config[business_id]
-        
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'services', 'config_negocios.json')
-
-        # Guardar archivo
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        config_store.eliminar(business_id, autor=request.remote_addr, version_esperada=_version_if_match())
         
         logger.warning(f"🗑️ Cliente {business_id} eliminado")
 
@@ -747,6 +823,10 @@ def eliminar_cliente(business_id):
             "deleted_data": cliente_eliminado
         }), 200
         
+    except ConflictoVersion as e:
+        return _respuesta_conflicto(e)
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
     except Exception as e:
         logger.exception(f"🔴 Error eliminando cliente {business_id}: {e}")
         return jsonify({"error": str(e)}), 500
@@ -827,28 +907,120 @@ def crear_cliente():
 			"thread_id_router": {"default": {"route": "lang_graph", "priority": 1}}
         }
         
-        # Agregar a la configuración
-        config[business_id] = nuevo_cliente
-
-        config_path = os.path.join(os.path.dirname(__file__), '..', 'services', 'config_negocios.json')
-
-        # Guardar archivo
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        # Agregar a la configuración (version_esperada=0: falla si otro request lo creó antes)
+        try:
+            version = config_store.guardar(business_id, nuevo_cliente, autor=request.remote_addr, version_esperada=0)
+        except ConflictoVersion:
+            return jsonify({"error": f"Cliente {business_id} ya existe"}), 409
         
         logger.success(f"✅ Cliente {business_id} creado exitosamente")
 
-        return jsonify({
+        response = jsonify({
             "status": "success",
             "message": f"Cliente {business_id} creado",
+            "version": version,
             "data": nuevo_cliente
-        }), 201
+        })
+        response.headers["ETag"] = _etag_config(version)
+        return response, 201
         
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
     except Exception as e:
         logger.exception(f"🔴 Error creando cliente: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@admin_bp.route('/config/clientes/<business_id>/historial', methods=['GET'])
+def historial_cliente(business_id):
+    """Últimos cambios de la configuración de un cliente (versión, operación, autor, claves modificadas).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: path
+        name: business_id
+        type: string
+        required: true
+      - in: query
+        name: limit
+        type: integer
+        required: false
+    responses:
+      200:
+        description: Change log
+    """
+    try:
+        limite = min(200, max(1, int(request.args.get("limit", 20))))
+    except ValueError:
+        return jsonify({"error": "limit debe ser un entero"}), 400
+    try:
+        return jsonify({"business_id": business_id, "changes": config_store.historial(business_id, limite)}), 200
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
+    except Exception as e:
+        logger.exception(f"🔴 Error leyendo historial de {business_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@admin_bp.route('/config/clientes/<business_id>/rollback', methods=['POST'])
+def rollback_cliente(business_id):
+    """Vuelve la configuración de un cliente a una versión del historial (también recrea un cliente eliminado).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: path
+        name: business_id
+        type: string
+        required: true
+      - in: header
+        name: If-Match
+        type: string
+        required: false
+      - in: body
+        name: body
+        schema:
+          type: object
+          example:
+            version: 42
+    responses:
+      200:
+        description: Restored
+      400:
+        description: Missing version
+      404:
+        description: Version not found
+      412:
+        description: Version mismatch (If-Match)
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        version = int(data.get("version"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Campo 'version' (entero) es requerido"}), 400
+
+    try:
+        datos, nueva_version = config_store.restaurar(business_id, version, autor=request.remote_addr,
+                                                      version_esperada=_version_if_match())
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    except ConflictoVersion as e:
+        return _respuesta_conflicto(e)
+    except ConfigNoDisponible as e:
+        return _respuesta_config_no_disponible(e)
+    except Exception as e:
+        logger.exception(f"🔴 Error restaurando {business_id} a la versión {version}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    logger.warning(f"⏪ Cliente {business_id} restaurado a la versión {version} (nueva versión {nueva_version})")
+    response = jsonify({"status": "success", "restored_from": version, "version": nueva_version, "data": datos})
+    response.headers["ETag"] = _etag_config(nueva_version)
+    return response, 200
+
+
 @admin_bp.route('/ver-grafo', methods=['GET'])
 def ver_grafo_png():
     """Obtiene el grafo de estados del agente en formato PNG para visualización.
@@ -901,4 +1073,531 @@ def ddos_stats():
     DDOS_PROTECTION_ENABLED = os.getenv("DDOS_PROTECTION_ENABLED", "true").lower() == "true"
     if not DDOS_PROTECTION_ENABLED or not ddos_protection:
         return jsonify({"enabled": False, "message": "DDoS protection disabled"})
-    return jsonify({"enabled": True, "stats": ddos_protection.get_stats()})
\ No newline at end of file
+    return jsonify({"enabled": True, "stats": ddos_protection.get_stats()})
+
+
+@admin_bp.route("/analytics-writer-stats", methods=['GET'])
+def analytics_writer_stats():
+    """Estadísticas del escritor de analytics en lote de este worker (encolados, escritos, descartados).
+
+    ---
+    tags:
+      - admin
+    produces:
+      - application/json
+    responses:
+      200:
+        description: JSON response with analytics writer stats
+    """
+    return jsonify({"pid": os.getpid(), "stats": analytics_writer.get_stats(), "dashboard_cache": dashboard_cache.get_stats()})
+
+
+@admin_bp.route("/analytics/rollups/rebuild", methods=['POST'])
+def rebuild_analytics_rollups():
+    """Recalcula en segundo plano los rollups horarios de un rango desde analytics_events.
+
+    Usar para el backfill de eventos anteriores a los rollups o para reparar horas.
+
+    ---
+    tags:
+      - admin
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        schema:
+          type: object
+          required:
+            - start_date
+            - end_date
+          properties:
+            start_date:
+              type: string
+              example: "2026-01-01"
+            end_date:
+              type: string
+              description: Fecha final inclusive (YYYY-MM-DD)
+              example: "2026-01-31"
+    responses:
+      202:
+        description: Rebuild started
+      400:
+        description: Invalid dates
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("ROLLUPS")
+    if no_autorizado:
+        return no_autorizado
+
+    data = request.get_json(silent=True) or {}
+    try:
+        start = datetime.strptime(data["start_date"], "%Y-%m-%d")
+        end = datetime.strptime(data["end_date"], "%Y-%m-%d") + timedelta(days=1)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Se requieren start_date y end_date con formato YYYY-MM-DD"}), 400
+
+    if end <= start:
+        return jsonify({"error": "end_date debe ser mayor o igual a start_date"}), 400
+
+    def _reconstruir():
+        try:
+            reconstruir_rollups(start, end)
+            dashboard_cache.invalidar()
+        except Exception as e:
+            logger.exception(f"🔴 [ROLLUPS] Error reconstruyendo rollups {start.date()} → {end.date()}: {e}")
+
+    threading.Thread(target=_reconstruir, name="rollup-rebuild", daemon=True).start()
+    logger.info(f"[ROLLUPS] Reconstrucción iniciada {start.date()} → {end.date()} desde {request.remote_addr}")
+    return jsonify({"status": "started", "start": start.strftime("%Y-%m-%d"), "end": data["end_date"]}), 202
+
+
+@admin_bp.route("/analytics/export", methods=['GET'])
+def export_analytics():
+    """Exporta (streaming) los eventos de un negocio en un rango, en CSV o Parquet, para facturación.
+
+    Las filas se leen con un cursor server-side en lotes y se envían con transfer chunked:
+    la memoria no depende de la cantidad de eventos. Usa un pool de conexiones propio
+    (DB_EXPORT_POOL_MAX) para no competir con el checkpointer.
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: query
+        name: business_id
+        type: string
+        required: true
+      - in: query
+        name: start_date
+        type: string
+        description: Fecha de inicio (YYYY-MM-DD). Default hace 30 días
+      - in: query
+        name: end_date
+        type: string
+        description: Fecha de fin inclusive (YYYY-MM-DD). Default hoy
+      - in: query
+        name: format
+        type: string
+        enum: [csv, parquet]
+        default: csv
+    responses:
+      200:
+        description: Export stream
+      400:
+        description: Invalid parameters
+      401:
+        description: Unauthorized
+      501:
+        description: Parquet not available (pyarrow not installed)
+      503:
+        description: Too many concurrent exports
+    """
+    no_autorizado = _admin_no_autorizado("EXPORT")
+    if no_autorizado:
+        return no_autorizado
+
+    business_id = request.args.get("business_id")
+    formato = (request.args.get("format") or "csv").lower()
+    if not business_id:
+        return jsonify({"error": "business_id es requerido"}), 400
+    if formato not in FORMATOS_EXPORT:
+        return jsonify({"error": f"Formato no soportado. Use: {', '.join(FORMATOS_EXPORT)}"}), 400
+    if not formato_export_disponible(formato):
+        return jsonify({"error": "Export Parquet no disponible: instalar pyarrow"}), 501
+
+    try:
+        end_date_str = request.args.get("end_date")
+        start_date_str = request.args.get("start_date")
+        end_date = (
+            datetime.strptime(end_date_str, "%Y-%m-%d") + timedelta(days=1)
+            if end_date_str else datetime.utcnow()
+        )
+        start_date = (
+            datetime.strptime(start_date_str, "%Y-%m-%d")
+            if start_date_str else end_date - timedelta(days=30)
+        )
+    except ValueError:
+        return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
+
+    # La conexión se toma antes de empezar a responder: si el pool de exports está
+    # ocupado se contesta 503 en lugar de cortar un stream ya iniciado
+    export_pool = get_export_pool()
+    try:
+        conn = export_pool.getconn(timeout=5)
+    except PoolTimeout:
+        logger.warning(f"[EXPORT] Pool de exports ocupado, rechazando export de {business_id}")
+        return jsonify({"error": "Demasiados exports en curso, reintentar en unos minutos"}), 503
+
+    logger.info(f"[EXPORT] Iniciando export {business_id} {start_date.date()} → {end_date.date()} ({formato}) desde {request.remote_addr}")
+    nombre = f"analytics_{business_id}_{start_date.strftime('%Y%m%d')}_{(end_date - timedelta(days=1)).strftime('%Y%m%d')}.{formato}"
+    return Response(
+        StreamExport(export_pool, conn, business_id, start_date, end_date, formato),
+        mimetype=FORMATOS_EXPORT[formato],
+        headers={
+            "Content-Disposition": f'attachment; filename="{nombre}"',
+            # Evita que un proxy nginx acumule la respuesta completa antes de enviarla
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@admin_bp.route("/analytics/latency", methods=['GET'])
+def latency_percentiles():
+    """Percentiles de latencia (p50/p95/p99) por negocio, modelo y tool, sin escanear eventos crudos.
+
+    source=rollups (default) combina los histogramas horarios persistidos (todos los workers);
+    source=live devuelve la ventana en memoria de este worker (LATENCY_LIVE_WINDOW_MIN).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: query
+        name: source
+        type: string
+        enum: [rollups, live]
+        default: rollups
+      - in: query
+        name: hours
+        type: integer
+        default: 1
+        description: Horas hacia atrás (solo source=rollups, incluye la hora en curso)
+      - in: query
+        name: business_id
+        type: string
+      - in: query
+        name: model
+        type: string
+      - in: query
+        name: tool
+        type: string
+    responses:
+      200:
+        description: Latency percentiles per (business_id, model, tool)
+      400:
+        description: Invalid parameters
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("LATENCIAS")
+    if no_autorizado:
+        return no_autorizado
+
+    source = (request.args.get("source") or "rollups").lower()
+    filtros = {
+        "business_id": request.args.get("business_id"),
+        "model": request.args.get("model"),
+        "tool": request.args.get("tool"),
+    }
+
+    if source == "live":
+        resultado = latencias_vivas.percentiles(**filtros)
+        return jsonify({"source": "live", "pid": os.getpid(), "window_min": latencias_vivas.ventana_min, **resultado})
+    if source != "rollups":
+        return jsonify({"error": "source debe ser 'rollups' o 'live'"}), 400
+
+    try:
+        horas = max(1, int(request.args.get("hours", 1)))
+    except ValueError:
+        return jsonify({"error": "hours debe ser un entero"}), 400
+
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    start = end - timedelta(hours=horas)
+    try:
+        with get_pool("reporting").connection() as conn:
+            with conn.cursor() as cur:
+                resultado = percentiles_persistidos(cur, start, end, **filtros)
+    except Exception as e:
+        logger.error(f"🔴 [LATENCIAS] Error leyendo rollups: {e}")
+        return jsonify({"error": "Error leyendo percentiles"}), 500
+
+    return jsonify({"source": "rollups", "start": start.isoformat(), "end": end.isoformat(), **resultado})
+
+
+@admin_bp.route("/checkpoints/compaction", methods=['GET', 'POST'])
+def checkpoints_compaction():
+    """Compactación de checkpoints: POST la inicia en segundo plano, GET muestra el estado.
+
+    Conserva los últimos CHECKPOINT_KEEP_LAST checkpoints por thread y los blobs/writes que
+    usan. El progreso acumulado (de todos los workers) está en /metrics.
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Last run summary of this worker and table sizes
+      202:
+        description: Compaction started
+      401:
+        description: Unauthorized
+      409:
+        description: Compaction already running in this worker
+    """
+    no_autorizado = _admin_no_autorizado("COMPACTACION")
+    if no_autorizado:
+        return no_autorizado
+
+    if request.method == "POST":
+        if compactador_checkpoints.en_curso:
+            return jsonify({"error": "Ya hay una compactación en curso"}), 409
+
+        def _compactar():
+            try:
+                resumen = compactador_checkpoints.ejecutar()
+                if resumen["skipped"]:
+                    logger.warning("[COMPACTACION] Otro worker está compactando; corrida omitida")
+            except Exception as e:
+                logger.exception(f"🔴 [COMPACTACION] Error compactando checkpoints: {e}")
+
+        threading.Thread(target=_compactar, name="checkpoint-compaction-manual", daemon=True).start()
+        logger.info(f"[COMPACTACION] Compactación iniciada desde {request.remote_addr}")
+        return jsonify({"status": "started", "keep_last": compactador_checkpoints.conservar}), 202
+
+    tamanos = {}
+    try:
+        with get_pool("admin").connection() as conn:
+            for tabla, total in conn.execute("""
+                SELECT relname, pg_total_relation_size(oid) FROM pg_class
+                WHERE relname IN ('checkpoints', 'checkpoint_writes', 'checkpoint_blobs') AND relkind = 'r'
+            """).fetchall():
+                tamanos[tabla] = total
+    except Exception as e:
+        logger.error(f"🔴 [COMPACTACION] Error leyendo tamaños de tablas: {e}")
+
+    return jsonify({
+        "pid": os.getpid(),
+        "running": compactador_checkpoints.en_curso,
+        "keep_last": compactador_checkpoints.conservar,
+        "last_run": compactador_checkpoints.ultima_corrida,
+        "table_bytes": tamanos,
+    })
+
+
+@admin_bp.route("/db/pools", methods=['GET'])
+def db_pools():
+    """Estado de los pools de Postgres de este worker: conexiones en uso, espera y saturación.
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Connection pool stats
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("POOLS")
+    if no_autorizado:
+        return no_autorizado
+    return jsonify({"pid": os.getpid(), "pgbouncer": modo_pgbouncer(), "pools": estado_pools()})
+
+
+@admin_bp.route("/checkpoints/cache", methods=['GET'])
+def checkpoints_cache():
+    """Estadísticas del cache de checkpoints de threads activos de este worker (hit ratio, tiempo ahorrado).
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Checkpoint cache stats
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("CACHE_CHECKPOINTS")
+    if no_autorizado:
+        return no_autorizado
+    return jsonify({"pid": os.getpid(), "stats": cache_checkpoints.get_stats()})
+
+
+@admin_bp.route("/media/cache", methods=['GET'])
+def media_cache():
+    """Estadísticas del cache de transcripciones y análisis de imágenes de este worker (hit ratio, USD ahorrados).
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Media cache stats
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("CACHE_MEDIA")
+    if no_autorizado:
+        return no_autorizado
+    return jsonify({"pid": os.getpid(), "stats": cache_media.get_stats()})
+
+
+@admin_bp.route("/costs/tenants", methods=['GET'])
+def costos_por_negocio():
+    """Gasto del día y del mes (UTC) por negocio y estado de su presupuesto, desde memoria.
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Per-tenant spend and budget status
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("COSTOS")
+    if no_autorizado:
+        return no_autorizado
+
+    config_actual = get_app_configs() or {}
+    negocios = cost_accumulator.snapshot()
+    for business_id in config_actual:
+        negocios.setdefault(business_id, {"day_usd": 0.0, "month_usd": 0.0})
+
+    resultado = {}
+    for business_id, gasto in sorted(negocios.items()):
+        presupuesto = (config_actual.get(business_id) or {}).get("presupuesto") or {}
+        estado, uso_pct = evaluar_presupuesto(business_id, presupuesto)
+        resultado[business_id] = {
+            "day_usd": round(gasto["day_usd"], 6),
+            "month_usd": round(gasto["month_usd"], 6),
+            "budget": {k: v for k, v in presupuesto.items() if k != "mensaje_agotado"} or None,
+            "budget_status": estado,
+            "budget_used_pct": uso_pct,
+        }
+    return jsonify({"pid": os.getpid(), "stats": cost_accumulator.get_stats(), "tenants": resultado})
+
+
+@admin_bp.route("/ddos/listas", methods=['GET'])
+def ddos_listas():
+    """Lista blacklist, whitelist, contadores de sospechosos y DMs en cooldown.
+
+    ---
+    tags:
+      - admin
+    responses:
+      200:
+        description: Current DDoS lists
+      401:
+        description: Unauthorized
+      503:
+        description: DDoS protection disabled
+    """
+    no_autorizado = _admin_no_autorizado("DDOS")
+    if no_autorizado:
+        return no_autorizado
+    if not ddos_protection:
+        return jsonify({"error": "DDoS protection disabled"}), 503
+
+    bl = ddos_protection.blacklist
+    with bl.lock:
+        data = {
+            "blacklist": sorted(bl.blacklist),
+            "whitelist": sorted(bl.whitelist),
+            "owner_numbers": sorted(bl.whitelist_fija),
+            "suspicious": dict(bl.auto_blacklist),
+        }
+    data["dm_tracker"] = tracker_dms.get_stats()
+    return jsonify(data), 200
+
+
+@admin_bp.route("/ddos/<lista>", methods=['POST'])
+def ddos_agregar(lista):
+    """Agrega un número a la blacklist o whitelist sin reiniciar (se persiste en DB).
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: path
+        name: lista
+        type: string
+        enum: [blacklist, whitelist]
+        required: true
+      - in: body
+        name: body
+        schema:
+          type: object
+          properties:
+            number:
+              type: string
+              example: "5491234567890@s.whatsapp.net"
+            reason:
+              type: string
+              example: "spam"
+    responses:
+      200:
+        description: Added
+      400:
+        description: Missing number or invalid list
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("DDOS")
+    if no_autorizado:
+        return no_autorizado
+    if not ddos_protection:
+        return jsonify({"error": "DDoS protection disabled"}), 503
+
+    data = request.get_json(silent=True) or {}
+    number = (data.get("number") or "").strip()
+    if not number:
+        return jsonify({"error": "Campo 'number' es requerido"}), 400
+
+    if lista == "blacklist":
+        ddos_protection.blacklist.add_to_blacklist(number, reason=data.get("reason", "admin"))
+    elif lista == "whitelist":
+        ddos_protection.agregar_a_whitelist(number)
+    else:
+        return jsonify({"error": f"Lista desconocida: {lista}. Use blacklist o whitelist"}), 400
+
+    logger.info(f"[ADMIN] {number} agregado a {lista} por {request.remote_addr}")
+    return jsonify({"status": "ok", "list": lista, "number": number}), 200
+
+
+@admin_bp.route("/ddos/<lista>/<path:number>", methods=['DELETE'])
+def ddos_remover(lista, number):
+    """Remueve un número de la blacklist, whitelist o del cooldown de DMs de Instagram.
+
+    ---
+    tags:
+      - admin
+    parameters:
+      - in: path
+        name: lista
+        type: string
+        enum: [blacklist, whitelist, dm-tracker]
+        required: true
+      - in: path
+        name: number
+        type: string
+        required: true
+    responses:
+      200:
+        description: Removed
+      404:
+        description: Number not found in list
+      401:
+        description: Unauthorized
+    """
+    no_autorizado = _admin_no_autorizado("DDOS")
+    if no_autorizado:
+        return no_autorizado
+
+    if lista == "dm-tracker":
+        removido = tracker_dms.olvidar_usuario(number)
+    elif not ddos_protection:
+        return jsonify({"error": "DDoS protection disabled"}), 503
+    elif lista == "blacklist":
+        removido = ddos_protection.blacklist.remove_from_blacklist(number)
+    elif lista == "whitelist":
+        removido = ddos_protection.blacklist.remove_from_whitelist(number)
+    else:
+        return jsonify({"error": f"Lista desconocida: {lista}. Use blacklist, whitelist o dm-tracker"}), 400
+
+    if not removido:
+        return jsonify({"error": f"{number} no está en {lista}"}), 404
+
+    logger.info(f"[ADMIN] {number} removido de {lista} por {request.remote_addr}")
+    return jsonify({"status": "ok", "list": lista, "number": number}), 200
@@ -2,7 +2,6 @@ from flask import Blueprint, request, jsonify
 #from ..db import get_pool
 from loguru import logger
 from ..logger_config import generar_resumen_auditoria
-from concurrent.futures import ThreadPoolExecutor
 import os
 import base64
 import io
@@ -10,6 +9,7 @@ import json
 import requests
 from ..services.cliente_config import ClienteConfig
 from ..utils.ddos_protection import ddos_protection
+from ..utils.metrics import ExecutorMedido, medir_envio
 from ..services.agent import transcribir_audio
 from ..services.router import route_text_message, route_image_message, route_audio_message
 
@@ -19,7 +19,7 @@ chatwoot_bp = Blueprint('chatwoot', __name__)
 # Pool de threads para manejar múltiples mensajes en paralelo
 # CPU de 4 núcleos (max_workers=10)
 # CPU de 8+ núcleos (max_workers=20)
-executor = ThreadPoolExecutor(max_workers=10)  # CPU de 2 núcleos - 10 mensajes simultáneos
+executor = ExecutorMedido(max_workers=10, nombre="chatwoot")  # CPU de 2 núcleos - 10 mensajes simultáneos
 
 logger.info("🚀 Starting Chatwoot Blueprint...")
 
@@ -310,8 +310,9 @@ def enviar_mensaje_chatwoot(account_id, conversation_id, texto_respuesta, client
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
-        response.raise_for_status()
+        with medir_envio("chatwoot"):
+            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response.raise_for_status()
         logger.info(f"✅ Respuesta enviada a Chatwoot (Conv ID: {conversation_id})")
 
         msg = f"[SND -> CWT] 📤 ID: {client_id} - MSG: {texto_respuesta[:100]}..."
@@ -2,7 +2,6 @@ from flask import Blueprint, request, jsonify
 #from ..db import get_pool
 from loguru import logger
 from ..logger_config import generar_resumen_auditoria
-from concurrent.futures import ThreadPoolExecutor
 from evolutionapi.client import EvolutionClient  # del paquete oficial
 import os
 import base64
@@ -10,6 +9,7 @@ import io
 import json
 from ..services.cliente_config import ClienteConfig
 from ..utils.ddos_protection import ddos_protection
+from ..utils.metrics import ExecutorMedido, medir_envio
 from ..services.agent import transcribir_audio, analizar_imagen_con_ai
 from ..services.router import route_text_message, route_image_message, route_audio_message
 
@@ -20,7 +20,7 @@ evolution_bp = Blueprint('evolution', __name__)
 # Pool de threads para manejar múltiples mensajes en paralelo
 # CPU de 4 núcleos (max_workers=10)
 # CPU de 8+ núcleos (max_workers=20)
-executor = ThreadPoolExecutor(max_workers=10)  # CPU de 2 núcleos - 10 mensajes simultáneos
+executor = ExecutorMedido(max_workers=10, nombre="evolution")  # CPU de 2 núcleos - 10 mensajes simultáneos
 
 logger.info("🚀 Starting Evolution Blueprint...")
 
@@ -262,7 +262,8 @@ def enviar_texto_whatsapp(numero_destino: str, mensaje, nombre_instancia: str =
             }
         }
     
-        response = client.post(endpoint, data=payload)
+        with medir_envio("whatsapp"):
+            response = client.post(endpoint, data=payload)
         
         if not response:
             logger.error(f"❌ Evolution client returned empty response")
@@ -490,7 +491,8 @@ def enviar_documento_whatsapp(numero_destino: str, documento, nombre_instancia:
                 "media": base64_data
             }
     
-        response = client.post(endpoint, data=payload)
+        with medir_envio("whatsapp"):
+            response = client.post(endpoint, data=payload)
         
         if not response:
             logger.error(f"❌ Evolution client returned empty response")
@@ -601,7 +603,8 @@ def enviar_lista_whatsapp(numero_destino: str, mensaje, nombre_instancia: str =
             ]
         }
     
-        response = client.post(endpoint, data=payload)
+        with medir_envio("whatsapp"):
+            response = client.post(endpoint, data=payload)
         logger.debug(f"Response from Evolution API: {str(response)[:200]}")
 
         if not response:
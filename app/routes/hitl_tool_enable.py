@@ -6,7 +6,8 @@ from datetime import datetime, timedelta
 import os, json
 from ..tools.tools_hitl import decodificar_token_reactivacion
 from langchain_core.messages import ToolMessage
-from langgraph.checkpoint.postgres import PostgresSaver
+from ..services.instrumentacion import PostgresSaverMedido
+from ..services.cache_checkpoints import envolver_checkpointer
 from ..services.agent import workflow_builder # Importamos el builder, NO la app completa
 
 hitl_tool_enable_bp = Blueprint('hitl_tool_enable', __name__)
@@ -182,7 +183,7 @@ def ejecutar_reactivar_bot(business_id: str, user_id: str) -> bool:
 
         pool = get_pool()
         with pool.connection() as conn:
-            checkpointer = PostgresSaver(conn)
+            checkpointer = envolver_checkpointer(PostgresSaverMedido(conn))
             # Usamos update_state para inyectar el mensaje sin ejecutar el LLM
             # Esto simplemente agrega el mensaje al historial
             workflow_builder.compile(checkpointer=checkpointer).update_state(
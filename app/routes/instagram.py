@@ -2,13 +2,13 @@ from flask import Blueprint, request, jsonify
 #from ..db import get_pool
 from loguru import logger
 from ..logger_config import generar_resumen_auditoria
-from concurrent.futures import ThreadPoolExecutor
 import os
 import base64
 import io
 import json
 from ..services.cliente_config import ClienteConfig
 from ..utils.ddos_protection import ddos_protection
+from ..utils.metrics import ExecutorMedido, medir_envio
 from ..services.agent import transcribir_audio
 from ..services.router import route_text_message, route_image_message, route_audio_message
 
@@ -18,7 +18,7 @@ instagram_bp = Blueprint('instagram', __name__)
 # Pool de threads para manejar múltiples mensajes en paralelo
 # CPU de 4 núcleos (max_workers=10)
 # CPU de 8+ núcleos (max_workers=20)
-executor = ThreadPoolExecutor(max_workers=10)  # CPU de 2 núcleos - 10 mensajes simultáneos
+executor = ExecutorMedido(max_workers=10, nombre="instagram")  # CPU de 2 núcleos - 10 mensajes simultáneos
 
 logger.info("🚀 Starting Instagram Blueprint...")
 
@@ -158,7 +158,8 @@ def enviar_mensaje_dm_chatwoot(page_id, user_id, message_text, payload=None):
     # Reenviar el DM al webhook de Chatwoot para crear/actualizar conversación
     try:
         chatwoot_ig_webhook = os.getenv("CHATWOOT_IG_WEBHOOK_URL", "https://sischat.sisnova.com.ar/webhooks/instagram")
-        resp_cwt = requests.post(chatwoot_ig_webhook, json=payload, timeout=5)
+        with medir_envio("chatwoot_ig"):
+            resp_cwt = requests.post(chatwoot_ig_webhook, json=payload, timeout=5)
         logger.debug(f"📤 DM reenviado a Chatwoot IG webhook → {resp_cwt.status_code}")
     except Exception as fwd_err:
         logger.error(f"🔴 Error reenviando DM a Chatwoot: {fwd_err}")
@@ -188,7 +189,8 @@ def responder_comentario_instagram(comment_id: str, mensaje: str):
             "access_token": access_token
         }
         
-        response = requests.post(url, params=payload, timeout=10)
+        with medir_envio("instagram_comment"):
+            response = requests.post(url, params=payload, timeout=10)
         
         if response.status_code == 200:
             result = response.json()
@@ -277,7 +279,8 @@ def enviar_dm_instagram(ig_page_id: str, recipient_id: str, mensaje: str):
             "Content-Type": "application/json"
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        with medir_envio("instagram_dm"):
+            response = requests.post(url, headers=headers, json=payload, timeout=10)
 
         if response.status_code == 200:
             result = response.json()
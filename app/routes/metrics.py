@@ -0,0 +1,21 @@
+from flask import Blueprint, request, Response
+from loguru import logger
+import os
+from ..utils.metrics import metricas
+
+metrics_bp = Blueprint('metrics', __name__)
+
+logger.info("🚀 Starting Metrics Blueprint...")
+
+
+# curl -sS http://localhost:5001/metrics
+# curl -sS -H "Authorization: Bearer $METRICS_TOKEN" http://sisagent.sisnova.org/metrics
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de exposición de texto de Prometheus (agregadas de todos los workers)"""
+    metrics_token = os.getenv("METRICS_TOKEN", "")
+    if metrics_token and request.headers.get("Authorization", "") != f"Bearer {metrics_token}":
+        logger.warning(f"[METRICS] Acceso no autorizado desde {request.remote_addr}")
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+
+    return Response(metricas.exportar(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -36,7 +36,8 @@ from langgraph.checkpoint.postgres import PostgresSaver
 
 # --- Imports de Herramientas ---
 from ..services.cliente_config import ClienteConfig
-from ..utils.utilities import get_app_configs, gestionar_expiracion_sesion
+from ..utils.utilities import get_app_configs
+from ..services.sesiones import gestionar_expiracion_sesion
 from ..tools.tools_crm import trigger_booking_tool, consultar_stock, ver_menu
 from ..tools.tools_hitl import solicitar_atencion_humana
 from ..tools.tools_rag import consultar_base_conocimiento
@@ -44,6 +45,15 @@ from ..tools.tools_n8n import invoke_n8n
 from ..tools.tools_tienda_nube import consultar_orden_tiendanube, consultar_productos_tiendanube
 from ..tools.tools_calendar import completar_auth_calendar, agendar_cita_calendar, consultar_citas_calendar
 from ..services.analytics import registrar_evento
+from ..services.costos import evaluar_presupuesto, pricing_resolver, ESTADO_AGOTADO, ESTADO_DEGRADAR
+from ..services.instrumentacion import PostgresSaverMedido, metricas_callback
+from ..services.durabilidad import resolver_modo, kwargs_durabilidad
+from ..services.cache_checkpoints import envolver_checkpointer
+from ..services.audio import duracion_audio
+from ..services.transcripcion import requiere_segmentar, transcribir_en_segmentos
+from ..services.cache_media import cache_media, TIPO_TRANSCRIPCION, TIPO_IMAGEN, TIPO_COMPROBANTE
+from ..services.imagenes import preparar_imagen, codificar, firma_preprocesado
+from ..utils.metrics import llm_fallbacks, transcripcion_total
 
 #agent_bp = Blueprint('agent', __name__)
 
@@ -84,27 +94,28 @@ TOOLS_REGISTRY = {
 # 1. SETUP GLOBAL (MODELOS Y DB)
 # ==============================================================================
 # Patron factory para obtener el modelo LLM según configuración
-def get_llm_model(provider_override=None):
+def get_llm_model(provider_override=None, model_override=None):
     """Retorna el modelo LLM según la configuración
    
     Args:
         provider_override: Si se especifica, usa este provider en lugar del configurado
+        model_override: Si se especifica, usa este modelo en lugar del de la variable de entorno del provider
     """
     try:
         provider = provider_override or os.getenv("LLM_PROVIDER", "google").lower()
         
         if provider == "openai":
-            OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+            OPENAI_MODEL = model_override or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
             logger.info("Usando modelo OpenAI:" + OPENAI_MODEL)
             return ChatOpenAI(model=OPENAI_MODEL, temperature=0, max_retries=2)
         
         elif provider == "groq":
-            GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+            GROQ_MODEL = model_override or os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
             logger.info("Usando modelo Groq " + GROQ_MODEL)
             return ChatGroq(model=GROQ_MODEL, temperature=0, max_retries=2)
 
         elif provider == "gemini":
-            GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+            GEMINI_MODEL = model_override or os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
             logger.info("Usando modelo Google Gemini " + GEMINI_MODEL)
             return ChatGoogleGenerativeAI(model=GEMINI_MODEL, temperature=0, max_retries=2)
 
@@ -121,6 +132,13 @@ LLM_PROVIDER_FALLBACK = os.getenv("LLM_PROVIDER_FALLBACK", "openai").lower()
 llm_primary = get_llm_model(LLM_PROVIDER)
 llm_backup = get_llm_model(LLM_PROVIDER_FALLBACK)
 
+# Modelo económico para negocios cerca de agotar su presupuesto (opcional)
+LLM_PROVIDER_ECONOMICO = os.getenv("LLM_PROVIDER_ECONOMICO", "").lower()
+llm_economico = (
+    get_llm_model(LLM_PROVIDER_ECONOMICO, os.getenv("LLM_MODEL_ECONOMICO") or None)
+    if LLM_PROVIDER_ECONOMICO else None
+)
+
 logger.info(f"LLM Provider configurado: {LLM_PROVIDER}")
 logger.info(f"LLM Provider fallback: {LLM_PROVIDER_FALLBACK}")
 
@@ -146,13 +164,10 @@ with pool.connection() as conn:
 
 
 def _lanzar_metricas_background(response_msg, thread_id, latency_ms, isLlmPrimary=True):
-    """Lanza el registro de métricas en un hilo independiente para no bloquear."""
-    hilo = threading.Thread(
-        target=registrar_evento,
-        args=(response_msg, thread_id, latency_ms, isLlmPrimary),
-        daemon=False # False asegura que se guarde aunque el request principal termine
-    )
-    hilo.start()
+    """Registra las métricas sin bloquear: registrar_evento solo calcula el costo y encola
+    la fila en el AnalyticsWriter del proceso, que la escribe en lote en background.
+    Devuelve el costo calculado (None si no se pudo)."""
+    return registrar_evento(response_msg, thread_id, latency_ms, isLlmPrimary)
 
 # ==============================================================================
 # 2. DEFINICIÓN DEL GRAFO MULTI-TENANT
@@ -216,6 +231,25 @@ def nodo_chatbot(state: State, config: RunnableConfig):
         return {"messages": []} 
     # ---------------------------------------------------------
 
+    # ---------------------PRESUPUESTO-------------------------
+    # Chequeo O(1) contra el gasto acumulado en memoria (costos.CostAccumulator)
+    estado_presupuesto, uso_presupuesto_pct = evaluar_presupuesto(business_id, info_negocio.presupuesto)
+    if estado_presupuesto == ESTADO_AGOTADO:
+        logger.warning(f"💸 Presupuesto agotado para {business_id} ({uso_presupuesto_pct}%). Respondiendo con mensaje fijo.")
+        return {"messages": [AIMessage(content=info_negocio.mensaje_presupuesto_agotado)]}
+
+    llm_base = llm_primary
+    llm_respaldo = llm_backup
+    if estado_presupuesto == ESTADO_DEGRADAR:
+        if llm_economico:
+            # El respaldo es a precio completo: degradado no se usa (si falla el económico, mensaje de error)
+            llm_base = llm_economico
+            llm_respaldo = None
+            logger.warning(f"💸 Presupuesto de {business_id} al {uso_presupuesto_pct}%. Usando modelo económico sin respaldo.")
+        else:
+            logger.warning(f"💸 Presupuesto de {business_id} al {uso_presupuesto_pct}% (sin LLM_PROVIDER_ECONOMICO configurado).")
+    # ---------------------------------------------------------
+
     # 4. Convertir nombres de tools a objetos tool
     tools_nombres = info_negocio.tools_habilitadas if info_negocio else []
     mis_tools = []
@@ -270,8 +304,8 @@ def nodo_chatbot(state: State, config: RunnableConfig):
     if mis_tools:
         # Creamos una instancia temporal del LLM que solo conoce estas tools
         try:
-            llm_actual = llm_primary.bind_tools(mis_tools)
-            llm_backup_actual = llm_backup.bind_tools(mis_tools)
+            llm_actual = llm_base.bind_tools(mis_tools)
+            llm_backup_actual = llm_respaldo.bind_tools(mis_tools) if llm_respaldo else None
             logger.info(f"🔧 Vinculadas {len(mis_tools)} herramientas para {business_id}")
             for tool in mis_tools:
                 logger.info(f"Tool vinculada: {tool.name}")
@@ -281,8 +315,8 @@ def nodo_chatbot(state: State, config: RunnableConfig):
             raise
     else:
         # Si no hay tools, usamos el modelo base sin capacidades extra
-        llm_actual = llm_primary
-        llm_backup_actual = llm_backup
+        llm_actual = llm_base
+        llm_backup_actual = llm_respaldo
         logger.info(f"ℹ️ No hay herramientas vinculadas para {business_id}")
     
     # 6. Construir mensajes (System + Historia)
@@ -309,10 +343,16 @@ def nodo_chatbot(state: State, config: RunnableConfig):
         return {"messages": [response_msg]}
 
     except Exception as e:
+        if llm_backup_actual is None:
+            llm_fallbacks.inc(provider=LLM_PROVIDER_FALLBACK, result="skipped")
+            logger.error(f"🔺 Fallo del modelo económico para {thread_id} ({e}). Sin respaldo por presupuesto degradado.")
+            return {"messages": [AIMessage(content="Lo siento, tengo un problema técnico temporal.")]}
+
         start_time = time.time()
         logger.warning(f"⚠️ Fallo LLM primario para {thread_id} ({e}). Cambiando a respaldo...")
         try:
             response_msg = llm_backup_actual.invoke(mensajes_entrada)
+            llm_fallbacks.inc(provider=LLM_PROVIDER_FALLBACK, result="ok")
 
             # ⏱️ CÁLCULO DE TIEMPO
             latency_ms = int((time.time() - start_time) * 1000)
@@ -324,6 +364,7 @@ def nodo_chatbot(state: State, config: RunnableConfig):
             return {"messages": [response_msg]}
 
         except Exception as e2:
+            llm_fallbacks.inc(provider=LLM_PROVIDER_FALLBACK, result="error")
             logger.error(f"🔺 Fallo total para {thread_id}: {e2}")
             # Devolvemos un mensaje de error encapsulado en AIMessage para no romper el flujo
             return {"messages": [AIMessage(content="Lo siento, tengo un problema técnico temporal.")]}
@@ -412,13 +453,16 @@ def procesar_msg_agente_ia(mensaje_usuario: str, config: dict) -> dict:
             logger.info(f"🧹 Sesión reiniciada para {thread_id} por inactividad.")
 
         with pool.connection() as conn:
-            checkpointer = PostgresSaver(conn)
+            checkpointer = envolver_checkpointer(PostgresSaverMedido(conn))
             app = workflow_builder.compile(checkpointer=checkpointer)        
             
             inputs = {"messages": [HumanMessage(content=mensaje_usuario)]}
             
-            # Ejecución
-            result = app.invoke(inputs, config=config)
+            # Ejecución (el callback mide latencias de LLM y tools para /metrics)
+            # Durabilidad del negocio: persistir en cada paso (sync/async) o solo al final (exit)
+            durabilidad = resolver_modo(ClienteConfig(business_id).durabilidad_checkpoint)
+            callbacks = list(config.get("callbacks") or []) + [metricas_callback]
+            result = app.invoke(inputs, config={**config, "callbacks": callbacks}, **kwargs_durabilidad(durabilidad))
 
             mensajes = result.get("messages", [])
 
@@ -471,9 +515,66 @@ def procesar_msg_agente_ia(mensaje_usuario: str, config: dict) -> dict:
 # ==============================================================================
 # 5. TRANSCRIPCIÓN DE AUDIO (Evolution Baileys WhatsApp)
 # ==============================================================================
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def cliente_openai():
+    """
+    Cliente de OpenAI del proceso (transcripción y visión). Se crea una sola vez: el cliente
+    HTTP mantiene las conexiones keep-alive y cada nota de voz no paga un handshake TLS nuevo.
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
+    return _openai_client
+
+
+def _transcribir_openai(audio_buffer: bytes, audio_format: str) -> Optional[str]:
+    """Un request de transcripción a OpenAI con el cliente compartido."""
+    # Crear un BytesIO buffer con el audio
+    ext_map = {"ogg": "ogg", "mp4": "mp4", "m4a": "mp4", "mp3": "mp3", "wav": "wav", "aac": "aac", "webm": "webm"}
+    ext = ext_map.get(audio_format, audio_format)
+    buffer = io.BytesIO(audio_buffer)
+    buffer.name = f"audio.{ext}"  # OpenAI necesita un nombre con extensión
+
+    response = cliente_openai().audio.transcriptions.create(
+        model=os.getenv("TRANSCRIPTION_MODEL", "whisper-1"),
+        file=buffer,
+        language="es",          # Español
+        response_format="text", # Texto plano
+        temperature=0.0         # Transcripciones deterministas
+    )
+    return response if isinstance(response, str) else response.text
+
+
+def _transcribir_whisper_local(audio_buffer: bytes, audio_format: str) -> Optional[str]:
+    from .whisper_local import pool_whisper
+
+    return pool_whisper.transcribir(audio_buffer, idioma="es")
+
+
+def limite_usd_nota_voz(business_id: str) -> float:
+    """Costo máximo de transcripción de una nota: presupuesto.max_usd_nota_voz del negocio o MAX_USD_NOTA_VOZ."""
+    limite = ClienteConfig(business_id).presupuesto.get("max_usd_nota_voz")
+    if limite is None:
+        try:
+            limite = float(os.getenv("MAX_USD_NOTA_VOZ", "0.06"))
+        except Exception:
+            limite = 0.06
+    return float(limite)
+
+
 def transcribir_audio(audio_buffer: bytes, thread_id, audio_format: str = "ogg") -> Optional[str]:
     """
-    Transcribe un mensaje de audio a texto usando OpenAI
+    Transcribe un mensaje de audio a texto usando OpenAI (o Whisper local).
+
+    Las notas más largas que TRANSCRIPCION_SEGMENTO_SEG se transcriben en segmentos paralelos
+    (ver transcripcion.py). El límite es de costo por negocio: se rechaza la nota cuyo costo
+    estimado supera presupuesto.max_usd_nota_voz (default MAX_USD_NOTA_VOZ).
     
     Args:
         audio_buffer: Bytes del archivo de audio
@@ -483,91 +584,81 @@ def transcribir_audio(audio_buffer: bytes, thread_id, audio_format: str = "ogg")
         Texto transcrito o None si hay error
     """
     try:
-        import io
-        from pydub import AudioSegment
-        
         TRANSCRIPTION_ENABLED = os.getenv("TRANSCRIPTION_ENABLED", "true").lower() == "true"
         TRANSCRIPTION_PROVIDER = os.getenv("TRANSCRIPTION_PROVIDER", "openai")
-        OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
         if not TRANSCRIPTION_ENABLED:
             logger.warning("⚠️ [AUDIO] Transcripción deshabilitada")
             return None
+
+        # Nota ya transcripta (reenvíos): mismos bytes, proveedor y modelo
+        modelo_cache = os.getenv("WHISPER_MODEL", "base") if TRANSCRIPTION_PROVIDER == "whisper-local" else os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
+        inicio_cache = time.time()
+        clave_cache = cache_media.clave(TIPO_TRANSCRIPCION, audio_buffer, TRANSCRIPTION_PROVIDER, modelo_cache, "es")
+        en_cache = cache_media.obtener(TIPO_TRANSCRIPCION, clave_cache)
+        if en_cache:
+            cache_media.registrar_hit(TIPO_TRANSCRIPCION, thread_id, en_cache, int((time.time() - inicio_cache) * 1000))
+            return en_cache["valor"]
         
-        # Verificar duración del audio
-        audio = AudioSegment.from_file(io.BytesIO(audio_buffer), format=audio_format)
-        duration_seconds = len(audio) / 1000.0  # pydub da duración en ms
+        # Verificar duración del audio (encabezados Ogg/MP4; decodifica solo si no alcanza)
+        duration_seconds = duracion_audio(audio_buffer, audio_format)
         duration_minutes = duration_seconds / 60.0
         logger.info(f"[AUDIO] Duración del audio: {duration_seconds:.2f} segundos")
-        MAX_DURATION_VOICE_SEC = int(os.getenv("MAX_DURATION_VOICE_SEC", 60))  # Límite configurable en segundos
 
-        if duration_seconds > MAX_DURATION_VOICE_SEC:
-            return f"¡Hola! La nota de voz es muy larga (más de {MAX_DURATION_VOICE_SEC // 60} minutos). Por favor, envíala en partes más cortas o resumí lo principal. 😊 Gracias!"
+        # Límite por costo del negocio (Whisper local se valúa al precio de whisper-1)
+        TRANSCRIPTION_MODEL = os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
+        business_id = str(thread_id).split(":")[0]
+        limite_usd = limite_usd_nota_voz(business_id)
+        costo_estimado, _ = pricing_resolver.costo_transcripcion(TRANSCRIPTION_MODEL, duration_minutes)
+        if costo_estimado > limite_usd:
+            minutos_permitidos = duration_minutes * limite_usd / costo_estimado
+            logger.warning(
+                f"⚠️ [AUDIO] Nota de {duration_minutes:.1f} min rechazada para {business_id}: "
+                f"costo estimado ${costo_estimado:.4f} > límite ${limite_usd:.4f}"
+            )
+            return f"¡Hola! La nota de voz es muy larga (más de {max(1, int(minutos_permitidos))} minutos). Por favor, envíala en partes más cortas o resumí lo principal. 😊 Gracias!"
         
         logger.info(f"[AUDIO] Iniciando transcripción de audio ({len(audio_buffer)} bytes)")
         
         # Transcribir según el proveedor
-        transcription = None
-        TRANSCRIPTION_MODEL = os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
-        
         if TRANSCRIPTION_PROVIDER == "openai":
             logger.debug(f"[AUDIO] Usando: {TRANSCRIPTION_MODEL} de OpenAI para transcripción")
-            from openai import OpenAI
-            
-            openai_client = OpenAI(api_key=OPENAI_API_KEY)
-            
-            # Crear un BytesIO buffer con el audio
-            ext_map = {"ogg": "ogg", "mp4": "mp4", "m4a": "mp4", "mp3": "mp3", "wav": "wav", "aac": "aac", "webm": "webm"}
-            ext = ext_map.get(audio_format, audio_format)
-            buffer = io.BytesIO(audio_buffer)
-            buffer.name = f"audio.{ext}"  # OpenAI necesita un nombre con extensión
-            start_time = time.time()
-
-            response = openai_client.audio.transcriptions.create(
-                model=TRANSCRIPTION_MODEL,
-                file=buffer,
-                language="es",          # Español
-                response_format="text", # Texto plano
-                temperature=0.0         # Transcripciones deterministas
+            transcribir_segmento = _transcribir_openai
+        elif TRANSCRIPTION_PROVIDER == "whisper-local":
+            logger.debug("[AUDIO] Usando Whisper local (pool de procesos con el modelo residente)")
+            transcribir_segmento = _transcribir_whisper_local
+        else:
+            logger.error(f"❌ [AUDIO] TRANSCRIPTION_PROVIDER desconocido: {TRANSCRIPTION_PROVIDER}")
+            return None
+
+        start_time = time.time()
+        if requiere_segmentar(duration_seconds):
+            transcription, segundos_enviados = transcribir_en_segmentos(
+                audio_buffer, audio_format, transcribir_segmento, TRANSCRIPTION_PROVIDER
             )
-            # ⏱️ CÁLCULO DE TIEMPO
-            latency_ms = int((time.time() - start_time) * 1000)
+        else:
+            transcription, segundos_enviados = transcribir_segmento(audio_buffer, audio_format), duration_seconds
+            transcripcion_total.observe(time.time() - start_time, provider=TRANSCRIPTION_PROVIDER, mode="single")
+        # ⏱️ CÁLCULO DE TIEMPO
+        latency_ms = int((time.time() - start_time) * 1000)
+
+        costo = 0.0
+        if TRANSCRIPTION_PROVIDER == "openai":
+            # Se factura el audio enviado, solapes entre segmentos incluidos
             transcription_metrics = {
                 "response_metadata": {
                     "model_name": TRANSCRIPTION_MODEL,
                     "provider": "openai"
                 },
                 "usage_transcription": {
-                    "duration_minutes": duration_minutes
+                    "duration_minutes": segundos_enviados / 60.0
                 }
             }
-            _lanzar_metricas_background(transcription_metrics, thread_id, latency_ms, isLlmPrimary=True)
-
-            transcription = response if isinstance(response, str) else response.text
-        
-        elif TRANSCRIPTION_PROVIDER == "whisper-local":
-            logger.debug("[AUDIO] Usando Whisper local")
-            import whisper
-            import tempfile
-            
-            # Guardar temporalmente para Whisper local
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_audio:
-                temp_audio.write(audio_buffer)
-                temp_audio_path = temp_audio.name
-            
-            try:
-                model = whisper.load_model("base")
-                result = model.transcribe(temp_audio_path, language="es")
-                transcription = result["text"]
-            finally:
-                # Limpiar archivo temporal
-                try:
-                    os.unlink(temp_audio_path)
-                except:
-                    pass
+            costo = _lanzar_metricas_background(transcription_metrics, thread_id, latency_ms, isLlmPrimary=True) or 0.0
         
         if transcription:
             logger.info(f"[AUDIO] Transcripción exitosa: {transcription[:100].replace('\n', ' ')}")
+            cache_media.guardar(clave_cache, transcription, costo, modelo_cache)
             return transcription
         else:
             logger.error("❌ [AUDIO] No se obtuvo transcripción")
@@ -604,9 +695,6 @@ def analizar_imagen_con_ai(image_buffer: bytes, thread_id: str, caption: str = N
         
         logger.info(f"[IMAGE] Iniciando análisis de imagen ({len(image_buffer)} bytes)")
         
-        # Convertir imagen a base64
-        image_base64 = base64.b64encode(image_buffer).decode('utf-8')
-        
         # Crear el prompt
         prompt_text = """Analiza esta imagen y extrae TODA la información visible relacionada con citas, eventos o agendas.
 
@@ -631,17 +719,25 @@ Analiza la imagen y extrae TODA la información relacionada con citas o eventos:
 Responde en relación al texto del usuario y estructura la información claramente."""
         
         start_time = time.time()
+
+        # Misma imagen con el mismo prompt (caption incluido): resultado cacheado
+        model = os.getenv("VISION_MODEL", "gpt-4o-mini" if IMAGE_ANALYSIS_PROVIDER == "openai" else "gemini-2.0-flash-exp")
+        clave_cache = cache_media.clave(
+            TIPO_IMAGEN, image_buffer, IMAGE_ANALYSIS_PROVIDER, model,
+            f"{firma_preprocesado(IMAGE_ANALYSIS_PROVIDER)}|{prompt_text}"
+        )
+        en_cache = cache_media.obtener(TIPO_IMAGEN, clave_cache)
+        if en_cache:
+            cache_media.registrar_hit(TIPO_IMAGEN, thread_id, en_cache, int((time.time() - start_time) * 1000))
+            return True, en_cache["valor"]
+
+        # Reducida y recomprimida para el proveedor; base64 de lo que realmente se envía
+        imagen_envio, mime_type, detail = preparar_imagen(image_buffer, IMAGE_ANALYSIS_PROVIDER)
+        image_base64 = base64.b64encode(imagen_envio).decode('utf-8')
         
         if IMAGE_ANALYSIS_PROVIDER == "openai":
             logger.debug("[IMAGE] Usando OpenAI GPT-4o Vision")
-            from openai import OpenAI
-            from langchain_core.messages import HumanMessage
-            
-            OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-            openai_client = OpenAI(api_key=OPENAI_API_KEY)
-            
-            # Usar GPT-4o o GPT-4o-mini que soportan visión
-            model = os.getenv("VISION_MODEL", "gpt-4o-mini")
+            openai_client = cliente_openai()
             
             response = openai_client.chat.completions.create(
                 model=model,
@@ -653,7 +749,8 @@ Responde en relación al texto del usuario y estructura la información claramen
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
+                                    "url": f"data:{mime_type};base64,{image_base64}",
+                                    "detail": detail or "auto"
                                 }
                             }
                         ]
@@ -667,14 +764,13 @@ Responde en relación al texto del usuario y estructura la información claramen
             analysis = response.choices[0].message.content
             
             logger.info(f"📊 [IMAGE] Análisis completado en {latency_ms}ms")
-            _lanzar_metricas_background(response, thread_id, latency_ms, isLlmPrimary=True)
+            costo = _lanzar_metricas_background(response, thread_id, latency_ms, isLlmPrimary=True)
             
         elif IMAGE_ANALYSIS_PROVIDER == "gemini":
             logger.debug("[IMAGE] Usando Google Gemini Vision")
             from langchain_google_genai import ChatGoogleGenerativeAI
             from langchain_core.messages import HumanMessage
             
-            model = os.getenv("VISION_MODEL", "gemini-2.0-flash-exp")
             llm = ChatGoogleGenerativeAI(model=model, temperature=0)
             
             # 1. Limpieza universal del prefijo
@@ -709,7 +805,7 @@ Responde en relación al texto del usuario y estructura la información claramen
             analysis = response.content
             
             logger.info(f"📊 [IMAGE] Análisis completado en {latency_ms}ms")
-            _lanzar_metricas_background(response, thread_id, latency_ms, isLlmPrimary=True)
+            costo = _lanzar_metricas_background(response, thread_id, latency_ms, isLlmPrimary=True)
         
         else:
             logger.error(f"❌ [IMAGE] Proveedor no soportado: {IMAGE_ANALYSIS_PROVIDER}")
@@ -717,6 +813,7 @@ Responde en relación al texto del usuario y estructura la información claramen
         
         if analysis:
             logger.info(f"[IMAGE] Análisis exitoso: {analysis[:100].replace(chr(10), ' ')}...")
+            cache_media.guardar(clave_cache, analysis, costo or 0.0, model)
             return True, analysis
         else:
             logger.error("❌ [IMAGE] No se obtuvo análisis")
@@ -764,9 +861,6 @@ def extract_transfer_receipt_data(image_buffer: bytes, thread_id: str, caption:
         
         logger.info(f"[IMAGE] Iniciando análisis de imagen ({len(image_buffer)} bytes)")
         
-        # Convertir imagen a base64
-        image_base64 = base64.b64encode(image_buffer).decode('utf-8')
-        
         # Crear el prompt
         prompt_text = """
 Analizá este comprobante de transferencia bancaria y extraé 
@@ -808,16 +902,18 @@ Responde únicamente con el JSON, sin texto adicional."""
         
         if IMAGE_ANALYSIS_PROVIDER == "openai":
             logger.debug("[IMAGE] Usando OpenAI Vision")
+            model = "gpt-5.4-mini"
             llm = ChatOpenAI(
-                model="gpt-5.4-mini",
+                model=model,
                 reasoning_effort="medium",
                 temperature=0
             )
 
         elif IMAGE_ANALYSIS_PROVIDER == "groq":
             logger.debug("[IMAGE] Usando Groq Vision")
+            model = "meta-llama/llama-4-scout-17b-16e-instruct"
             llm = ChatGroq(
-            model="meta-llama/llama-4-scout-17b-16e-instruct",
+            model=model,
             temperature=0.0,
             max_tokens=3000,
             )
@@ -830,8 +926,22 @@ Responde únicamente con el JSON, sin texto adicional."""
         else:
             logger.error(f"❌ [IMAGE] Proveedor no soportado: {IMAGE_ANALYSIS_PROVIDER}")
             return False, "❌ Proveedor no soportado"
+
+        # Comprobante reenviado: solo se cachean las extracciones completas
+        clave_cache = cache_media.clave(
+            TIPO_COMPROBANTE, image_buffer, IMAGE_ANALYSIS_PROVIDER, model,
+            f"{mime_type}|{firma_preprocesado(IMAGE_ANALYSIS_PROVIDER)}|{prompt_text}"
+        )
+        en_cache = cache_media.obtener(TIPO_COMPROBANTE, clave_cache)
+        if en_cache:
+            cache_media.registrar_hit(TIPO_COMPROBANTE, thread_id, en_cache, int((time.time() - start_time) * 1000))
+            return True, en_cache["valor"]
         
         llm_estructurado = llm.with_structured_output(ReciboTransferencia, include_raw=True)
+
+        # Imágenes: reducidas y recomprimidas para el proveedor (los PDF van sin tocar)
+        imagen_envio, mime_envio, detail = preparar_imagen(image_buffer, IMAGE_ANALYSIS_PROVIDER, mime_type)
+        image_base64 = base64.b64encode(imagen_envio).decode('utf-8')
             
         # Si el base64 ya trae el prefijo "data:...", se lo quitamos para armarlo limpio
         # 1. Limpieza universal del prefijo
@@ -845,24 +955,27 @@ Responde únicamente con el JSON, sin texto adicional."""
         # 3. Evaluamos el tipo de archivo para inyectarlo con la sintaxis correcta
         if mime_type.startswith("image/"):
             # Sintaxis estándar para imágenes (JPEG, PNG, WEBP)
+            imagen_url = {"url": f"data:{mime_envio};base64,{base64_limpio}"}
+            if detail:
+                imagen_url["detail"] = detail
             contenido_mensaje.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:{mime_type};base64,{base64_limpio}"}
+                "image_url": imagen_url
             })
         else:
             # Convierte PDF a lista de imágenes para Groq (solo soporta image_url)
             if IMAGE_ANALYSIS_PROVIDER == "openai" or IMAGE_ANALYSIS_PROVIDER == "groq":
                 images = convert_from_bytes(image_buffer, dpi=300)
                 for i, img in enumerate(images):
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="PNG")
-                    img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                    # Cada página reducida al lado máximo del proveedor (a 300 dpi una A4 son 2480x3508)
+                    pagina, mime_pagina, detail_pagina, _ = codificar(img, IMAGE_ANALYSIS_PROVIDER)
+                    img_base64 = base64.b64encode(pagina).decode('utf-8')
+                    imagen_url = {"url": f"data:{mime_pagina};base64,{img_base64}"}
+                    if detail_pagina:
+                        imagen_url["detail"] = detail_pagina
                     contenido_mensaje.append({
                         "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{img_base64}",
-                            "detail": "high"
-                        }
+                        "image_url": imagen_url
                     })
             elif IMAGE_ANALYSIS_PROVIDER == "gemini":
                 contenido_mensaje.append({
@@ -893,7 +1006,7 @@ Responde únicamente con el JSON, sin texto adicional."""
         latency_ms = int((time.time() - start_time) * 1000)
 
         logger.info(f"📊 [IMAGE] Análisis completado en {latency_ms}ms")
-        _lanzar_metricas_background(raw_msg, thread_id, latency_ms, isLlmPrimary=True)
+        costo = _lanzar_metricas_background(raw_msg, thread_id, latency_ms, isLlmPrimary=True)
 
         if analysis:
             # Normalizar a dict si es posible (para validar campos requeridos)
@@ -924,7 +1037,9 @@ Responde únicamente con el JSON, sin texto adicional."""
 
             # Si llegamos acá, los campos obligatorios están presentes (o no parseable pero no vacío)
             logger.info(f"[IMAGE] Análisis exitoso: {str(analysis)[:100].replace(chr(10), ' ')}...")
-            return True, parsed if isinstance(parsed, dict) else analysis
+            resultado_final = parsed if isinstance(parsed, dict) else analysis
+            cache_media.guardar(clave_cache, resultado_final, costo or 0.0, model)
+            return True, resultado_final
         else:
             logger.error("❌ [IMAGE] No se obtuvo análisis")
             return False, "❌ No se obtuvo análisis"
@@ -2,34 +2,214 @@ import time
 #from psycopg_pool import ConnectionPool
 from loguru import logger
 from langchain_core.messages import BaseMessage
+from datetime import datetime, timezone
 import os
 import json
+import queue
+import atexit
+import threading
 from app.db import get_pool
+from .analytics_rollups import actualizar_rollups, asegurar_tablas_rollup
+from .costos import pricing_resolver, cost_accumulator
+from .latencias import latencias_vivas
 
 
 # ==============================================================================
 # 2. MÉTRICAS
 # ==============================================================================
-def cargar_pricing():
-    """Carga la configuración de precios desde config_pricing.json"""
+# Precios por modelo: ver costos.PricingResolver (longest match + recarga en caliente
+# de config_pricing.json). El gasto de cada evento se suma al acumulador por negocio.
+
+
+# ==============================================================================
+# ESCRITOR DE ANALYTICS EN LOTE (uno por proceso)
+# ==============================================================================
+ANALYTICS_COLUMNS = (
+    "timestamp", "business_id", "thread_id", "event_type", "input_tokens", "output_tokens",
+    "model_name", "estimated_cost", "latency_ms", "tool_name", "sentiment_label", "cost_avoided"
+)
+
+# Columnas agregadas después de la creación de la tabla (instalaciones existentes)
+SQL_COLUMNAS_NUEVAS = """
+ALTER TABLE analytics_events ADD COLUMN IF NOT EXISTS cost_avoided DOUBLE PRECISION DEFAULT 0.0
+"""
+
+
+class AnalyticsWriter:
+    """
+    Buffer acotado en memoria + un único hilo que vuelca los eventos a analytics_events
+    con COPY cada `batch_size` filas o cada `flush_ms` milisegundos (lo que ocurra primero).
+    Reemplaza el hilo + INSERT por evento: una sola conexión del pool por lote.
+    Si el buffer está lleno el evento se descarta y se cuenta en `descartados`.
+    Con `rollups=True` cada lote también se suma a los rollups horarios (analytics_rollups.py).
+    """
+
+    def __init__(self, batch_size=100, flush_ms=1000, max_buffer=10000, rollups=True):
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.rollups = rollups
+        self.buffer = queue.Queue(maxsize=max_buffer)
+
+        self.encolados = 0
+        self.escritos = 0
+        self.descartados = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.rollup_errores = 0
+        self.ultimo_flush_ms = None
+
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        logger.info(f"AnalyticsWriter inicializado: batch_size={batch_size}, flush_ms={flush_ms}, max_buffer={max_buffer}")
+
+    def encolar(self, fila: tuple) -> bool:
+        """Agrega una fila (en el orden de ANALYTICS_COLUMNS) al buffer sin bloquear."""
+        self._asegurar_hilo()
+        try:
+            self.buffer.put_nowait(fila)
+            self.encolados += 1
+            return True
+        except queue.Full:
+            self.descartados += 1
+            if self.descartados % 100 == 1:
+                logger.warning(f"⚠️ AnalyticsWriter: buffer lleno, eventos descartados: {self.descartados}")
+            return False
+
+    def _asegurar_hilo(self):
+        # Arranque perezoso: el pool recién existe después de create_app() -> init_db()
+        if self._hilo and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._loop, name="analytics-writer", daemon=True)
+            self._hilo.start()
+
+    def _tomar_lote(self) -> list:
+        """Espera hasta completar batch_size filas o hasta que venza flush_ms."""
+        lote = []
+        limite = time.monotonic() + self.flush_ms / 1000
+        while len(lote) < self.batch_size:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.buffer.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _drenar(self) -> list:
+        lote = []
+        while len(lote) < self.batch_size:
+            try:
+                lote.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _escribir(self, lote: list):
+        if not lote:
+            return
+        inicio = time.perf_counter()
+        try:
+            pool = get_pool("analytics")
+            with pool.connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        with cur.copy(f"COPY analytics_events ({', '.join(ANALYTICS_COLUMNS)}) FROM STDIN") as copy:
+                            for fila in lote:
+                                copy.write_row(fila)
+
+                        if self.rollups:
+                            # Savepoint: si falla el rollup no perdemos los eventos crudos
+                            try:
+                                with conn.transaction():
+                                    actualizar_rollups(cur, lote)
+                            except Exception as e:
+                                self.rollup_errores += 1
+                                logger.error(f"🔴 AnalyticsWriter: error actualizando rollups ({len(lote)} eventos): {e}")
+            self.escritos += len(lote)
+            self.lotes += 1
+            self.ultimo_flush_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            logger.debug(f"✅ AnalyticsWriter: {len(lote)} eventos escritos en {self.ultimo_flush_ms}ms")
+        except Exception as e:
+            self.fallidos += len(lote)
+            logger.error(f"🔴 AnalyticsWriter: error escribiendo lote de {len(lote)} eventos: {e}")
+
+    def _loop(self):
+        logger.info("👷 AnalyticsWriter: hilo de escritura iniciado")
+        try:
+            with get_pool("analytics").connection() as conn:
+                # ADD COLUMN toma un lock exclusivo aunque la columna exista: solo si falta
+                if not conn.execute(
+                    "SELECT 1 FROM information_schema.columns WHERE table_name = 'analytics_events' AND column_name = 'cost_avoided'"
+                ).fetchone():
+                    conn.execute(SQL_COLUMNAS_NUEVAS)
+        except Exception as e:
+            logger.error(f"🔴 AnalyticsWriter: no se pudo agregar la columna cost_avoided: {e}")
+        if self.rollups:
+            try:
+                with get_pool("analytics").connection() as conn:
+                    asegurar_tablas_rollup(conn)
+            except Exception as e:
+                logger.error(f"🔴 AnalyticsWriter: no se pudieron crear las tablas de rollup: {e}")
+        while not self._detener.is_set():
+            self._escribir(self._tomar_lote())
+
+    def flush(self):
+        """Escribe todo lo pendiente en el buffer (usado al apagar el proceso)."""
+        while not self.buffer.empty():
+            self._escribir(self._drenar())
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=self.flush_ms / 1000 + 2)
+        self.flush()
+        logger.info(f"🛑 AnalyticsWriter detenido: {self.get_stats()}")
+
+    def get_stats(self) -> dict:
+        return {
+            "enqueued": self.encolados,
+            "written": self.escritos,
+            "dropped": self.descartados,
+            "failed": self.fallidos,
+            "batches": self.lotes,
+            "rollup_errors": self.rollup_errores,
+            "buffered": self.buffer.qsize(),
+            "last_flush_ms": self.ultimo_flush_ms,
+        }
+
+
+def _crear_analytics_writer():
     try:
-        pricing_path = os.path.join(os.path.dirname(__file__), 'config_pricing.json')
-        with open(pricing_path, 'r', encoding='utf-8') as f:
-            pricing_data = json.load(f)
-        logger.info("✅ Configuración de precios cargada.")
-        return pricing_data['MODEL_PRICING']
-    except Exception as e:
-        logger.exception(f"🔴 Error cargando config_pricing.json: {e}")
-        return {}
+        batch_size = int(os.getenv("ANALYTICS_BATCH_SIZE", "100"))
+    except Exception:
+        batch_size = 100
+    try:
+        flush_ms = int(os.getenv("ANALYTICS_FLUSH_MS", "1000"))
+    except Exception:
+        flush_ms = 1000
+    try:
+        max_buffer = int(os.getenv("ANALYTICS_BUFFER_MAX", "10000"))
+    except Exception:
+        max_buffer = 10000
+    rollups = os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true").lower() == "true"
+    return AnalyticsWriter(batch_size=batch_size, flush_ms=flush_ms, max_buffer=max_buffer, rollups=rollups)
 
 
-MODEL_PRICING = cargar_pricing()
+analytics_writer = _crear_analytics_writer()
+# Flush final al apagar el worker (gunicorn sale con sys.exit tras SIGTERM)
+atexit.register(analytics_writer.detener)
 
 def registrar_evento(result, thread_id, latency_ms, isLlmPrimary=True):
     """
     1- Extrae tokens y calcula costo exacto según el modelo utilizado.
-    2- Inserta un evento en la tabla de analytics de forma segura.
-    No bloquea si falla (fire and forget lógico).
+    2- Encola el evento en el AnalyticsWriter (se escribe en lote con COPY).
+    3- Devuelve el costo calculado en USD (None si no hubo información de uso).
+    No bloquea ni toca la DB (fire and forget lógico).
     """
     try:
         # 1. Normalización del objeto mensaje/result
@@ -107,10 +287,9 @@ def registrar_evento(result, thread_id, latency_ms, isLlmPrimary=True):
                 else:
                     model_name = metadata.get('model_name', 'whisper-1').lower()
                 
-                if model_name == "gpt-4o-mini-transcribe":
-                    costo_total = duration_minutes * 0.003  
-                elif model_name == "whisper-1":
-                    costo_total = duration_minutes * 0.006  
+                costo_total, reconocido = pricing_resolver.costo_transcripcion(model_name, duration_minutes)
+                if not reconocido:
+                    logger.warning(f"⚠️ Modelo de transcripción no reconocido para cálculo de costos: {model_name}")
 
                 logger.info(
                     f"💰 TRANSCRIPTION USAGE [{thread_id}] ({model_name}): "
@@ -128,24 +307,11 @@ def registrar_evento(result, thread_id, latency_ms, isLlmPrimary=True):
                 # 3. Detección de Modelo y Precio
                 model_name = metadata.get('model_name', '').lower()
                 
-                # Buscamos el precio en el diccionario usando coincidencia parcial
-                # (Ej: "gpt-4o-mini-2024" coincidirá con "gpt-4o-mini")
-                costos = None
-                for key, precios in MODEL_PRICING.items():
-                    if key in model_name:
-                        costos = precios
-                        break
-                
-                # Cálculo del costo
-                if costos:
-                    costo_input = (input_tokens / 1_000_000) * costos["input"]
-                    costo_output = (output_tokens / 1_000_000) * costos["output"]
-                    costo_total = costo_input + costo_output
-                else:
+                # Precio por la clave más larga contenida en el nombre
+                # (Ej: "gpt-4o-mini-2024" -> "gpt-4o-mini", no "gpt-4o")
+                costo_total, reconocido = pricing_resolver.costo_tokens(model_name, input_tokens, output_tokens)
+                if not reconocido:
                     logger.warning(f"⚠️ Modelo no reconocido para cálculo de costos: {model_name}")
-                    costo_input = (input_tokens / 1_000_000) * 0.15
-                    costo_output = (output_tokens / 1_000_000) * 0.60
-                    costo_total = costo_input + costo_output
 
                 logger.info(
                     f"💰 TOKEN USAGE [{thread_id}] ({model_name}): "
@@ -197,6 +363,7 @@ def registrar_evento(result, thread_id, latency_ms, isLlmPrimary=True):
                 event_type = "llm_primary" if isLlmPrimary else "llm_fallback"
 
             data = (
+                datetime.now(timezone.utc),
                 business_id,
                 thread_id,
                 event_type,
@@ -206,22 +373,19 @@ def registrar_evento(result, thread_id, latency_ms, isLlmPrimary=True):
                 costo_total,
                 latency_ms,
                 tool_name,
-                None
+                None,
+                0.0
             )
 
-            sql = """
-            INSERT INTO analytics_events 
-            (business_id, thread_id, event_type, input_tokens, output_tokens, 
-            model_name, estimated_cost, latency_ms, tool_name, sentiment_label)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            pool = get_pool()
-            with pool.connection() as conn:
-                conn.execute(sql, data)
+            # Gasto acumulado del negocio (presupuestos): O(1), sin consultar la DB
+            cost_accumulator.sumar(business_id, costo_total)
+            # Percentiles en vivo por (negocio, modelo, tool)
+            latencias_vivas.registrar(business_id, model_name, tool_name, latency_ms)
 
-            logger.info(f"✅ Evento de consumo de tokens registrado en DB para thread_id: {thread_id}")
+            if analytics_writer.encolar(data):
+                logger.info(f"✅ Evento de consumo de tokens encolado para thread_id: {thread_id}")
 
-            return usage
+            return costo_total
         else:
             logger.warning(f"⚠️ No se pudo extraer información de tokens para métricas del resultado: {result}")
             return None
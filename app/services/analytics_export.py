@@ -0,0 +1,208 @@
+"""
+Export de analytics_events para facturación
+===========================================
+
+Genera el export de un negocio en un rango de fechas como un stream de bytes (CSV o
+Parquet) para devolverlo con una respuesta HTTP chunked:
+
+- Los eventos se leen con un cursor con nombre (server-side) en lotes de
+  ANALYTICS_EXPORT_BATCH filas: la memoria queda acotada a un lote sin importar el total.
+- La conexión sale de get_export_pool() (pool propio y chico), no del pool principal.
+- Parquet es opcional: requiere pyarrow. Cada lote se escribe como un row group y los
+  bytes se emiten apenas el writer los produce.
+"""
+
+import os
+import io
+import csv
+import time
+from datetime import datetime
+from loguru import logger
+from .analytics import ANALYTICS_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _HAS_PYARROW = True
+except Exception:
+    _HAS_PYARROW = False
+
+EXPORT_COLUMNS = ("id",) + ANALYTICS_COLUMNS
+
+FORMATOS = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+try:
+    TAMANO_LOTE = int(os.getenv("ANALYTICS_EXPORT_BATCH", "5000"))
+except Exception:
+    TAMANO_LOTE = 5000
+
+
+def formato_disponible(formato: str) -> bool:
+    if formato == "parquet":
+        return _HAS_PYARROW
+    return formato in FORMATOS
+
+
+def _iterar_lotes(conn, business_id: str, start: datetime, end: datetime, tamano_lote: int):
+    """Lotes de filas (orden EXPORT_COLUMNS) leídos con un cursor server-side."""
+    # Los cursores con nombre viven dentro de una transacción (el pool es autocommit)
+    with conn.transaction():
+        with conn.cursor(name="analytics_export") as cur:
+            cur.execute(
+                f"SELECT {', '.join(EXPORT_COLUMNS)} FROM analytics_events "
+                "WHERE business_id = %s AND timestamp >= %s AND timestamp < %s "
+                "ORDER BY timestamp, id",
+                (business_id, start, end),
+            )
+            while True:
+                filas = cur.fetchmany(tamano_lote)
+                if not filas:
+                    break
+                yield filas
+
+
+def _csv(lotes):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for filas in lotes:
+        writer.writerows(
+            [(r[0], r[1].isoformat() if r[1] else "", *r[2:]) for r in filas]
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    # Solo el encabezado si no hubo filas
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _SalidaParquet:
+    """Archivo de solo escritura para ParquetWriter cuyo contenido se drena en cada lote."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, data):
+        self._buffer += data
+        self._posicion += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def drenar(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _esquema_parquet():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("business_id", pa.string()),
+        ("thread_id", pa.string()),
+        ("event_type", pa.string()),
+        ("input_tokens", pa.int32()),
+        ("output_tokens", pa.int32()),
+        ("model_name", pa.string()),
+        ("estimated_cost", pa.float64()),
+        ("latency_ms", pa.int32()),
+        ("tool_name", pa.string()),
+        ("sentiment_label", pa.string()),
+        ("cost_avoided", pa.float64()),
+    ])
+
+
+def _parquet(lotes):
+    esquema = _esquema_parquet()
+    salida = _SalidaParquet()
+    writer = pq.ParquetWriter(salida, esquema, compression="zstd")
+    try:
+        for filas in lotes:
+            columnas = {col: [r[i] for r in filas] for i, col in enumerate(EXPORT_COLUMNS)}
+            writer.write_table(pa.Table.from_pydict(columnas, schema=esquema))
+            data = salida.drenar()
+            if data:
+                yield data
+    finally:
+        # Escribe el footer (también en un export vacío: Parquet válido sin row groups)
+        writer.close()
+    data = salida.drenar()
+    if data:
+        yield data
+
+
+def generar_export(conn, business_id: str, start: datetime, end: datetime, formato: str = "csv"):
+    """
+    Generador de bytes del export sobre `conn`. No devuelve la conexión al pool: si el
+    generador nunca arranca (HEAD, cliente que corta antes del primer chunk) su finally no
+    corre. Para responder usar StreamExport, que la devuelve en close().
+    """
+    inicio = time.perf_counter()
+    contador = {"filas": 0}
+
+    def _contar(lotes):
+        for filas in lotes:
+            contador["filas"] += len(filas)
+            yield filas
+
+    crudos = _iterar_lotes(conn, business_id, start, end, TAMANO_LOTE)
+    try:
+        lotes = _contar(crudos)
+        serializador = _parquet if formato == "parquet" else _csv
+        yield from serializador(lotes)
+        logger.info(
+            f"📤 [EXPORT] {business_id} {start.date()} → {end.date()} ({formato}): "
+            f"{contador['filas']} eventos en {time.perf_counter() - inicio:.1f}s"
+        )
+    except GeneratorExit:
+        logger.warning(f"⚠️ [EXPORT] Descarga interrumpida por el cliente ({business_id}, {contador['filas']} eventos enviados)")
+        raise
+    except Exception as e:
+        logger.exception(f"🔴 [EXPORT] Error exportando {business_id}: {e}")
+        raise
+    finally:
+        # Cerrar el cursor/transacción antes de que StreamExport devuelva la conexión
+        crudos.close()
+
+
+class StreamExport:
+    """
+    Iterable de respuesta del export. Toma posesión de `conn` (obtenida con pool.getconn())
+    y la devuelve al pool en close(), que el servidor WSGI llama siempre al terminar la
+    respuesta: export completo, descarga cortada, HEAD o cliente que se fue antes de que el
+    generador empezara.
+    """
+
+    def __init__(self, pool, conn, business_id: str, start: datetime, end: datetime, formato: str = "csv"):
+        self.pool = pool
+        self.conn = conn
+        self._generador = generar_export(conn, business_id, start, end, formato)
+        self._devuelta = False
+
+    def __iter__(self):
+        return self._generador
+
+    def close(self):
+        try:
+            self._generador.close()
+        finally:
+            if not self._devuelta:
+                self._devuelta = True
+                self.pool.putconn(self.conn)
@@ -0,0 +1,187 @@
+"""
+Particiones mensuales de analytics_events
+=========================================
+
+Con la migración DB/migrate_analytics_partitions.sh, analytics_events pasa a ser una tabla
+particionada por RANGE(timestamp) con una partición por mes (analytics_events_YYYYMM) y un
+índice BRIN sobre timestamp. Este módulo hace el mantenimiento:
+
+- Crea por adelantado las particiones del mes actual y de los próximos
+  ANALYTICS_PARTITIONS_AHEAD meses (sin ellas los INSERT/COPY fallarían).
+- Retención: las particiones completas más viejas que ANALYTICS_RETENTION_MESES se
+  desacoplan (DETACH) y se eliminan (DROP). Es O(1) por mes, sin DELETE fila a fila ni
+  VACUUM posterior. Los rollups horarios no se tocan: el histórico agregado se conserva.
+
+Si la tabla todavía no está particionada el mantenimiento no hace nada.
+"""
+
+import os
+import re
+import time
+import threading
+from datetime import date, datetime, timezone
+from loguru import logger
+from app.db import get_pool, conexion_dedicada
+
+TABLA = "analytics_events"
+PATRON_PARTICION = re.compile(r"^analytics_events_(\d{4})(\d{2})$")
+
+# Lock de sesión para que un solo worker de gunicorn haga el mantenimiento a la vez
+ADVISORY_LOCK_ID = 72026030
+
+
+def _sumar_meses(mes: date, n: int) -> date:
+    total = mes.year * 12 + (mes.month - 1) + n
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _mes_actual() -> date:
+    hoy = datetime.now(timezone.utc).date()
+    return date(hoy.year, hoy.month, 1)
+
+
+def nombre_particion(mes: date) -> str:
+    return f"{TABLA}_{mes.year:04d}{mes.month:02d}"
+
+
+def esta_particionada(conn) -> bool:
+    fila = conn.execute(
+        "SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", (TABLA,)
+    ).fetchone()
+    return bool(fila) and fila[0] == "p"
+
+
+def listar_particiones(conn) -> dict:
+    """{ mes (date): nombre } de las particiones mensuales existentes."""
+    filas = conn.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        (TABLA,),
+    ).fetchall()
+    particiones = {}
+    for (nombre,) in filas:
+        m = PATRON_PARTICION.match(nombre)
+        if m:
+            particiones[date(int(m.group(1)), int(m.group(2)), 1)] = nombre
+    return particiones
+
+
+def crear_particiones_futuras(conn, meses_adelante: int = 2) -> list:
+    """Crea (si faltan) las particiones del mes actual y de los próximos `meses_adelante` meses."""
+    existentes = listar_particiones(conn)
+    creadas = []
+    mes = _mes_actual()
+    for i in range(meses_adelante + 1):
+        desde = _sumar_meses(mes, i)
+        if desde in existentes:
+            continue
+        hasta = _sumar_meses(desde, 1)
+        nombre = nombre_particion(desde)
+        # Límites explícitos en UTC: no dependen del TimeZone de la sesión
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF {TABLA} "
+            f"FOR VALUES FROM ('{desde.isoformat()} 00:00:00+00') TO ('{hasta.isoformat()} 00:00:00+00')"
+        )
+        creadas.append(nombre)
+    if creadas:
+        logger.info(f"🗂️ Particiones de analytics creadas: {', '.join(creadas)}")
+    return creadas
+
+
+def particiones_vencidas(conn, retencion_meses: int) -> list:
+    """Particiones cuyo mes completo es anterior a la ventana de retención (mes actual + N previos)."""
+    if retencion_meses <= 0:
+        return []
+    limite = _sumar_meses(_mes_actual(), -retencion_meses)
+    return [nombre for mes, nombre in sorted(listar_particiones(conn).items()) if mes < limite]
+
+
+def eliminar_particiones_vencidas(conn, retencion_meses: int, dry_run: bool = False) -> list:
+    """DETACH + DROP de las particiones fuera de la ventana de retención."""
+    vencidas = particiones_vencidas(conn, retencion_meses)
+    if dry_run or not vencidas:
+        return vencidas
+
+    # DETACH CONCURRENTLY (PG14+) no bloquea los COPY del AnalyticsWriter; requiere autocommit
+    concurrente = conn.info.server_version >= 140000 and conn.autocommit
+    for nombre in vencidas:
+        try:
+            if concurrente:
+                conn.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre} CONCURRENTLY")
+            else:
+                conn.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}")
+            conn.execute(f"DROP TABLE IF EXISTS {nombre}")
+            logger.info(f"🗑️ Partición {nombre} desacoplada y eliminada (retención {retencion_meses} meses)")
+        except Exception as e:
+            logger.error(f"🔴 Error eliminando partición {nombre}: {e}")
+    return vencidas
+
+
+def mantener_particiones(meses_adelante: int = 2, retencion_meses: int = 0) -> dict:
+    """
+    Una pasada de mantenimiento. Solo la ejecuta el worker que obtiene el advisory lock.
+
+    Returns:
+        {"partitioned": bool, "created": [...], "dropped": [...], "skipped": bool}
+    """
+    resultado = {"partitioned": False, "created": [], "dropped": [], "skipped": False}
+    if not get_pool("admin"):
+        return resultado
+
+    with conexion_dedicada("admin") as conn:
+        if not conn.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,)).fetchone()[0]:
+            resultado["skipped"] = True
+            return resultado
+        try:
+            if not esta_particionada(conn):
+                return resultado
+            resultado["partitioned"] = True
+            resultado["created"] = crear_particiones_futuras(conn, meses_adelante)
+            resultado["dropped"] = eliminar_particiones_vencidas(conn, retencion_meses)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+    return resultado
+
+
+def _leer_config():
+    try:
+        adelante = int(os.getenv("ANALYTICS_PARTITIONS_AHEAD", "2"))
+    except Exception:
+        adelante = 2
+
+    try:
+        retencion = int(os.getenv("ANALYTICS_RETENTION_MESES", "0"))
+    except Exception:
+        retencion = 0
+
+    try:
+        intervalo_horas = float(os.getenv("ANALYTICS_PARTITION_CHECK_HORAS", "6"))
+    except Exception:
+        intervalo_horas = 6.0
+
+    return adelante, retencion, intervalo_horas
+
+
+def iniciar_mantenimiento_particiones():
+    """Arranca el hilo demonio que mantiene las particiones (al iniciar y cada N horas)."""
+    adelante, retencion, intervalo_horas = _leer_config()
+
+    def _loop():
+        while True:
+            try:
+                resultado = mantener_particiones(adelante, retencion)
+                if resultado["partitioned"] and not resultado["skipped"]:
+                    logger.debug(f"🗂️ Mantenimiento de particiones OK: {resultado}")
+            except Exception as e:
+                logger.error(f"🔴 Error en mantenimiento de particiones de analytics: {e}")
+            time.sleep(intervalo_horas * 3600)
+
+    threading.Thread(target=_loop, name="analytics-partitions", daemon=True).start()
+    logger.info(
+        f"🗂️ Mantenimiento de particiones de analytics: {adelante} meses adelante, "
+        f"retención {retencion or 'ilimitada'} meses, cada {intervalo_horas}h"
+    )
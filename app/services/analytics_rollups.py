@@ -0,0 +1,460 @@
+"""
+Rollups horarios de analytics_events
+====================================
+
+El AnalyticsWriter agrega cada lote en memoria y lo suma (UPSERT) a:
+
+- analytics_rollup_hourly: una fila por (hour, business_id, event_type, model_name, tool_name)
+  con sumas, conteos y un histograma de latencias (buckets logarítmicos, sumables entre filas).
+  cost_avoided suma el costo evitado por los hits del cache de medios (event_type "cache_hit").
+- analytics_rollup_threads: (day, business_id, thread_id) para poder contar conversaciones
+  únicas por día/rango/negocio sin escanear eventos crudos.
+
+El dashboard lee estas tablas para rangos mayores a un día, así su costo depende de la
+cantidad de horas del rango y no del volumen histórico de eventos. Al crearlas por primera vez
+se completan con la historia que ya hay en analytics_events (bajo advisory lock), para que el
+dashboard no arranque vacío después de actualizar.
+"""
+
+import time
+from datetime import datetime
+from loguru import logger
+from app.db import get_pool
+
+# Límites superiores (ms) de los buckets de latencia. El último bucket es overflow (> 120s).
+LATENCY_BOUNDS_MS = (
+    10, 20, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000,
+    4000, 5000, 7500, 10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000,
+)
+N_BUCKETS = len(LATENCY_BOUNDS_MS) + 1
+ADVISORY_LOCK_ID = 72026028
+
+SQL_CREAR_TABLAS = """
+CREATE TABLE IF NOT EXISTS analytics_rollup_hourly (
+    hour TIMESTAMPTZ NOT NULL,
+    business_id VARCHAR(50) NOT NULL,
+    event_type VARCHAR(50) NOT NULL DEFAULT '',
+    model_name VARCHAR(50) NOT NULL DEFAULT '',
+    tool_name VARCHAR(50) NOT NULL DEFAULT '',
+    events BIGINT DEFAULT 0,
+    input_tokens BIGINT DEFAULT 0,
+    output_tokens BIGINT DEFAULT 0,
+    estimated_cost DOUBLE PRECISION DEFAULT 0.0,
+    latency_sum_ms BIGINT DEFAULT 0,
+    latency_max_ms INT DEFAULT 0,
+    latency_buckets INT[] NOT NULL,
+    ratio_sum DOUBLE PRECISION DEFAULT 0.0,
+    ratio_count BIGINT DEFAULT 0,
+    cost_avoided DOUBLE PRECISION DEFAULT 0.0,
+    PRIMARY KEY (hour, business_id, event_type, model_name, tool_name)
+);
+
+CREATE TABLE IF NOT EXISTS analytics_rollup_threads (
+    day DATE NOT NULL,
+    business_id VARCHAR(50) NOT NULL,
+    thread_id VARCHAR(100) NOT NULL,
+    PRIMARY KEY (day, business_id, thread_id)
+);
+"""
+
+# Columnas agregadas después de la creación de la tabla (instalaciones existentes)
+SQL_COLUMNAS_NUEVAS = """
+ALTER TABLE analytics_rollup_hourly ADD COLUMN IF NOT EXISTS cost_avoided DOUBLE PRECISION DEFAULT 0.0
+"""
+
+SQL_UPSERT_HOURLY = """
+INSERT INTO analytics_rollup_hourly AS r
+    (hour, business_id, event_type, model_name, tool_name, events, input_tokens, output_tokens,
+     estimated_cost, latency_sum_ms, latency_max_ms, latency_buckets, ratio_sum, ratio_count, cost_avoided)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (hour, business_id, event_type, model_name, tool_name) DO UPDATE SET
+    events = r.events + EXCLUDED.events,
+    input_tokens = r.input_tokens + EXCLUDED.input_tokens,
+    output_tokens = r.output_tokens + EXCLUDED.output_tokens,
+    estimated_cost = r.estimated_cost + EXCLUDED.estimated_cost,
+    latency_sum_ms = r.latency_sum_ms + EXCLUDED.latency_sum_ms,
+    latency_max_ms = GREATEST(r.latency_max_ms, EXCLUDED.latency_max_ms),
+    latency_buckets = ARRAY(
+        SELECT COALESCE(a, 0) + COALESCE(b, 0)
+        FROM unnest(r.latency_buckets, EXCLUDED.latency_buckets) WITH ORDINALITY AS t(a, b, i)
+        ORDER BY i
+    ),
+    ratio_sum = r.ratio_sum + EXCLUDED.ratio_sum,
+    ratio_count = r.ratio_count + EXCLUDED.ratio_count,
+    cost_avoided = r.cost_avoided + EXCLUDED.cost_avoided
+"""
+
+SQL_UPSERT_THREADS = """
+INSERT INTO analytics_rollup_threads (day, business_id, thread_id)
+VALUES ((%s::timestamptz)::date, %s, %s)
+ON CONFLICT DO NOTHING
+"""
+
+
+def bucket_latencia(latency_ms: int) -> int:
+    """Índice del bucket de latencia (búsqueda lineal: son pocos buckets)."""
+    for i, limite in enumerate(LATENCY_BOUNDS_MS):
+        if latency_ms <= limite:
+            return i
+    return N_BUCKETS - 1
+
+
+def percentil_histograma(buckets, q: float, max_ms: int = None):
+    """Estima el percentil q (0-1) interpolando linealmente dentro del bucket."""
+    total = sum(buckets)
+    if not total:
+        return None
+    objetivo = q * total
+    acumulado = 0
+    for i, n in enumerate(buckets):
+        if not n:
+            continue
+        if acumulado + n >= objetivo:
+            inferior = LATENCY_BOUNDS_MS[i - 1] if i > 0 else 0
+            superior = LATENCY_BOUNDS_MS[i] if i < len(LATENCY_BOUNDS_MS) else (max_ms or inferior)
+            if max_ms is not None:
+                superior = min(superior, max_ms)
+            fraccion = (objetivo - acumulado) / n
+            return int(round(inferior + (superior - inferior) * fraccion))
+        acumulado += n
+    return max_ms
+
+
+def _nuevo_acumulador():
+    return {
+        "events": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0,
+        "latency_sum": 0, "latency_max": 0, "buckets": [0] * N_BUCKETS,
+        "ratio_sum": 0.0, "ratio_count": 0, "cost_avoided": 0.0,
+    }
+
+
+def agregar_eventos(filas):
+    """
+    Agrega filas con el orden de ANALYTICS_COLUMNS.
+
+    Returns:
+        (agregados, hilos): { (hour, business_id, event_type, model_name, tool_name): acumulador }
+        y el set de (hour, business_id, thread_id) para analytics_rollup_threads.
+    """
+    agregados = {}
+    hilos = set()
+    for ts, business_id, thread_id, event_type, inp, out, model, cost, latency, tool, _, avoided, *_ in filas:
+        hora = ts.replace(minute=0, second=0, microsecond=0)
+        clave = (hora, business_id or "", event_type or "", model or "", tool or "")
+        acc = agregados.get(clave)
+        if acc is None:
+            acc = agregados[clave] = _nuevo_acumulador()
+
+        inp = inp or 0
+        out = out or 0
+        latency = latency or 0
+        acc["events"] += 1
+        acc["input_tokens"] += inp
+        acc["output_tokens"] += out
+        acc["cost"] += cost or 0.0
+        acc["cost_avoided"] += avoided or 0.0
+        acc["latency_sum"] += latency
+        acc["latency_max"] = max(acc["latency_max"], latency)
+        acc["buckets"][bucket_latencia(latency)] += 1
+        if inp:
+            acc["ratio_sum"] += out / inp
+            acc["ratio_count"] += 1
+
+        hilos.add((hora, business_id or "", thread_id))
+    return agregados, hilos
+
+
+def actualizar_rollups(cur, filas):
+    """Suma un lote de eventos a los rollups (usa el cursor/transacción del llamador)."""
+    agregados, hilos = agregar_eventos(filas)
+    cur.executemany(SQL_UPSERT_HOURLY, [
+        (*clave, a["events"], a["input_tokens"], a["output_tokens"], a["cost"], a["latency_sum"],
+         a["latency_max"], a["buckets"], a["ratio_sum"], a["ratio_count"], a["cost_avoided"])
+        for clave, a in agregados.items()
+    ])
+    cur.executemany(SQL_UPSERT_THREADS, list(hilos))
+
+
+def asegurar_tablas_rollup(conn):
+    """
+    Crea las tablas de rollup; si no existían, las completa con los eventos que ya hay en
+    analytics_events. Los demás workers esperan el advisory lock, así que sus escritores no
+    suman eventos mientras corre el backfill (se acumulan en el buffer).
+    """
+    conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+    try:
+        existia = conn.execute("SELECT to_regclass('analytics_rollup_hourly') IS NOT NULL").fetchone()[0]
+        conn.execute(SQL_CREAR_TABLAS)
+        # ADD COLUMN toma un lock exclusivo aunque la columna exista: solo si falta
+        if not conn.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'analytics_rollup_hourly' AND column_name = 'cost_avoided'"
+        ).fetchone():
+            conn.execute(SQL_COLUMNAS_NUEVAS)
+        if existia or not conn.execute("SELECT to_regclass('analytics_events') IS NOT NULL").fetchone()[0]:
+            return
+
+        desde, hasta = conn.execute("SELECT MIN(timestamp), NOW() FROM analytics_events").fetchone()
+        if desde is not None:
+            logger.info(f"📊 Rollups nuevos: completando con la historia de analytics_events desde {desde}")
+            _recalcular(conn, desde, hasta)
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+
+def reconstruir_rollups(start: datetime, end: datetime, tamano_lote: int = 5000):
+    """
+    Recalcula los rollups de [start, end) desde analytics_events (backfill de historia previa
+    o reparación). Las horas del rango se borran y se vuelven a sumar en una transacción.
+    """
+    with get_pool("analytics").connection() as conn:
+        asegurar_tablas_rollup(conn)
+        return _recalcular(conn, start, end, tamano_lote)
+
+
+def _recalcular(conn, start: datetime, end: datetime, tamano_lote: int = 5000) -> int:
+    """Borra y vuelve a sumar las horas de [start, end) en una transacción de `conn`."""
+    from .analytics import ANALYTICS_COLUMNS
+    from .analytics_partitions import esta_particionada, listar_particiones
+
+    inicio = time.perf_counter()
+    total = 0
+    # Con retención por particiones, los meses ya eliminados solo existen en los rollups:
+    # no se borran ni se recalculan
+    if esta_particionada(conn):
+        meses = listar_particiones(conn)
+        if meses:
+            start = max(start, datetime.combine(min(meses), datetime.min.time(), tzinfo=start.tzinfo))
+        if start >= end:
+            logger.warning("⚠️ Rango sin eventos crudos disponibles (particiones eliminadas); rollups sin cambios")
+            return 0
+
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM analytics_rollup_hourly WHERE hour >= %s AND hour < %s", (start, end))
+            cur.execute("DELETE FROM analytics_rollup_threads WHERE day >= %s::date AND day < %s", (start, end))
+
+        # Cursor con nombre (server-side): memoria constante sin importar el volumen
+        with conn.cursor(name="rollup_backfill") as lectura, conn.cursor() as escritura:
+            lectura.execute(
+                f"SELECT {', '.join(ANALYTICS_COLUMNS)} FROM analytics_events "
+                "WHERE timestamp >= %s AND timestamp < %s",
+                (start, end),
+            )
+            while True:
+                filas = lectura.fetchmany(tamano_lote)
+                if not filas:
+                    break
+                actualizar_rollups(escritura, filas)
+                total += len(filas)
+
+    logger.info(f"✅ Rollups reconstruidos {start} → {end}: {total} eventos en {time.perf_counter() - inicio:.1f}s")
+    return total
+
+
+def construir_dashboard_desde_rollups(cur, dashboard: dict, start: datetime, end: datetime, business_id: str = None):
+    """
+    Completa las secciones kpis/performance/costs/security/usage/businesses del dashboard
+    leyendo solo los rollups (mismo formato que las consultas sobre eventos crudos).
+    """
+    biz_filter = "AND business_id = %s" if business_id else ""
+    biz_params = (business_id,) if business_id else ()
+
+    cur.execute(f"""
+        SELECT hour, business_id, event_type, model_name, tool_name, events, input_tokens, output_tokens,
+               estimated_cost, latency_sum_ms, latency_max_ms, latency_buckets, ratio_sum, ratio_count, cost_avoided
+        FROM analytics_rollup_hourly
+        WHERE hour >= %s AND hour < %s
+        {biz_filter}
+    """, (start, end) + biz_params)
+    filas = cur.fetchall()
+
+    # Conversaciones únicas: total, por día y por negocio en una sola pasada
+    cur.execute(f"""
+        SELECT GROUPING(day) AS g_day, GROUPING(business_id) AS g_biz, day, business_id,
+               COUNT(DISTINCT thread_id)
+        FROM analytics_rollup_threads
+        WHERE day >= %s::date AND day < %s
+        {biz_filter}
+        GROUP BY GROUPING SETS ((), (day), (business_id))
+    """, (start, end) + biz_params)
+    unicos_total = 0
+    unicos_dia = {}
+    unicos_negocio = {}
+    for g_day, g_biz, day, biz, n in cur.fetchall():
+        if g_day and g_biz:
+            unicos_total = n
+        elif not g_day:
+            unicos_dia[day] = n
+        else:
+            unicos_negocio[biz] = n
+
+    ensamblar_dashboard(dashboard, filas, unicos_total, unicos_dia, unicos_negocio, business_id)
+    dashboard["source"] = "rollups"
+    return dashboard
+
+
+def ensamblar_dashboard(dashboard: dict, filas, unicos_total: int, unicos_dia: dict, unicos_negocio: dict,
+                        business_id: str = None, percentiles: dict = None):
+    """
+    Arma las secciones del dashboard a partir de filas con la forma de analytics_rollup_hourly
+    (latency_buckets puede ser None si se pasan `percentiles` exactos ya calculados).
+
+    Los hits del cache de medios ("cache_hit") cuentan como eventos y suman cost_avoided, pero
+    no entran en latencias, modelos ni tools: su latencia es la del cache y su tool_name es el
+    tipo de medio, no una herramienta.
+    """
+    total = {"events": 0, "tokens": 0, "cost": 0.0, "latency_events": 0, "latency_sum": 0, "latency_max": None,
+             "buckets": [0] * N_BUCKETS, "ratio_sum": 0.0, "ratio_count": 0, "hitl": 0}
+    cache = {}
+    por_tipo = {}
+    por_modelo = {}
+    por_tool = {}
+    por_hora = {}
+    por_dia = {}
+    por_negocio = {}
+    errores_tool = {}
+
+    for (hour, biz, event_type, model, tool, events, inp, out, cost, lat_sum, lat_max,
+         buckets, ratio_sum, ratio_count, avoided) in filas:
+        es_hit = event_type == "cache_hit"
+        total["events"] += events
+        total["tokens"] += inp + out
+        total["cost"] += cost
+        if not es_hit:
+            total["latency_events"] += events
+            total["latency_sum"] += lat_sum
+            total["latency_max"] = lat_max if total["latency_max"] is None else max(total["latency_max"], lat_max)
+            for i, n in enumerate(buckets or ()):
+                total["buckets"][i] += n
+        if event_type not in ("transcription", "image_analysis"):
+            total["ratio_sum"] += ratio_sum
+            total["ratio_count"] += ratio_count
+
+        t = por_tipo.setdefault(event_type, {"events": 0, "cost": 0.0})
+        t["events"] += events
+        t["cost"] += cost
+
+        if es_hit:
+            c = cache.setdefault(tool, {"hits": 0, "cost_avoided": 0.0})
+            c["hits"] += events
+            c["cost_avoided"] += avoided or 0.0
+        elif model:
+            m = por_modelo.setdefault(model, {"cost": 0.0, "input": 0, "output": 0, "calls": 0})
+            m["cost"] += cost
+            m["input"] += inp
+            m["output"] += out
+            m["calls"] += events
+
+        if tool and not es_hit:
+            tl = por_tool.setdefault(tool, {"calls": 0, "latency_sum": 0})
+            tl["calls"] += events
+            tl["latency_sum"] += lat_sum
+            if tool == "solicitar_atencion_humana":
+                total["hitl"] += events
+            if event_type == "tool_error":
+                errores_tool[tool] = errores_tool.get(tool, 0) + events
+
+        por_hora[hour] = por_hora.get(hour, 0) + events
+
+        d = por_dia.setdefault(hour.date(), {"events": 0, "fallbacks": 0, "cost": 0.0, "tokens": 0})
+        d["events"] += events
+        d["cost"] += cost
+        d["tokens"] += inp + out
+        if event_type == "llm_fallback":
+            d["fallbacks"] += events
+
+        b = por_negocio.setdefault(biz, {"events": 0, "cost": 0.0, "latency_events": 0, "latency_sum": 0, "fallbacks": 0})
+        b["events"] += events
+        b["cost"] += cost
+        if not es_hit:
+            b["latency_events"] += events
+            b["latency_sum"] += lat_sum
+        if event_type == "llm_fallback":
+            b["fallbacks"] += events
+
+    def _count(tipo):
+        return por_tipo.get(tipo, {}).get("events", 0)
+
+    total_events = total["events"] or 1
+    dashboard["kpis"] = {
+        "total_events": total["events"],
+        "unique_conversations": unicos_total,
+        "active_businesses": len({biz for biz, b in por_negocio.items() if b["events"]}),
+        "total_tokens": total["tokens"],
+        "total_cost_usd": round(total["cost"], 6),
+        "avg_latency_ms": int(round(total["latency_sum"] / total["latency_events"])) if total["latency_events"] else 0,
+        "fallback_rate_pct": round(_count("llm_fallback") / total_events * 100, 2),
+        "transcription_events": _count("transcription"),
+        "image_analysis_events": _count("image_analysis"),
+    }
+
+    dashboard["performance"]["latency_percentiles_ms"] = percentiles or {
+        "p50": percentil_histograma(total["buckets"], 0.50, total["latency_max"]),
+        "p95": percentil_histograma(total["buckets"], 0.95, total["latency_max"]),
+        "p99": percentil_histograma(total["buckets"], 0.99, total["latency_max"]),
+        "max": total["latency_max"],
+    }
+    latency_by_tool = [
+        {"tool": tool, "avg_latency_ms": int(round(v["latency_sum"] / v["calls"])), "calls": v["calls"]}
+        for tool, v in por_tool.items() if v["calls"]
+    ]
+    dashboard["performance"]["latency_by_tool"] = sorted(latency_by_tool, key=lambda r: r["avg_latency_ms"], reverse=True)
+    dashboard["performance"]["events_per_hour"] = [{"hour": h.isoformat(), "events": n} for h, n in sorted(por_hora.items())]
+    dashboard["performance"]["fallback_rate_daily"] = [
+        {"date": str(day), "fallbacks": d["fallbacks"], "total": d["events"],
+         "rate_pct": round(d["fallbacks"] / max(d["events"], 1) * 100, 2)}
+        for day, d in sorted(por_dia.items())
+    ]
+
+    dashboard["costs"]["daily"] = [
+        {"date": str(day), "cost_usd": round(d["cost"], 6), "tokens": d["tokens"]} for day, d in sorted(por_dia.items())
+    ]
+    if por_dia:
+        dashboard["costs"]["monthly_projection_usd"] = round(sum(d["cost"] for d in por_dia.values()) / len(por_dia) * 30, 4)
+    else:
+        dashboard["costs"]["monthly_projection_usd"] = 0.0
+    dashboard["costs"]["by_model"] = sorted([
+        {"model": model, "cost_usd": round(m["cost"], 6), "input_tokens": m["input"], "output_tokens": m["output"], "calls": m["calls"]}
+        for model, m in por_modelo.items()
+    ], key=lambda r: r["cost_usd"], reverse=True)
+    dashboard["costs"]["by_event_type"] = sorted([
+        {"type": tipo or None, "cost_usd": round(t["cost"], 6), "calls": t["events"]} for tipo, t in por_tipo.items()
+    ], key=lambda r: r["cost_usd"], reverse=True)
+    dashboard["costs"]["cache_avoided"] = {
+        "hits": sum(c["hits"] for c in cache.values()),
+        "cost_avoided_usd": round(sum(c["cost_avoided"] for c in cache.values()), 6),
+        "by_kind": sorted([
+            {"kind": kind or None, "hits": c["hits"], "cost_avoided_usd": round(c["cost_avoided"], 6)}
+            for kind, c in cache.items()
+        ], key=lambda r: r["cost_avoided_usd"], reverse=True),
+    }
+    dashboard["costs"]["avg_output_input_ratio"] = round(total["ratio_sum"] / total["ratio_count"], 3) if total["ratio_count"] else 0
+
+    dashboard["security"]["hitl_escalations"] = total["hitl"]
+    dashboard["security"]["hitl_rate_pct"] = round(total["hitl"] / total_events * 100, 2)
+    dashboard["security"]["tool_errors"] = [
+        {"tool": tool, "errors": n} for tool, n in sorted(errores_tool.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    ]
+
+    dashboard["usage"]["daily_unique_users"] = [{"date": str(day), "users": n} for day, n in sorted(unicos_dia.items())]
+    dashboard["usage"]["top_tools"] = [
+        {"tool": tool, "calls": v["calls"]} for tool, v in sorted(por_tool.items(), key=lambda kv: kv[1]["calls"], reverse=True)[:15]
+    ]
+    dashboard["usage"]["event_type_distribution"] = sorted([
+        {"type": tipo or None, "count": t["events"]} for tipo, t in por_tipo.items()
+    ], key=lambda r: r["count"], reverse=True)
+
+    if not business_id:
+        dashboard["businesses"] = sorted([
+            {
+                "business_id": biz,
+                "events": b["events"],
+                "conversations": unicos_negocio.get(biz, 0),
+                "cost_usd": round(b["cost"], 6),
+                "avg_latency_ms": int(round(b["latency_sum"] / b["latency_events"])) if b["latency_events"] else 0,
+                "fallback_rate_pct": round(b["fallbacks"] / max(b["events"], 1) * 100, 2),
+            }
+            for biz, b in por_negocio.items()
+        ], key=lambda r: r["cost_usd"], reverse=True)
+
+    return dashboard
@@ -0,0 +1,112 @@
+"""
+Duración de notas de voz sin decodificar
+========================================
+
+WhatsApp manda las notas de voz en Ogg/Opus y Chatwoot/Instagram suelen mandar MP4/M4A. En
+ambos contenedores la duración está en los encabezados:
+
+- Ogg: granule position de la última página (muestras a 48 kHz en Opus, menos el pre-skip
+  del OpusHead; en Vorbis, a la frecuencia del encabezado de identificación).
+- MP4/M4A: timescale y duration de la caja moov/mvhd.
+
+Solo si el contenedor no se reconoce (mp3, wav, archivos truncados, MP4 fragmentado sin
+duración en mvhd) se decodifica con pydub/ffmpeg como antes.
+"""
+
+import io
+import struct
+from typing import Optional
+from loguru import logger
+
+OPUS_TASA = 48000
+
+
+def _duracion_ogg(buf: bytes) -> Optional[float]:
+    if buf[:4] != b"OggS" or len(buf) < 28:
+        return None
+
+    # Primer paquete de la primera página: OpusHead o encabezado de identificación de Vorbis
+    inicio = 27 + buf[26]
+    paquete = buf[inicio:inicio + 19]
+    if paquete.startswith(b"OpusHead") and len(paquete) >= 12:
+        tasa = OPUS_TASA
+        pre_skip = struct.unpack_from("<H", paquete, 10)[0]
+    elif paquete[:7] == b"\x01vorbis" and len(paquete) >= 16:
+        tasa = struct.unpack_from("<I", paquete, 12)[0]
+        pre_skip = 0
+    else:
+        return None
+    if not tasa:
+        return None
+
+    # Última página con granule position válida (-1 = ningún paquete termina en esa página)
+    pos = buf.rfind(b"OggS")
+    while pos >= 0:
+        if pos + 14 <= len(buf) and buf[pos + 4] == 0:
+            granule = struct.unpack_from("<q", buf, pos + 6)[0]
+            if granule >= 0:
+                return max(0, granule - pre_skip) / tasa
+        pos = buf.rfind(b"OggS", 0, pos)
+    return None
+
+
+def _cajas_mp4(buf: bytes, inicio: int, fin: int):
+    """(tipo, inicio del contenido, fin) de las cajas entre inicio y fin."""
+    pos = inicio
+    while pos + 8 <= fin:
+        tamano, tipo = struct.unpack_from(">I4s", buf, pos)
+        cabecera = 8
+        if tamano == 1:
+            if pos + 16 > fin:
+                return
+            tamano = struct.unpack_from(">Q", buf, pos + 8)[0]
+            cabecera = 16
+        elif tamano == 0:
+            tamano = fin - pos
+        if tamano < cabecera:
+            return
+        yield tipo, pos + cabecera, min(pos + tamano, fin)
+        pos += tamano
+
+
+def _duracion_mp4(buf: bytes) -> Optional[float]:
+    if buf[4:8] != b"ftyp":
+        return None
+    for tipo, inicio, fin in _cajas_mp4(buf, 0, len(buf)):
+        if tipo != b"moov":
+            continue
+        for subtipo, i, f in _cajas_mp4(buf, inicio, fin):
+            if subtipo != b"mvhd" or f - i < 20:
+                continue
+            if buf[i] == 1:
+                if f - i < 32:
+                    return None
+                escala, duracion = struct.unpack_from(">IQ", buf, i + 20)
+                desconocida = 0xFFFFFFFFFFFFFFFF
+            else:
+                escala, duracion = struct.unpack_from(">II", buf, i + 12)
+                desconocida = 0xFFFFFFFF
+            if not escala or not duracion or duracion == desconocida:
+                return None
+            return duracion / escala
+        return None
+    return None
+
+
+def duracion_por_encabezado(buf: bytes) -> Optional[float]:
+    """Duración en segundos leída de los encabezados Ogg o MP4, o None si no se puede."""
+    try:
+        return _duracion_ogg(buf) if buf[:4] == b"OggS" else _duracion_mp4(buf)
+    except struct.error:
+        return None
+
+
+def duracion_audio(buf: bytes, formato: str = "ogg") -> float:
+    """Duración en segundos: encabezados del contenedor y, si no alcanza, decodificación con pydub."""
+    segundos = duracion_por_encabezado(buf)
+    if segundos is not None:
+        return segundos
+
+    logger.debug(f"[AUDIO] Duración no disponible en encabezados ({formato}), decodificando")
+    from pydub import AudioSegment
+    return len(AudioSegment.from_file(io.BytesIO(buf), format=formato)) / 1000.0
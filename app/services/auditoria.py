@@ -0,0 +1,384 @@
+"""
+Registro de auditoría consultable (tabla audit_log)
+===================================================
+
+Además de los archivos logs_auditoria/audit_<business_id>.log, cada registro de auditoría
+([RCV <- EVO], [SND -> EVO], [---TOOL---], ...) se guarda en audit_log para poder buscarlo
+sin recorrer archivos rotados:
+
+- Un sink de Loguru (filtrado por is_audit) parsea el mensaje y lo encola sin bloquear; un
+  hilo por proceso lo escribe con COPY en lotes de AUDIT_BATCH_SIZE o cada AUDIT_FLUSH_MS.
+- audit_log está particionada por mes sobre ts (audit_log_YYYYMM), con índices por negocio,
+  por contacto y GIN de texto completo. Las particiones se crean por adelantado y las más
+  viejas que AUDIT_RETENCION_MESES se eliminan con DETACH + DROP.
+- buscar() pagina por keyset (ts, id) dentro de una ventana de tiempo: cada página lee solo
+  las particiones del rango y un tramo de índice, sin OFFSET.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import queue
+import atexit
+import threading
+from datetime import date, datetime, timedelta, timezone
+from loguru import logger
+from app.db import get_pool, conexion_dedicada
+from app.logger_config import filtro_auditoria
+from .analytics_partitions import _sumar_meses, _mes_actual
+
+TABLA = "audit_log"
+PATRON_PARTICION = re.compile(r"^audit_log_(\d{4})(\d{2})$")
+COLUMNAS = ("ts", "business_id", "direccion", "canal", "contacto", "mensaje")
+
+# Lock para que un solo worker cree las tablas y mantenga las particiones
+ADVISORY_LOCK_ID = 72026045
+
+# [RCV <- EVO] 📨 ID: 549... - MSG: ... | [SND -> IG DM] 📤 ID: @user - MSG: ... | [---TOOL---] 🔧 TEL: 549... - MSG: ...
+PATRON_MENSAJE = re.compile(
+    r"^\[(?:(?P<sentido>RCV <-|SND ->)\s*(?P<canal>[^\]]+?)|-+(?P<tool>TOOL)-+)\]"
+    r"\s*\S*\s*(?:(?:ID|TEL):\s*(?P<contacto>\S+))?",
+    re.DOTALL,
+)
+DIRECCIONES = {"RCV <-": "rcv", "SND ->": "snd"}
+
+SQL_CREAR = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    id BIGSERIAL,
+    ts TIMESTAMPTZ NOT NULL,
+    business_id TEXT NOT NULL,
+    direccion TEXT NOT NULL,
+    canal TEXT,
+    contacto TEXT,
+    mensaje TEXT NOT NULL,
+    tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', mensaje)) STORED
+) PARTITION BY RANGE (ts);
+CREATE INDEX IF NOT EXISTS idx_audit_log_business_ts ON audit_log (business_id, ts DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_log_contacto_ts ON audit_log (contacto, ts DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_audit_log_tsv ON audit_log USING GIN (tsv);
+"""
+
+
+def parsear_mensaje(mensaje: str) -> tuple:
+    """(direccion, canal, contacto) de un mensaje de auditoría. direccion: rcv, snd, tool u otro."""
+    m = PATRON_MENSAJE.match(mensaje)
+    if not m:
+        return "otro", None, None
+    if m.group("tool"):
+        direccion, canal = "tool", None
+    else:
+        direccion, canal = DIRECCIONES[m.group("sentido")], m.group("canal").strip()
+    contacto = m.group("contacto")
+    return direccion, canal, contacto.lstrip("@") if contacto else None
+
+
+def nombre_particion(mes) -> str:
+    return f"{TABLA}_{mes.year:04d}{mes.month:02d}"
+
+
+def listar_particiones(conn) -> dict:
+    """{ mes (date): nombre } de las particiones mensuales de audit_log."""
+    filas = conn.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)",
+        (TABLA,),
+    ).fetchall()
+    particiones = {}
+    for (nombre,) in filas:
+        m = PATRON_PARTICION.match(nombre)
+        if m:
+            particiones[date(int(m.group(1)), int(m.group(2)), 1)] = nombre
+    return particiones
+
+
+def crear_particiones(conn, meses_adelante: int) -> list:
+    """Crea (si faltan) las particiones del mes actual y de los próximos `meses_adelante` meses."""
+    existentes = listar_particiones(conn)
+    creadas = []
+    for i in range(meses_adelante + 1):
+        desde = _sumar_meses(_mes_actual(), i)
+        if desde in existentes:
+            continue
+        hasta = _sumar_meses(desde, 1)
+        nombre = nombre_particion(desde)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF {TABLA} "
+            f"FOR VALUES FROM ('{desde.isoformat()} 00:00:00+00') TO ('{hasta.isoformat()} 00:00:00+00')"
+        )
+        creadas.append(nombre)
+    if creadas:
+        logger.info(f"🗂️ Particiones de auditoría creadas: {', '.join(creadas)}")
+    return creadas
+
+
+def eliminar_particiones_vencidas(conn, retencion_meses: int) -> list:
+    """DETACH + DROP de las particiones anteriores a la ventana de retención (0 = ilimitada)."""
+    if retencion_meses <= 0:
+        return []
+    limite = _sumar_meses(_mes_actual(), -retencion_meses)
+    vencidas = [nombre for mes, nombre in sorted(listar_particiones(conn).items()) if mes < limite]
+    for nombre in vencidas:
+        try:
+            conn.execute(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}")
+            conn.execute(f"DROP TABLE IF EXISTS {nombre}")
+            logger.info(f"🗑️ Partición {nombre} eliminada (retención de auditoría {retencion_meses} meses)")
+        except Exception as e:
+            logger.error(f"🔴 Error eliminando partición {nombre}: {e}")
+    return vencidas
+
+
+def _cursor(ts: datetime, id_: int, desde: datetime, hasta: datetime) -> str:
+    """Último (ts, id) de la página y el rango de la búsqueda, en base64 apto para URL."""
+    datos = json.dumps([ts.isoformat(), id_, desde.isoformat(), hasta.isoformat()])
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+
+def _leer_cursor(cursor: str) -> tuple:
+    """(ts, id, desde, hasta); ValueError si el cursor no es válido."""
+    try:
+        ts, id_, desde, hasta = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(ts), int(id_), datetime.fromisoformat(desde), datetime.fromisoformat(hasta)
+    except Exception as e:
+        raise ValueError(f"cursor inválido: {e}")
+
+
+class AuditStore:
+    """
+    Escritor en lote + búsqueda de audit_log. Un buffer acotado por proceso: si se llena el
+    registro se descarta de la tabla (el archivo de auditoría lo conserva igual) y se cuenta.
+    """
+
+    def __init__(self, habilitado=True, batch_size=200, flush_ms=2000, max_buffer=20000,
+                 meses_adelante=2, retencion_meses=0, intervalo_horas=6.0):
+        self.habilitado = habilitado
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.meses_adelante = meses_adelante
+        self.retencion_meses = retencion_meses
+        self.intervalo_horas = intervalo_horas
+        self.buffer = queue.Queue(maxsize=max_buffer)
+
+        self.encolados = 0
+        self.escritos = 0
+        self.descartados = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.ultimo_flush_ms = None
+
+        self._activo = False
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def registrar(self, message):
+        """Sink de Loguru: encola el registro de auditoría sin bloquear ni loguear."""
+        record = message.record
+        texto = record["message"]
+        direccion, canal, contacto = parsear_mensaje(texto)
+        try:
+            self.buffer.put_nowait((
+                record["time"], str(record["extra"].get("business_id")), direccion, canal, contacto, texto
+            ))
+            self.encolados += 1
+        except queue.Full:
+            self.descartados += 1
+
+    def _tomar_lote(self) -> list:
+        lote = []
+        limite = time.monotonic() + self.flush_ms / 1000
+        while len(lote) < self.batch_size:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.buffer.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _drenar(self) -> list:
+        lote = []
+        while len(lote) < self.batch_size:
+            try:
+                lote.append(self.buffer.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _escribir(self, lote: list):
+        if not lote:
+            return
+        inicio = time.perf_counter()
+        try:
+            with get_pool("analytics").connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        with cur.copy(f"COPY {TABLA} ({', '.join(COLUMNAS)}) FROM STDIN") as copy:
+                            for fila in lote:
+                                copy.write_row(fila)
+            self.escritos += len(lote)
+            self.lotes += 1
+            self.ultimo_flush_ms = round((time.perf_counter() - inicio) * 1000, 2)
+        except Exception as e:
+            self.fallidos += len(lote)
+            logger.error(f"🔴 AuditStore: error escribiendo lote de {len(lote)} registros: {e}")
+
+    def _loop(self):
+        descartados = 0
+        while not self._detener.is_set():
+            self._escribir(self._tomar_lote())
+            if self.descartados != descartados:
+                descartados = self.descartados
+                logger.warning(f"⚠️ AuditStore: buffer lleno, registros descartados: {descartados}")
+
+    def detener(self):
+        if not self._activo:
+            return
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=self.flush_ms / 1000 + 2)
+        while not self.buffer.empty():
+            self._escribir(self._drenar())
+        logger.info(f"🛑 AuditStore detenido: {self.get_stats()}")
+
+    def _asegurar_tabla(self):
+        with get_pool("admin").connection() as conn:
+            with conn.transaction():
+                conn.execute("SELECT pg_advisory_xact_lock(%s)", (ADVISORY_LOCK_ID,))
+                conn.execute(SQL_CREAR)
+                crear_particiones(conn, self.meses_adelante)
+
+    def _mantener_particiones(self):
+        with conexion_dedicada("admin") as conn:
+            if not conn.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,)).fetchone()[0]:
+                return
+            try:
+                crear_particiones(conn, self.meses_adelante)
+                eliminar_particiones_vencidas(conn, self.retencion_meses)
+            finally:
+                conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+    def _loop_mantenimiento(self):
+        while True:
+            time.sleep(self.intervalo_horas * 3600)
+            try:
+                self._mantener_particiones()
+            except Exception as e:
+                logger.error(f"🔴 Error en mantenimiento de particiones de auditoría: {e}")
+
+    def iniciar(self):
+        """Crea la tabla y las particiones, registra el sink en Loguru y arranca los hilos."""
+        if not self.habilitado or self._activo or not get_pool("admin"):
+            return
+        try:
+            self._asegurar_tabla()
+        except Exception as e:
+            logger.error(f"🔴 AuditStore: no se pudo preparar {TABLA}, la auditoría queda solo en archivos: {e}")
+            return
+
+        self._activo = True
+        logger.add(self.registrar, filter=filtro_auditoria, format="{message}")
+        self._hilo = threading.Thread(target=self._loop, name="audit-writer", daemon=True)
+        self._hilo.start()
+        threading.Thread(target=self._loop_mantenimiento, name="audit-partitions", daemon=True).start()
+        logger.info(
+            f"📚 Auditoría en {TABLA}: lotes de {self.batch_size} o {self.flush_ms}ms, "
+            f"retención {self.retencion_meses or 'ilimitada'} meses"
+        )
+
+    def buscar(self, business_id=None, contacto=None, direccion=None, desde=None, hasta=None,
+               texto=None, limite=50, cursor=None) -> dict:
+        """
+        Registros de auditoría del más nuevo al más viejo dentro de [desde, hasta).
+
+        Returns:
+            {"items": [...], "next_cursor": str | None}; next_cursor se pasa como `cursor`
+            para pedir la página siguiente. El cursor lleva el rango de la primera página: sin
+            `hasta` el default (ahora) no se recalcula entre páginas y no se pierden registros
+            en el borde de los 7 días.
+        """
+        if cursor:
+            cursor_ts, cursor_id, desde, hasta = _leer_cursor(cursor)
+        hasta = hasta or datetime.now(timezone.utc)
+        desde = desde or hasta - timedelta(days=7)
+        condiciones = ["ts >= %(desde)s", "ts < %(hasta)s"]
+        params = {"desde": desde, "hasta": hasta, "limite": limite}
+
+        if business_id:
+            condiciones.append("business_id = %(business_id)s")
+            params["business_id"] = business_id
+        if contacto:
+            condiciones.append("contacto = %(contacto)s")
+            params["contacto"] = contacto.lstrip("@")
+        if direccion:
+            condiciones.append("direccion = %(direccion)s")
+            params["direccion"] = direccion
+        if texto:
+            condiciones.append("tsv @@ websearch_to_tsquery('simple', %(texto)s)")
+            params["texto"] = texto
+        if cursor:
+            params["cursor_ts"], params["cursor_id"] = cursor_ts, cursor_id
+            condiciones.append("(ts, id) < (%(cursor_ts)s, %(cursor_id)s)")
+
+        sql = (
+            f"SELECT id, ts, business_id, direccion, canal, contacto, mensaje FROM {TABLA} "
+            f"WHERE {' AND '.join(condiciones)} ORDER BY ts DESC, id DESC LIMIT %(limite)s"
+        )
+        with get_pool("reporting").connection() as conn:
+            filas = conn.execute(sql, params).fetchall()
+
+        items = [
+            {
+                "timestamp": ts.isoformat(),
+                "business_id": negocio,
+                "direction": dir_,
+                "channel": canal,
+                "client_id": cliente,
+                "message": mensaje,
+            }
+            for _, ts, negocio, dir_, canal, cliente, mensaje in filas
+        ]
+        siguiente = _cursor(filas[-1][1], filas[-1][0], desde, hasta) if len(filas) == limite else None
+        return {"items": items, "next_cursor": siguiente}
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self._activo,
+            "enqueued": self.encolados,
+            "written": self.escritos,
+            "dropped": self.descartados,
+            "failed": self.fallidos,
+            "batches": self.lotes,
+            "buffered": self.buffer.qsize(),
+            "last_flush_ms": self.ultimo_flush_ms,
+        }
+
+
+def _crear_audit_store():
+    habilitado = os.getenv("AUDIT_DB_ENABLED", "true").lower() == "true"
+    try:
+        batch_size = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+    except Exception:
+        batch_size = 200
+    try:
+        flush_ms = int(os.getenv("AUDIT_FLUSH_MS", "2000"))
+    except Exception:
+        flush_ms = 2000
+    try:
+        max_buffer = int(os.getenv("AUDIT_BUFFER_MAX", "20000"))
+    except Exception:
+        max_buffer = 20000
+    try:
+        retencion_meses = int(os.getenv("AUDIT_RETENCION_MESES", "0"))
+    except Exception:
+        retencion_meses = 0
+    return AuditStore(
+        habilitado=habilitado, batch_size=batch_size, flush_ms=flush_ms,
+        max_buffer=max_buffer, retencion_meses=retencion_meses,
+    )
+
+
+audit_store = _crear_audit_store()
+# Flush final al apagar el worker
+atexit.register(audit_store.detener)
@@ -0,0 +1,331 @@
+"""
+Cache de checkpoints de threads activos
+=======================================
+
+Cada turno carga el último checkpoint del thread desde Postgres (checkpoint + blobs +
+writes) y lo deserializa, aunque el mensaje anterior haya sido hace segundos en el mismo
+worker. SaverConCache envuelve al PostgresSaver (es un BaseCheckpointSaver, el grafo no
+cambia) y guarda el último CheckpointTuple de cada (thread_id, checkpoint_ns):
+
+- Read-through: get_tuple del último checkpoint consulta primero el LRU en memoria y, si
+  está habilitado, Redis (CHECKPOINT_CACHE_REDIS=true).
+- Write-through: put guarda en el cache el checkpoint recién escrito; put_writes invalida.
+- Multi-worker: antes de usar una entrada se compara su versión (checkpoint_id, cantidad de
+  writes pendientes) con la de Postgres mediante una consulta que solo toca índices de PK.
+  Si otro worker escribió un checkpoint más nuevo, la entrada se descarta y se lee de la DB.
+
+El loop de LangGraph modifica en el lugar el checkpoint que recibe (channel_versions,
+versions_seen): el cache guarda una copia y entrega otra en cada hit, así una corrida que
+falla antes de put() o dos turnos simultáneos del mismo thread no alteran la entrada.
+"""
+
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from loguru import logger
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id
+from ..utils.metrics import metricas, checkpoint_duracion
+
+try:
+    import redis
+    _HAS_REDIS = True
+except Exception:
+    _HAS_REDIS = False
+
+cache_resultados = metricas.counter(
+    "sisagent_checkpoint_cache_total",
+    "Lecturas del último checkpoint: hit (memoria), redis_hit, stale (versión vieja) o miss",
+    ("result",),
+)
+cache_ahorro = metricas.counter(
+    "sisagent_checkpoint_cache_saved_seconds_total",
+    "Tiempo de carga desde Postgres ahorrado por el cache (estimado con la media de los miss)",
+)
+
+SQL_VERSION = """
+SELECT c.checkpoint_id,
+       (SELECT COUNT(*) FROM checkpoint_writes w
+        WHERE w.thread_id = c.thread_id AND w.checkpoint_ns = c.checkpoint_ns
+          AND w.checkpoint_id = c.checkpoint_id) AS writes
+FROM checkpoints c
+WHERE c.thread_id = %s AND c.checkpoint_ns = %s
+ORDER BY c.checkpoint_id DESC
+LIMIT 1
+"""
+
+
+def _version(tupla: CheckpointTuple) -> tuple:
+    return tupla.config["configurable"]["checkpoint_id"], len(tupla.pending_writes or [])
+
+
+class CacheCheckpoints:
+    """LRU en proceso (con TTL) del último CheckpointTuple por thread, con Redis opcional."""
+
+    def __init__(self, max_threads: int = 1000, ttl_seg: float = 900.0, redis_client=None):
+        self.max_threads = max_threads
+        self.ttl_seg = ttl_seg
+        self.redis = redis_client
+        self.lock = threading.Lock()
+        self._entradas = OrderedDict()   # { (thread_id, ns): (tupla, vence) }
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.segundos_miss = 0.0
+        self.segundos_hit = 0.0
+
+    @property
+    def habilitado(self) -> bool:
+        return self.max_threads > 0
+
+    # ------------------------------------------------------------------
+    # Nivel 1: memoria
+    # ------------------------------------------------------------------
+    def obtener(self, clave):
+        with self.lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            tupla, vence = entrada
+            if vence < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return tupla
+
+    def guardar(self, clave, tupla: CheckpointTuple, serde=None):
+        with self.lock:
+            self._entradas[clave] = (tupla, time.monotonic() + self.ttl_seg)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_threads:
+                self._entradas.popitem(last=False)
+        if self.redis and serde:
+            self._guardar_redis(clave, tupla, serde)
+
+    def invalidar(self, thread_id: str, checkpoint_ns: str = None):
+        with self.lock:
+            for clave in [c for c in self._entradas if c[0] == thread_id and checkpoint_ns in (None, c[1])]:
+                del self._entradas[clave]
+        if self.redis:
+            try:
+                if checkpoint_ns is None:
+                    claves = list(self.redis.scan_iter(match=f"{self._prefijo_redis(thread_id)}*"))
+                else:
+                    claves = [self._clave_redis((thread_id, checkpoint_ns))]
+                if claves:
+                    self.redis.delete(*claves)
+            except Exception as e:
+                logger.debug(f"Cache checkpoints: error invalidando en Redis: {e}")
+
+    # ------------------------------------------------------------------
+    # Nivel 2: Redis (opcional)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _prefijo_redis(thread_id: str) -> str:
+        return f"sisagent:ckpt:{thread_id}:"
+
+    def _clave_redis(self, clave) -> str:
+        return f"{self._prefijo_redis(clave[0])}{clave[1]}"
+
+    def _guardar_redis(self, clave, tupla: CheckpointTuple, serde):
+        try:
+            tipo, datos = serde.dumps_typed({
+                "config": tupla.config,
+                "checkpoint": tupla.checkpoint,
+                "metadata": tupla.metadata,
+                "parent_config": tupla.parent_config,
+                "pending_writes": [list(w) for w in (tupla.pending_writes or [])],
+            })
+            self.redis.set(self._clave_redis(clave), tipo.encode() + b"\0" + datos, ex=int(self.ttl_seg))
+        except Exception as e:
+            logger.debug(f"Cache checkpoints: error guardando en Redis: {e}")
+
+    def obtener_redis(self, clave, serde):
+        if not self.redis:
+            return None
+        try:
+            valor = self.redis.get(self._clave_redis(clave))
+            if not valor:
+                return None
+            tipo, datos = valor.split(b"\0", 1)
+            d = serde.loads_typed((tipo.decode(), datos))
+            return CheckpointTuple(
+                config=d["config"],
+                checkpoint=d["checkpoint"],
+                metadata=d["metadata"],
+                parent_config=d["parent_config"],
+                pending_writes=[tuple(w) for w in d["pending_writes"]],
+            )
+        except Exception as e:
+            logger.debug(f"Cache checkpoints: error leyendo de Redis: {e}")
+            return None
+
+    # ------------------------------------------------------------------
+    def registrar_hit(self, segundos: float, nivel: str = "hit"):
+        with self.lock:
+            if nivel == "redis_hit":
+                self.redis_hits += 1
+            else:
+                self.hits += 1
+            self.segundos_hit += segundos
+            media_miss = self.segundos_miss / self.misses if self.misses else 0.0
+        cache_resultados.inc(result=nivel)
+        if media_miss > segundos:
+            cache_ahorro.inc(media_miss - segundos)
+
+    def registrar_miss(self, segundos: float, stale: bool = False):
+        with self.lock:
+            self.misses += 1
+            self.segundos_miss += segundos
+            if stale:
+                self.stale += 1
+        cache_resultados.inc(result="stale" if stale else "miss")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            aciertos = self.hits + self.redis_hits
+            total = aciertos + self.misses
+            media_miss = self.segundos_miss / self.misses if self.misses else None
+            media_hit = self.segundos_hit / aciertos if aciertos else None
+            return {
+                "enabled": self.habilitado,
+                "redis": bool(self.redis),
+                "entries": len(self._entradas),
+                "max_threads": self.max_threads,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio_pct": round(aciertos / total * 100, 2) if total else None,
+                "avg_miss_ms": round(media_miss * 1000, 2) if media_miss is not None else None,
+                "avg_hit_ms": round(media_hit * 1000, 2) if media_hit is not None else None,
+                "saved_s": round(max(0.0, aciertos * (media_miss or 0) - self.segundos_hit), 2),
+            }
+
+
+class SaverConCache(BaseCheckpointSaver):
+    """BaseCheckpointSaver que delega en `saver` (PostgresSaver) y cachea el último checkpoint."""
+
+    def __init__(self, saver, cache: CacheCheckpoints):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.cache = cache
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    def _version_db(self, thread_id: str, checkpoint_ns: str):
+        with self.saver._cursor() as cur:
+            cur.execute(SQL_VERSION, (thread_id, checkpoint_ns))
+            fila = cur.fetchone()
+        return (fila["checkpoint_id"], fila["writes"]) if fila else None
+
+    def get_tuple(self, config):
+        # Solo el último checkpoint se cachea; un checkpoint_id explícito va directo a la DB
+        if get_checkpoint_id(config):
+            return self.saver.get_tuple(config)
+
+        configurable = config["configurable"]
+        clave = (configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+        inicio = time.perf_counter()
+
+        nivel = "hit"
+        tupla = self.cache.obtener(clave)
+        if tupla is None:
+            nivel = "redis_hit"
+            tupla = self.cache.obtener_redis(clave, self.serde)
+
+        stale = False
+        if tupla is not None:
+            if self._version_db(*clave) == _version(tupla):
+                if nivel == "redis_hit":
+                    self.cache.guardar(clave, tupla)
+                tupla = copy.deepcopy(tupla)
+                segundos = time.perf_counter() - inicio
+                checkpoint_duracion.observe(segundos, op="load_cached")
+                self.cache.registrar_hit(segundos, nivel)
+                return tupla
+            stale = True
+            self.cache.invalidar(*clave)
+
+        tupla = self.saver.get_tuple(config)
+        self.cache.registrar_miss(time.perf_counter() - inicio, stale=stale)
+        if tupla is not None:
+            self.cache.guardar(clave, copy.deepcopy(tupla), self.serde)
+        return tupla
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        return self.saver.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        nuevo_config = self.saver.put(config, checkpoint, metadata, new_versions)
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        padre = configurable.get("checkpoint_id")
+        tupla = CheckpointTuple(
+            config=copy.deepcopy(nuevo_config),
+            checkpoint=copy.deepcopy(checkpoint),
+            metadata=copy.deepcopy(metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": padre}}
+                if padre else None
+            ),
+            pending_writes=[],
+        )
+        self.cache.guardar((thread_id, checkpoint_ns), tupla, self.serde)
+        return nuevo_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        self.saver.put_writes(config, writes, task_id, task_path)
+        configurable = config["configurable"]
+        self.cache.invalidar(configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+
+    def delete_thread(self, thread_id):
+        self.cache.invalidar(thread_id)
+        return self.saver.delete_thread(thread_id)
+
+
+def _crear_cache() -> CacheCheckpoints:
+    try:
+        max_threads = int(os.getenv("CHECKPOINT_CACHE_MAX", "1000"))
+    except Exception:
+        max_threads = 1000
+
+    try:
+        ttl_seg = float(os.getenv("CHECKPOINT_CACHE_TTL_SEG", "900"))
+    except Exception:
+        ttl_seg = 900.0
+
+    cliente_redis = None
+    if max_threads > 0 and os.getenv("CHECKPOINT_CACHE_REDIS", "false").lower() == "true":
+        if not _HAS_REDIS:
+            logger.warning("⚠️ CHECKPOINT_CACHE_REDIS=true pero el paquete redis no está instalado; solo cache en memoria")
+        else:
+            try:
+                cliente_redis = redis.Redis(
+                    host=os.getenv("REDIS_HOST", "localhost"),
+                    port=int(os.getenv("REDIS_PORT", "6379")),
+                    db=int(os.getenv("REDIS_DB", "0")),
+                    password=os.getenv("REDIS_PASSWORD") or None,
+                    socket_timeout=0.2,
+                )
+            except Exception as e:
+                logger.error(f"🔴 Cache de checkpoints: no se pudo configurar Redis: {e}")
+
+    return CacheCheckpoints(max_threads=max_threads, ttl_seg=ttl_seg, redis_client=cliente_redis)
+
+
+cache_checkpoints = _crear_cache()
+
+
+def envolver_checkpointer(saver):
+    """SaverConCache sobre `saver`, o el mismo saver si el cache está deshabilitado."""
+    return SaverConCache(saver, cache_checkpoints) if cache_checkpoints.habilitado else saver
@@ -0,0 +1,309 @@
+"""
+Cache de transcripciones y análisis de imágenes por contenido
+=============================================================
+
+Las notas de voz reenviadas y los comprobantes que se mandan dos veces llegan con los
+mismos bytes. El resultado de transcribir_audio, analizar_imagen_con_ai y
+extract_transfer_receipt_data se guarda con una clave derivada del contenido:
+
+    sha256(tipo | proveedor | modelo | sha256(versión del prompt) | sha256(bytes del medio))
+
+Cambiar de proveedor, de modelo o el texto del prompt genera claves nuevas; las viejas
+vencen solas por TTL.
+
+- Nivel 1: LRU en memoria del worker (MEDIA_CACHE_MAX entradas).
+- Nivel 2: Redis compartido entre workers (MEDIA_CACHE_REDIS=true) o, si no, un directorio
+  en disco acotado a MEDIA_CACHE_DISK_MB (se borran los archivos menos usados al pasarse).
+- Cada hit se registra en analytics_events (event_type "cache_hit", tool_name = tipo) con el
+  costo que se habría pagado en cost_avoided.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from loguru import logger
+from ..utils.metrics import metricas
+from .analytics import analytics_writer
+
+try:
+    import redis
+    _HAS_REDIS = True
+except Exception:
+    _HAS_REDIS = False
+
+TIPO_TRANSCRIPCION = "transcription"
+TIPO_IMAGEN = "image_analysis"
+TIPO_COMPROBANTE = "receipt_extraction"
+
+cache_resultados = metricas.counter(
+    "sisagent_media_cache_total",
+    "Lecturas del cache de medios por tipo: hit (memoria), l2_hit (Redis/disco) o miss",
+    ("kind", "result"),
+)
+cache_ahorro_usd = metricas.counter(
+    "sisagent_media_cache_saved_usd_total",
+    "Costo de proveedor evitado por hits del cache de medios (USD)",
+    ("kind",),
+)
+
+
+def _sha256(datos: bytes) -> str:
+    return hashlib.sha256(datos).hexdigest()
+
+
+class CacheMedia:
+    """LRU en memoria con TTL + nivel 2 en Redis o en disco, para resultados por hash de contenido."""
+
+    def __init__(self, max_entradas: int = 500, ttl_seg: float = 7 * 86400.0, redis_client=None,
+                 directorio: Optional[str] = None, max_bytes_disco: int = 0):
+        self.max_entradas = max_entradas
+        self.ttl_seg = ttl_seg
+        self.redis = redis_client
+        self.directorio = directorio if not redis_client else None
+        self.max_bytes_disco = max_bytes_disco
+        self.lock = threading.Lock()
+        self._entradas = OrderedDict()   # { clave: (entrada, vence) }
+        self._bytes_disco = None         # Se calcula al primer guardado en disco
+
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.ahorro_usd = 0.0
+
+    @property
+    def habilitado(self) -> bool:
+        return self.max_entradas > 0
+
+    @staticmethod
+    def clave(tipo: str, datos: bytes, proveedor: str, modelo: str, version: str = "") -> str:
+        prefijo = f"{tipo}|{proveedor}|{modelo}|{_sha256(version.encode())}|"
+        return _sha256(prefijo.encode() + _sha256(datos).encode())
+
+    def obtener(self, tipo: str, clave: str) -> Optional[dict]:
+        """{"valor", "costo", "modelo"} guardado para la clave, o None."""
+        if not self.habilitado:
+            return None
+        ahora = time.time()
+        with self.lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada[1] >= ahora:
+                    self._entradas.move_to_end(clave)
+                    self.hits += 1
+                    cache_resultados.inc(kind=tipo, result="hit")
+                    return entrada[0]
+                del self._entradas[clave]
+
+        entrada = self._obtener_redis(clave) if self.redis else self._obtener_disco(clave)
+        if entrada is not None and entrada.get("vence", 0) >= ahora:
+            self._guardar_memoria(clave, entrada)
+            with self.lock:
+                self.l2_hits += 1
+            cache_resultados.inc(kind=tipo, result="l2_hit")
+            return entrada
+
+        with self.lock:
+            self.misses += 1
+        cache_resultados.inc(kind=tipo, result="miss")
+        return None
+
+    def guardar(self, clave: str, valor, costo: float, modelo: str):
+        if not self.habilitado:
+            return
+        entrada = {"valor": valor, "costo": costo, "modelo": modelo, "vence": time.time() + self.ttl_seg}
+        self._guardar_memoria(clave, entrada)
+        if self.redis:
+            self._guardar_redis(clave, entrada)
+        elif self.directorio:
+            self._guardar_disco(clave, entrada)
+
+    def _guardar_memoria(self, clave: str, entrada: dict):
+        with self.lock:
+            self._entradas[clave] = (entrada, entrada["vence"])
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Nivel 2: Redis
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _clave_redis(clave: str) -> str:
+        return f"sisagent:media:{clave}"
+
+    def _obtener_redis(self, clave: str) -> Optional[dict]:
+        try:
+            valor = self.redis.get(self._clave_redis(clave))
+            return json.loads(valor) if valor else None
+        except Exception as e:
+            logger.debug(f"Cache de medios: error leyendo de Redis: {e}")
+            return None
+
+    def _guardar_redis(self, clave: str, entrada: dict):
+        try:
+            self.redis.set(self._clave_redis(clave), json.dumps(entrada, ensure_ascii=False), ex=int(self.ttl_seg))
+        except Exception as e:
+            logger.debug(f"Cache de medios: error guardando en Redis: {e}")
+
+    # ------------------------------------------------------------------
+    # Nivel 2: disco
+    # ------------------------------------------------------------------
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave[:2], f"{clave}.json")
+
+    def _obtener_disco(self, clave: str) -> Optional[dict]:
+        if not self.directorio:
+            return None
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                entrada = json.load(f)
+            os.utime(ruta)  # El mtime marca el último uso para el recorte
+            return entrada
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug(f"Cache de medios: error leyendo {ruta}: {e}")
+            return None
+
+    def _archivos_disco(self) -> list:
+        """[(mtime, bytes, ruta)] de todas las entradas en disco."""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    st = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                archivos.append((st.st_mtime, st.st_size, ruta))
+        return archivos
+
+    def _guardar_disco(self, clave: str, entrada: dict):
+        ruta = self._ruta(clave)
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            datos = json.dumps(entrada, ensure_ascii=False).encode("utf-8")
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, "wb") as f:
+                f.write(datos)
+            os.replace(temporal, ruta)
+        except Exception as e:
+            logger.debug(f"Cache de medios: error guardando {ruta}: {e}")
+            return
+
+        if not self.max_bytes_disco:
+            return
+        with self.lock:
+            if self._bytes_disco is None:
+                self._bytes_disco = sum(b for _, b, _ in self._archivos_disco())
+            else:
+                self._bytes_disco += len(datos)
+            if self._bytes_disco > self.max_bytes_disco:
+                self._recortar_disco()
+
+    def _recortar_disco(self):
+        """Borra las entradas menos usadas hasta quedar en el 80% del límite (con self.lock tomado)."""
+        archivos = sorted(self._archivos_disco())
+        total = sum(b for _, b, _ in archivos)
+        objetivo = self.max_bytes_disco * 0.8
+        borrados = 0
+        for _, tamano, ruta in archivos:
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+                total -= tamano
+                borrados += 1
+            except FileNotFoundError:
+                pass
+        self._bytes_disco = total
+        logger.info(f"🧹 Cache de medios: {borrados} entradas borradas del disco ({total / 1048576:.1f} MB)")
+
+    # ------------------------------------------------------------------
+    def registrar_hit(self, tipo: str, thread_id: str, entrada: dict, latency_ms: int):
+        """Suma el ahorro y encola el evento cache_hit en analytics_events."""
+        costo = float(entrada.get("costo") or 0.0)
+        with self.lock:
+            self.ahorro_usd += costo
+        if costo:
+            cache_ahorro_usd.inc(costo, kind=tipo)
+        thread_id = str(thread_id)
+        business_id = thread_id.split(":")[0] if ":" in thread_id else ""
+        analytics_writer.encolar((
+            datetime.now(timezone.utc),
+            business_id,
+            thread_id,
+            "cache_hit",
+            0,
+            0,
+            entrada.get("modelo") or "",
+            0.0,
+            latency_ms,
+            tipo,
+            None,
+            costo,
+        ))
+        logger.info(f"♻️ [CACHE] {tipo} servido desde el cache para {thread_id} (ahorro ${costo:.6f} USD)")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            aciertos = self.hits + self.l2_hits
+            total = aciertos + self.misses
+            return {
+                "enabled": self.habilitado,
+                "tier2": "redis" if self.redis else ("disk" if self.directorio else None),
+                "entries": len(self._entradas),
+                "max_entries": self.max_entradas,
+                "disk_mb": round(self._bytes_disco / 1048576, 2) if self._bytes_disco is not None else None,
+                "hits": self.hits,
+                "l2_hits": self.l2_hits,
+                "misses": self.misses,
+                "hit_ratio_pct": round(aciertos / total * 100, 2) if total else None,
+                "saved_usd": round(self.ahorro_usd, 6),
+            }
+
+
+def _crear_cache() -> CacheMedia:
+    try:
+        max_entradas = int(os.getenv("MEDIA_CACHE_MAX", "500"))
+    except Exception:
+        max_entradas = 500
+
+    try:
+        ttl_seg = float(os.getenv("MEDIA_CACHE_TTL_HORAS", "168")) * 3600
+    except Exception:
+        ttl_seg = 168 * 3600.0
+
+    try:
+        max_bytes_disco = int(float(os.getenv("MEDIA_CACHE_DISK_MB", "200")) * 1048576)
+    except Exception:
+        max_bytes_disco = 200 * 1048576
+
+    cliente_redis = None
+    if max_entradas > 0 and os.getenv("MEDIA_CACHE_REDIS", "false").lower() == "true":
+        if not _HAS_REDIS:
+            logger.warning("⚠️ MEDIA_CACHE_REDIS=true pero el paquete redis no está instalado; se usa el cache en disco")
+        else:
+            try:
+                cliente_redis = redis.Redis(
+                    host=os.getenv("REDIS_HOST", "localhost"),
+                    port=int(os.getenv("REDIS_PORT", "6379")),
+                    db=int(os.getenv("REDIS_DB", "0")),
+                    password=os.getenv("REDIS_PASSWORD") or None,
+                    socket_timeout=0.2,
+                )
+            except Exception as e:
+                logger.error(f"🔴 Cache de medios: no se pudo configurar Redis: {e}")
+
+    directorio = os.getenv("MEDIA_CACHE_DIR", "cache_media") if max_bytes_disco > 0 else None
+    return CacheMedia(max_entradas=max_entradas, ttl_seg=ttl_seg, redis_client=cliente_redis,
+                      directorio=directorio, max_bytes_disco=max_bytes_disco)
+
+
+cache_media = _crear_cache()
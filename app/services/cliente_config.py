@@ -37,6 +37,15 @@ class ClienteConfig:
         self.mensaje_hitl = data.get("mensaje_HITL")
         self.tools_habilitadas = data.get("tools_habilitadas", [])
         self.thread_id_router = data.get("thread_id_router", {"default": {"route": "lang_graph", "priority": 1}})
+        # Durabilidad de checkpoints: "sync" | "async" | "exit" (None = CHECKPOINT_DURABILITY)
+        self.durabilidad_checkpoint = data.get("durabilidad_checkpoint")
+
+        # Presupuesto opcional: {"diario_usd", "mensual_usd", "degradar_desde_pct", "mensaje_agotado", "max_usd_nota_voz"}
+        self.presupuesto = data.get("presupuesto") or {}
+        mensaje_agotado = self.presupuesto.get("mensaje_agotado") or (
+            "En este momento no podemos responder de forma automática. Un asesor te contactará a la brevedad."
+        )
+        self.mensaje_presupuesto_agotado = " ".join(mensaje_agotado) if isinstance(mensaje_agotado, list) else mensaje_agotado
 
     def es_horario_laboral(self) -> tuple[bool, str]:
         if not self.fuera_de_servicio.activo:
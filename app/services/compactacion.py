@@ -0,0 +1,227 @@
+"""
+Compactación de checkpoints de LangGraph
+========================================
+
+PostgresSaver guarda un checkpoint por superstep (chatbot, tools, chatbot...) y nunca borra
+los anteriores. La compactación conserva los últimos CHECKPOINT_KEEP_LAST checkpoints de
+cada (thread_id, checkpoint_ns) y borra:
+
+- checkpoints más viejos que esos N;
+- checkpoint_writes de checkpoints anteriores al más viejo conservado;
+- checkpoint_blobs con una versión menor a la mínima que referencia algún checkpoint
+  conservado para ese canal.
+
+Los checkpoint_id (uuid6) y las versiones de canal de LangGraph crecen de forma monótona,
+así que lo que escribe una conversación en curso siempre queda por encima del corte: la
+compactación puede correr con tráfico sin coordinar con el checkpointer.
+
+Se recorre la tabla por thread_id (loose index scan sobre la PK) y cada lote de threads es
+una transacción propia. El progreso se publica en /metrics y en los logs.
+"""
+
+import os
+import time
+import threading
+from loguru import logger
+from app.db import get_pool, conexion_dedicada
+from ..utils.metrics import metricas
+
+ADVISORY_LOCK_ID = 72026036
+
+compactacion_filas = metricas.counter(
+    "sisagent_checkpoint_compaction_rows_total",
+    "Filas eliminadas por la compactación de checkpoints, por tabla",
+    ("table",),
+)
+compactacion_bytes = metricas.counter(
+    "sisagent_checkpoint_compaction_bytes_total",
+    "Bytes de filas eliminadas por la compactación (reutilizables tras VACUUM), por tabla",
+    ("table",),
+)
+compactacion_threads = metricas.counter(
+    "sisagent_checkpoint_compaction_threads_total",
+    "Threads recorridos (scanned) y compactados (compacted)",
+    ("result",),
+)
+
+# Siguientes thread_id distintos a partir de un cursor, sin leer todas las filas de cada thread
+SQL_SIGUIENTES_THREADS = """
+WITH RECURSIVE t AS (
+    (SELECT thread_id FROM checkpoints WHERE thread_id > %(desde)s ORDER BY thread_id LIMIT 1)
+    UNION ALL
+    SELECT (SELECT c.thread_id FROM checkpoints c WHERE c.thread_id > t.thread_id ORDER BY c.thread_id LIMIT 1)
+    FROM t WHERE t.thread_id IS NOT NULL
+)
+SELECT thread_id FROM t WHERE thread_id IS NOT NULL LIMIT %(limite)s
+"""
+
+SQL_BORRAR_CHECKPOINTS = """
+WITH ranking AS (
+    SELECT thread_id, checkpoint_ns, checkpoint_id,
+           ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+    FROM checkpoints
+    WHERE thread_id = ANY(%(threads)s)
+), borrados AS (
+    DELETE FROM checkpoints c
+    USING ranking r
+    WHERE c.thread_id = r.thread_id AND c.checkpoint_ns = r.checkpoint_ns
+      AND c.checkpoint_id = r.checkpoint_id AND r.rn > %(conservar)s
+    RETURNING c.thread_id, pg_column_size(c.*) AS bytes
+)
+SELECT COUNT(*), COALESCE(SUM(bytes), 0), COUNT(DISTINCT thread_id) FROM borrados
+"""
+
+SQL_BORRAR_WRITES = """
+WITH corte AS (
+    SELECT thread_id, checkpoint_ns, MIN(checkpoint_id) AS checkpoint_id
+    FROM checkpoints
+    WHERE thread_id = ANY(%(threads)s)
+    GROUP BY thread_id, checkpoint_ns
+), borrados AS (
+    DELETE FROM checkpoint_writes w
+    USING corte k
+    WHERE w.thread_id = k.thread_id AND w.checkpoint_ns = k.checkpoint_ns
+      AND w.checkpoint_id < k.checkpoint_id
+    RETURNING pg_column_size(w.*) AS bytes
+)
+SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM borrados
+"""
+
+SQL_BORRAR_BLOBS = """
+WITH corte AS (
+    SELECT c.thread_id, c.checkpoint_ns, v.key AS channel, MIN(v.value) AS version
+    FROM checkpoints c, jsonb_each_text(c.checkpoint -> 'channel_versions') v
+    WHERE c.thread_id = ANY(%(threads)s)
+    GROUP BY c.thread_id, c.checkpoint_ns, v.key
+), borrados AS (
+    DELETE FROM checkpoint_blobs b
+    USING corte k
+    WHERE b.thread_id = k.thread_id AND b.checkpoint_ns = k.checkpoint_ns
+      AND b.channel = k.channel AND b.version < k.version
+    RETURNING pg_column_size(b.*) AS bytes
+)
+SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM borrados
+"""
+
+
+def compactar_lote(conn, thread_ids: list, conservar: int) -> dict:
+    """Compacta un lote de threads en una transacción. Retorna filas y bytes por tabla."""
+    resultado = {}
+    params = {"threads": thread_ids, "conservar": conservar}
+    with conn.transaction():
+        filas, bytes_, compactados = conn.execute(SQL_BORRAR_CHECKPOINTS, params).fetchone()
+        resultado["checkpoints"] = (filas, int(bytes_))
+        resultado["threads_compacted"] = compactados
+        for tabla, sql in (("checkpoint_writes", SQL_BORRAR_WRITES), ("checkpoint_blobs", SQL_BORRAR_BLOBS)):
+            filas, bytes_ = conn.execute(sql, params).fetchone()
+            resultado[tabla] = (filas, int(bytes_))
+    return resultado
+
+
+class CompactadorCheckpoints:
+    """Recorre todos los threads en lotes; una sola corrida a la vez entre workers (advisory lock)."""
+
+    def __init__(self, conservar: int = 5, threads_por_lote: int = 200, pausa_entre_lotes_seg: float = 0.05):
+        self.conservar = conservar
+        self.threads_por_lote = threads_por_lote
+        self.pausa_entre_lotes_seg = pausa_entre_lotes_seg
+        self.en_curso = False
+        self.ultima_corrida = None
+
+    def ejecutar(self) -> dict:
+        """Una corrida completa. Retorna el resumen (o skipped=True si otro worker está compactando)."""
+        resumen = {
+            "skipped": False, "threads_scanned": 0, "threads_compacted": 0, "batches": 0,
+            "rows": {"checkpoints": 0, "checkpoint_writes": 0, "checkpoint_blobs": 0},
+            "bytes": {"checkpoints": 0, "checkpoint_writes": 0, "checkpoint_blobs": 0},
+        }
+        if not get_pool("admin"):
+            return resumen
+
+        inicio = time.perf_counter()
+        # Conexión propia: el lock y las pausas entre lotes no ocupan el pool admin
+        with conexion_dedicada("admin") as conn:
+            if not conn.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,)).fetchone()[0]:
+                resumen["skipped"] = True
+                return resumen
+            self.en_curso = True
+            try:
+                cursor = ""
+                while True:
+                    thread_ids = [r[0] for r in conn.execute(
+                        SQL_SIGUIENTES_THREADS, {"desde": cursor, "limite": self.threads_por_lote}
+                    ).fetchall()]
+                    if not thread_ids:
+                        break
+                    cursor = thread_ids[-1]
+
+                    lote = compactar_lote(conn, thread_ids, self.conservar)
+                    resumen["batches"] += 1
+                    resumen["threads_scanned"] += len(thread_ids)
+                    resumen["threads_compacted"] += lote["threads_compacted"]
+                    compactacion_threads.inc(len(thread_ids), result="scanned")
+                    compactacion_threads.inc(lote["threads_compacted"], result="compacted")
+                    for tabla in resumen["rows"]:
+                        filas, bytes_ = lote[tabla]
+                        resumen["rows"][tabla] += filas
+                        resumen["bytes"][tabla] += bytes_
+                        compactacion_filas.inc(filas, table=tabla)
+                        compactacion_bytes.inc(bytes_, table=tabla)
+                    logger.debug(f"🗜️ Compactación lote {resumen['batches']}: hasta {cursor} ({resumen['threads_scanned']} threads)")
+
+                    if len(thread_ids) < self.threads_por_lote:
+                        break
+                    time.sleep(self.pausa_entre_lotes_seg)
+            finally:
+                self.en_curso = False
+                conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+        resumen["duration_s"] = round(time.perf_counter() - inicio, 1)
+        resumen["finished_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.ultima_corrida = resumen
+        logger.info(
+            f"🗜️ Compactación de checkpoints: {resumen['threads_compacted']}/{resumen['threads_scanned']} threads, "
+            f"{sum(resumen['rows'].values())} filas y {sum(resumen['bytes'].values()) / 1_048_576:.1f} MB "
+            f"liberados en {resumen['duration_s']}s"
+        )
+        return resumen
+
+    def iniciar(self, intervalo_horas: float):
+        """Corrida periódica en un hilo demonio (intervalo_horas <= 0: solo manual)."""
+        if intervalo_horas <= 0:
+            return
+
+        def _loop():
+            while True:
+                time.sleep(intervalo_horas * 3600)
+                try:
+                    self.ejecutar()
+                except Exception as e:
+                    logger.error(f"🔴 Error en la compactación de checkpoints: {e}")
+
+        threading.Thread(target=_loop, name="checkpoint-compaction", daemon=True).start()
+        logger.info(f"🗜️ Compactación de checkpoints cada {intervalo_horas}h (conserva {self.conservar} por thread)")
+
+
+def _crear_compactador() -> CompactadorCheckpoints:
+    try:
+        conservar = max(1, int(os.getenv("CHECKPOINT_KEEP_LAST", "5")))
+    except Exception:
+        conservar = 5
+
+    try:
+        threads_por_lote = int(os.getenv("CHECKPOINT_COMPACT_BATCH", "200"))
+    except Exception:
+        threads_por_lote = 200
+
+    return CompactadorCheckpoints(conservar=conservar, threads_por_lote=threads_por_lote)
+
+
+def intervalo_compactacion_horas() -> float:
+    try:
+        return float(os.getenv("CHECKPOINT_COMPACT_HORAS", "24"))
+    except Exception:
+        return 24.0
+
+
+compactador_checkpoints = _crear_compactador()
@@ -0,0 +1,381 @@
+"""
+Configuración de negocios en Postgres con invalidación por LISTEN/NOTIFY
+========================================================================
+
+- tenant_config: una fila por negocio (config JSONB). Un trigger asigna a cada escritura una
+  versión de una secuencia global y avisa por NOTIFY en el canal tenant_config con
+  {business_id, version, op}. Cualquier escritura (API, psql) avisa a todos los workers.
+- Cada worker guarda un snapshot en memoria (dict inmutable, se reemplaza entero): las
+  lecturas de get_app_configs() no tocan el filesystem ni la DB.
+- Un hilo por worker escucha el canal con una conexión propia (fuera del pool; con PgBouncer
+  usa DB_DIRECT_URI) y recarga solo el negocio que cambió. Cada CONFIG_RESYNC_SEG compara la
+  versión máxima y la cantidad de filas para detectar avisos perdidos (p. ej. durante una
+  reconexión) y recarga todo si difieren.
+- Si la tabla está vacía al arrancar se importa config_negocios.json (una sola vez, con
+  advisory lock). Desde entonces el archivo no se lee.
+- Si la DB no responde al arrancar el worker lee config_negocios.json mientras el hilo de
+  escucha reintenta cada 5s; al conectar crea/carga la tabla y pasa a usarla. Mientras tanto
+  las escrituras fallan con ConfigNoDisponible (503 en la API).
+- Escrituras: una transacción por negocio (SELECT ... FOR UPDATE + UPDATE de esa fila), con
+  control optimista opcional por versión (ETag / If-Match en la API). El mismo trigger
+  registra cada cambio en tenant_config_changelog (config anterior y nueva, autor) para
+  auditar y volver atrás.
+"""
+
+import os
+import json
+import time
+import threading
+from psycopg.types.json import Jsonb
+from loguru import logger
+from app import db
+
+ADVISORY_LOCK_ID = 72026042
+CANAL = "tenant_config"
+
+RUTA_JSON = os.path.join(os.path.dirname(__file__), 'config_negocios.json')
+
+SQL_CREAR_TABLA = """
+CREATE SEQUENCE IF NOT EXISTS tenant_config_version_seq;
+CREATE TABLE IF NOT EXISTS tenant_config (
+    business_id VARCHAR(50) PRIMARY KEY,
+    config JSONB NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('tenant_config_version_seq'),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_by VARCHAR(100)
+);
+
+CREATE OR REPLACE FUNCTION tenant_config_versionar() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('tenant_config_version_seq');
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE IF NOT EXISTS tenant_config_changelog (
+    id BIGSERIAL PRIMARY KEY,
+    business_id VARCHAR(50) NOT NULL,
+    version BIGINT NOT NULL,
+    op VARCHAR(6) NOT NULL,
+    config JSONB,
+    config_anterior JSONB,
+    changed_by VARCHAR(100),
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_tenant_config_changelog_business
+    ON tenant_config_changelog (business_id, version DESC);
+
+-- Registra el cambio en el changelog y avisa a los workers (se envía al hacer commit)
+CREATE OR REPLACE FUNCTION tenant_config_avisar() RETURNS trigger AS $$
+DECLARE
+    fila tenant_config%ROWTYPE;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        fila := OLD;
+    ELSE
+        fila := NEW;
+    END IF;
+    INSERT INTO tenant_config_changelog (business_id, version, op, config, config_anterior, changed_by)
+    VALUES (fila.business_id, fila.version, TG_OP,
+            CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE NEW.config END,
+            CASE WHEN TG_OP = 'INSERT' THEN NULL ELSE OLD.config END,
+            COALESCE(NULLIF(current_setting('sisagent.autor', true), ''), fila.updated_by, current_user));
+    PERFORM pg_notify('tenant_config', json_build_object(
+        'business_id', fila.business_id, 'version', fila.version, 'op', TG_OP)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tenant_config_versionar ON tenant_config;
+CREATE TRIGGER tenant_config_versionar BEFORE UPDATE ON tenant_config
+    FOR EACH ROW EXECUTE FUNCTION tenant_config_versionar();
+DROP TRIGGER IF EXISTS tenant_config_avisar ON tenant_config;
+CREATE TRIGGER tenant_config_avisar AFTER INSERT OR UPDATE OR DELETE ON tenant_config
+    FOR EACH ROW EXECUTE FUNCTION tenant_config_avisar();
+"""
+
+SQL_GUARDAR = """
+INSERT INTO tenant_config (business_id, config, updated_by) VALUES (%s, %s, %s)
+ON CONFLICT (business_id) DO UPDATE SET config = EXCLUDED.config, updated_by = EXCLUDED.updated_by
+RETURNING version
+"""
+
+SQL_HISTORIAL = """
+SELECT version, op, changed_by, changed_at,
+       ARRAY(
+           SELECT k FROM (
+               SELECT key AS k FROM jsonb_each(COALESCE(config, '{}'::jsonb))
+               UNION SELECT key FROM jsonb_each(COALESCE(config_anterior, '{}'::jsonb))
+           ) claves
+           WHERE config -> k IS DISTINCT FROM config_anterior -> k
+           ORDER BY k
+       ) AS changed_keys
+FROM tenant_config_changelog
+WHERE business_id = %s
+ORDER BY version DESC
+LIMIT %s
+"""
+
+
+class ConfigNoDisponible(Exception):
+    """tenant_config todavía no está disponible en este worker (la DB no respondió al arrancar)."""
+
+
+class ConflictoVersion(Exception):
+    """La versión esperada (If-Match) no es la actual. actual = 0 si el negocio no existe."""
+
+    def __init__(self, business_id: str, actual: int):
+        super().__init__(f"Conflicto de versión en {business_id}: versión actual {actual}")
+        self.business_id = business_id
+        self.actual = actual
+
+
+class ConfigStore:
+    """Snapshot local de tenant_config, actualizado por NOTIFY."""
+
+    def __init__(self, resync_seg: float = 60.0):
+        self.resync_seg = resync_seg
+        self.activo = False
+        self.snapshot = {}
+        self._versiones = {}
+        self._lock = threading.Lock()
+        self.ultimo_aviso = None
+
+    # --- Lectura -------------------------------------------------------------------------
+
+    def _reemplazar(self, configs: dict, versiones: dict):
+        with self._lock:
+            self.snapshot = configs
+            self._versiones = versiones
+
+    def _aplicar(self, business_id: str, config, version: int):
+        """
+        Aplica un cambio si es más nuevo que lo que tenemos. config None = borrado, que llega
+        con la versión de la fila borrada: se aplica si no tenemos una versión posterior.
+        """
+        with self._lock:
+            actual = self._versiones.get(business_id, 0)
+            if actual > version or (actual == version and config is not None):
+                return False
+            snapshot = dict(self.snapshot)
+            versiones = dict(self._versiones)
+            if config is None:
+                snapshot.pop(business_id, None)
+            else:
+                snapshot[business_id] = config
+            # El borrado también guarda su versión para descartar avisos anteriores
+            versiones[business_id] = version
+            self.snapshot, self._versiones = snapshot, versiones
+            return True
+
+    def recargar(self, conn=None):
+        """Carga todas las filas y reemplaza el snapshot."""
+        def _leer(c):
+            return c.execute("SELECT business_id, config, version FROM tenant_config").fetchall()
+
+        if conn is None:
+            with db.get_pool("admin").connection() as c:
+                filas = _leer(c)
+        else:
+            filas = _leer(conn)
+        self._reemplazar({b: cfg for b, cfg, _ in filas}, {b: v for b, _, v in filas})
+        logger.info(f"✅ Configuración recargada desde tenant_config: {len(filas)} negocios.")
+
+    def _recargar_negocio(self, business_id: str, version: int, op: str):
+        if op == "DELETE":
+            self._aplicar(business_id, None, version)
+            return
+        with db.get_pool("admin").connection() as conn:
+            fila = conn.execute(
+                "SELECT config, version FROM tenant_config WHERE business_id = %s", (business_id,)
+            ).fetchone()
+        if fila:
+            self._aplicar(business_id, fila[0], fila[1])
+
+    def version(self, business_id: str) -> int:
+        return self._versiones.get(business_id, 0)
+
+    # --- Escritura -----------------------------------------------------------------------
+
+    def actualizar(self, business_id: str, modificar, autor: str = None, version_esperada: int = None) -> tuple:
+        """
+        Lee la fila con FOR UPDATE, calcula `modificar(config_actual o None)` (None = borrar) y
+        la escribe en la misma transacción: solo toca la fila de ese negocio y dos escrituras
+        concurrentes no se pisan.
+
+        version_esperada: None = sin control; 0 = el negocio no debe existir; N = la versión
+        actual debe ser N (If-Match). Si no coincide lanza ConflictoVersion.
+
+        Returns:
+            (config nueva o None, versión)
+        """
+        if not self.activo:
+            raise ConfigNoDisponible("Configuración en Postgres no disponible todavía, reintentar en unos segundos")
+        with db.get_pool("admin").connection() as conn:
+            with conn.transaction():
+                # Autor para el changelog (lo lee el trigger; también en DELETE)
+                conn.execute("SELECT set_config('sisagent.autor', %s, true)", (autor or "",))
+                fila = conn.execute(
+                    "SELECT config, version FROM tenant_config WHERE business_id = %s FOR UPDATE", (business_id,)
+                ).fetchone()
+                actual, version_actual = fila if fila else (None, 0)
+                if version_esperada is not None and version_esperada != version_actual:
+                    raise ConflictoVersion(business_id, version_actual)
+
+                nuevo = modificar(actual)
+                if nuevo is None:
+                    if fila is None:
+                        return None, 0
+                    version = conn.execute(
+                        "DELETE FROM tenant_config WHERE business_id = %s RETURNING version", (business_id,)
+                    ).fetchone()[0]
+                elif fila is None:
+                    insertada = conn.execute(
+                        "INSERT INTO tenant_config (business_id, config, updated_by) VALUES (%s, %s, %s) "
+                        "ON CONFLICT (business_id) DO NOTHING RETURNING version",
+                        (business_id, Jsonb(nuevo), autor),
+                    ).fetchone()
+                    if not insertada:
+                        # Otro request lo creó entre el SELECT y el INSERT
+                        raise ConflictoVersion(business_id, -1)
+                    version = insertada[0]
+                else:
+                    version = conn.execute(
+                        "UPDATE tenant_config SET config = %s, updated_by = %s WHERE business_id = %s RETURNING version",
+                        (Jsonb(nuevo), autor, business_id),
+                    ).fetchone()[0]
+
+        # Este worker ve su propia escritura sin esperar el NOTIFY
+        self._aplicar(business_id, nuevo, version)
+        if nuevo is None:
+            logger.warning(f"🗑️ Configuración de {business_id} eliminada (versión {version})")
+        else:
+            logger.info(f"💾 Configuración de {business_id} guardada (versión {version})")
+        return nuevo, version
+
+    def guardar(self, business_id: str, config: dict, autor: str = None, version_esperada: int = None) -> int:
+        """Crea o reemplaza la configuración de un negocio. Retorna la nueva versión."""
+        return self.actualizar(business_id, lambda _: config, autor, version_esperada)[1]
+
+    def eliminar(self, business_id: str, autor: str = None, version_esperada: int = None) -> bool:
+        return self.actualizar(business_id, lambda _: None, autor, version_esperada)[1] > 0
+
+    def historial(self, business_id: str, limite: int = 20) -> list:
+        """Últimos cambios del negocio (versión, operación, autor, claves modificadas)."""
+        if not self.activo:
+            raise ConfigNoDisponible("Configuración en Postgres no disponible todavía, reintentar en unos segundos")
+        with db.get_pool("admin").connection() as conn:
+            filas = conn.execute(SQL_HISTORIAL, (business_id, limite)).fetchall()
+        return [
+            {"version": v, "op": op, "changed_by": autor, "changed_at": fecha.isoformat(), "changed_keys": claves}
+            for v, op, autor, fecha, claves in filas
+        ]
+
+    def restaurar(self, business_id: str, version: int, autor: str = None, version_esperada: int = None) -> tuple:
+        """Vuelve la configuración al estado que dejó el cambio `version` (también recrea un negocio borrado)."""
+        if not self.activo:
+            raise ConfigNoDisponible("Configuración en Postgres no disponible todavía, reintentar en unos segundos")
+        with db.get_pool("admin").connection() as conn:
+            fila = conn.execute(
+                "SELECT config FROM tenant_config_changelog WHERE business_id = %s AND version = %s AND config IS NOT NULL",
+                (business_id, version),
+            ).fetchone()
+        if not fila:
+            raise KeyError(f"No hay una versión {version} restaurable de {business_id}")
+        return self.actualizar(business_id, lambda _: fila[0], f"rollback:v{version}:{autor or ''}"[:100], version_esperada)
+
+    # --- Arranque y escucha --------------------------------------------------------------
+
+    def _asegurar_tabla(self, conn):
+        conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        try:
+            conn.execute(SQL_CREAR_TABLA)
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM tenant_config)").fetchone()[0] or not os.path.exists(RUTA_JSON):
+                return
+            with open(RUTA_JSON, 'r', encoding='utf-8') as f:
+                configs = json.load(f)
+            with conn.transaction():
+                for business_id, config in configs.items():
+                    conn.execute(SQL_GUARDAR, (business_id, Jsonb(config), "import:config_negocios.json"))
+            logger.info(f"📥 config_negocios.json importado a tenant_config: {len(configs)} negocios")
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+    def _verificar(self, conn):
+        """Recarga todo si la versión máxima o la cantidad de negocios no coinciden con el snapshot."""
+        maxima, cantidad = conn.execute("SELECT COALESCE(MAX(version), 0), COUNT(*) FROM tenant_config").fetchone()
+        with self._lock:
+            vivos = [v for b, v in self._versiones.items() if b in self.snapshot]
+        if cantidad != len(self.snapshot) or maxima != max(vivos, default=0):
+            logger.warning("⚠️ tenant_config cambió sin aviso recibido: recargando")
+            self.recargar(conn)
+
+    def _escuchar(self):
+        while True:
+            try:
+                with db.conexion_dedicada("admin") as conn:
+                    if not self.activo:
+                        # La DB no respondía al arrancar: se inicializa recién ahora
+                        self._asegurar_tabla(conn)
+                    conn.execute(f"LISTEN {CANAL}")
+                    # Lo que cambió mientras no escuchábamos
+                    self.recargar(conn)
+                    if not self.activo:
+                        self.activo = True
+                        logger.success("✅ tenant_config disponible: se deja de usar config_negocios.json")
+                    while True:
+                        for aviso in conn.notifies(timeout=self.resync_seg):
+                            try:
+                                datos = json.loads(aviso.payload)
+                                self._recargar_negocio(datos["business_id"], int(datos["version"]), datos.get("op"))
+                                self.ultimo_aviso = time.strftime("%Y-%m-%d %H:%M:%S")
+                                logger.debug(f"🔔 Configuración de {datos['business_id']} actualizada ({datos.get('op')} v{datos['version']})")
+                            except Exception as e:
+                                logger.error(f"🔴 Aviso de tenant_config inválido ({aviso.payload}): {e}")
+                        self._verificar(conn)
+            except Exception as e:
+                logger.error(f"🔴 Escucha de tenant_config interrumpida: {e}. Reintentando en 5s")
+                time.sleep(5)
+
+    def iniciar(self) -> bool:
+        """Crea la tabla (importando el JSON si está vacía), carga el snapshot y arranca la escucha."""
+        pool = db.get_pool("admin")
+        if not pool:
+            return False
+        try:
+            with pool.connection() as conn:
+                self._asegurar_tabla(conn)
+                self.recargar(conn)
+        except Exception as e:
+            # El hilo de escucha reintenta la conexión e inicializa la tabla cuando la DB responda
+            logger.error(f"🔴 No se pudo iniciar tenant_config ({e}): se usa config_negocios.json hasta que la DB responda")
+            self._arrancar_escucha()
+            return False
+
+        self.activo = True
+        self._arrancar_escucha()
+        return True
+
+    def _arrancar_escucha(self):
+        threading.Thread(target=self._escuchar, name="tenant-config-listener", daemon=True).start()
+        logger.info(f"🔔 Escuchando cambios de configuración (canal {CANAL}, verificación cada {self.resync_seg}s)")
+
+    def get_stats(self) -> dict:
+        return {
+            "active": self.activo,
+            "businesses": len(self.snapshot),
+            "max_version": max(self._versiones.values(), default=0),
+            "last_notification": self.ultimo_aviso,
+        }
+
+
+def _crear_config_store() -> ConfigStore:
+    try:
+        resync_seg = float(os.getenv("CONFIG_RESYNC_SEG", "60"))
+    except Exception:
+        resync_seg = 60.0
+    return ConfigStore(resync_seg=resync_seg)
+
+
+config_store = _crear_config_store()
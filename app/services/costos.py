@@ -0,0 +1,302 @@
+"""
+Motor de costos por negocio
+===========================
+
+- PricingResolver: precio por modelo con coincidencia por la clave MÁS LARGA contenida en
+  el nombre del modelo ("gpt-5.4-mini-2026" -> "gpt-5.4-mini", no "gpt-5.4"). Las claves se
+  ordenan una vez por recarga y cada nombre de modelo se resuelve una sola vez (memo).
+  La transcripción tiene su propia tabla en USD por minuto (TRANSCRIPTION_PRICING): así
+  "gpt-4o-transcribe" no cae en el precio por token de "gpt-4o".
+  config_pricing.json se recarga en caliente si cambia su mtime.
+- CostAccumulator: gasto del día y del mes (UTC) por negocio en memoria. Se reconcilia
+  contra la DB al iniciar y cada COST_RECONCILE_SEG para sumar lo que registraron los otros
+  workers de gunicorn; entre reconciliaciones suma localmente cada evento.
+- evaluar_presupuesto: chequeo O(1) del presupuesto opcional del negocio
+  (config_negocios.json -> "presupuesto") que usa nodo_chatbot.
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from loguru import logger
+from app.db import get_pool
+
+PRICING_PATH = os.path.join(os.path.dirname(__file__), 'config_pricing.json')
+
+# Precio por defecto (USD por millón de tokens) para modelos no reconocidos
+PRECIO_DEFAULT = {"input": 0.15, "output": 0.60}
+# USD por minuto de audio si el modelo de transcripción no está en TRANSCRIPTION_PRICING
+PRECIO_MINUTO_DEFAULT = 0.006
+
+ESTADO_OK = "ok"
+ESTADO_DEGRADAR = "degradar"
+ESTADO_AGOTADO = "agotado"
+
+
+class PricingResolver:
+    """Resuelve precios por modelo (longest match) con recarga en caliente del JSON."""
+
+    def __init__(self, path: str = PRICING_PATH, intervalo_chequeo_seg: float = 5.0):
+        self.path = path
+        self.intervalo_chequeo_seg = intervalo_chequeo_seg
+        self.precios = {}
+        self._claves = []          # claves ordenadas de la más larga a la más corta
+        self._memo = {}            # { model_name: precios | None }
+        self.precios_minuto = {}   # { modelo de transcripción: USD por minuto }
+        self._claves_minuto = []
+        self._mtime = None
+        self._ultimo_chequeo = 0.0
+        self._lock = threading.Lock()
+        self._recargar_si_cambio(forzar=True)
+
+    def _recargar_si_cambio(self, forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_chequeo < self.intervalo_chequeo_seg:
+            return
+        self._ultimo_chequeo = ahora
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            precios = config['MODEL_PRICING']
+            precios_minuto = config.get('TRANSCRIPTION_PRICING', {"whisper-1": PRECIO_MINUTO_DEFAULT})
+            with self._lock:
+                self.precios = {k.lower(): v for k, v in precios.items()}
+                self._claves = sorted(self.precios, key=len, reverse=True)
+                self.precios_minuto = {k.lower(): float(v) for k, v in precios_minuto.items()}
+                self._claves_minuto = sorted(self.precios_minuto, key=len, reverse=True)
+                self._memo = {}
+                self._mtime = mtime
+            logger.info(
+                f"✅ Configuración de precios cargada: {len(self.precios)} modelos, "
+                f"{len(self.precios_minuto)} de transcripción."
+            )
+        except Exception as e:
+            # Si falla la recarga seguimos con los precios anteriores
+            logger.exception(f"🔴 Error cargando config_pricing.json: {e}")
+
+    def resolver(self, model_name: str):
+        """Precios {"input", "output"} del modelo o None si no hay coincidencia."""
+        self._recargar_si_cambio()
+        model_name = (model_name or "").lower()
+        memo = self._memo
+        if model_name in memo:
+            return memo[model_name]
+        precios = next((self.precios[k] for k in self._claves if k in model_name), None)
+        memo[model_name] = precios
+        return precios
+
+    def costo_tokens(self, model_name: str, input_tokens: int, output_tokens: int) -> tuple[float, bool]:
+        """Retorna (costo USD, reconocido)."""
+        precios = self.resolver(model_name)
+        reconocido = precios is not None
+        precios = precios or PRECIO_DEFAULT
+        costo = (input_tokens / 1_000_000) * precios["input"] + (output_tokens / 1_000_000) * precios["output"]
+        return costo, reconocido
+
+    def costo_transcripcion(self, model_name: str, minutos: float) -> tuple[float, bool]:
+        """Transcripción: USD por minuto de TRANSCRIPTION_PRICING (longest match solo en esa tabla).
+        Un modelo desconocido se valúa al precio de whisper-1 y se marca como no reconocido."""
+        self._recargar_si_cambio()
+        model_name = (model_name or "").lower()
+        clave = next((k for k in self._claves_minuto if k in model_name), None)
+        if clave is None:
+            return minutos * self.precios_minuto.get("whisper-1", PRECIO_MINUTO_DEFAULT), False
+        return minutos * self.precios_minuto[clave], True
+
+
+class CostAccumulator:
+    """Gasto diario/mensual por negocio en memoria, reconciliado periódicamente con la DB."""
+
+    def __init__(self, intervalo_reconciliacion_seg: float = 60.0):
+        self.intervalo_reconciliacion_seg = intervalo_reconciliacion_seg
+        self.lock = threading.Lock()
+        # { business_id: [costo_dia, costo_mes] }
+        self._base = {}       # último total leído de la DB (todos los workers)
+        self._delta = {}      # sumado localmente desde la última reconciliación
+        self._previo = {}     # delta anterior, hasta que el AnalyticsWriter lo haya escrito
+        self._dia, self._mes = self._periodo_actual()
+
+        self.reconciliaciones = 0
+        self.ultima_reconciliacion = None
+        self.ultima_reconciliacion_ms = None
+        self._hilo = None
+
+    @staticmethod
+    def _periodo_actual():
+        hoy = datetime.now(timezone.utc).date()
+        return hoy, (hoy.year, hoy.month)
+
+    def _rotar_periodo(self):
+        """Reinicia los acumulados del día / mes al cambiar de fecha (llamar con el lock)."""
+        dia, mes = self._periodo_actual()
+        if dia == self._dia:
+            return
+        cambio_mes = mes != self._mes
+        for acumulados in (self._base, self._delta, self._previo):
+            for valores in acumulados.values():
+                valores[0] = 0.0
+                if cambio_mes:
+                    valores[1] = 0.0
+        self._dia, self._mes = dia, mes
+
+    def sumar(self, business_id: str, costo: float):
+        if not business_id or not costo:
+            return
+        with self.lock:
+            self._rotar_periodo()
+            valores = self._delta.setdefault(business_id, [0.0, 0.0])
+            valores[0] += costo
+            valores[1] += costo
+
+    def gasto(self, business_id: str) -> tuple[float, float]:
+        """(gasto del día, gasto del mes) en USD."""
+        with self.lock:
+            self._rotar_periodo()
+            dia = mes = 0.0
+            for acumulados in (self._base, self._previo, self._delta):
+                valores = acumulados.get(business_id)
+                if valores:
+                    dia += valores[0]
+                    mes += valores[1]
+            return dia, mes
+
+    def reconciliar(self, espera_escritura_seg: float = 0.0):
+        """
+        Reemplaza la base por los totales de la DB. El delta local se aparta antes de
+        esperar a que el AnalyticsWriter lo escriba; lo sumado durante la consulta puede
+        contarse dos veces hasta la próxima reconciliación (error conservador).
+        """
+        pool = get_pool("analytics")
+        if not pool:
+            return
+        with self.lock:
+            self._rotar_periodo()
+            self._previo, self._delta = self._delta, {}
+            dia, mes = self._dia, self._mes
+
+        if espera_escritura_seg:
+            time.sleep(espera_escritura_seg)
+
+        inicio = time.perf_counter()
+        desde_dia = datetime(dia.year, dia.month, dia.day, tzinfo=timezone.utc)
+        desde_mes = datetime(mes[0], mes[1], 1, tzinfo=timezone.utc)
+        if os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true").lower() == "true":
+            sql = """
+                SELECT business_id,
+                       COALESCE(SUM(estimated_cost) FILTER (WHERE hour >= %s), 0),
+                       COALESCE(SUM(estimated_cost), 0)
+                FROM analytics_rollup_hourly
+                WHERE hour >= %s
+                GROUP BY business_id
+            """
+        else:
+            sql = """
+                SELECT business_id,
+                       COALESCE(SUM(estimated_cost) FILTER (WHERE timestamp >= %s), 0),
+                       COALESCE(SUM(estimated_cost), 0)
+                FROM analytics_events
+                WHERE timestamp >= %s
+                GROUP BY business_id
+            """
+        try:
+            with pool.connection() as conn:
+                filas = conn.execute(sql, (desde_dia, desde_mes)).fetchall()
+        except Exception:
+            # Sin DB devolvemos el delta para no perder lo sumado
+            with self.lock:
+                for business_id, valores in self._previo.items():
+                    actual = self._delta.setdefault(business_id, [0.0, 0.0])
+                    actual[0] += valores[0]
+                    actual[1] += valores[1]
+                self._previo = {}
+            raise
+
+        with self.lock:
+            self._base = {business_id: [float(d), float(m)] for business_id, d, m in filas}
+            self._previo = {}
+            self.reconciliaciones += 1
+            self.ultima_reconciliacion = time.time()
+            self.ultima_reconciliacion_ms = round((time.perf_counter() - inicio) * 1000, 2)
+
+    def iniciar(self):
+        """Reconciliación inicial (bloqueante) y luego periódica en un hilo demonio."""
+        try:
+            self.reconciliar()
+            logger.info(f"💰 Costos por negocio reconciliados en {self.ultima_reconciliacion_ms}ms ({len(self._base)} negocios)")
+        except Exception as e:
+            logger.error(f"🔴 CostAccumulator: error en la reconciliación inicial: {e}")
+
+        if self._hilo and self._hilo.is_alive():
+            return
+
+        def _loop():
+            from .analytics import analytics_writer
+            espera = analytics_writer.flush_ms / 1000 + 0.5
+            while True:
+                time.sleep(self.intervalo_reconciliacion_seg)
+                try:
+                    self.reconciliar(espera_escritura_seg=espera)
+                except Exception as e:
+                    logger.error(f"🔴 CostAccumulator: error reconciliando costos: {e}")
+
+        self._hilo = threading.Thread(target=_loop, name="cost-reconcile", daemon=True)
+        self._hilo.start()
+
+    def snapshot(self) -> dict:
+        negocios = set(self._base) | set(self._delta) | set(self._previo)
+        return {business_id: dict(zip(("day_usd", "month_usd"), self.gasto(business_id))) for business_id in negocios}
+
+    def get_stats(self) -> dict:
+        return {
+            "reconciliations": self.reconciliaciones,
+            "last_reconcile": time.strftime("%H:%M:%S", time.localtime(self.ultima_reconciliacion)) if self.ultima_reconciliacion else None,
+            "last_reconcile_ms": self.ultima_reconciliacion_ms,
+            "tenants": len(self._base) + len(set(self._delta) - set(self._base)),
+        }
+
+
+def evaluar_presupuesto(business_id: str, presupuesto: dict) -> tuple[str, float]:
+    """
+    Compara el gasto acumulado con el presupuesto del negocio.
+
+    presupuesto (config_negocios.json): {"diario_usd": 2.0, "mensual_usd": 40.0,
+    "degradar_desde_pct": 80, "mensaje_agotado": "..."}
+
+    Returns:
+        (ESTADO_OK | ESTADO_DEGRADAR | ESTADO_AGOTADO, porcentaje consumido del límite más cercano)
+    """
+    if not presupuesto:
+        return ESTADO_OK, 0.0
+
+    dia, mes = cost_accumulator.gasto(business_id)
+    uso = 0.0
+    limite_dia = presupuesto.get("diario_usd")
+    limite_mes = presupuesto.get("mensual_usd")
+    if limite_dia:
+        uso = max(uso, dia / limite_dia)
+    if limite_mes:
+        uso = max(uso, mes / limite_mes)
+
+    pct = round(uso * 100, 1)
+    if uso >= 1:
+        return ESTADO_AGOTADO, pct
+    if pct >= presupuesto.get("degradar_desde_pct", 80):
+        return ESTADO_DEGRADAR, pct
+    return ESTADO_OK, pct
+
+
+def _crear_cost_accumulator() -> CostAccumulator:
+    try:
+        intervalo = float(os.getenv("COST_RECONCILE_SEG", "60"))
+    except Exception:
+        intervalo = 60.0
+    return CostAccumulator(intervalo_reconciliacion_seg=intervalo)
+
+
+pricing_resolver = PricingResolver()
+cost_accumulator = _crear_cost_accumulator()
@@ -0,0 +1,171 @@
+"""
+Armado y caché del dashboard de analytics
+=========================================
+
+- construir_dashboard_desde_eventos: rangos cortos (<= 1 día) se calculan sobre
+  analytics_events en UNA sola pasada: un CTE materializado con el rango y un único
+  SELECT con GROUPING SETS que devuelve a la vez las filas finas (hora, negocio, tipo,
+  modelo, tool), los totales con percentiles exactos y las conversaciones únicas por
+  día y por negocio. El ensamblado del JSON es el mismo que usan los rollups.
+- DashboardCache: respuestas armadas por (business_id, start, end) con TTL corto y un
+  ETag estable (no depende de generated_at) para que el frontend haga polling con
+  If-None-Match y reciba 304 mientras los datos no cambien.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from loguru import logger
+from .analytics_rollups import ensamblar_dashboard
+
+SQL_DASHBOARD_UNA_PASADA = """
+WITH base AS MATERIALIZED (
+    SELECT
+        DATE_TRUNC('hour', timestamp)  AS hour,
+        DATE(timestamp)                AS day,
+        business_id,
+        thread_id,
+        COALESCE(event_type, '')       AS event_type,
+        COALESCE(model_name, '')       AS model_name,
+        COALESCE(tool_name, '')        AS tool_name,
+        COALESCE(input_tokens, 0)      AS input_tokens,
+        COALESCE(output_tokens, 0)     AS output_tokens,
+        COALESCE(estimated_cost, 0.0)  AS estimated_cost,
+        COALESCE(cost_avoided, 0.0)    AS cost_avoided,
+        -- La latencia de un hit del cache no es la del proveedor: fuera de percentiles y máximo
+        CASE WHEN event_type = 'cache_hit' THEN NULL ELSE latency_ms END AS latency_ms
+    FROM analytics_events
+    WHERE timestamp >= %s AND timestamp < %s
+    {biz_filter}
+)
+SELECT
+    GROUPING(hour)        AS g_hour,
+    GROUPING(day)         AS g_day,
+    GROUPING(business_id) AS g_biz,
+    hour, day, business_id, event_type, model_name, tool_name,
+    COUNT(*)                                                   AS events,
+    SUM(input_tokens)                                          AS input_tokens,
+    SUM(output_tokens)                                         AS output_tokens,
+    SUM(estimated_cost)                                        AS estimated_cost,
+    COALESCE(SUM(latency_ms), 0)                               AS latency_sum_ms,
+    COALESCE(MAX(latency_ms), 0)                               AS latency_max_ms,
+    COALESCE(SUM(output_tokens::float / NULLIF(input_tokens, 0)), 0) AS ratio_sum,
+    COUNT(NULLIF(input_tokens, 0))                             AS ratio_count,
+    SUM(cost_avoided)                                          AS cost_avoided,
+    COUNT(DISTINCT thread_id)                                  AS unique_threads,
+    PERCENTILE_CONT(ARRAY[0.50, 0.95, 0.99]) WITHIN GROUP (ORDER BY latency_ms) AS percentiles
+FROM base
+GROUP BY GROUPING SETS (
+    (hour, business_id, event_type, model_name, tool_name),
+    (),
+    (day),
+    (business_id)
+)
+"""
+
+
+def construir_dashboard_desde_eventos(cur, dashboard: dict, start: datetime, end: datetime, business_id: str = None):
+    """Completa el dashboard desde analytics_events con una única consulta (un solo escaneo del rango)."""
+    biz_filter = "AND business_id = %s" if business_id else ""
+    biz_params = (business_id,) if business_id else ()
+
+    cur.execute(SQL_DASHBOARD_UNA_PASADA.format(biz_filter=biz_filter), (start, end) + biz_params)
+
+    filas = []
+    unicos_total = 0
+    unicos_dia = {}
+    unicos_negocio = {}
+    percentiles = {"p50": None, "p95": None, "p99": None, "max": None}
+
+    for (g_hour, g_day, g_biz, hour, day, biz, event_type, model, tool, events, inp, out, cost,
+         lat_sum, lat_max, ratio_sum, ratio_count, avoided, unicos, pcts) in cur.fetchall():
+        if not g_hour:
+            # Fila fina: misma forma que analytics_rollup_hourly (sin histograma)
+            filas.append((hour, biz, event_type, model, tool, events, inp, out, cost,
+                          lat_sum, lat_max, None, ratio_sum, ratio_count, avoided))
+        elif not g_day:
+            unicos_dia[day] = unicos
+        elif not g_biz:
+            unicos_negocio[biz] = unicos
+        else:
+            unicos_total = unicos
+            p50, p95, p99 = (int(p) if p is not None else None for p in (pcts or (None, None, None)))
+            percentiles = {"p50": p50, "p95": p95, "p99": p99, "max": lat_max if events else None}
+
+    ensamblar_dashboard(dashboard, filas, unicos_total, unicos_dia, unicos_negocio, business_id, percentiles)
+    dashboard["source"] = "events"
+    return dashboard
+
+
+def calcular_etag(dashboard: dict) -> str:
+    """ETag débil sobre el contenido, ignorando generated_at para que no cambie en cada armado."""
+    contenido = {k: v for k, v in dashboard.items() if k != "generated_at"}
+    digest = hashlib.sha1(json.dumps(contenido, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+class DashboardCache:
+    """Caché en memoria (por worker) de dashboards armados, con TTL corto."""
+
+    def __init__(self, ttl_seg: float = 30.0, max_entradas: int = 256):
+        self.ttl_seg = ttl_seg
+        self.max_entradas = max_entradas
+        # { clave: (expira_en, etag, dashboard) }
+        self.entradas = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, clave):
+        """Retorna (etag, dashboard) vigente o None."""
+        if self.ttl_seg <= 0:
+            return None
+        ahora = time.monotonic()
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada and entrada[0] > ahora:
+                self.hits += 1
+                return entrada[1], entrada[2]
+            if entrada:
+                del self.entradas[clave]
+            self.misses += 1
+        return None
+
+    def guardar(self, clave, dashboard: dict) -> str:
+        etag = calcular_etag(dashboard)
+        if self.ttl_seg <= 0:
+            return etag
+        ahora = time.monotonic()
+        with self.lock:
+            if len(self.entradas) >= self.max_entradas:
+                # Primero descartamos vencidas; si no alcanza, la más próxima a vencer
+                for k in [k for k, (exp, _, _) in self.entradas.items() if exp <= ahora]:
+                    del self.entradas[k]
+                if len(self.entradas) >= self.max_entradas:
+                    del self.entradas[min(self.entradas, key=lambda k: self.entradas[k][0])]
+            self.entradas[clave] = (ahora + self.ttl_seg, etag, dashboard)
+        return etag
+
+    def invalidar(self):
+        with self.lock:
+            self.entradas.clear()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            entradas = len(self.entradas)
+        return {"ttl_seg": self.ttl_seg, "entries": entradas, "hits": self.hits, "misses": self.misses}
+
+
+def _crear_dashboard_cache() -> DashboardCache:
+    try:
+        ttl = float(os.getenv("DASHBOARD_CACHE_TTL_SEG", "30"))
+    except Exception:
+        ttl = 30.0
+    logger.info(f"DashboardCache inicializado: ttl={ttl}s")
+    return DashboardCache(ttl_seg=ttl)
+
+
+dashboard_cache = _crear_dashboard_cache()
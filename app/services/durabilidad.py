@@ -0,0 +1,52 @@
+"""
+Durabilidad de checkpoints por negocio
+======================================
+
+Cuándo persiste LangGraph el estado durante una ejecución del grafo:
+
+- "sync": después de cada paso (chatbot, tools, chatbot...) antes de seguir. Es el
+  comportamiento histórico y el más seguro.
+- "async": después de cada paso, pero la escritura corre en segundo plano mientras avanza
+  el siguiente paso.
+- "exit": una sola vez al terminar la ejecución. Menos viajes a Postgres y blobs
+  intermedios; si el proceso muere a mitad de un mensaje se pierde ese mensaje.
+
+Se configura con "durabilidad_checkpoint" en config_negocios.json o CHECKPOINT_DURABILITY.
+Ver Support/bench_checkpoint_durability.py para medir escrituras y latencia por modo.
+"""
+
+import os
+import inspect
+from loguru import logger
+from langgraph.pregel import Pregel
+
+MODOS_DURABILIDAD = ("sync", "async", "exit")
+
+_PARAMETROS_INVOKE = inspect.signature(Pregel.invoke).parameters
+
+
+def modo_por_defecto() -> str:
+    modo = os.getenv("CHECKPOINT_DURABILITY", "sync").lower()
+    return modo if modo in MODOS_DURABILIDAD else "sync"
+
+
+def resolver_modo(modo_negocio: str = None) -> str:
+    """Modo del negocio si es válido; si no, el de CHECKPOINT_DURABILITY."""
+    if modo_negocio:
+        modo = str(modo_negocio).lower()
+        if modo in MODOS_DURABILIDAD:
+            return modo
+        logger.warning(f"⚠️ durabilidad_checkpoint inválida: {modo_negocio}. Usando {modo_por_defecto()}")
+    return modo_por_defecto()
+
+
+def kwargs_durabilidad(modo: str) -> dict:
+    """
+    Argumentos para graph.invoke según la versión de LangGraph instalada:
+    `durability` (>= 0.6) o `checkpoint_during` (0.4/0.5, sin modo async).
+    """
+    if "durability" in _PARAMETROS_INVOKE:
+        return {"durability": modo}
+    if "checkpoint_during" in _PARAMETROS_INVOKE:
+        return {"checkpoint_during": modo != "exit"}
+    return {}
@@ -0,0 +1,181 @@
+"""
+Preprocesado de imágenes para modelos de visión
+===============================================
+
+Las fotos de comprobantes llegan a resolución de cámara (4000 px, varios MB) y se mandaban
+en base64 tal cual. Los tokens de imagen, el upload y la latencia crecen con el tamaño, y
+cada proveedor igual la reduce del lado del servidor:
+
+- OpenAI (detail=high): la encaja en 2048x2048 y lleva el lado corto a 768; cobra 170 tokens
+  por tile de 512 px + 85. Con detail=low son 85 tokens fijos (imagen de 512 px).
+- Gemini: 258 tokens por tile de 768 px.
+- Groq (Llama 4): imágenes de hasta ~1120 px por lado sin perder detalle útil.
+
+preparar_imagen aplica antes del upload: orientación EXIF, recorte opcional del comprobante
+(VISION_RECORTE=true: se descarta el borde del color del fondo), reducción al lado máximo del
+proveedor (VISION_LADO_MAX_<PROVEEDOR>, y VISION_LADO_CORTO_MAX_OPENAI) y recompresión a
+VISION_FORMATO (jpeg o webp) con VISION_CALIDAD. Si nada de eso achica la imagen se manda la
+original. Sin Pillow (o con VISION_PREPROCESADO=false) las imágenes van sin tocar.
+
+Precisión de extracción y tokens contra comprobantes de referencia: Support/check_vision_recibos.py.
+"""
+
+import io
+import os
+from typing import Optional
+from loguru import logger
+from ..utils.metrics import vision_bytes
+
+try:
+    from PIL import Image, ImageOps
+    _HAS_PIL = True
+except Exception:
+    _HAS_PIL = False
+
+LADO_MAX_DEFAULT = {"openai": 2048, "gemini": 1536, "groq": 1120}
+LADO_CORTO_MAX_DEFAULT = {"openai": 768}
+LADO_DETAIL_LOW = 512
+FORMATOS_MIME = {"jpeg": "image/jpeg", "webp": "image/webp"}
+# Formato que detecta Pillow -> mime_type real (WhatsApp y los canales no siempre lo informan bien)
+MIME_POR_FORMATO_PIL = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def _leer_config():
+    lado_max, lado_corto_max = {}, {}
+    for proveedor, default in LADO_MAX_DEFAULT.items():
+        try:
+            lado_max[proveedor] = int(os.getenv(f"VISION_LADO_MAX_{proveedor.upper()}", str(default)))
+        except Exception:
+            lado_max[proveedor] = default
+    for proveedor, default in LADO_CORTO_MAX_DEFAULT.items():
+        try:
+            lado_corto_max[proveedor] = int(os.getenv(f"VISION_LADO_CORTO_MAX_{proveedor.upper()}", str(default)))
+        except Exception:
+            lado_corto_max[proveedor] = default
+    try:
+        calidad = int(os.getenv("VISION_CALIDAD", "85"))
+    except Exception:
+        calidad = 85
+    formato = os.getenv("VISION_FORMATO", "jpeg").lower()
+    if formato not in FORMATOS_MIME:
+        formato = "jpeg"
+    return lado_max, lado_corto_max, calidad, formato
+
+
+LADO_MAX, LADO_CORTO_MAX, CALIDAD, FORMATO = _leer_config()
+PREPROCESADO = os.getenv("VISION_PREPROCESADO", "true").lower() == "true"
+RECORTE = os.getenv("VISION_RECORTE", "false").lower() == "true"
+DETAIL = os.getenv("VISION_DETAIL", "auto").lower()   # auto, low o high (solo OpenAI)
+
+
+def firma_preprocesado(proveedor: str) -> str:
+    """Parámetros que cambian la imagen enviada (para la clave del cache de medios)."""
+    if not (PREPROCESADO and _HAS_PIL):
+        return "original"
+    return f"{LADO_MAX.get(proveedor, 0)}|{LADO_CORTO_MAX.get(proveedor, 0)}|{FORMATO}|{CALIDAD}|{RECORTE}|{DETAIL}"
+
+
+def _recortar(imagen, umbral: int = 24):
+    """Recorta al contenido que se distingue del color del borde (fondo), si eso quita al menos un 10%."""
+    muestra = ImageOps.grayscale(imagen)
+    muestra.thumbnail((256, 256))
+    ancho, alto = muestra.size
+    borde = [muestra.getpixel((x, y)) for x in range(ancho) for y in (0, alto - 1)]
+    borde += [muestra.getpixel((x, y)) for y in range(alto) for x in (0, ancho - 1)]
+    fondo = sorted(borde)[len(borde) // 2]
+
+    caja = muestra.point(lambda p: 255 if abs(p - fondo) > umbral else 0).getbbox()
+    if not caja:
+        return imagen
+
+    escala_x, escala_y = imagen.width / ancho, imagen.height / alto
+    margen_x, margen_y = int(imagen.width * 0.02), int(imagen.height * 0.02)
+    izq = max(0, int(caja[0] * escala_x) - margen_x)
+    arr = max(0, int(caja[1] * escala_y) - margen_y)
+    der = min(imagen.width, int(caja[2] * escala_x) + margen_x)
+    aba = min(imagen.height, int(caja[3] * escala_y) + margen_y)
+
+    proporcion = (der - izq) * (aba - arr) / (imagen.width * imagen.height)
+    # Menos del 20% es casi seguro un falso positivo (una mancha, un ícono), no el comprobante
+    if proporcion > 0.9 or proporcion < 0.2:
+        return imagen
+    return imagen.crop((izq, arr, der, aba))
+
+
+def _reducir(imagen, proveedor: str):
+    ancho, alto = imagen.size
+    escala = 1.0
+    if LADO_MAX.get(proveedor):
+        escala = min(escala, LADO_MAX[proveedor] / max(ancho, alto))
+    if LADO_CORTO_MAX.get(proveedor):
+        escala = min(escala, LADO_CORTO_MAX[proveedor] / min(ancho, alto))
+    if escala >= 1.0:
+        return imagen
+    return imagen.resize((max(1, round(ancho * escala)), max(1, round(alto * escala))), Image.LANCZOS)
+
+
+def _detail(proveedor: str, ancho: int, alto: int) -> Optional[str]:
+    if proveedor != "openai":
+        return None
+    if DETAIL in ("low", "high"):
+        return DETAIL
+    # Si entra en 512x512, low ve la misma imagen por 85 tokens fijos
+    return "low" if max(ancho, alto) <= LADO_DETAIL_LOW else "high"
+
+
+def codificar(imagen, proveedor: str) -> tuple:
+    """(bytes, mime_type, detail, (ancho, alto)) de una imagen PIL, recortada, reducida y recomprimida."""
+    if not PREPROCESADO:
+        # Comportamiento anterior (páginas de PDF): PNG sin reducir
+        salida = io.BytesIO()
+        imagen.save(salida, format="PNG")
+        return salida.getvalue(), "image/png", "high", imagen.size
+    if RECORTE:
+        imagen = _recortar(imagen)
+    imagen = _reducir(imagen, proveedor)
+    if imagen.mode not in ("RGB", "L"):
+        fondo = Image.new("RGB", imagen.size, (255, 255, 255))
+        fondo.paste(imagen.convert("RGBA"), mask=imagen.convert("RGBA").split()[-1])
+        imagen = fondo
+    salida = io.BytesIO()
+    if FORMATO == "webp":
+        imagen.save(salida, format="WEBP", quality=CALIDAD, method=4)
+    else:
+        imagen.save(salida, format="JPEG", quality=CALIDAD, optimize=True)
+    return salida.getvalue(), FORMATOS_MIME[FORMATO], _detail(proveedor, *imagen.size), imagen.size
+
+
+def preparar_imagen(image_buffer: bytes, proveedor: str, mime_type: str = "image/jpeg") -> tuple:
+    """
+    Imagen lista para mandar al modelo de visión de `proveedor`.
+
+    Returns:
+        (bytes, mime_type, detail): detail es "low"/"high" para OpenAI y None para el resto.
+        Si no conviene procesar, los bytes originales con el mime_type de su formato real.
+    """
+    if not (PREPROCESADO and _HAS_PIL) or not mime_type.startswith("image/"):
+        return image_buffer, mime_type, None
+    try:
+        imagen = Image.open(io.BytesIO(image_buffer))
+        mime_type = MIME_POR_FORMATO_PIL.get(imagen.format, mime_type)
+        original = imagen.size
+        # Fotos de celular: la orientación suele venir solo en EXIF y no todos los modelos la aplican
+        rotada = imagen.getexif().get(0x0112, 1) != 1
+        imagen = ImageOps.exif_transpose(imagen)
+
+        datos, mime_salida, detail, final = codificar(imagen, proveedor)
+        if final == original and not rotada and len(datos) >= len(image_buffer) \
+                and mime_type in FORMATOS_MIME.values():
+            # Ya era chica y comprimida: recomprimir solo perdería calidad
+            return image_buffer, mime_type, _detail(proveedor, *original)
+
+        vision_bytes.inc(len(image_buffer), provider=proveedor, stage="original")
+        vision_bytes.inc(len(datos), provider=proveedor, stage="sent")
+        logger.info(
+            f"🖼️ [IMAGE] Preprocesada para {proveedor}: {original[0]}x{original[1]} {len(image_buffer) // 1024} KB -> "
+            f"{final[0]}x{final[1]} {len(datos) // 1024} KB ({mime_salida}, detail={detail})"
+        )
+        return datos, mime_salida, detail
+    except Exception as e:
+        logger.warning(f"⚠️ [IMAGE] No se pudo preprocesar la imagen, se envía la original: {e}")
+        return image_buffer, mime_type, None
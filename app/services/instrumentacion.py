@@ -0,0 +1,86 @@
+"""
+Instrumentación del agente para /metrics
+========================================
+
+- PostgresSaverMedido: PostgresSaver que mide la carga (get_tuple) y el guardado
+  (put / put_writes) de checkpoints. Usa el serializador comprimido por defecto.
+- MetricasCallbackHandler: callback de LangChain que mide la latencia de cada invocación
+  de modelo (por provider/modelo) y de cada tool dentro del grafo. Se pasa en
+  config["callbacks"] al invocar el grafo y LangGraph lo propaga a los nodos.
+"""
+
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.checkpoint.postgres import PostgresSaver
+from ..utils.metrics import checkpoint_duracion, llm_latencia, tool_latencia
+from .serializacion import serializador_checkpoints
+
+
+class PostgresSaverMedido(PostgresSaver):
+    """PostgresSaver con histogramas de duración por operación (y blobs comprimidos, ver serializacion.py)."""
+
+    def __init__(self, conn, pipe=None, serde=None):
+        super().__init__(conn, pipe=pipe, serde=serde or serializador_checkpoints)
+
+    def get_tuple(self, config):
+        with checkpoint_duracion.medir(op="load"):
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with checkpoint_duracion.medir(op="save"):
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with checkpoint_duracion.medir(op="save_writes"):
+            return super().put_writes(config, writes, task_id, task_path)
+
+
+class MetricasCallbackHandler(BaseCallbackHandler):
+    """Latencias de LLM y tools. Es compartido entre hilos: el estado se indexa por run_id."""
+
+    def __init__(self):
+        self._llm = {}    # { run_id: (inicio, provider, model) }
+        self._tools = {}  # { run_id: (inicio, tool) }
+
+    def _inicio_llm(self, serialized, run_id, metadata):
+        metadata = metadata or {}
+        provider = metadata.get("ls_provider") or (serialized or {}).get("name") or "unknown"
+        model = metadata.get("ls_model_name") or "unknown"
+        self._llm[run_id] = (time.perf_counter(), provider, model)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._inicio_llm(serialized, run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._inicio_llm(serialized, run_id, metadata)
+
+    def _fin_llm(self, run_id):
+        datos = self._llm.pop(run_id, None)
+        if datos:
+            inicio, provider, model = datos
+            llm_latencia.observe(time.perf_counter() - inicio, provider=provider, model=model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._fin_llm(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._fin_llm(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        nombre = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._tools[run_id] = (time.perf_counter(), nombre)
+
+    def _fin_tool(self, run_id, status):
+        datos = self._tools.pop(run_id, None)
+        if datos:
+            inicio, nombre = datos
+            tool_latencia.observe(time.perf_counter() - inicio, tool=nombre, status=status)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._fin_tool(run_id, "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._fin_tool(run_id, "error")
+
+
+metricas_callback = MetricasCallbackHandler()
@@ -0,0 +1,144 @@
+"""
+Percentiles de latencia por negocio, modelo y tool
+==================================================
+
+Los "sketches" son histogramas con los mismos buckets logarítmicos que analytics_rollup_hourly
+(LATENCY_BOUNDS_MS): se combinan sumando contadores, así que los percentiles en vivo y los
+históricos salen de la misma estructura y nunca se escanean eventos crudos.
+
+- LatenciasVivas: ventana deslizante en memoria (por minuto) por (business_id, model, tool),
+  actualizada en cada registrar_evento. Es del worker actual; sirve para decisiones locales
+  (p. ej. timeouts adaptativos con percentil(q, model=...)).
+- percentiles_persistidos: lee los histogramas de analytics_rollup_hourly, que el
+  AnalyticsWriter persiste en cada flush con los eventos de todos los workers.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+from .analytics_rollups import N_BUCKETS, bucket_latencia, percentil_histograma
+
+CUANTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+
+def _resumen(buckets, maximo) -> dict:
+    resumen = {"events": sum(buckets)}
+    for nombre, q in CUANTILES:
+        resumen[f"{nombre}_ms"] = percentil_histograma(buckets, q, maximo)
+    resumen["max_ms"] = maximo
+    return resumen
+
+
+def _coincide(clave, business_id, model, tool) -> bool:
+    biz, mod, tl = clave
+    return not ((business_id and biz != business_id) or (model and mod != model) or (tool and tl != tool))
+
+
+def _agrupar(entradas) -> list:
+    """entradas: iterable de ((business_id, model, tool), buckets, maximo). Combina por clave."""
+    grupos = {}
+    for clave, buckets, maximo in entradas:
+        g = grupos.get(clave)
+        if g is None:
+            g = grupos[clave] = [[0] * N_BUCKETS, 0]
+        for i, n in enumerate(buckets):
+            g[0][i] += n
+        g[1] = max(g[1], maximo or 0)
+
+    resultado = [
+        {"business_id": biz, "model_name": mod, "tool_name": tl, **_resumen(b, m)}
+        for (biz, mod, tl), (b, m) in grupos.items()
+    ]
+    return sorted(resultado, key=lambda r: r["events"], reverse=True)
+
+
+def _total(grupos_crudos) -> dict:
+    buckets = [0] * N_BUCKETS
+    maximo = 0
+    for b, m in grupos_crudos:
+        for i, n in enumerate(b):
+            buckets[i] += n
+        maximo = max(maximo, m or 0)
+    return _resumen(buckets, maximo)
+
+
+class LatenciasVivas:
+    """Histogramas por minuto en una ventana deslizante de `ventana_min` minutos."""
+
+    def __init__(self, ventana_min: int = 15):
+        self.ventana_min = ventana_min
+        self.lock = threading.Lock()
+        # { (business_id, model, tool): { minuto: [buckets, max_ms] } }
+        self._minutos = {}
+
+    def registrar(self, business_id: str, model: str, tool: str, latency_ms: int):
+        if latency_ms is None:
+            return
+        clave = (business_id or "", model or "", tool or "")
+        minuto = int(time.time() // 60)
+        with self.lock:
+            por_minuto = self._minutos.setdefault(clave, {})
+            actual = por_minuto.get(minuto)
+            if actual is None:
+                actual = por_minuto[minuto] = [[0] * N_BUCKETS, 0]
+                # Solo al abrir un minuto nuevo: descartar los que salieron de la ventana
+                for viejo in [m for m in por_minuto if m <= minuto - self.ventana_min]:
+                    del por_minuto[viejo]
+            actual[0][bucket_latencia(latency_ms)] += 1
+            actual[1] = max(actual[1], latency_ms)
+
+    def _entradas(self, business_id=None, model=None, tool=None):
+        desde = int(time.time() // 60) - self.ventana_min
+        with self.lock:
+            return [
+                (clave, list(buckets), maximo)
+                for clave, por_minuto in self._minutos.items() if _coincide(clave, business_id, model, tool)
+                for minuto, (buckets, maximo) in por_minuto.items() if minuto > desde
+            ]
+
+    def percentiles(self, business_id: str = None, model: str = None, tool: str = None) -> dict:
+        entradas = self._entradas(business_id, model, tool)
+        return {"groups": _agrupar(entradas), "total": _total([(b, m) for _, b, m in entradas])}
+
+    def percentil(self, q: float, business_id: str = None, model: str = None, tool: str = None,
+                  minimo_eventos: int = 20):
+        """Percentil q (ms) de la ventana, o None si hay menos de `minimo_eventos` muestras."""
+        entradas = self._entradas(business_id, model, tool)
+        buckets = [0] * N_BUCKETS
+        for _, b, _ in entradas:
+            for i, n in enumerate(b):
+                buckets[i] += n
+        if sum(buckets) < minimo_eventos:
+            return None
+        return percentil_histograma(buckets, q, max(m for _, _, m in entradas))
+
+
+def percentiles_persistidos(cur, start: datetime, end: datetime, business_id: str = None,
+                            model: str = None, tool: str = None) -> dict:
+    """Percentiles por (business_id, model, tool) combinando las horas de analytics_rollup_hourly (sin hits del cache)."""
+    filtros = ""
+    params = [start, end]
+    for columna, valor in (("business_id", business_id), ("model_name", model), ("tool_name", tool)):
+        if valor:
+            filtros += f" AND {columna} = %s"
+            params.append(valor)
+    cur.execute(f"""
+        SELECT business_id, model_name, tool_name, latency_buckets, latency_max_ms
+        FROM analytics_rollup_hourly
+        WHERE hour >= %s AND hour < %s AND event_type <> 'cache_hit' {filtros}
+    """, params)
+    filas = cur.fetchall()
+    entradas = [((biz, mod, tl), buckets, maximo) for biz, mod, tl, buckets, maximo in filas]
+    return {"groups": _agrupar(entradas), "total": _total([(b, m) for _, b, m in entradas])}
+
+
+def _crear_latencias_vivas() -> LatenciasVivas:
+    try:
+        ventana = int(os.getenv("LATENCY_LIVE_WINDOW_MIN", "15"))
+    except Exception:
+        ventana = 15
+    return LatenciasVivas(ventana_min=ventana)
+
+
+latencias_vivas = _crear_latencias_vivas()
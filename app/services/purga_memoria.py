@@ -0,0 +1,298 @@
+"""
+Purga masiva de memoria (checkpoints) por negocio o lista de usuarios
+=====================================================================
+
+Para dar de baja un negocio o atender pedidos de privacidad sin una llamada HTTP por thread:
+
+- Un job borra checkpoints, checkpoint_writes, checkpoint_blobs y session_activity en
+  lotes de MEMORY_PURGE_BATCH threads, cada lote en su propia transacción.
+- Paginación por keyset: con un negocio completo se recorren los thread_id de `checkpoints`
+  (la PK, salteando de thread en thread) dentro del rango 'biz:' <= thread_id < 'biz;', más
+  los de session_activity: hay threads con checkpoints y sin fila de actividad (TTL <= 0,
+  UPSERT de actividad fallido, HITL). Con una lista de user_ids, la lista ordenada. El cursor se guarda
+  en la misma transacción que el borrado, así que un job interrumpido retoma donde quedó.
+- Throttling: después de cada lote se duerme al menos MEMORY_PURGE_PAUSA_MS y lo necesario
+  para que el job no ocupe más de MEMORY_PURGE_DUTY del tiempo (0.5 = la mitad).
+- El estado vive en memory_purge_jobs: cualquier worker responde el status. Un job sin
+  progreso en MEMORY_PURGE_STALE_SEG (worker reciclado) se retoma al volver a pedirlo.
+
+Conviene deshabilitar el negocio antes de purgarlo completo: los mensajes que lleguen
+durante la purga vuelven a crear memoria.
+"""
+
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from loguru import logger
+from app.db import get_pool
+from .sesiones import borrar_memoria_threads, TABLAS_CHECKPOINT
+from ..utils.metrics import metricas
+
+ADVISORY_LOCK_ID = 72026040
+
+purga_filas = metricas.counter(
+    "sisagent_memory_purge_rows_total",
+    "Filas eliminadas por los jobs de purga masiva de memoria, por tabla",
+    ("table",),
+)
+
+SQL_CREAR_TABLA = """
+CREATE TABLE IF NOT EXISTS memory_purge_jobs (
+    job_id VARCHAR(32) PRIMARY KEY,
+    business_id VARCHAR(50) NOT NULL,
+    user_ids JSONB,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    cursor TEXT NOT NULL DEFAULT '',
+    estimated_threads INTEGER NOT NULL DEFAULT 0,
+    threads_purged INTEGER NOT NULL DEFAULT 0,
+    rows_deleted BIGINT NOT NULL DEFAULT 0,
+    batches INTEGER NOT NULL DEFAULT 0,
+    requested_by VARCHAR(100),
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_memory_purge_jobs_business
+    ON memory_purge_jobs (business_id) WHERE status IN ('pending', 'running');
+"""
+
+SQL_JOB_ACTIVO = """
+SELECT job_id, user_ids, updated_at < NOW() - make_interval(secs => %s) AS vencido
+FROM memory_purge_jobs
+WHERE business_id = %s AND status IN ('pending', 'running')
+FOR UPDATE
+"""
+
+# Skip scan sobre la PK de checkpoints (un salto de índice por thread, no por checkpoint).
+# Con una collation que no ordena por bytes el rango de prefijo no es contiguo: %(fin)s es
+# NULL, se recorre desde el cursor y el filtro starts_with descarta los threads de otros negocios.
+SQL_LOTE_NEGOCIO = """
+WITH RECURSIVE t AS (
+    (SELECT thread_id FROM checkpoints
+     WHERE thread_id > %(desde)s AND thread_id >= %(inicio)s
+     ORDER BY thread_id LIMIT 1)
+    UNION ALL
+    SELECT (SELECT c.thread_id FROM checkpoints c WHERE c.thread_id > t.thread_id ORDER BY c.thread_id LIMIT 1)
+    FROM t
+    WHERE t.thread_id IS NOT NULL AND (%(fin)s::text IS NULL OR t.thread_id < %(fin)s)
+),
+con_checkpoints AS (
+    SELECT thread_id FROM t
+    WHERE thread_id IS NOT NULL AND starts_with(thread_id, %(prefijo)s)
+    LIMIT %(limite)s
+)
+SELECT thread_id FROM (
+    SELECT thread_id FROM con_checkpoints
+    UNION
+    (SELECT thread_id FROM session_activity
+     WHERE business_id = %(business_id)s AND thread_id > %(desde)s
+     ORDER BY thread_id LIMIT %(limite)s)
+) lote
+ORDER BY thread_id
+LIMIT %(limite)s
+"""
+
+SQL_COLLATION = "SELECT datcollate FROM pg_database WHERE datname = current_database()"
+
+SQL_PROGRESO = """
+UPDATE memory_purge_jobs SET
+    status = 'running', cursor = %(cursor)s, threads_purged = threads_purged + %(threads)s,
+    rows_deleted = rows_deleted + %(filas)s, batches = batches + 1, updated_at = NOW()
+WHERE job_id = %(job_id)s
+"""
+
+SQL_FINALIZAR = """
+UPDATE memory_purge_jobs SET status = %s, error = %s, updated_at = NOW(), finished_at = NOW()
+WHERE job_id = %s
+"""
+
+COLUMNAS_ESTADO = (
+    "job_id, business_id, jsonb_array_length(COALESCE(user_ids, '[]'::jsonb)) AS user_ids, status, "
+    "estimated_threads, threads_purged, rows_deleted, batches, requested_by, error, "
+    "created_at, updated_at, finished_at"
+)
+
+
+class PurgaEnCurso(Exception):
+    """Ya hay un job activo (con progreso reciente) para ese negocio."""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Purga en curso: {job_id}")
+        self.job_id = job_id
+
+
+def asegurar_tabla_purgas(conn):
+    conn.execute(SQL_CREAR_TABLA)
+
+
+def _fechas_iso(fila: dict) -> dict:
+    for campo in ("created_at", "updated_at", "finished_at"):
+        if fila.get(campo):
+            fila[campo] = fila[campo].isoformat()
+    return fila
+
+
+class PurgaMemoria:
+    """Crea, ejecuta (un hilo por job) y reporta los jobs de purga masiva."""
+
+    def __init__(self, tamano_lote: int = 200, pausa_min_seg: float = 0.1, ciclo_util: float = 0.5,
+                 vencido_seg: float = 300.0):
+        self.tamano_lote = tamano_lote
+        self.pausa_min_seg = pausa_min_seg
+        self.ciclo_util = min(1.0, max(0.05, ciclo_util))
+        self.vencido_seg = vencido_seg
+        self._tabla_lista = False
+
+    @contextmanager
+    def _conexion(self):
+        with get_pool("admin").connection() as conn:
+            if not self._tabla_lista:
+                asegurar_tabla_purgas(conn)
+                self._tabla_lista = True
+            yield conn
+
+    def crear(self, business_id: str, user_ids: list = None, solicitante: str = None) -> dict:
+        """
+        Registra el job y lo arranca en segundo plano. Si hay un job vencido para el mismo
+        objetivo lo retoma; si hay uno activo lanza PurgaEnCurso.
+        """
+        user_ids = sorted({str(u) for u in user_ids}) if user_ids else None
+        with self._conexion() as conn:
+            with conn.transaction():
+                # Serializa la creación entre workers para el mismo negocio
+                conn.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (ADVISORY_LOCK_ID, business_id))
+                job_id = None
+                for previo_id, previo_ids, vencido in conn.execute(
+                    SQL_JOB_ACTIVO, (self.vencido_seg, business_id)
+                ).fetchall():
+                    if not vencido:
+                        raise PurgaEnCurso(previo_id)
+                    if previo_ids == user_ids and job_id is None:
+                        job_id = previo_id
+                        conn.execute(
+                            "UPDATE memory_purge_jobs SET status = 'running', updated_at = NOW() WHERE job_id = %s",
+                            (job_id,),
+                        )
+                        logger.warning(f"🧽 Purga {job_id} sin progreso desde hace más de {self.vencido_seg}s: se retoma")
+                    else:
+                        conn.execute(SQL_FINALIZAR, ("error", "Abandonado: reemplazado por otro job", previo_id))
+
+                if job_id is None:
+                    job_id = uuid.uuid4().hex
+                    if user_ids:
+                        estimados = len(user_ids)
+                    else:
+                        estimados = conn.execute(
+                            "SELECT COUNT(*) FROM session_activity WHERE business_id = %s", (business_id,)
+                        ).fetchone()[0]
+                    conn.execute(
+                        "INSERT INTO memory_purge_jobs (job_id, business_id, user_ids, estimated_threads, requested_by) "
+                        "VALUES (%s, %s, %s, %s, %s)",
+                        (job_id, business_id, Jsonb(user_ids) if user_ids else None, estimados, solicitante),
+                    )
+
+        threading.Thread(target=self._ejecutar, args=(job_id,), name=f"memory-purge-{job_id[:8]}", daemon=True).start()
+        logger.info(f"🧽 Purga de memoria {job_id} iniciada: {business_id} ({f'{len(user_ids)} usuarios' if user_ids else 'negocio completo'})")
+        return self.estado(job_id)
+
+    def estado(self, job_id: str):
+        with self._conexion() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(f"SELECT {COLUMNAS_ESTADO} FROM memory_purge_jobs WHERE job_id = %s", (job_id,))
+                fila = cur.fetchone()
+        return _fechas_iso(fila) if fila else None
+
+    def listar(self, business_id: str = None, limite: int = 20) -> list:
+        with self._conexion() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                cur.execute(
+                    f"SELECT {COLUMNAS_ESTADO} FROM memory_purge_jobs "
+                    "WHERE %(business_id)s::text IS NULL OR business_id = %(business_id)s "
+                    "ORDER BY created_at DESC LIMIT %(limite)s",
+                    {"business_id": business_id, "limite": limite},
+                )
+                return [_fechas_iso(f) for f in cur.fetchall()]
+
+    def _siguiente_lote(self, conn, business_id: str, user_ids: list, cursor: str) -> list:
+        if user_ids is None:
+            prefijo = f"{business_id}:"
+            # ';' es el carácter siguiente a ':': con orden por bytes el negocio es un rango contiguo
+            collation = (conn.execute(SQL_COLLATION).fetchone()[0] or "").lower()
+            por_bytes = collation in ("c", "posix") or collation.startswith("c.")
+            return [r[0] for r in conn.execute(SQL_LOTE_NEGOCIO, {
+                "desde": cursor, "inicio": prefijo if por_bytes else "", "fin": f"{business_id};" if por_bytes else None,
+                "prefijo": prefijo, "business_id": business_id, "limite": self.tamano_lote,
+            }).fetchall()]
+        thread_ids = sorted(f"{business_id}:{u}" for u in user_ids)
+        return [t for t in thread_ids if t > cursor][:self.tamano_lote]
+
+    def _ejecutar(self, job_id: str):
+        try:
+            with self._conexion() as conn:
+                business_id, user_ids, cursor = conn.execute(
+                    "SELECT business_id, user_ids, cursor FROM memory_purge_jobs WHERE job_id = %s", (job_id,)
+                ).fetchone()
+
+            while True:
+                inicio = time.perf_counter()
+                with self._conexion() as conn:
+                    with conn.transaction():
+                        thread_ids = self._siguiente_lote(conn, business_id, user_ids, cursor)
+                        if not thread_ids:
+                            break
+                        filas = borrar_memoria_threads(conn, thread_ids)
+                        cursor = thread_ids[-1]
+                        conn.execute(SQL_PROGRESO, {
+                            "job_id": job_id, "cursor": cursor, "threads": len(thread_ids),
+                            "filas": sum(filas.values()),
+                        })
+                for tabla in TABLAS_CHECKPOINT:
+                    purga_filas.inc(filas[tabla], table=tabla)
+                logger.debug(f"🧽 Purga {job_id}: lote hasta {cursor} ({sum(filas.values())} filas)")
+
+                duracion = time.perf_counter() - inicio
+                time.sleep(max(self.pausa_min_seg, duracion * (1 / self.ciclo_util - 1)))
+
+            with self._conexion() as conn:
+                conn.execute(SQL_FINALIZAR, ("done", None, job_id))
+            logger.info(f"🧽 Purga de memoria {job_id} terminada ({business_id})")
+        except Exception as e:
+            logger.error(f"🔴 Error en la purga de memoria {job_id}: {e}")
+            try:
+                with self._conexion() as conn:
+                    conn.execute(SQL_FINALIZAR, ("error", str(e)[:500], job_id))
+            except Exception:
+                pass
+
+
+def _crear_purga() -> PurgaMemoria:
+    try:
+        tamano_lote = int(os.getenv("MEMORY_PURGE_BATCH", "200"))
+    except Exception:
+        tamano_lote = 200
+
+    try:
+        pausa_min_seg = float(os.getenv("MEMORY_PURGE_PAUSA_MS", "100")) / 1000
+    except Exception:
+        pausa_min_seg = 0.1
+
+    try:
+        ciclo_util = float(os.getenv("MEMORY_PURGE_DUTY", "0.5"))
+    except Exception:
+        ciclo_util = 0.5
+
+    try:
+        vencido_seg = float(os.getenv("MEMORY_PURGE_STALE_SEG", "300"))
+    except Exception:
+        vencido_seg = 300.0
+
+    return PurgaMemoria(tamano_lote=tamano_lote, pausa_min_seg=pausa_min_seg, ciclo_util=ciclo_util,
+                        vencido_seg=vencido_seg)
+
+
+purga_memoria = _crear_purga()
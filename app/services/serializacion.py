@@ -0,0 +1,135 @@
+"""
+Serializador comprimido para checkpoint_blobs y checkpoint_writes
+=================================================================
+
+SerializadorComprimido envuelve al serializador de LangGraph (JsonPlusSerializer: msgpack
+con tipos extendidos para mensajes de LangChain) y comprime con zstd lo que guarda en
+checkpoint_blobs / checkpoint_writes:
+
+- Escritura: (tipo, datos) del serializador base -> (f"{tipo}+zstd", zstd(datos)). Valores
+  menores a CHECKPOINT_ZSTD_MIN_BYTES se guardan sin comprimir.
+- Diccionario compartido (CHECKPOINT_ZSTD_DICT): entrenado con nuestros propios mensajes
+  (Support/entrenar_diccionario_zstd.py). Los mensajes de WhatsApp, tool outputs de Tienda
+  Nube o calendario repiten las mismas claves y estructuras, que el diccionario ya conoce.
+- Lectura: cada frame zstd trae el id de su diccionario; se cargan todos los *.dict de la
+  carpeta del diccionario activo, así que rotarlo no deja filas ilegibles. Las filas sin
+  sufijo +zstd (las existentes) se leen con el serializador base.
+
+CHECKPOINT_COMPRESSION=none vuelve a escribir sin comprimir (la lectura de filas +zstd sigue
+funcionando mientras zstandard esté instalado).
+Ver Support/bench_checkpoint_serde.py para medir bytes y tiempos con historias reales.
+"""
+
+import os
+import glob
+import threading
+from loguru import logger
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+try:
+    import zstandard
+    _HAS_ZSTD = True
+except Exception:
+    _HAS_ZSTD = False
+
+SUFIJO = "+zstd"
+
+
+def cargar_diccionario(ruta: str):
+    with open(ruta, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+class SerializadorComprimido:
+    """SerializerProtocol de LangGraph: delega en `base` y comprime/descomprime con zstd."""
+
+    def __init__(self, base=None, nivel: int = 3, min_bytes: int = 256, diccionario=None,
+                 diccionarios_lectura: list = None, comprimir: bool = True):
+        self.base = base or JsonPlusSerializer()
+        self.nivel = nivel
+        self.min_bytes = min_bytes
+        self.diccionario = diccionario
+        self.comprimir = comprimir and _HAS_ZSTD
+        self._diccionarios = {d.dict_id(): d for d in (diccionarios_lectura or [])}
+        if diccionario is not None:
+            self._diccionarios[diccionario.dict_id()] = diccionario
+        # Compresores y descompresores de zstandard no son thread-safe: uno por hilo
+        self._local = threading.local()
+
+    # Compatibilidad con SerializerProtocol (dumps/loads sin tipo)
+    def dumps(self, obj):
+        return self.base.dumps(obj)
+
+    def loads(self, data):
+        return self.base.loads(data)
+
+    def _compresor(self):
+        compresor = getattr(self._local, "compresor", None)
+        if compresor is None:
+            compresor = self._local.compresor = zstandard.ZstdCompressor(level=self.nivel, dict_data=self.diccionario)
+        return compresor
+
+    def _descompresor(self, dict_id: int):
+        descompresores = getattr(self._local, "descompresores", None)
+        if descompresores is None:
+            descompresores = self._local.descompresores = {}
+        descompresor = descompresores.get(dict_id)
+        if descompresor is None:
+            if dict_id and dict_id not in self._diccionarios:
+                raise ValueError(f"Diccionario zstd {dict_id} no disponible (ver CHECKPOINT_ZSTD_DICT)")
+            descompresor = descompresores[dict_id] = zstandard.ZstdDecompressor(dict_data=self._diccionarios.get(dict_id))
+        return descompresor
+
+    def dumps_typed(self, obj):
+        tipo, datos = self.base.dumps_typed(obj)
+        if not self.comprimir or tipo == "null" or len(datos) < self.min_bytes:
+            return tipo, datos
+        return tipo + SUFIJO, self._compresor().compress(datos)
+
+    def descomprimir(self, tipo: str, datos: bytes) -> tuple:
+        """(tipo, datos) tal como los escribió el serializador base."""
+        if not tipo.endswith(SUFIJO):
+            return tipo, datos
+        if not _HAS_ZSTD:
+            raise RuntimeError("Checkpoint comprimido con zstd y el paquete zstandard no está instalado")
+        dict_id = zstandard.get_frame_parameters(datos).dict_id
+        return tipo[:-len(SUFIJO)], self._descompresor(dict_id).decompress(datos)
+
+    def loads_typed(self, data):
+        return self.base.loads_typed(self.descomprimir(*data))
+
+
+def _crear_serializador() -> SerializadorComprimido:
+    comprimir = os.getenv("CHECKPOINT_COMPRESSION", "zstd").lower() == "zstd"
+    if not _HAS_ZSTD:
+        if comprimir:
+            logger.warning("⚠️ zstandard no instalado: checkpoints sin comprimir")
+        return SerializadorComprimido(comprimir=False)
+
+    try:
+        nivel = int(os.getenv("CHECKPOINT_ZSTD_LEVEL", "3"))
+    except Exception:
+        nivel = 3
+
+    try:
+        min_bytes = int(os.getenv("CHECKPOINT_ZSTD_MIN_BYTES", "256"))
+    except Exception:
+        min_bytes = 256
+
+    diccionario, lectura = None, []
+    ruta = os.getenv("CHECKPOINT_ZSTD_DICT", "")
+    if ruta:
+        try:
+            diccionario = cargar_diccionario(ruta)
+            for otra in glob.glob(os.path.join(os.path.dirname(ruta) or ".", "*.dict")):
+                if os.path.abspath(otra) != os.path.abspath(ruta):
+                    lectura.append(cargar_diccionario(otra))
+            logger.info(f"🗜️ Diccionario zstd de checkpoints {diccionario.dict_id()} cargado ({len(lectura)} anteriores para lectura)")
+        except Exception as e:
+            logger.error(f"🔴 No se pudo cargar el diccionario zstd {ruta}: {e}. Se comprime sin diccionario")
+
+    return SerializadorComprimido(nivel=nivel, min_bytes=min_bytes, diccionario=diccionario,
+                                  diccionarios_lectura=lectura, comprimir=comprimir)
+
+
+serializador_checkpoints = _crear_serializador()
@@ -0,0 +1,214 @@
+"""
+Expiración de sesiones (memoria del checkpointer)
+=================================================
+
+- session_activity: una fila por thread con su última actividad y su vencimiento
+  (last_activity + TTL del negocio). Cada mensaje hace un único UPSERT por PK que además
+  devuelve si la sesión ya estaba vencida: sin escanear `checkpoints`.
+- Barrido en segundo plano: un solo worker a la vez (advisory lock) borra los threads
+  vencidos en lotes de SESSION_SWEEP_BATCH por transacción, usando el índice de expires_at.
+- Si un usuario vuelve antes de que el barrido llegue a su thread, se limpia en línea
+  (solo ese thread) para no responder con memoria vencida.
+"""
+
+import os
+import time
+import threading
+import psycopg
+from psycopg.types.json import Jsonb
+from loguru import logger
+from app.db import get_pool, conexion_dedicada
+from ..utils.utilities import get_app_configs
+
+ADVISORY_LOCK_ID = 72026035
+
+TABLAS_CHECKPOINT = ("checkpoint_writes", "checkpoint_blobs", "checkpoints")
+
+SQL_CREAR_TABLA = """
+CREATE TABLE IF NOT EXISTS session_activity (
+    thread_id VARCHAR(150) PRIMARY KEY,
+    business_id VARCHAR(50) NOT NULL DEFAULT '',
+    last_activity TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_session_activity_expires_at
+    ON session_activity (expires_at) WHERE expires_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_session_activity_business
+    ON session_activity (business_id, thread_id);
+"""
+
+# El CTE lee la fila previa (snapshot anterior al UPSERT) para saber si ya estaba vencida
+SQL_REGISTRAR_ACTIVIDAD = """
+WITH previo AS (
+    SELECT expires_at FROM session_activity WHERE thread_id = %(thread_id)s
+)
+INSERT INTO session_activity AS s (thread_id, business_id, last_activity, expires_at)
+VALUES (%(thread_id)s, %(business_id)s, NOW(), NOW() + make_interval(mins => %(ttl)s))
+ON CONFLICT (thread_id) DO UPDATE SET
+    business_id = EXCLUDED.business_id,
+    last_activity = EXCLUDED.last_activity,
+    expires_at = EXCLUDED.expires_at
+RETURNING COALESCE((SELECT expires_at FROM previo) < NOW(), FALSE)
+"""
+
+# Threads que ya tenían historia al crear la tabla: vencimiento con el TTL actual del negocio
+SQL_BACKFILL = """
+INSERT INTO session_activity (thread_id, business_id, last_activity, expires_at)
+SELECT thread_id, split_part(thread_id, ':', 1), MAX(created_at),
+       MAX(created_at) + make_interval(mins => COALESCE((%s::jsonb ->> split_part(thread_id, ':', 1))::int, %s))
+FROM checkpoints
+GROUP BY thread_id
+ON CONFLICT (thread_id) DO NOTHING
+"""
+
+SQL_LOTE_VENCIDO = """
+SELECT thread_id FROM session_activity
+WHERE expires_at < NOW()
+ORDER BY expires_at
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+
+def borrar_memoria_threads(conn, thread_ids: list) -> dict:
+    """Borra la memoria de los threads (llamar dentro de una transacción). Retorna filas borradas por tabla."""
+    filas = {}
+    for tabla in TABLAS_CHECKPOINT:
+        filas[tabla] = conn.execute(f"DELETE FROM {tabla} WHERE thread_id = ANY(%s)", (thread_ids,)).rowcount
+    conn.execute("DELETE FROM session_activity WHERE thread_id = ANY(%s)", (thread_ids,))
+    return filas
+
+
+def asegurar_tabla_sesiones(conn):
+    """Crea session_activity; si no existía, la completa con los threads actuales de `checkpoints`."""
+    conn.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+    try:
+        existia = conn.execute("SELECT to_regclass('session_activity') IS NOT NULL").fetchone()[0]
+        conn.execute(SQL_CREAR_TABLA)
+        if existia or not conn.execute("SELECT to_regclass('checkpoints') IS NOT NULL").fetchone()[0]:
+            return
+
+        ttl_por_negocio = {
+            business_id: cfg.get("ttl_sesion_minutos")
+            for business_id, cfg in (get_app_configs() or {}).items()
+            if isinstance(cfg, dict) and cfg.get("ttl_sesion_minutos")
+        }
+        inicio = time.perf_counter()
+        filas = conn.execute(SQL_BACKFILL, (Jsonb(ttl_por_negocio), 60)).rowcount
+        logger.info(f"🧹 session_activity creada con {filas} threads existentes en {time.perf_counter() - inicio:.1f}s")
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+
+
+def gestionar_expiracion_sesion(pool, thread_id: str, ttl_minutos: int):
+    """
+    Registra la actividad del thread y verifica si la sesión había vencido ('ttl_minutos'
+    sin mensajes). Si es así, BORRA la memoria (checkpoints) de ese thread.
+    Retorna True si se reseteó la memoria, False si continúa la charla.
+    """
+    if ttl_minutos <= 0:
+        return False # Si es 0, nunca expira
+
+    business_id = thread_id.split(':')[0] if ':' in thread_id else ""
+
+    # Reintentar una vez si la conexión fue terminada externamente por Postgres (AdminShutdown)
+    for intento in range(2):
+        try:
+            with pool.connection() as conn:
+                vencida = conn.execute(
+                    SQL_REGISTRAR_ACTIVIDAD,
+                    {"thread_id": thread_id, "business_id": business_id, "ttl": ttl_minutos},
+                ).fetchone()[0]
+                if not vencida:
+                    return False
+
+                # El barrido todavía no pasó por este thread: limpiarlo ahora (conserva la actividad nueva)
+                logger.info(f"🧹 Limpiando memoria de {thread_id} (sesión vencida antes del barrido)")
+                with conn.transaction():
+                    for tabla in TABLAS_CHECKPOINT:
+                        conn.execute(f"DELETE FROM {tabla} WHERE thread_id = %s", (thread_id,))
+                return True
+
+        except Exception as e:
+            if intento == 0 and isinstance(e, (psycopg.errors.AdminShutdown, psycopg.OperationalError)):
+                logger.warning(f"[DB] Conexión terminada por Postgres, reintentando... ({e})")
+                continue
+            logger.exception(f"[DB] Error en gestionar_expiracion_sesion para {thread_id}: {e}")
+            return False
+    return False
+
+
+def barrer_sesiones_vencidas(tamano_lote: int = 500, max_lotes: int = 100) -> dict:
+    """
+    Una pasada del barrido. Solo la ejecuta el worker que obtiene el advisory lock.
+    Cada lote es una transacción propia (como máximo `tamano_lote` threads).
+
+    Returns:
+        {"purged": int, "batches": int, "skipped": bool}
+    """
+    resultado = {"purged": 0, "batches": 0, "skipped": False}
+    if not get_pool("admin"):
+        return resultado
+
+    # Conexión propia: el advisory lock de sesión no ocupa el pool admin durante el barrido
+    with conexion_dedicada("admin") as conn:
+        if not conn.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_ID,)).fetchone()[0]:
+            resultado["skipped"] = True
+            return resultado
+        try:
+            while resultado["batches"] < max_lotes:
+                with conn.transaction():
+                    thread_ids = [r[0] for r in conn.execute(SQL_LOTE_VENCIDO, (tamano_lote,)).fetchall()]
+                    if thread_ids:
+                        borrar_memoria_threads(conn, thread_ids)
+                if not thread_ids:
+                    break
+                resultado["purged"] += len(thread_ids)
+                resultado["batches"] += 1
+                if len(thread_ids) < tamano_lote:
+                    break
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+    return resultado
+
+
+def _leer_config():
+    try:
+        intervalo_seg = float(os.getenv("SESSION_SWEEP_SEG", "60"))
+    except Exception:
+        intervalo_seg = 60.0
+
+    try:
+        tamano_lote = int(os.getenv("SESSION_SWEEP_BATCH", "500"))
+    except Exception:
+        tamano_lote = 500
+
+    return intervalo_seg, tamano_lote
+
+
+def iniciar_barrido_sesiones():
+    """Crea la tabla (bloqueante) y arranca el hilo demonio del barrido de sesiones vencidas."""
+    pool = get_pool("admin")
+    if not pool:
+        return
+    try:
+        with pool.connection() as conn:
+            asegurar_tabla_sesiones(conn)
+    except Exception as e:
+        logger.error(f"🔴 Error creando session_activity: {e}")
+        return
+
+    intervalo_seg, tamano_lote = _leer_config()
+
+    def _loop():
+        while True:
+            time.sleep(intervalo_seg)
+            try:
+                resultado = barrer_sesiones_vencidas(tamano_lote)
+                if resultado["purged"]:
+                    logger.info(f"🧹 Barrido de sesiones: {resultado['purged']} threads vencidos eliminados en {resultado['batches']} lotes")
+            except Exception as e:
+                logger.error(f"🔴 Error en el barrido de sesiones vencidas: {e}")
+
+    threading.Thread(target=_loop, name="session-sweeper", daemon=True).start()
+    logger.info(f"🧹 Barrido de sesiones vencidas cada {intervalo_seg}s (lotes de {tamano_lote})")
@@ -0,0 +1,150 @@
+"""
+Transcripción en segmentos de notas de voz largas
+=================================================
+
+Una nota más larga que TRANSCRIPCION_SEGMENTO_SEG se corta en segmentos de ese largo,
+buscando el silencio más cercano a cada corte dentro de ±TRANSCRIPCION_VENTANA_SEG (si no
+hay silencio se corta en el punto exacto). Cada segmento se extiende TRANSCRIPCION_SOLAPE_MS
+hacia ambos lados para no perder palabras en el borde, los segmentos se transcriben en
+paralelo (TRANSCRIPCION_PARALELO) y los textos se unen en orden, quitando las palabras
+repetidas por el solape.
+
+Se registra la latencia de cada segmento y el tiempo total de pared; la suma de las
+latencias de los segmentos es lo que habría tardado la misma transcripción en serie.
+"""
+
+import io
+import os
+import re
+import time
+from typing import Callable, Optional
+from loguru import logger
+from app.utils.metrics import ExecutorMedido, transcripcion_segmento, transcripcion_total
+
+FORMATO_SEGMENTO = "mp3"
+
+
+def _leer_config():
+    try:
+        segmento_seg = float(os.getenv("TRANSCRIPCION_SEGMENTO_SEG", "60"))
+    except Exception:
+        segmento_seg = 60.0
+    try:
+        ventana_seg = float(os.getenv("TRANSCRIPCION_VENTANA_SEG", "10"))
+    except Exception:
+        ventana_seg = 10.0
+    try:
+        solape_ms = int(os.getenv("TRANSCRIPCION_SOLAPE_MS", "1000"))
+    except Exception:
+        solape_ms = 1000
+    try:
+        paralelo = max(1, int(os.getenv("TRANSCRIPCION_PARALELO", "4")))
+    except Exception:
+        paralelo = 4
+    return segmento_seg, ventana_seg, solape_ms, paralelo
+
+
+SEGMENTO_SEG, VENTANA_SEG, SOLAPE_MS, PARALELO = _leer_config()
+_executor = ExecutorMedido(max_workers=PARALELO, nombre="transcripcion")
+
+
+def requiere_segmentar(duracion_seg: float) -> bool:
+    return SEGMENTO_SEG > 0 and duracion_seg > SEGMENTO_SEG
+
+
+def _corte_en_silencio(audio, objetivo_ms: int, minimo_ms: int) -> int:
+    """Centro del silencio más cercano a objetivo_ms (entre minimo_ms y el final), u objetivo_ms."""
+    from pydub import silence
+
+    ventana_ms = int(VENTANA_SEG * 1000)
+    desde = max(minimo_ms, objetivo_ms - ventana_ms)
+    hasta = min(len(audio), objetivo_ms + ventana_ms)
+    silencios = silence.detect_silence(
+        audio[desde:hasta], min_silence_len=300, silence_thresh=audio.dBFS - 16, seek_step=10
+    )
+    candidatos = [desde + (a + b) // 2 for a, b in silencios]
+    if not candidatos:
+        return objetivo_ms
+    return min(candidatos, key=lambda c: abs(c - objetivo_ms))
+
+
+def segmentar(audio_buffer: bytes, formato: str) -> list:
+    """[(desde_ms, hasta_ms, bytes mp3)] en orden; cada segmento ya incluye el solape."""
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(io.BytesIO(audio_buffer), format=formato).set_channels(1)
+    largo = len(audio)
+    objetivo_ms = int(SEGMENTO_SEG * 1000)
+    if audio.dBFS == float("-inf"):
+        cortes = []  # Todo silencio: no hay dónde buscar
+    else:
+        cortes, inicio = [], 0
+        while largo - inicio > objetivo_ms:
+            corte = _corte_en_silencio(audio, inicio + objetivo_ms, inicio + 1000)
+            cortes.append(corte)
+            inicio = corte
+
+    segmentos = []
+    for inicio, fin in zip([0] + cortes, cortes + [largo]):
+        desde, hasta = max(0, inicio - SOLAPE_MS), min(largo, fin + SOLAPE_MS)
+        buffer = io.BytesIO()
+        audio[desde:hasta].export(buffer, format=FORMATO_SEGMENTO, bitrate="48k")
+        segmentos.append((desde, hasta, buffer.getvalue()))
+    return segmentos
+
+
+def _normalizar(palabra: str) -> str:
+    return re.sub(r"[^\w]", "", palabra.lower())
+
+
+def unir_textos(textos: list, max_solape_palabras: int = 8) -> str:
+    """Une los textos en orden quitando el prefijo de cada uno que repite el final del anterior."""
+    palabras = []
+    for texto in textos:
+        if not texto:
+            continue  # Segmento de silencio: no corta el solape entre sus vecinos
+        nuevas = texto.split()
+        repetidas = 0
+        for n in range(min(max_solape_palabras, len(palabras), len(nuevas)), 0, -1):
+            if [_normalizar(p) for p in palabras[-n:]] == [_normalizar(p) for p in nuevas[:n]]:
+                repetidas = n
+                break
+        palabras.extend(nuevas[repetidas:])
+    return " ".join(palabras)
+
+
+def transcribir_en_segmentos(audio_buffer: bytes, formato: str, transcribir: Callable,
+                             proveedor: str) -> tuple[Optional[str], float]:
+    """
+    Transcribe la nota en segmentos paralelos. `transcribir(bytes, formato)` transcribe un
+    segmento y devuelve su texto ("" si el segmento es silencio) o None si falla.
+
+    Returns:
+        (texto unido o None si falló algún segmento, segundos de audio enviados incluyendo solapes)
+    """
+    inicio = time.perf_counter()
+    segmentos = segmentar(audio_buffer, formato)
+    segundos_enviados = sum(hasta - desde for desde, hasta, _ in segmentos) / 1000
+
+    def _uno(datos: bytes) -> tuple:
+        t0 = time.perf_counter()
+        texto = transcribir(datos, FORMATO_SEGMENTO)
+        latencia = time.perf_counter() - t0
+        transcripcion_segmento.observe(latencia, provider=proveedor)
+        return texto, latencia
+
+    resultados = list(_executor.map(_uno, [datos for _, _, datos in segmentos]))
+    pared = time.perf_counter() - inicio
+    transcripcion_total.observe(pared, provider=proveedor, mode="chunked")
+
+    serie = sum(latencia for _, latencia in resultados)
+    logger.info(
+        f"[AUDIO] {len(segmentos)} segmentos transcritos en {pared:.1f}s de pared "
+        f"(serie: {serie:.1f}s, máx. segmento: {max(l for _, l in resultados):.1f}s)"
+    )
+    # Un texto vacío es un segmento sin voz (pausa larga, música): solo None es un fallo
+    fallidos = sum(1 for texto, _ in resultados if texto is None)
+    if fallidos:
+        logger.error(f"❌ [AUDIO] Falló la transcripción de {fallidos} segmentos")
+        return None, segundos_enviados
+    return unir_textos([texto for texto, _ in resultados]), segundos_enviados
@@ -0,0 +1,195 @@
+"""
+Cliente de Whisper local (TRANSCRIPTION_PROVIDER=whisper-local)
+===============================================================
+
+Las notas se transcriben en un único servidor por host (whisper_worker.py, en la raíz del
+repo) que comparten todos los workers de gunicorn: el modelo se carga WHISPER_PROCESOS veces
+por host y no una vez por worker. Este módulo le manda los bytes por el socket Unix
+WHISPER_SOCKET y, si el servidor no está corriendo, lo lanza (si otro worker lo lanza al
+mismo tiempo, el flock del servidor deja uno solo).
+
+- Backends: "whisper" (openai-whisper) o "faster-whisper" (CTranslate2, con
+  WHISPER_COMPUTE_TYPE=int8 en CPU: menos memoria y más rápido sin GPU).
+- Contrapresión: como máximo WHISPER_PROCESOS + WHISPER_COLA_MAX notas en curso en el host.
+  Una nota que no consigue lugar en WHISPER_ESPERA_SEG se rechaza (transcribir devuelve None).
+- Métricas: notas en cola y en proceso del servidor (sisagent_whisper_queue_depth) y factor
+  de tiempo real (segundos de proceso / segundos de audio, sisagent_whisper_rtf).
+"""
+
+import os
+import sys
+import time
+import subprocess
+import threading
+from multiprocessing.connection import Client
+from typing import Optional
+from loguru import logger
+from app.utils.metrics import whisper_rtf, whisper_rechazos
+
+SOCKET_DEFAULT = "/tmp/sisagent-whisper.sock"
+SERVIDOR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "whisper_worker.py"))
+LANZAMIENTO_CADA_SEG = 10.0
+
+
+class PoolWhisper:
+    def __init__(self, modelo="base", backend="whisper", compute_type="int8", procesos=1,
+                 cola_max=4, espera_seg=30.0, timeout_seg=300.0, direccion=SOCKET_DEFAULT, authkey=None):
+        self.modelo = modelo
+        self.backend = backend
+        self.compute_type = compute_type
+        self.procesos = max(1, procesos)
+        self.cola_max = max(0, cola_max)
+        self.espera_seg = espera_seg
+        self.timeout_seg = timeout_seg
+        self.direccion = direccion
+        self.authkey = authkey
+
+        self._lock = threading.Lock()
+        self._ultimo_lanzamiento = 0.0
+
+        self.transcriptas = 0
+        self.rechazadas = 0
+        self.fallidas = 0
+        self.segundos_audio = 0.0
+        self.segundos_proceso = 0.0
+
+    def _lanzar_servidor(self):
+        """Arranca whisper_worker.py desacoplado del worker (a lo sumo una vez cada LANZAMIENTO_CADA_SEG)."""
+        with self._lock:
+            if time.monotonic() - self._ultimo_lanzamiento < LANZAMIENTO_CADA_SEG:
+                return
+            self._ultimo_lanzamiento = time.monotonic()
+        try:
+            subprocess.Popen([sys.executable, SERVIDOR], start_new_session=True,
+                             stdin=subprocess.DEVNULL, close_fds=True)
+            logger.info(f"🎙️ Lanzando el servidor de Whisper local ({SERVIDOR}) en {self.direccion}")
+        except Exception as e:
+            logger.error(f"🔴 [AUDIO] No se pudo lanzar el servidor de Whisper local: {e}")
+
+    def _conectar(self, lanzar: bool = True, espera_seg: float = 0.0):
+        """Conexión al servidor; si no responde y `lanzar`, lo arranca y reintenta hasta `espera_seg`."""
+        limite = time.monotonic() + espera_seg
+        while True:
+            try:
+                return Client(self.direccion, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not lanzar or time.monotonic() >= limite:
+                    raise
+                self._lanzar_servidor()
+                time.sleep(0.2)
+
+    def iniciar(self):
+        """Se asegura de que el servidor del host esté corriendo (la carga del modelo sigue en segundo plano)."""
+        try:
+            self._conectar(espera_seg=5.0).close()
+            logger.info(
+                f"🎙️ Whisper local en {self.direccion}: {self.procesos} procesos por host, modelo '{self.modelo}' "
+                f"({self.backend}{', ' + self.compute_type if self.backend == 'faster-whisper' else ''}), "
+                f"cola máx {self.cola_max}"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Servidor de Whisper local todavía no disponible en {self.direccion}: {e}")
+
+    def transcribir(self, audio_buffer: bytes, idioma: str = "es") -> Optional[str]:
+        """Texto transcripto, o None si la cola está llena o la transcripción falla."""
+        try:
+            conn = self._conectar(espera_seg=self.espera_seg)
+        except Exception as e:
+            self.fallidas += 1
+            logger.error(f"🔴 [AUDIO] Servidor de Whisper local no disponible: {e}")
+            return None
+
+        try:
+            conn.send(("transcribir", audio_buffer, idioma))
+            # El servidor espera hasta espera_seg por un cupo y hasta timeout_seg por la nota
+            if not conn.poll(self.espera_seg + self.timeout_seg + 5):
+                raise TimeoutError(f"sin respuesta en {self.espera_seg + self.timeout_seg:.0f}s")
+            respuesta = conn.recv()
+        except Exception as e:
+            self.fallidas += 1
+            logger.error(f"🔴 [AUDIO] Error en Whisper local: {e}")
+            return None
+        finally:
+            conn.close()
+
+        if respuesta[0] == "lleno":
+            self.rechazadas += 1
+            whisper_rechazos.inc()
+            logger.warning(f"⚠️ [AUDIO] Cola de Whisper local llena ({respuesta[1]} notas en curso), nota rechazada")
+            return None
+        if respuesta[0] != "ok":
+            self.fallidas += 1
+            logger.error(f"🔴 [AUDIO] Error en Whisper local: {respuesta[1]}")
+            return None
+
+        _, texto, segundos_audio, segundos_proceso = respuesta
+        self.transcriptas += 1
+        self.segundos_audio += segundos_audio
+        self.segundos_proceso += segundos_proceso
+        if segundos_audio > 0:
+            whisper_rtf.observe(segundos_proceso / segundos_audio, backend=self.backend)
+        logger.debug(f"[AUDIO] Whisper local: {segundos_audio:.1f}s de audio en {segundos_proceso:.1f}s")
+        return texto
+
+    def profundidad(self) -> dict:
+        """Notas esperando un proceso libre y notas transcribiéndose en el servidor del host ({} si no corre)."""
+        try:
+            conn = self._conectar(lanzar=False)
+        except Exception:
+            return {}
+        try:
+            conn.send(("estado",))
+            if not conn.poll(1.0):
+                return {}
+            estado, valor = conn.recv()
+            return valor if estado == "ok" else {}
+        except Exception:
+            return {}
+        finally:
+            conn.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "model": self.modelo,
+            "backend": self.backend,
+            "processes": self.procesos,
+            "socket": self.direccion,
+            **self.profundidad(),
+            "transcribed": self.transcriptas,
+            "rejected": self.rechazadas,
+            "failed": self.fallidas,
+            "rtf": round(self.segundos_proceso / self.segundos_audio, 3) if self.segundos_audio else None,
+        }
+
+
+def _crear_pool_whisper():
+    try:
+        procesos = int(os.getenv("WHISPER_PROCESOS", "1"))
+    except Exception:
+        procesos = 1
+    try:
+        cola_max = int(os.getenv("WHISPER_COLA_MAX", "4"))
+    except Exception:
+        cola_max = 4
+    try:
+        espera_seg = float(os.getenv("WHISPER_ESPERA_SEG", "30"))
+    except Exception:
+        espera_seg = 30.0
+    try:
+        timeout_seg = float(os.getenv("WHISPER_TIMEOUT_SEG", "300"))
+    except Exception:
+        timeout_seg = 300.0
+    return PoolWhisper(
+        modelo=os.getenv("WHISPER_MODEL", "base"),
+        backend=os.getenv("WHISPER_BACKEND", "whisper").lower(),
+        compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8"),
+        procesos=procesos,
+        cola_max=cola_max,
+        espera_seg=espera_seg,
+        timeout_seg=timeout_seg,
+        direccion=os.getenv("WHISPER_SOCKET", SOCKET_DEFAULT),
+        authkey=os.getenv("WHISPER_AUTHKEY", "").encode() or None,
+    )
+
+
+pool_whisper = _crear_pool_whisper()
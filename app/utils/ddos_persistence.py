@@ -0,0 +1,288 @@
+"""
+Persistencia del estado de protección DDoS en Postgres
+======================================================
+
+Blacklist, whitelist, contadores de auto-blacklist y el tracker de DMs de Instagram
+viven en memoria para que las verificaciones sean O(1). Este módulo los respalda en
+la tabla `ddos_state` para que sobrevivan a un deploy:
+
+- Escritura incremental: cada cambio se encola y un hilo demonio los vuelca en lote
+  (UPSERT/DELETE con executemany) cada DDOS_STATE_FLUSH_SEG segundos.
+- Carga en bloque: al iniciar el worker se lee toda la tabla con un único SELECT, después de
+  borrar los DMs cuyo cooldown ya venció (los usuarios que no vuelven a escribir nunca pasan
+  por TrackerRespuestasDM.ya_recibio_dm y su fila quedaría para siempre).
+- Sincronización: cada DDOS_STATE_RELOAD_SEG segundos se recarga blacklist/whitelist
+  para que los cambios hechos por un admin en otro worker de gunicorn se propaguen.
+"""
+
+import os
+import time
+import threading
+from loguru import logger
+from dotenv import load_dotenv
+from app.db import get_pool
+
+load_dotenv()
+
+# Tipos de entrada almacenados en la tabla
+TIPO_BLACKLIST = "blacklist"
+TIPO_WHITELIST = "whitelist"
+TIPO_SOSPECHOSO = "suspicious"
+TIPO_DM_ENVIADO = "dm_sent"
+
+SQL_CREAR_TABLA = """
+CREATE TABLE IF NOT EXISTS ddos_state (
+    entry_type VARCHAR(20) NOT NULL,
+    entry_key VARCHAR(100) NOT NULL,
+    value DOUBLE PRECISION DEFAULT 0,
+    reason VARCHAR(100),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (entry_type, entry_key)
+);
+"""
+
+SQL_UPSERT = """
+INSERT INTO ddos_state (entry_type, entry_key, value, reason, updated_at)
+VALUES (%s, %s, %s, %s, NOW())
+ON CONFLICT (entry_type, entry_key)
+DO UPDATE SET value = EXCLUDED.value, reason = EXCLUDED.reason, updated_at = NOW()
+"""
+
+SQL_DELETE = "DELETE FROM ddos_state WHERE entry_type = %s AND entry_key = %s"
+
+SQL_PURGAR_DMS = "DELETE FROM ddos_state WHERE entry_type = %s AND value < %s"
+
+
+class DDoSStateStore:
+    """Respaldo incremental en Postgres del estado en memoria de DDoSProtection."""
+
+    def __init__(self, flush_interval_seg=2.0, reload_interval_seg=30.0, dm_cooldown_seg=None):
+        self.flush_interval_seg = flush_interval_seg
+        self.reload_interval_seg = reload_interval_seg
+        self.dm_cooldown_seg = dm_cooldown_seg   # None: no se purgan los DMs vencidos
+
+        # Cambios pendientes coalescidos por (tipo, clave): solo importa el último
+        # { (tipo, clave): ("upsert", valor, motivo) | ("delete", None, None) }
+        self.pendientes = {}
+        self.lock = threading.Lock()
+
+        self.startup_load_ms = None     # Tiempo de la carga inicial del worker
+        self.ultimo_load_ms = None      # Tiempo de la última recarga periódica
+        self.filas_cargadas = 0
+        self.dms_purgados = 0
+        self.ultimo_flush = None
+        self.flush_errores = 0
+        self.escrituras_totales = 0
+
+        self._hilo = None
+        self._detener = threading.Event()
+        logger.info(f"DDoSStateStore inicializado: flush={flush_interval_seg}s, reload={reload_interval_seg}s")
+
+    # ------------------------------------------------------------------
+    # Registro de cambios (llamado desde las estructuras en memoria)
+    # ------------------------------------------------------------------
+    def registrar(self, tipo: str, clave: str, valor: float = 0.0, motivo: str = None):
+        """Encola un UPSERT de la entrada (no bloquea ni toca la DB)."""
+        with self.lock:
+            self.pendientes[(tipo, clave)] = ("upsert", float(valor), motivo)
+
+    def eliminar(self, tipo: str, clave: str):
+        """Encola el borrado de la entrada."""
+        with self.lock:
+            self.pendientes[(tipo, clave)] = ("delete", None, None)
+
+    # ------------------------------------------------------------------
+    # Acceso a la DB
+    # ------------------------------------------------------------------
+    def asegurar_tabla(self) -> bool:
+        pool = get_pool("analytics")
+        if not pool:
+            logger.warning("⚠️ DDoSStateStore: pool no inicializado, persistencia deshabilitada")
+            return False
+        with pool.connection() as conn:
+            conn.execute(SQL_CREAR_TABLA)
+        return True
+
+    def cargar(self) -> dict:
+        """
+        Borra los DMs fuera de cooldown y lee el resto de la tabla en un único SELECT,
+        agrupado por tipo.
+
+        Returns:
+            { tipo: { clave: (valor, motivo) } }
+        """
+        inicio = time.perf_counter()
+        estado = {TIPO_BLACKLIST: {}, TIPO_WHITELIST: {}, TIPO_SOSPECHOSO: {}, TIPO_DM_ENVIADO: {}}
+
+        pool = get_pool("analytics")
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                if self.dm_cooldown_seg:
+                    cur.execute(SQL_PURGAR_DMS, (TIPO_DM_ENVIADO, time.time() - self.dm_cooldown_seg))
+                    if cur.rowcount > 0:
+                        self.dms_purgados += cur.rowcount
+                        logger.debug(f"🧹 DDoSStateStore: {cur.rowcount} DMs fuera de cooldown eliminados")
+                cur.execute("SELECT entry_type, entry_key, value, reason FROM ddos_state")
+                filas = cur.fetchall()
+
+        for tipo, clave, valor, motivo in filas:
+            estado.setdefault(tipo, {})[clave] = (valor, motivo)
+
+        self.filas_cargadas = len(filas)
+        self.ultimo_load_ms = round((time.perf_counter() - inicio) * 1000, 2)
+        return estado
+
+    def flush(self) -> int:
+        """Vuelca en lote los cambios pendientes. Retorna la cantidad de filas escritas."""
+        with self.lock:
+            if not self.pendientes:
+                return 0
+            lote = self.pendientes
+            self.pendientes = {}
+
+        upserts = [(t, k, v, m) for (t, k), (op, v, m) in lote.items() if op == "upsert"]
+        deletes = [(t, k) for (t, k), (op, _, _) in lote.items() if op == "delete"]
+
+        try:
+            pool = get_pool("analytics")
+            with pool.connection() as conn:
+                with conn.transaction():
+                    with conn.cursor() as cur:
+                        if upserts:
+                            cur.executemany(SQL_UPSERT, upserts)
+                        if deletes:
+                            cur.executemany(SQL_DELETE, deletes)
+            self.ultimo_flush = time.time()
+            self.escrituras_totales += len(lote)
+            logger.debug(f"💾 DDoSStateStore: {len(upserts)} upserts y {len(deletes)} deletes persistidos")
+            return len(lote)
+
+        except Exception as e:
+            self.flush_errores += 1
+            logger.error(f"🔴 DDoSStateStore: error persistiendo estado ({len(lote)} cambios): {e}")
+            # Reencolamos sin pisar cambios más nuevos que hayan llegado mientras tanto
+            with self.lock:
+                for clave, cambio in lote.items():
+                    self.pendientes.setdefault(clave, cambio)
+            return 0
+
+    # ------------------------------------------------------------------
+    # Hilo de sincronización
+    # ------------------------------------------------------------------
+    def iniciar(self, on_reload=None):
+        """Arranca el hilo demonio que hace flush periódico y recarga listas."""
+        if self._hilo and self._hilo.is_alive():
+            return
+
+        def _loop():
+            ultimo_reload = time.time()
+            while not self._detener.wait(self.flush_interval_seg):
+                self.flush()
+                if on_reload and time.time() - ultimo_reload >= self.reload_interval_seg:
+                    ultimo_reload = time.time()
+                    try:
+                        on_reload()
+                    except Exception as e:
+                        logger.error(f"🔴 DDoSStateStore: error recargando estado: {e}")
+            # Último flush al apagar
+            self.flush()
+
+        self._hilo = threading.Thread(target=_loop, name="ddos-state-sync", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout=5)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            pendientes = len(self.pendientes)
+        return {
+            "startup_load_ms": self.startup_load_ms,
+            "last_reload_ms": self.ultimo_load_ms,
+            "rows_loaded": self.filas_cargadas,
+            "expired_dms_purged": self.dms_purgados,
+            "pending_writes": pendientes,
+            "total_writes": self.escrituras_totales,
+            "flush_errors": self.flush_errores,
+            "last_flush": time.strftime("%H:%M:%S", time.localtime(self.ultimo_flush)) if self.ultimo_flush else None,
+        }
+
+
+
+def _conectar_estructuras(store, ddos, tracker):
+    """Engancha el store a las estructuras en memoria para que registren sus cambios."""
+    if ddos:
+        ddos.blacklist.store = store
+    if tracker:
+        tracker.store = store
+
+
+def _aplicar_estado(estado: dict, ddos, tracker, solo_listas=False):
+    if ddos:
+        ddos.blacklist.cargar_snapshot(
+            blacklist=estado.get(TIPO_BLACKLIST, {}).keys(),
+            whitelist=estado.get(TIPO_WHITELIST, {}).keys(),
+            contadores=None if solo_listas else {k: int(v) for k, (v, _) in estado.get(TIPO_SOSPECHOSO, {}).items()},
+        )
+    if tracker and not solo_listas:
+        tracker.cargar_snapshot({k: v for k, (v, _) in estado.get(TIPO_DM_ENVIADO, {}).items()})
+
+
+def inicializar_persistencia_ddos(ddos, tracker):
+    """
+    Crea la tabla si no existe, carga el estado persistido en bloque y arranca el
+    hilo de sincronización. Se llama una vez por worker desde create_app().
+
+    Returns:
+        DDoSStateStore o None si la persistencia está deshabilitada o falló.
+    """
+    if os.getenv("DDOS_STATE_PERSISTENCE", "true").lower() != "true":
+        logger.warning("⚠️ Persistencia de estado DDoS deshabilitada por DDOS_STATE_PERSISTENCE=false")
+        return None
+
+    try:
+        flush_seg = float(os.getenv("DDOS_STATE_FLUSH_SEG", "2"))
+    except Exception:
+        flush_seg = 2.0
+
+    try:
+        reload_seg = float(os.getenv("DDOS_STATE_RELOAD_SEG", "30"))
+    except Exception:
+        reload_seg = 30.0
+
+    store = DDoSStateStore(
+        flush_interval_seg=flush_seg,
+        reload_interval_seg=reload_seg,
+        dm_cooldown_seg=tracker.cooldown_segundos if tracker else None,
+    )
+
+    try:
+        if not store.asegurar_tabla():
+            return None
+
+        estado = store.cargar()
+        store.startup_load_ms = store.ultimo_load_ms
+        _aplicar_estado(estado, ddos, tracker)
+        _conectar_estructuras(store, ddos, tracker)
+
+        logger.info(
+            f"⏱️ Estado DDoS cargado en {store.startup_load_ms}ms: "
+            f"{len(estado[TIPO_BLACKLIST])} blacklist, {len(estado[TIPO_WHITELIST])} whitelist, "
+            f"{len(estado[TIPO_SOSPECHOSO])} sospechosos, {len(estado[TIPO_DM_ENVIADO])} DMs en cooldown"
+        )
+
+    except Exception as e:
+        logger.exception(f"🔴 Error cargando estado DDoS persistido: {e}")
+        return None
+
+    def _recargar_listas():
+        # Flush previo para no pisar con el snapshot cambios locales aún no persistidos
+        store.flush()
+        _aplicar_estado(store.cargar(), ddos, None, solo_listas=True)
+        if tracker:
+            tracker.purgar_vencidos()
+
+    store.iniciar(on_reload=_recargar_listas if ddos else None)
+    return store
@@ -10,6 +10,8 @@ Capas de protección:
 5. Análisis de patrones de comportamiento
 6. Filtro del Loro (detectar loops de bots que repiten el mismo mensaje)
 7. Rastreo de DMs enviados para evitar spam a los usuarios (cooldown por usuario)
+
+El estado de las capas 4 y 7 se persiste en Postgres (ver ddos_persistence.py).
 """
 
 import os
@@ -20,6 +22,8 @@ from dotenv import load_dotenv
 from collections import defaultdict, deque
 from typing import Optional, Tuple, Set
 from datetime import datetime, timedelta
+from .ddos_persistence import TIPO_BLACKLIST, TIPO_WHITELIST, TIPO_SOSPECHOSO, TIPO_DM_ENVIADO
+from .metrics import ddos_bloqueos
 
 load_dotenv()
 
@@ -33,6 +37,9 @@ class TrackerRespuestasDM:
         # Diccionario en memoria: { "user_id": timestamp_del_ultimo_dm }
         self.usuarios_contactados = {}
         self.lock = Lock()
+
+        # DDoSStateStore opcional (se engancha al iniciar la app) para sobrevivir a deploys
+        self.store = None
     
     def ya_recibio_dm(self, user_id: str) -> bool:
         """Verifica si el usuario ya recibió un DM recientemente."""
@@ -47,13 +54,51 @@ class TrackerRespuestasDM:
                 else:
                     # El bloqueo expiró, lo borramos para liberar memoria
                     del self.usuarios_contactados[user_id]
+                    if self.store:
+                        self.store.eliminar(TIPO_DM_ENVIADO, user_id)
                     return False
             return False
             
     def registrar_envio(self, user_id: str):
         """Anota que a este usuario se le acaba de enviar un DM."""
         with self.lock:
-            self.usuarios_contactados[user_id] = time.time()
+            ahora = time.time()
+            self.usuarios_contactados[user_id] = ahora
+            if self.store:
+                self.store.registrar(TIPO_DM_ENVIADO, user_id, ahora)
+
+    def olvidar_usuario(self, user_id: str) -> bool:
+        """Quita el cooldown de un usuario (permite volver a enviarle un DM)."""
+        with self.lock:
+            existia = self.usuarios_contactados.pop(user_id, None) is not None
+            if self.store:
+                self.store.eliminar(TIPO_DM_ENVIADO, user_id)
+            return existia
+
+    def purgar_vencidos(self) -> int:
+        """Olvida en memoria los envíos fuera de cooldown (la fila en la DB la borra DDoSStateStore.cargar)."""
+        with self.lock:
+            ahora = time.time()
+            vencidos = [uid for uid, ts in self.usuarios_contactados.items() if ahora - ts >= self.cooldown_segundos]
+            for uid in vencidos:
+                del self.usuarios_contactados[uid]
+            return len(vencidos)
+
+    def cargar_snapshot(self, contactados: dict):
+        """Carga en bloque los envíos persistidos, descartando los que ya salieron del cooldown."""
+        with self.lock:
+            ahora = time.time()
+            vigentes = {uid: ts for uid, ts in contactados.items() if ahora - ts < self.cooldown_segundos}
+            self.usuarios_contactados.update(vigentes)
+            logger.info(f"TrackerRespuestasDM: {len(vigentes)} usuarios en cooldown restaurados")
+
+    def get_stats(self) -> dict:
+        """Obtiene estadísticas"""
+        with self.lock:
+            return {
+                "users_in_cooldown": len(self.usuarios_contactados),
+                "cooldown_hours": round(self.cooldown_segundos / 3600, 1)
+            }
 
 
 class GlobalRateLimiter:
@@ -243,8 +288,10 @@ class NumberBlacklist:
         self.blacklist: Set[str] = set()
         self.whitelist: Set[str] = set()
         self.auto_blacklist = defaultdict(int)  # contador de comportamiento sospechoso
+        self.whitelist_fija: Set[str] = set()  # números del propietario (vienen del .env, no se persisten)
         self.lock = Lock()
         self.auto_blacklist_threshold = auto_blacklist_threshold
+        self.store = None  # DDoSStateStore opcional
         logger.info(f"NumberBlacklist inicializado: auto_blacklist_threshold={auto_blacklist_threshold}")
     
     def is_blocked(self, number: str) -> Tuple[bool, str]:
@@ -259,17 +306,25 @@ class NumberBlacklist:
             
             return False, ""
 
-    def remove_from_blacklist(self, number: str):
-        """Remueve un número de la blacklist"""
+    def remove_from_blacklist(self, number: str) -> bool:
+        """Remueve un número de la blacklist (y resetea su contador de reportes)"""
         with self.lock:
-            if number in self.blacklist:
-                self.blacklist.discard(number)
+            existia = number in self.blacklist
+            self.blacklist.discard(number)
+            self.auto_blacklist.pop(number, None)
+            if self.store:
+                self.store.eliminar(TIPO_BLACKLIST, number)
+                self.store.eliminar(TIPO_SOSPECHOSO, number)
+            if existia:
                 logger.info(f"NumberBlacklist: número removido de blacklist: {number}")
+            return existia
     
     def add_to_blacklist(self, number: str, reason: str = "manual"):
         """Agrega un número a la blacklist"""
         with self.lock:
             self.blacklist.add(number)
+            if self.store:
+                self.store.registrar(TIPO_BLACKLIST, number, motivo=reason)
             logger.warning(f"⚠️ NumberBlacklist: número agregado a blacklist: {number} (razón: {reason})")
     
     def add_to_whitelist(self, number: str):
@@ -278,18 +333,51 @@ class NumberBlacklist:
             self.whitelist.add(number)
             # Remover de blacklist si estaba
             self.blacklist.discard(number)
+            if self.store:
+                self.store.registrar(TIPO_WHITELIST, number)
+                self.store.eliminar(TIPO_BLACKLIST, number)
             logger.info(f"NumberWhitelist: número agregado a whitelist: {number}")
+
+    def remove_from_whitelist(self, number: str) -> bool:
+        """Remueve un número de la whitelist (los números del propietario no se pueden quitar)"""
+        with self.lock:
+            if number in self.whitelist_fija:
+                logger.warning(f"⚠️ NumberWhitelist: {number} es número del propietario (DDOS_OWNER_NUMBERS), no se remueve")
+                return False
+            existia = number in self.whitelist
+            self.whitelist.discard(number)
+            if self.store:
+                self.store.eliminar(TIPO_WHITELIST, number)
+            if existia:
+                logger.info(f"NumberWhitelist: número removido de whitelist: {number}")
+            return existia
+
+    def cargar_snapshot(self, blacklist, whitelist, contadores: dict = None):
+        """
+        Reemplaza en bloque las listas con el estado persistido.
+        Si contadores es None se conservan los contadores en memoria (recarga periódica).
+        """
+        with self.lock:
+            self.blacklist = set(blacklist)
+            self.whitelist = set(whitelist) | self.whitelist_fija
+            self.blacklist -= self.whitelist
+            if contadores is not None:
+                self.auto_blacklist = defaultdict(int, contadores)
     
     def report_suspicious_behavior(self, number: str):
         """Reporta comportamiento sospechoso de un número"""
         with self.lock:
             self.auto_blacklist[number] += 1
+            if self.store:
+                self.store.registrar(TIPO_SOSPECHOSO, number, self.auto_blacklist[number])
             logger.warning(f"⚠️ NumberBlacklist: comportamiento sospechoso reportado para {number} (total: {self.auto_blacklist[number]})")
             # Auto-blacklist después de 3 reportes
             # NOTA: No llamar a add_to_blacklist() aquí porque también adquiere self.lock
             # y threading.Lock NO es reentrante → deadlock.
             if self.auto_blacklist[number] >= self.auto_blacklist_threshold:
                 self.blacklist.add(number)
+                if self.store:
+                    self.store.registrar(TIPO_BLACKLIST, number, motivo="auto")
                 logger.warning(f"⚠️ NumberBlacklist: número auto-bloqueado por comportamiento sospechoso: {number}")
     
     def get_stats(self) -> dict:
@@ -404,6 +492,7 @@ class DDoSProtection:
         # Agregar números del propietario a whitelist automáticamente
         if owner_numbers:
             for number in owner_numbers:
+                self.blacklist.whitelist_fija.add(number)
                 self.blacklist.add_to_whitelist(number)
                 logger.info(f"DDoSProtection: número del propietario en whitelist: {number}")
         
@@ -419,21 +508,25 @@ class DDoSProtection:
         # 1. Verificar blacklist
         blocked, msg = self.blacklist.is_blocked(number)
         if blocked:
+            ddos_bloqueos.inc(layer="blacklist")
             return False, msg
         
         # 2. Verificar circuit breaker
         puede, msg = self.circuit_breaker.puede_procesar()
         if not puede:
+            ddos_bloqueos.inc(layer="circuit_breaker")
             return False, msg
         
         # 3. Verificar rate limit global
         puede, msg = self.global_limiter.puede_procesar()
         if not puede:
+            ddos_bloqueos.inc(layer="global_rate")
             return False, msg
         
         # 4. Verificar detector de números nuevos
         puede, msg = self.new_number_detector.check_number(number)
         if not puede:
+            ddos_bloqueos.inc(layer="new_numbers")
             return False, msg
 
         # 5. NUEVA CAPA: Comportamiento del Usuario (Anti-Spam / Anti-Bot)
@@ -444,6 +537,7 @@ class DDoSProtection:
             self.reportar_sospechoso(number)
 
         if not puede:
+            ddos_bloqueos.inc(layer="bot_loop" if es_bot else "user_behavior")
             return False, msg
         
         return True, ""
@@ -472,7 +566,8 @@ class DDoSProtection:
             "new_numbers": self.new_number_detector.get_stats(),
             "circuit_breaker": self.circuit_breaker.get_stats(),
             "blacklist": self.blacklist.get_stats(),
-            "user_behavior": self.user_monitor.get_stats()
+            "user_behavior": self.user_monitor.get_stats(),
+            "persistence": self.blacklist.store.get_stats() if self.blacklist.store else None
         }
 
 
@@ -530,3 +625,11 @@ if _enabled:
 else:
     ddos_protection = None
     logger.warning('⚠️ DDoSProtection deshabilitado por DDOS_PROTECTION_ENABLED=false')
+
+# Tracker global de DMs de Instagram (cooldown configurable con IG_DM_COOLDOWN_HORAS)
+try:
+    _cooldown_horas = float(os.getenv('IG_DM_COOLDOWN_HORAS', '12'))
+except Exception:
+    _cooldown_horas = 12
+
+tracker_dms = TrackerRespuestasDM(cooldown_horas=_cooldown_horas)
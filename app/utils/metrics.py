@@ -0,0 +1,526 @@
+"""
+Métricas en vivo (formato de exposición de texto de Prometheus)
+===============================================================
+
+Registro en proceso de counters, gauges e histogramas con etiquetas, expuesto en /metrics.
+
+Multi-worker (gunicorn con 10 workers): si METRICS_MULTIPROC_DIR está definido, cada worker
+vuelca su snapshot a <dir>/<pid>.json cada METRICS_DUMP_SEG segundos (escritura atómica) y
+el worker que atiende /metrics suma los snapshots de todos:
+
+- Counters e histogramas: se suman los de todos los archivos, incluidos los de workers ya
+  reciclados, para que los totales sigan siendo monótonos. El archivo de un worker muerto se
+  pliega en <dir>/archivo.json (solo counters e histogramas) antes de que su pid pueda
+  reusarse: al leer /metrics si el pid ya no existe, y al arrancar un worker que encuentra
+  un archivo con su propio pid (de un worker anterior con el mismo pid). Sin esto el primer
+  volcado del worker nuevo pisaría los contadores del muerto y la suma bajaría (Prometheus
+  lo toma como un reset y rate() da picos falsos).
+- Gauges: solo de workers vivos, sumados (o con etiqueta pid si agregacion="pid").
+
+El directorio debe vaciarse al arrancar el contenedor (ver Dockerfile).
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from loguru import logger
+
+# Counters e histogramas acumulados de los workers muertos (ver archivar_pid)
+ARCHIVO_MUERTOS = "archivo.json"
+
+# Buckets por defecto (segundos): de 5ms a 2 minutos
+BUCKETS_DEFAULT = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_etiquetas(nombres, valores, extra=None) -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.extend(f'{n}="{_escapar(v)}"' for n, v in extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _formatear_numero(valor) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.etiquetas)
+
+    def _serializar(self) -> dict:
+        with self._lock:
+            valores = [[list(k), v] for k, v in self._valores.items()]
+        return {"tipo": self.tipo, "ayuda": self.ayuda, "etiquetas": list(self.etiquetas), "valores": valores}
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **labels):
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Gauge(_Metrica):
+    """Gauge con valor fijado (`set`) o calculado al exportar (`funcion` -> {labels_tuple: valor})."""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None, agregacion="sum"):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+        self.agregacion = agregacion
+
+    def set(self, valor: float, **labels):
+        with self._lock:
+            self._valores[self._clave(labels)] = valor
+
+    def _serializar(self) -> dict:
+        if self.funcion:
+            try:
+                calculados = self.funcion() or {}
+                with self._lock:
+                    self._valores = {tuple(str(x) for x in k): v for k, v in calculados.items()}
+            except Exception as e:
+                logger.debug(f"Gauge {self.nombre}: error calculando valor: {e}")
+        datos = super()._serializar()
+        datos["agregacion"] = self.agregacion
+        return datos
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DEFAULT):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, **labels):
+        clave = self._clave(labels)
+        # Índice del primer bucket que contiene el valor (el último es +Inf)
+        indice = len(self.buckets)
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                indice = i
+                break
+        with self._lock:
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            datos[0][indice] += 1
+            datos[1] += valor
+            datos[2] += 1
+
+    @contextmanager
+    def medir(self, **labels):
+        """Observa la duración (segundos) del bloque."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def _serializar(self) -> dict:
+        datos = super()._serializar()
+        datos["buckets"] = list(self.buckets)
+        return datos
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self.metricas = {}
+        self.dir_multiproceso = os.getenv("METRICS_MULTIPROC_DIR", "")
+        try:
+            self.intervalo_volcado_seg = float(os.getenv("METRICS_DUMP_SEG", "5"))
+        except Exception:
+            self.intervalo_volcado_seg = 5.0
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        self.metricas[metrica.nombre] = metrica
+        return metrica
+
+    def counter(self, nombre, ayuda, etiquetas=()):
+        return self.registrar(Counter(nombre, ayuda, etiquetas))
+
+    def gauge(self, nombre, ayuda, etiquetas=(), funcion=None, agregacion="sum"):
+        return self.registrar(Gauge(nombre, ayuda, etiquetas, funcion=funcion, agregacion=agregacion))
+
+    def histogram(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_DEFAULT):
+        return self.registrar(Histogram(nombre, ayuda, etiquetas, buckets))
+
+    def snapshot(self) -> dict:
+        return {nombre: m._serializar() for nombre, m in self.metricas.items()}
+
+    # ------------------------------------------------------------------
+    # Multi-worker
+    # ------------------------------------------------------------------
+    def volcar(self):
+        """Escribe el snapshot de este worker en <dir>/<pid>.json (rename atómico)."""
+        if not self.dir_multiproceso:
+            return
+        os.makedirs(self.dir_multiproceso, exist_ok=True)
+        destino = os.path.join(self.dir_multiproceso, f"{os.getpid()}.json")
+        temporal = destino + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporal, destino)
+
+    @contextmanager
+    def _bloqueo_directorio(self, exclusivo: bool):
+        """flock sobre <dir>/.lock: el archivado es exclusivo, la lectura para /metrics compartida."""
+        os.makedirs(self.dir_multiproceso, exist_ok=True)
+        with open(os.path.join(self.dir_multiproceso, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _acumular(archivo: dict, snapshot: dict):
+        """Suma los counters e histogramas de `snapshot` en `archivo` (los gauges de un muerto no cuentan)."""
+        for nombre, datos in snapshot.items():
+            tipo = datos["tipo"]
+            if tipo == "gauge":
+                continue
+            destino = archivo.setdefault(nombre, {**datos, "valores": []})
+            valores = {tuple(etiquetas): valor for etiquetas, valor in destino["valores"]}
+            for etiquetas, valor in datos["valores"]:
+                clave = tuple(etiquetas)
+                actual = valores.get(clave)
+                if tipo == "histogram":
+                    if actual is None:
+                        valores[clave] = [list(valor[0]), valor[1], valor[2]]
+                    else:
+                        valores[clave] = [[a + b for a, b in zip(actual[0], valor[0])],
+                                          actual[1] + valor[1], actual[2] + valor[2]]
+                else:
+                    valores[clave] = (actual or 0) + valor
+            destino["valores"] = [[list(clave), valor] for clave, valor in valores.items()]
+
+    def archivar_pid(self, pid: int) -> bool:
+        """Pliega <dir>/<pid>.json en archivo.json y lo borra. False si no había archivo."""
+        if not self.dir_multiproceso:
+            return False
+        ruta = os.path.join(self.dir_multiproceso, f"{pid}.json")
+        ruta_archivo = os.path.join(self.dir_multiproceso, ARCHIVO_MUERTOS)
+        with self._bloqueo_directorio(exclusivo=True):
+            try:
+                with open(ruta, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                return False
+            except Exception as e:
+                logger.warning(f"⚠️ Métricas: snapshot ilegible de {pid}, se descarta: {e}")
+                os.remove(ruta)
+                return False
+            archivo = {}
+            if os.path.exists(ruta_archivo):
+                with open(ruta_archivo, "r", encoding="utf-8") as f:
+                    archivo = json.load(f)
+            self._acumular(archivo, snapshot)
+            temporal = ruta_archivo + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(archivo, f)
+            os.replace(temporal, ruta_archivo)
+            os.remove(ruta)
+        logger.debug(f"Métricas: snapshot del worker {pid} archivado")
+        return True
+
+    def iniciar(self):
+        """Arranca el volcado periódico (solo si METRICS_MULTIPROC_DIR está definido)."""
+        if not self.dir_multiproceso or (self._hilo and self._hilo.is_alive()):
+            return
+
+        # Un archivo con nuestro pid es de un worker muerto que tenía el mismo pid: se archiva
+        # antes del primer volcado para no pisar sus contadores
+        try:
+            if self.archivar_pid(os.getpid()):
+                logger.info(f"📈 Métricas: snapshot de un worker anterior con pid {os.getpid()} archivado")
+        except Exception as e:
+            logger.error(f"🔴 Métricas: error archivando el snapshot previo de {os.getpid()}: {e}")
+
+        def _loop():
+            while True:
+                try:
+                    self.volcar()
+                except Exception as e:
+                    logger.error(f"🔴 Métricas: error volcando snapshot: {e}")
+                time.sleep(self.intervalo_volcado_seg)
+
+        self._hilo = threading.Thread(target=_loop, name="metrics-dump", daemon=True)
+        self._hilo.start()
+        logger.info(f"📈 Métricas multi-worker en {self.dir_multiproceso} (volcado cada {self.intervalo_volcado_seg}s)")
+
+    @staticmethod
+    def _pid_vivo(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def _pids_volcados(self) -> list:
+        pids = []
+        for archivo in os.listdir(self.dir_multiproceso):
+            if archivo.endswith(".json"):
+                try:
+                    pids.append(int(archivo[:-5]))
+                except ValueError:
+                    continue
+        return pids
+
+    def _snapshots_workers(self) -> list:
+        """
+        [(pid, snapshot, vivo)] de todos los workers; el propio se toma en memoria y los
+        workers ya archivados vienen juntos con pid None.
+        """
+        propio = os.getpid()
+        resultado = [(propio, self.snapshot(), True)]
+        if not self.dir_multiproceso or not os.path.isdir(self.dir_multiproceso):
+            return resultado
+
+        # Workers muertos: a archivo.json antes de que otro worker reuse el pid
+        for pid in self._pids_volcados():
+            if pid != propio and not self._pid_vivo(pid):
+                try:
+                    self.archivar_pid(pid)
+                except Exception as e:
+                    logger.error(f"🔴 Métricas: error archivando el snapshot de {pid}: {e}")
+
+        # Lectura con el lock compartido: nunca se ve un snapshot a la vez suelto y archivado
+        with self._bloqueo_directorio(exclusivo=False):
+            ruta_archivo = os.path.join(self.dir_multiproceso, ARCHIVO_MUERTOS)
+            if os.path.exists(ruta_archivo):
+                try:
+                    with open(ruta_archivo, "r", encoding="utf-8") as f:
+                        resultado.append((None, json.load(f), False))
+                except Exception as e:
+                    logger.error(f"🔴 Métricas: {ARCHIVO_MUERTOS} ilegible: {e}")
+            for pid in self._pids_volcados():
+                if pid == propio:
+                    continue
+                try:
+                    with open(os.path.join(self.dir_multiproceso, f"{pid}.json"), "r", encoding="utf-8") as f:
+                        resultado.append((pid, json.load(f), self._pid_vivo(pid)))
+                except Exception as e:
+                    logger.debug(f"Métricas: snapshot ilegible {pid}.json: {e}")
+        return resultado
+
+    def exportar(self) -> str:
+        """Texto en formato de exposición de Prometheus con los snapshots agregados."""
+        agregado = {}
+        for pid, snapshot, vivo in self._snapshots_workers():
+            for nombre, datos in snapshot.items():
+                tipo = datos["tipo"]
+                if tipo == "gauge" and not vivo:
+                    continue
+                destino = agregado.setdefault(nombre, {**datos, "valores": {}})
+                for etiquetas, valor in datos["valores"]:
+                    clave = tuple(etiquetas)
+                    if tipo == "gauge" and datos.get("agregacion") == "pid":
+                        clave = clave + (str(pid),)
+                    actual = destino["valores"].get(clave)
+                    if tipo == "histogram":
+                        if actual is None:
+                            destino["valores"][clave] = [list(valor[0]), valor[1], valor[2]]
+                        else:
+                            actual[0] = [a + b for a, b in zip(actual[0], valor[0])]
+                            actual[1] += valor[1]
+                            actual[2] += valor[2]
+                    elif tipo == "gauge" and datos.get("agregacion") == "max":
+                        destino["valores"][clave] = valor if actual is None else max(actual, valor)
+                    else:
+                        destino["valores"][clave] = (actual or 0) + valor
+
+        lineas = []
+        for nombre in sorted(agregado):
+            datos = agregado[nombre]
+            tipo = datos["tipo"]
+            etiquetas = list(datos["etiquetas"])
+            if tipo == "gauge" and datos.get("agregacion") == "pid":
+                etiquetas.append("pid")
+            lineas.append(f"# HELP {nombre} {datos['ayuda']}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for clave, valor in sorted(datos["valores"].items()):
+                if tipo == "histogram":
+                    acumulado = 0
+                    limites = list(datos["buckets"]) + [float("inf")]
+                    for limite, n in zip(limites, valor[0]):
+                        acumulado += n
+                        le = _formatear_numero(float(limite))
+                        lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, clave, [('le', le)])} {acumulado}")
+                    lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas, clave)} {_formatear_numero(float(valor[1]))}")
+                    lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas, clave)} {valor[2]}")
+                else:
+                    lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas, clave)} {_formatear_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+def _estado_pools() -> dict:
+    """Conexiones de cada pool de Postgres de este worker (tamaño, disponibles, en espera)."""
+    from app import db
+
+    valores = {}
+    for nombre, estado in db.estado_pools().items():
+        for clave in ("max", "size", "available", "in_use", "waiting"):
+            valores[(nombre, clave)] = estado[clave]
+    return valores
+
+
+def _cola_whisper() -> dict:
+    """Notas de voz en cola y en proceso del servidor de Whisper local (el mismo para todos los workers)."""
+    from app.services.whisper_local import pool_whisper
+
+    return {(estado,): valor for estado, valor in pool_whisper.profundidad().items()}
+
+
+metricas = RegistroMetricas()
+
+http_duracion = metricas.histogram(
+    "sisagent_http_request_duration_seconds",
+    "Tiempo de atención de requests HTTP (webhooks incluidos) por endpoint",
+    ("endpoint", "method", "status"),
+)
+executor_espera = metricas.histogram(
+    "sisagent_executor_queue_wait_seconds",
+    "Espera en la cola del ThreadPoolExecutor hasta empezar a procesar",
+    ("executor",),
+)
+checkpoint_duracion = metricas.histogram(
+    "sisagent_checkpoint_duration_seconds",
+    "Duración de lecturas (load) y escrituras (save, save_writes) del checkpointer",
+    ("op",),
+)
+llm_latencia = metricas.histogram(
+    "sisagent_llm_latency_seconds",
+    "Latencia de invocaciones a modelos LLM",
+    ("provider", "model"),
+)
+tool_latencia = metricas.histogram(
+    "sisagent_tool_latency_seconds",
+    "Latencia de ejecución de tools del agente",
+    ("tool", "status"),
+)
+envio_latencia = metricas.histogram(
+    "sisagent_outbound_send_seconds",
+    "Latencia de envío de mensajes salientes por canal",
+    ("channel", "status"),
+)
+ddos_bloqueos = metricas.counter(
+    "sisagent_ddos_blocks_total",
+    "Requests rechazados por la protección DDoS, por capa",
+    ("layer",),
+)
+llm_fallbacks = metricas.counter(
+    "sisagent_llm_fallbacks_total",
+    "Invocaciones que fallaron en el LLM primario y pasaron al de respaldo",
+    ("provider", "result"),
+)
+pool_espera = metricas.histogram(
+    "sisagent_db_pool_wait_seconds",
+    "Espera hasta obtener una conexión de cada pool de Postgres",
+    ("pool",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+pool_timeouts = metricas.counter(
+    "sisagent_db_pool_timeouts_total",
+    "Pedidos de conexión que agotaron el timeout del pool (PoolTimeout)",
+    ("pool",),
+)
+pool_conexiones = metricas.gauge(
+    "sisagent_db_pool_connections",
+    "Conexiones de los pools de Postgres por estado (suma de workers)",
+    ("pool", "state"),
+    funcion=_estado_pools,
+)
+
+transcripcion_segmento = metricas.histogram(
+    "sisagent_transcription_segment_seconds",
+    "Latencia de transcripción de cada segmento de una nota de voz larga",
+    ("provider",),
+    buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0),
+)
+transcripcion_total = metricas.histogram(
+    "sisagent_transcription_seconds",
+    "Tiempo de pared de la transcripción de una nota de voz (single = un request, chunked = segmentos en paralelo)",
+    ("provider", "mode"),
+    buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0, 120.0),
+)
+whisper_rtf = metricas.histogram(
+    "sisagent_whisper_rtf",
+    "Factor de tiempo real de Whisper local (segundos de proceso / segundos de audio)",
+    ("backend",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0),
+)
+whisper_rechazos = metricas.counter(
+    "sisagent_whisper_rejected_total",
+    "Notas de voz rechazadas por la cola llena de Whisper local",
+)
+whisper_cola = metricas.gauge(
+    "sisagent_whisper_queue_depth",
+    "Notas de voz esperando o en proceso en el servidor de Whisper local del host",
+    ("state",),
+    funcion=_cola_whisper,
+    agregacion="max",
+)
+vision_bytes = metricas.counter(
+    "sisagent_vision_image_bytes_total",
+    "Bytes de imágenes para modelos de visión antes (original) y después (sent) del preprocesado",
+    ("provider", "stage"),
+)
+
+
+@contextmanager
+def medir_envio(canal: str):
+    """Mide un envío saliente; status=error si el bloque lanza excepción."""
+    inicio = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        envio_latencia.observe(time.perf_counter() - inicio, channel=canal, status=status)
+
+
+class ExecutorMedido(ThreadPoolExecutor):
+    """ThreadPoolExecutor que observa cuánto espera cada tarea en la cola antes de ejecutarse."""
+
+    def __init__(self, max_workers=None, nombre="default", **kwargs):
+        super().__init__(max_workers=max_workers, thread_name_prefix=nombre, **kwargs)
+        self.nombre = nombre
+
+    def submit(self, fn, /, *args, **kwargs):
+        encolado = time.perf_counter()
+
+        def _tarea():
+            executor_espera.observe(time.perf_counter() - encolado, executor=self.nombre)
+            return fn(*args, **kwargs)
+
+        return super().submit(_tarea)
@@ -4,6 +4,7 @@ import time
 from datetime import datetime, timezone, timedelta
 from langgraph.checkpoint.postgres import PostgresSaver
 from loguru import logger
+from ..services.config_store import config_store
 
 # ==============================================================================
 # 0. CARGAR CONFIGURACIONES DESDE JSON
@@ -16,10 +17,14 @@ _CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'services', 'config
 
 def get_app_configs():
     """
-    Retorna la configuración. Si el archivo cambió en disco, recarga automáticamente (hot reload).
+    Retorna la configuración. Con tenant_config activo (ver services/config_store.py) es el
+    snapshot en memoria del worker; si no, el JSON con hot reload por mtime.
     """
     global _CONFIG_CACHE, _LAST_MTIME
 
+    if config_store.activo:
+        return config_store.snapshot
+
     try:
         # 1. Obtenemos la fecha de modificación actual del archivo
         current_mtime = os.path.getmtime(_CONFIG_PATH)
@@ -166,72 +171,3 @@ def extraer_datos_respuesta(respuesta):
         return None
 
     return None
-
-
-
-def gestionar_expiracion_sesion(pool, thread_id: str, ttl_minutos: int):
-    """
-    Verifica si la última interacción fue hace más de 'ttl_minutos'.
-    Si es así, BORRA la memoria (checkpoints) de ese thread.
-    Retorna True si se reseteó la memoria, False si continúa la charla.
-    """
-    if ttl_minutos <= 0:
-        return False # Si es 0, nunca expira
-
-    # SQL para verificar la antigüedad
-    sql_check = """
-    SELECT created_at 
-    FROM checkpoints 
-    WHERE thread_id = %s 
-    ORDER BY created_at DESC 
-    LIMIT 1;
-    """
-
-    # Reintentar una vez si la conexión fue terminada externamente por Postgres (AdminShutdown)
-    for intento in range(2):
-        try:
-            with pool.connection() as conn:
-                with conn.cursor() as cur:
-                    # 1. Obtenemos la fecha del último checkpoint guardado
-                    cur.execute(sql_check, (thread_id,))
-                    resultado = cur.fetchone()
-
-                    if not resultado:
-                        return False  # No hay historia previa, es un usuario nuevo
-
-                    # Procesamos la fecha
-                    last_seen = resultado[0]
-                    if last_seen.tzinfo is None:
-                        last_seen = last_seen.replace(tzinfo=timezone.utc)
-
-                    # Hora actual en UTC
-                    ahora = datetime.now(timezone.utc)
-
-                    # Calculamos la diferencia
-                    diferencia = ahora - last_seen
-
-                    # 2. Comparamos
-                    if diferencia > timedelta(minutes=ttl_minutos):
-                        logger.info(f"🧹 Limpiando memoria de {thread_id}. Inactividad: {diferencia}")
-
-                        # A. Borrar writes
-                        cur.execute("DELETE FROM checkpoint_writes WHERE thread_id = %s", (thread_id,))
-
-                        # B. Borrar blobs
-                        cur.execute("DELETE FROM checkpoint_blobs WHERE thread_id = %s", (thread_id,))
-
-                        # C. Borrar checkpoints principales
-                        cur.execute("DELETE FROM checkpoints WHERE thread_id = %s", (thread_id,))
-
-                        return True
-
-                    return False
-
-        except Exception as e:
-            import psycopg
-            if intento == 0 and isinstance(e, (psycopg.errors.AdminShutdown, psycopg.OperationalError)):
-                logger.warning(f"[DB] Conexión terminada por Postgres, reintentando... ({e})")
-                continue
-            logger.exception(f"[DB] Error en gestionar_expiracion_sesion para {thread_id}: {e}")
-            return False
-    return False
\ No newline at end of file
@@ -3,6 +3,8 @@ from loguru import logger
 import queue
 import random
 import uuid
+from ..utils.ddos_protection import tracker_dms
+from ..utils.metrics import medir_envio
 
 
 # ==================== WEBHOOK DE INSTAGRAM COMMENTS y DMs ====================
@@ -256,7 +258,8 @@ def enviar_mensaje_dm_chatwoot(page_id, user_id, message_text, payload=None):
     # Reenviar el DM al webhook de Chatwoot para crear/actualizar conversación
     try:
         chatwoot_ig_webhook = os.getenv("CHATWOOT_IG_WEBHOOK_URL", "https://sischat.sisnova.com.ar/webhooks/instagram")
-        resp_cwt = requests.post(chatwoot_ig_webhook, json=payload, timeout=5)
+        with medir_envio("chatwoot_ig"):
+            resp_cwt = requests.post(chatwoot_ig_webhook, json=payload, timeout=5)
         logger.debug(f"📤 DM reenviado a Chatwoot IG webhook → {resp_cwt.status_code}")
     except Exception as fwd_err:
         logger.error(f"🔴 Error reenviando DM a Chatwoot: {fwd_err}")
@@ -286,7 +289,8 @@ def responder_comentario_instagram(comment_id: str, mensaje: str):
             "access_token": access_token
         }
         
-        response = requests.post(url, params=payload, timeout=10)
+        with medir_envio("instagram_comment"):
+            response = requests.post(url, params=payload, timeout=10)
         
         if response.status_code == 200:
             result = response.json()
@@ -413,7 +417,8 @@ def enviar_dm_instagram(ig_page_id: str, recipient_id: str, mensaje: str):
             "Content-Type": "application/json"
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        with medir_envio("instagram_dm"):
+            response = requests.post(url, headers=headers, json=payload, timeout=10)
 
         if response.status_code == 200:
             result = response.json()
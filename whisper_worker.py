@@ -0,0 +1,247 @@
+"""
+Servidor de Whisper local compartido por todos los workers del host
+===================================================================
+
+Un solo proceso por host (flock sobre <WHISPER_SOCKET>.lock) con un pool de WHISPER_PROCESOS
+procesos que cargan el modelo una vez y quedan residentes. Los workers de gunicorn le mandan
+las notas por un socket Unix (app/services/whisper_local.py); el primero que no encuentra el
+socket lanza este servidor con `python whisper_worker.py`, y si ya hay uno corriendo el nuevo
+sale sin hacer nada. Así el modelo se carga WHISPER_PROCESOS veces por host, no por worker.
+
+Este módulo está fuera del paquete `app` a propósito: los procesos del pool se crean con
+"spawn" e importan solo este archivo (ni Flask, ni LangChain, ni los singletons de la app).
+
+Contrapresión: como máximo WHISPER_PROCESOS + WHISPER_COLA_MAX notas en curso en todo el
+host. El cupo se libera cuando el proceso termina la nota, no cuando vence el timeout del
+pedido: una nota que excede WHISPER_TIMEOUT_SEG sigue ocupando su lugar hasta terminar.
+
+Protocolo (multiprocessing.connection, un pedido por conexión):
+    ("transcribir", bytes, idioma) -> ("ok", texto, segundos_audio, segundos_proceso)
+                                      | ("lleno", en_curso) | ("error", mensaje)
+    ("estado",)                    -> ("ok", {"queued": n, "running": n})
+
+Los procesos se crean con "spawn": el servidor tiene hilos que no deben heredarse con fork.
+"""
+
+import os
+import sys
+import time
+import fcntl
+import subprocess
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturoTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Listener
+from loguru import logger
+
+TASA_MUESTREO = 16000
+SOCKET_DEFAULT = "/tmp/sisagent-whisper.sock"
+
+# Estado dentro de cada proceso del pool
+_modelo = None
+_backend = None
+
+
+def _cargar_modelo(backend: str, nombre: str, compute_type: str):
+    """Initializer de cada proceso: carga el modelo una vez."""
+    global _modelo, _backend
+    inicio = time.perf_counter()
+    if backend == "faster-whisper":
+        from faster_whisper import WhisperModel
+        _modelo = WhisperModel(nombre, device="cpu", compute_type=compute_type)
+    else:
+        import whisper
+        _modelo = whisper.load_model(nombre)
+    _backend = backend
+    logger.info(f"🎙️ Whisper '{nombre}' ({backend}) cargado en pid {os.getpid()} en {time.perf_counter() - inicio:.1f}s")
+
+
+def _decodificar(audio_buffer: bytes):
+    """PCM mono float32 a 16 kHz (lo que esperan ambos backends), decodificado desde memoria."""
+    import numpy as np
+    proceso = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(TASA_MUESTREO), "pipe:1"],
+        input=audio_buffer, capture_output=True, check=True,
+    )
+    return np.frombuffer(proceso.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def _transcribir_en_proceso(audio_buffer: bytes, idioma: str) -> tuple:
+    """(texto, segundos de audio, segundos de proceso). Corre dentro del proceso del pool."""
+    inicio = time.perf_counter()
+    audio = _decodificar(audio_buffer)
+    if _backend == "faster-whisper":
+        segmentos, _ = _modelo.transcribe(audio, language=idioma)
+        texto = "".join(s.text for s in segmentos)
+    else:
+        texto = _modelo.transcribe(audio, language=idioma, fp16=False)["text"]
+    return texto.strip(), len(audio) / TASA_MUESTREO, time.perf_counter() - inicio
+
+
+def _listo() -> int:
+    return os.getpid()
+
+
+def direccion_socket() -> str:
+    return os.getenv("WHISPER_SOCKET", SOCKET_DEFAULT)
+
+
+def clave_autenticacion():
+    return os.getenv("WHISPER_AUTHKEY", "").encode() or None
+
+
+class ServidorWhisper:
+    def __init__(self, modelo="base", backend="whisper", compute_type="int8", procesos=1,
+                 cola_max=4, espera_seg=30.0, timeout_seg=300.0):
+        self.modelo = modelo
+        self.backend = backend
+        self.compute_type = compute_type
+        self.procesos = max(1, procesos)
+        self.cola_max = max(0, cola_max)
+        self.espera_seg = espera_seg
+        self.timeout_seg = timeout_seg
+
+        self._cupos = threading.BoundedSemaphore(self.procesos + self.cola_max)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.en_curso = 0
+
+    def _obtener_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.procesos,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_cargar_modelo,
+                    initargs=(self.backend, self.modelo, self.compute_type),
+                )
+            return self._pool
+
+    def _descartar_pool(self, pool):
+        # Un proceso murió (p. ej. OOM): el próximo pedido arranca un pool nuevo
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _liberar(self, _futuro=None):
+        with self._lock:
+            self.en_curso -= 1
+        self._cupos.release()
+
+    def profundidad(self) -> dict:
+        """Notas esperando un proceso libre y notas transcribiéndose (todo el host)."""
+        corriendo = min(self.en_curso, self.procesos)
+        return {"queued": self.en_curso - corriendo, "running": corriendo}
+
+    def transcribir(self, audio_buffer: bytes, idioma: str) -> tuple:
+        if not self._cupos.acquire(timeout=self.espera_seg):
+            return ("lleno", self.en_curso)
+        with self._lock:
+            self.en_curso += 1
+
+        pool = self._obtener_pool()
+        try:
+            futuro = pool.submit(_transcribir_en_proceso, audio_buffer, idioma)
+        except Exception as e:
+            self._liberar()
+            if isinstance(e, BrokenProcessPool):
+                self._descartar_pool(pool)
+            return ("error", f"no se pudo encolar la nota: {e}")
+        # El cupo se devuelve cuando el proceso termina (o el futuro se cancela), no antes
+        futuro.add_done_callback(self._liberar)
+
+        try:
+            texto, segundos_audio, segundos_proceso = futuro.result(timeout=self.timeout_seg)
+            return ("ok", texto, segundos_audio, segundos_proceso)
+        except FuturoTimeout:
+            return ("error", f"timeout de {self.timeout_seg:.0f}s (la nota sigue ocupando su proceso)")
+        except BrokenProcessPool:
+            logger.error("🔴 [AUDIO] Un proceso de Whisper local terminó inesperadamente; se recrea el pool")
+            self._descartar_pool(pool)
+            return ("error", "proceso de Whisper terminado inesperadamente")
+        except Exception as e:
+            return ("error", str(e))
+
+    def _atender(self, conn):
+        try:
+            pedido = conn.recv()
+            if pedido[0] == "transcribir":
+                conn.send(self.transcribir(pedido[1], pedido[2]))
+            elif pedido[0] == "estado":
+                conn.send(("ok", self.profundidad()))
+            else:
+                conn.send(("error", f"pedido desconocido: {pedido[0]}"))
+        except (EOFError, OSError):
+            pass  # El worker cortó la conexión (timeout o reciclado)
+        except Exception as e:
+            logger.error(f"🔴 [AUDIO] Error atendiendo un pedido de Whisper local: {e}")
+        finally:
+            conn.close()
+
+    def servir(self, direccion: str):
+        pool = self._obtener_pool()
+        for _ in range(self.procesos):
+            pool.submit(_listo)
+
+        if os.path.exists(direccion):
+            os.unlink(direccion)  # Socket de un servidor anterior que ya no tiene el lock
+        with Listener(direccion, family="AF_UNIX", authkey=clave_autenticacion()) as listener:
+            os.chmod(direccion, 0o600)
+            logger.info(
+                f"🎙️ Servidor de Whisper local en {direccion} (pid {os.getpid()}): {self.procesos} procesos, "
+                f"modelo '{self.modelo}' ({self.backend}{', ' + self.compute_type if self.backend == 'faster-whisper' else ''}), "
+                f"cola máx {self.cola_max}"
+            )
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"⚠️ [AUDIO] Conexión rechazada por el servidor de Whisper: {e}")
+                    continue
+                threading.Thread(target=self._atender, args=(conn,), daemon=True).start()
+
+
+def _crear_servidor() -> ServidorWhisper:
+    try:
+        procesos = int(os.getenv("WHISPER_PROCESOS", "1"))
+    except Exception:
+        procesos = 1
+    try:
+        cola_max = int(os.getenv("WHISPER_COLA_MAX", "4"))
+    except Exception:
+        cola_max = 4
+    try:
+        espera_seg = float(os.getenv("WHISPER_ESPERA_SEG", "30"))
+    except Exception:
+        espera_seg = 30.0
+    try:
+        timeout_seg = float(os.getenv("WHISPER_TIMEOUT_SEG", "300"))
+    except Exception:
+        timeout_seg = 300.0
+    return ServidorWhisper(
+        modelo=os.getenv("WHISPER_MODEL", "base"),
+        backend=os.getenv("WHISPER_BACKEND", "whisper").lower(),
+        compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8"),
+        procesos=procesos,
+        cola_max=cola_max,
+        espera_seg=espera_seg,
+        timeout_seg=timeout_seg,
+    )
+
+
+def main() -> int:
+    direccion = direccion_socket()
+    bloqueo = open(f"{direccion}.lock", "w")
+    try:
+        fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return 0  # Ya hay un servidor en este host
+    _crear_servidor().servir(direccion)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())